@@ -10,7 +10,9 @@ from .storage import (
     claim_reply_reward,
     find_question_by_message,
     get_question_notification_subscribers,
+    initialize_egg_qa_storage,
     list_panels,
+    may_be_question_message,
     remove_panel,
     revoke_reply_reward,
 )
@@ -55,6 +57,10 @@ class EggQACog(commands.Cog, name="小蛋问答"):
 
     @commands.Cog.listener()
     async def on_ready(self):
+        try:
+            await asyncio.to_thread(initialize_egg_qa_storage)
+        except Exception as e:
+            print(f"[EggQA] storage-init-failed: {e}")
         self.bot.add_view(EggQAPanelView())
         self.bot.add_view(EggQAEntryView())
         self.bot.add_view(EggQuestionSubscriptionView())
@@ -219,7 +225,7 @@ class EggQACog(commands.Cog, name="小蛋问答"):
             return
 
         referenced_id = message.reference.message_id
-        if not referenced_id:
+        if not referenced_id or not may_be_question_message(referenced_id):
             return
         question = await asyncio.to_thread(find_question_by_message, referenced_id)
         if not question:
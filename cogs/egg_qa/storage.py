@@ -2,10 +2,13 @@ import json
 import os
 import random
 import threading
+from contextlib import contextmanager
 from functools import wraps
 from datetime import datetime, timedelta, timezone
 
-from cogs.shared.sqlite_store import load_json_namespace, save_json_namespace
+from cogs.shared import sqlite_store
+from cogs.shared.bloom_filter import BloomFilter
+from cogs.shared.sqlite_store import app_state_connection
 
 
 DATA_FILE = "data/egg_qa.json"
@@ -20,6 +23,79 @@ REWARD_WEIGHTS = [6000, 3000, 900, 60, 25, 10, 4, 2, 1, 1, 1, 1, 1]
 SELF_ANSWER_AMOUNTS = [1, 2, 3]
 SELF_ANSWER_WEIGHTS = [6, 3, 1]
 
+# 问题、回答奖励、单题订阅、题主订阅和面板各占一张表；
+# message_id 上的唯一索引让逐条回复的题目查找变成一次点查。
+_QUESTION_COLUMNS = ("id", "guild_id", "channel_id", "message_id", "author_id", "content", "date", "created_at")
+_BLOB_TABLES = (
+    "egg_qa_questions",
+    "egg_qa_reward_claims",
+    "egg_qa_question_subscribers",
+    "egg_qa_author_subscriptions",
+    "egg_qa_panels",
+)
+
+# 已发布问题的 message_id 布隆过滤器：绝大多数普通回复在事件循环里直接排除，
+# 不再切线程查库。过滤器在建表时整体构建，发布时增量加入；取消的问题无法删除，
+# 累积到一定数量或超出容量时整体重建。
+QUESTION_FILTER_MIN_CAPACITY = 4096
+QUESTION_FILTER_ERROR_RATE = 0.001
+_question_filter: BloomFilter | None = None
+_question_filter_removed = 0
+_question_filter_stats = {"checks": 0, "rejected": 0, "false_positives": 0}
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS egg_qa_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS egg_qa_questions (
+    id TEXT PRIMARY KEY,
+    guild_id TEXT NOT NULL DEFAULT '',
+    channel_id TEXT NOT NULL DEFAULT '',
+    message_id TEXT NOT NULL DEFAULT '',
+    author_id TEXT NOT NULL DEFAULT '',
+    content TEXT NOT NULL DEFAULT '',
+    date TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL DEFAULT '',
+    payload TEXT NOT NULL DEFAULT '{}'
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_egg_qa_questions_message
+    ON egg_qa_questions(message_id) WHERE message_id != '';
+CREATE INDEX IF NOT EXISTS idx_egg_qa_questions_daily
+    ON egg_qa_questions(guild_id, author_id, date);
+CREATE TABLE IF NOT EXISTS egg_qa_reward_claims (
+    question_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    guild_id TEXT NOT NULL DEFAULT '',
+    reply_message_id TEXT NOT NULL DEFAULT '',
+    amount INTEGER NOT NULL DEFAULT 0,
+    self_answer INTEGER NOT NULL DEFAULT 0,
+    date TEXT NOT NULL DEFAULT '',
+    daily_total_after INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY(question_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_egg_qa_reward_claims_daily
+    ON egg_qa_reward_claims(guild_id, user_id, date);
+CREATE TABLE IF NOT EXISTS egg_qa_question_subscribers (
+    question_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    subscribed_at TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY(question_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS egg_qa_author_subscriptions (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    enabled_at TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY(guild_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS egg_qa_panels (
+    channel_id TEXT PRIMARY KEY,
+    message_id TEXT NOT NULL DEFAULT '',
+    updated_at TEXT NOT NULL DEFAULT ''
+);
+"""
+
 
 def _synchronized(func):
     @wraps(func)
@@ -42,137 +118,342 @@ def _empty_data() -> dict:
     return {"version": 2, "questions": {}, "panels": {}, "author_subscriptions": {}}
 
 
-@_synchronized
-def load_data() -> dict:
-    raw = load_json_namespace("egg_qa", legacy_file=DATA_FILE, default=_empty_data())
-
-    if not isinstance(raw, dict) or not isinstance(raw.get("questions"), dict):
-        return _empty_data()
-    panels = raw.get("panels", {})
-    if not isinstance(panels, dict):
-        panels = {}
-    author_subscriptions = raw.get("author_subscriptions", {})
-    if not isinstance(author_subscriptions, dict):
-        author_subscriptions = {}
+def _dump(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _insert_question(connection, record: dict) -> None:
+    payload = {
+        key: value
+        for key, value in record.items()
+        if key not in _QUESTION_COLUMNS and key not in ("rewards", "subscribers")
+    }
+    connection.execute(
+        f"""INSERT OR REPLACE INTO egg_qa_questions({", ".join(_QUESTION_COLUMNS)}, payload)
+            VALUES ({", ".join("?" for _ in _QUESTION_COLUMNS)}, ?)""",
+        (*(str(record.get(column, "") or "") for column in _QUESTION_COLUMNS), _dump(payload)),
+    )
+
+
+def _insert_reward(connection, question_id: str, guild_id: str, reward: dict) -> None:
+    connection.execute(
+        """INSERT OR REPLACE INTO egg_qa_reward_claims(
+               question_id, user_id, guild_id, reply_message_id, amount,
+               self_answer, date, daily_total_after, created_at
+           ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (
+            question_id,
+            str(reward.get("user_id", "") or ""),
+            guild_id,
+            str(reward.get("reply_message_id", "") or ""),
+            max(0, int(reward.get("amount", 0) or 0)),
+            1 if reward.get("self_answer") else 0,
+            str(reward.get("date") or reward.get("created_at", ""))[:10],
+            int(reward.get("daily_total_after", 0) or 0),
+            str(reward.get("created_at", "") or ""),
+        ),
+    )
+
+
+def _import_blob(connection, data: dict) -> None:
+    """问题连同奖励领取和单题订阅逐题写入，面板和题主订阅各自成表。"""
+    questions = data.get("questions") if isinstance(data.get("questions"), dict) else {}
+    for key, record in questions.items():
+        if not isinstance(record, dict):
+            continue
+        record = dict(record)
+        record.setdefault("id", str(key))
+        question_id = str(record["id"])
+        message_id = str(record.get("message_id", "") or "")
+        if message_id and connection.execute(
+            "SELECT 1 FROM egg_qa_questions WHERE message_id=? AND id!=?", (message_id, question_id)
+        ).fetchone():
+            # 同一条消息只能对应一个问题，旧数据里的重复保留先出现的那条
+            record["message_id"] = ""
+        _insert_question(connection, record)
+        guild_id = str(record.get("guild_id", "") or "")
+        rewards = record.get("rewards") if isinstance(record.get("rewards"), dict) else {}
+        for user_id, reward in rewards.items():
+            if isinstance(reward, dict):
+                _insert_reward(connection, question_id, guild_id, {"user_id": str(user_id), **reward})
+        subscribers = record.get("subscribers") if isinstance(record.get("subscribers"), dict) else {}
+        connection.executemany(
+            "INSERT OR REPLACE INTO egg_qa_question_subscribers(question_id, user_id, subscribed_at) VALUES (?, ?, ?)",
+            [
+                (question_id, str(user_id), str((value or {}).get("subscribed_at", "")) if isinstance(value, dict) else "")
+                for user_id, value in subscribers.items()
+            ],
+        )
+    panels = data.get("panels") if isinstance(data.get("panels"), dict) else {}
+    for channel_id, panel in panels.items():
+        if isinstance(panel, dict):
+            connection.execute(
+                "INSERT OR REPLACE INTO egg_qa_panels(channel_id, message_id, updated_at) VALUES (?, ?, ?)",
+                (str(channel_id), str(panel.get("message_id", "") or ""), str(panel.get("updated_at", "") or "")),
+            )
+    subscriptions = data.get("author_subscriptions") if isinstance(data.get("author_subscriptions"), dict) else {}
+    for key, value in subscriptions.items():
+        guild_id, _, user_id = str(key).partition(":")
+        if not user_id:
+            continue
+        connection.execute(
+            "INSERT OR REPLACE INTO egg_qa_author_subscriptions(guild_id, user_id, enabled_at) VALUES (?, ?, ?)",
+            (guild_id, user_id, str(value.get("enabled_at", "")) if isinstance(value, dict) else ""),
+        )
+
+
+def _ensure_egg_qa_tables() -> None:
+    sqlite_store.ensure_blob_tables(
+        "egg_qa",
+        schema_sql=_SCHEMA_SQL,
+        meta_table="egg_qa_meta",
+        legacy_file=DATA_FILE,
+        default=_empty_data(),
+        importer=_import_blob,
+        lock=_DATA_LOCK,
+        on_ready=_rebuild_question_filter,
+    )
+
+
+def _rebuild_question_filter(connection) -> None:
+    # 调用方需持有 _DATA_LOCK
+    global _question_filter, _question_filter_removed
+    message_ids = [
+        row["message_id"]
+        for row in connection.execute("SELECT message_id FROM egg_qa_questions WHERE message_id != ''")
+    ]
+    capacity = max(QUESTION_FILTER_MIN_CAPACITY, len(message_ids) * 2)
+    _question_filter = BloomFilter(capacity, QUESTION_FILTER_ERROR_RATE, message_ids)
+    _question_filter_removed = 0
+
+
+def may_be_question_message(message_id: int) -> bool:
+    """纯内存判断一条消息是否可能是问题卡片；返回 False 时一定不是，无需查库。"""
+    question_filter = _question_filter
+    if question_filter is None or not sqlite_store.blob_tables_ready("egg_qa"):
+        return True
+    _question_filter_stats["checks"] += 1
+    if str(message_id) in question_filter:
+        return True
+    _question_filter_stats["rejected"] += 1
+    return False
+
+
+def question_filter_stats() -> dict:
+    """过滤器命中统计：实测误判率 = 放行后查库未命中数 / 实际非问题消息数。"""
+    question_filter = _question_filter
+    stats = dict(_question_filter_stats)
+    negatives = stats["rejected"] + stats["false_positives"]
+    stats["measured_false_positive_rate"] = stats["false_positives"] / negatives if negatives else 0.0
+    if question_filter is not None:
+        stats.update(
+            items=len(question_filter),
+            capacity=question_filter.capacity,
+            estimated_false_positive_rate=question_filter.estimated_false_positive_rate(),
+        )
+    return stats
+
+
+@contextmanager
+def _connection():
+    _ensure_egg_qa_tables()
+    with app_state_connection() as connection:
+        yield connection
+
+
+def initialize_egg_qa_storage() -> None:
+    """启动时完成拆表并构建问题卡片的布隆过滤器。"""
+    _ensure_egg_qa_tables()
+
+
+def _reward_from_row(row) -> dict:
     return {
-        "version": 2,
-        "questions": raw["questions"],
-        "panels": panels,
-        "author_subscriptions": author_subscriptions,
+        "user_id": row["user_id"],
+        "reply_message_id": row["reply_message_id"],
+        "amount": int(row["amount"]),
+        "self_answer": bool(row["self_answer"]),
+        "date": row["date"],
+        "daily_total_after": int(row["daily_total_after"]),
+        "created_at": row["created_at"],
+    }
+
+
+def _question_from_row(connection, row) -> dict:
+    try:
+        record = json.loads(row["payload"] or "{}")
+    except json.JSONDecodeError:
+        record = {}
+    if not isinstance(record, dict):
+        record = {}
+    for column in _QUESTION_COLUMNS:
+        record[column] = row[column]
+    record["rewards"] = {
+        reward["user_id"]: _reward_from_row(reward)
+        for reward in connection.execute(
+            "SELECT * FROM egg_qa_reward_claims WHERE question_id=? ORDER BY rowid", (row["id"],)
+        )
     }
+    subscribers = {
+        sub["user_id"]: {"subscribed_at": sub["subscribed_at"]}
+        for sub in connection.execute(
+            "SELECT user_id, subscribed_at FROM egg_qa_question_subscribers WHERE question_id=? ORDER BY rowid",
+            (row["id"],),
+        )
+    }
+    if subscribers:
+        record["subscribers"] = subscribers
+    return record
+
+
+def _get_question(connection, question_id: str) -> dict | None:
+    row = connection.execute("SELECT * FROM egg_qa_questions WHERE id=?", (str(question_id),)).fetchone()
+    return _question_from_row(connection, row) if row is not None else None
+
+
+def _count_daily_questions(connection, author_id: str, guild_id: str, day: str) -> int:
+    row = connection.execute(
+        "SELECT COUNT(*) AS total FROM egg_qa_questions WHERE guild_id=? AND author_id=? AND date=?",
+        (guild_id, author_id, day),
+    ).fetchone()
+    return int(row["total"])
 
 
 @_synchronized
-def save_data(data: dict) -> None:
-    save_json_namespace("egg_qa", data)
+def load_data() -> dict:
+    """组装问题（含奖励与订阅者）、面板和题主订阅。"""
+    data = _empty_data()
+    with _connection() as connection:
+        for row in connection.execute("SELECT * FROM egg_qa_questions ORDER BY rowid").fetchall():
+            data["questions"][row["id"]] = _question_from_row(connection, row)
+        for row in connection.execute("SELECT * FROM egg_qa_panels ORDER BY rowid"):
+            data["panels"][row["channel_id"]] = {
+                "channel_id": row["channel_id"],
+                "message_id": row["message_id"],
+                "updated_at": row["updated_at"],
+            }
+        for row in connection.execute("SELECT * FROM egg_qa_author_subscriptions ORDER BY rowid"):
+            key = _author_subscription_key(row["user_id"], row["guild_id"])
+            data["author_subscriptions"][key] = {"enabled_at": row["enabled_at"]}
+    return data
 
 
 @_synchronized
+def save_data(data: dict) -> None:
+    """替换后按新的问题卡片重建布隆过滤器。"""
+    with _connection() as connection:
+        sqlite_store.replace_blob_tables(connection, _BLOB_TABLES, _import_blob, data)
+        _rebuild_question_filter(connection)
+
+
 def get_daily_usage(user_id: int, guild_id: int) -> int:
-    uid = str(user_id)
-    gid = str(guild_id)
-    today = _today()
-    return sum(
-        1
-        for row in load_data()["questions"].values()
-        if isinstance(row, dict)
-        and row.get("author_id") == uid
-        and row.get("guild_id") == gid
-        and row.get("date") == today
-    )
+    with _connection() as connection:
+        return _count_daily_questions(connection, str(user_id), str(guild_id), _today())
 
 
-@_synchronized
 def save_panel(channel_id: int, message_id: int) -> None:
-    data = load_data()
-    data["panels"][str(channel_id)] = {
-        "channel_id": str(channel_id),
-        "message_id": str(message_id),
-        "updated_at": _now_iso(),
-    }
-    save_data(data)
+    with _connection() as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO egg_qa_panels(channel_id, message_id, updated_at) VALUES (?, ?, ?)",
+            (str(channel_id), str(message_id), _now_iso()),
+        )
 
 
-@_synchronized
 def get_panel(channel_id: int) -> dict | None:
-    panel = load_data()["panels"].get(str(channel_id))
-    return panel if isinstance(panel, dict) else None
+    with _connection() as connection:
+        row = connection.execute("SELECT * FROM egg_qa_panels WHERE channel_id=?", (str(channel_id),)).fetchone()
+    if row is None:
+        return None
+    return {"channel_id": row["channel_id"], "message_id": row["message_id"], "updated_at": row["updated_at"]}
 
 
-@_synchronized
 def list_panels() -> list[dict]:
-    return [row for row in load_data()["panels"].values() if isinstance(row, dict)]
+    with _connection() as connection:
+        return [
+            {"channel_id": row["channel_id"], "message_id": row["message_id"], "updated_at": row["updated_at"]}
+            for row in connection.execute("SELECT * FROM egg_qa_panels ORDER BY rowid")
+        ]
 
 
-@_synchronized
 def remove_panel(channel_id: int, message_id: int | None = None) -> None:
-    data = load_data()
-    panel = data["panels"].get(str(channel_id))
-    if not isinstance(panel, dict):
-        return
-    if message_id is not None and panel.get("message_id") != str(message_id):
-        return
-    data["panels"].pop(str(channel_id), None)
-    save_data(data)
+    with _connection() as connection:
+        if message_id is None:
+            connection.execute("DELETE FROM egg_qa_panels WHERE channel_id=?", (str(channel_id),))
+        else:
+            connection.execute(
+                "DELETE FROM egg_qa_panels WHERE channel_id=? AND message_id=?", (str(channel_id), str(message_id))
+            )
 
 
 @_synchronized
 def create_question(*, author_id: int, guild_id: int, channel_id: int, content: str) -> dict | None:
-    data = load_data()
     uid = str(author_id)
     gid = str(guild_id)
     today = _today()
-    used = sum(
-        1
-        for row in data["questions"].values()
-        if isinstance(row, dict)
-        and row.get("author_id") == uid
-        and row.get("guild_id") == gid
-        and row.get("date") == today
-    )
-    if used >= DAILY_QUESTION_LIMIT:
-        return None
-
-    question_id = f"{int(datetime.now(TZ_CN).timestamp() * 1000)}{random.randint(100, 999)}"
-    record = {
-        "id": question_id,
-        "guild_id": gid,
-        "channel_id": str(channel_id),
-        "message_id": "",
-        "author_id": uid,
-        "content": content,
-        "date": today,
-        "created_at": _now_iso(),
-        "rewards": {},
-    }
-    data["questions"][question_id] = record
-    save_data(data)
-    return record
+    with _connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        if _count_daily_questions(connection, uid, gid, today) >= DAILY_QUESTION_LIMIT:
+            return None
+
+        question_id = f"{int(datetime.now(TZ_CN).timestamp() * 1000)}{random.randint(100, 999)}"
+        while connection.execute("SELECT 1 FROM egg_qa_questions WHERE id=?", (question_id,)).fetchone():
+            question_id = f"{int(datetime.now(TZ_CN).timestamp() * 1000)}{random.randint(100, 999)}"
+        record = {
+            "id": question_id,
+            "guild_id": gid,
+            "channel_id": str(channel_id),
+            "message_id": "",
+            "author_id": uid,
+            "content": content,
+            "date": today,
+            "created_at": _now_iso(),
+            "rewards": {},
+        }
+        _insert_question(connection, record)
+        return record
 
 
 @_synchronized
 def finalize_question(question_id: str, message_id: int) -> None:
-    data = load_data()
-    record = data["questions"].get(str(question_id))
-    if isinstance(record, dict):
-        record["message_id"] = str(message_id)
-        save_data(data)
+    with _connection() as connection:
+        updated = connection.execute(
+            "UPDATE egg_qa_questions SET message_id=? WHERE id=?", (str(message_id), str(question_id))
+        ).rowcount
+        if not updated:
+            return
+        if _question_filter is None or len(_question_filter) >= _question_filter.capacity:
+            _rebuild_question_filter(connection)
+        else:
+            _question_filter.add(str(message_id))
 
 
 @_synchronized
 def cancel_question(question_id: str) -> None:
-    data = load_data()
-    if data["questions"].pop(str(question_id), None) is not None:
-        save_data(data)
+    global _question_filter_removed
+    with _connection() as connection:
+        row = connection.execute("SELECT message_id FROM egg_qa_questions WHERE id=?", (str(question_id),)).fetchone()
+        for table, column in (
+            ("egg_qa_reward_claims", "question_id"),
+            ("egg_qa_question_subscribers", "question_id"),
+            ("egg_qa_questions", "id"),
+        ):
+            connection.execute(f"DELETE FROM {table} WHERE {column}=?", (str(question_id),))
+        if row is not None and row["message_id"]:
+            _question_filter_removed += 1
+            if _question_filter is not None and _question_filter_removed * 4 > max(len(_question_filter), 64):
+                _rebuild_question_filter(connection)
 
 
-@_synchronized
 def find_question_by_message(message_id: int) -> dict | None:
     target = str(message_id)
-    for record in load_data()["questions"].values():
-        if isinstance(record, dict) and record.get("message_id") == target:
-            return record
-    return None
+    if not target:
+        return None
+    with _connection() as connection:
+        row = connection.execute("SELECT * FROM egg_qa_questions WHERE message_id=?", (target,)).fetchone()
+        if row is None:
+            if _question_filter is not None and target in _question_filter:
+                _question_filter_stats["false_positives"] += 1
+            return None
+        return _question_from_row(connection, row)
 
 
 def _author_subscription_key(user_id: int | str, guild_id: int | str) -> str:
@@ -182,60 +463,59 @@ def _author_subscription_key(user_id: int | str, guild_id: int | str) -> str:
 @_synchronized
 def toggle_author_subscription(*, user_id: int, guild_id: int) -> bool:
     """切换用户对自己所发问题的自动私信订阅，返回切换后的状态。"""
-    data = load_data()
-    subscriptions = data["author_subscriptions"]
-    key = _author_subscription_key(user_id, guild_id)
-    if key in subscriptions:
-        subscriptions.pop(key, None)
-        enabled = False
-    else:
-        subscriptions[key] = {"enabled_at": _now_iso()}
-        enabled = True
-    save_data(data)
-    return enabled
+    key = (str(guild_id), str(user_id))
+    with _connection() as connection:
+        removed = connection.execute(
+            "DELETE FROM egg_qa_author_subscriptions WHERE guild_id=? AND user_id=?", key
+        ).rowcount
+        if removed:
+            return False
+        connection.execute(
+            "INSERT INTO egg_qa_author_subscriptions(guild_id, user_id, enabled_at) VALUES (?, ?, ?)",
+            (*key, _now_iso()),
+        )
+        return True
 
 
 @_synchronized
 def toggle_question_subscription(*, question_id: str, user_id: int) -> bool | None:
     """切换指定问题的追踪订阅；问题不存在时返回 None。"""
-    data = load_data()
-    record = data["questions"].get(str(question_id))
-    if not isinstance(record, dict):
-        return None
+    key = (str(question_id), str(user_id))
+    with _connection() as connection:
+        if connection.execute("SELECT 1 FROM egg_qa_questions WHERE id=?", (key[0],)).fetchone() is None:
+            return None
+        removed = connection.execute(
+            "DELETE FROM egg_qa_question_subscribers WHERE question_id=? AND user_id=?", key
+        ).rowcount
+        if removed:
+            return False
+        connection.execute(
+            "INSERT INTO egg_qa_question_subscribers(question_id, user_id, subscribed_at) VALUES (?, ?, ?)",
+            (*key, _now_iso()),
+        )
+        return True
 
-    subscribers = record.setdefault("subscribers", {})
-    if not isinstance(subscribers, dict):
-        subscribers = {}
-        record["subscribers"] = subscribers
-    uid = str(user_id)
-    if uid in subscribers:
-        subscribers.pop(uid, None)
-        enabled = False
-    else:
-        subscribers[uid] = {"subscribed_at": _now_iso()}
-        enabled = True
-    save_data(data)
-    return enabled
 
-
-@_synchronized
 def get_question_notification_subscribers(question_id: str) -> list[int]:
     """返回单题追踪者，以及开启了“我的提问自动订阅”的题主。"""
-    data = load_data()
-    record = data["questions"].get(str(question_id))
-    if not isinstance(record, dict):
-        return []
-
-    subscriber_ids = set()
-    subscribers = record.get("subscribers", {})
-    if isinstance(subscribers, dict):
-        subscriber_ids.update(str(uid) for uid in subscribers)
-
-    author_id = str(record.get("author_id") or "")
-    guild_id = str(record.get("guild_id") or "")
-    key = _author_subscription_key(author_id, guild_id)
-    if author_id and key in data["author_subscriptions"]:
-        subscriber_ids.add(author_id)
+    with _connection() as connection:
+        row = connection.execute(
+            "SELECT author_id, guild_id FROM egg_qa_questions WHERE id=?", (str(question_id),)
+        ).fetchone()
+        if row is None:
+            return []
+        subscriber_ids = {
+            sub["user_id"]
+            for sub in connection.execute(
+                "SELECT user_id FROM egg_qa_question_subscribers WHERE question_id=?", (str(question_id),)
+            )
+        }
+        author_id = str(row["author_id"] or "")
+        if author_id and connection.execute(
+            "SELECT 1 FROM egg_qa_author_subscriptions WHERE guild_id=? AND user_id=?",
+            (str(row["guild_id"] or ""), author_id),
+        ).fetchone():
+            subscriber_ids.add(author_id)
 
     return [int(uid) for uid in subscriber_ids if uid.isdigit()]
 
@@ -249,60 +529,54 @@ def claim_reply_reward(
     is_self_answer: bool = False,
 ) -> dict | None:
     """原子式记录首次回复奖励；同一用户对同一问题只能成功一次。"""
-    data = load_data()
-    record = data["questions"].get(str(question_id))
-    if not isinstance(record, dict):
-        return None
-
     uid = str(user_id)
-    rewards = record.setdefault("rewards", {})
-    if uid in rewards:
-        return None
-
-    today = _today()
-    daily_total = 0
-    for question in data["questions"].values():
-        if not isinstance(question, dict) or question.get("guild_id") != record.get("guild_id"):
-            continue
-        for old_reward in question.get("rewards", {}).values():
-            if not isinstance(old_reward, dict) or old_reward.get("user_id") != uid:
-                continue
-            reward_date = str(old_reward.get("date") or old_reward.get("created_at", ""))[:10]
-            if reward_date == today:
-                daily_total += max(0, int(old_reward.get("amount", 0) or 0))
-
-    remaining = max(0, DAILY_REPLY_REWARD_CAP - daily_total)
-    if remaining <= 0:
-        return None
-
-    if is_self_answer:
-        amount = random.choices(SELF_ANSWER_AMOUNTS, weights=SELF_ANSWER_WEIGHTS, k=1)[0]
-    else:
-        amount = random.choices(REWARD_AMOUNTS, weights=REWARD_WEIGHTS, k=1)[0]
-    amount = min(amount, remaining)
-    reward = {
-        "user_id": uid,
-        "reply_message_id": str(reply_message_id),
-        "amount": amount,
-        "self_answer": bool(is_self_answer),
-        "date": today,
-        "daily_total_after": daily_total + amount,
-        "created_at": _now_iso(),
-    }
-    rewards[uid] = reward
-    save_data(data)
-    return reward
+    with _connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        question = connection.execute(
+            "SELECT guild_id FROM egg_qa_questions WHERE id=?", (str(question_id),)
+        ).fetchone()
+        if question is None:
+            return None
+        if connection.execute(
+            "SELECT 1 FROM egg_qa_reward_claims WHERE question_id=? AND user_id=?", (str(question_id), uid)
+        ).fetchone():
+            return None
+
+        today = _today()
+        guild_id = str(question["guild_id"] or "")
+        daily_total = int(
+            connection.execute(
+                """SELECT COALESCE(SUM(amount), 0) AS total FROM egg_qa_reward_claims
+                   WHERE guild_id=? AND user_id=? AND date=?""",
+                (guild_id, uid, today),
+            ).fetchone()["total"]
+        )
+        remaining = max(0, DAILY_REPLY_REWARD_CAP - daily_total)
+        if remaining <= 0:
+            return None
+
+        if is_self_answer:
+            amount = random.choices(SELF_ANSWER_AMOUNTS, weights=SELF_ANSWER_WEIGHTS, k=1)[0]
+        else:
+            amount = random.choices(REWARD_AMOUNTS, weights=REWARD_WEIGHTS, k=1)[0]
+        amount = min(amount, remaining)
+        reward = {
+            "user_id": uid,
+            "reply_message_id": str(reply_message_id),
+            "amount": amount,
+            "self_answer": bool(is_self_answer),
+            "date": today,
+            "daily_total_after": daily_total + amount,
+            "created_at": _now_iso(),
+        }
+        _insert_reward(connection, str(question_id), guild_id, reward)
+        return reward
 
 
-@_synchronized
 def revoke_reply_reward(*, question_id: str, user_id: int, reply_message_id: int) -> None:
     """蛋壳入账失败时撤销占位，允许用户稍后重新回答。"""
-    data = load_data()
-    record = data["questions"].get(str(question_id))
-    if not isinstance(record, dict):
-        return
-    rewards = record.get("rewards", {})
-    reward = rewards.get(str(user_id)) if isinstance(rewards, dict) else None
-    if isinstance(reward, dict) and reward.get("reply_message_id") == str(reply_message_id):
-        rewards.pop(str(user_id), None)
-        save_data(data)
+    with _connection() as connection:
+        connection.execute(
+            "DELETE FROM egg_qa_reward_claims WHERE question_id=? AND user_id=? AND reply_message_id=?",
+            (str(question_id), str(user_id), str(reply_message_id)),
+        )
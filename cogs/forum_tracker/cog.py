@@ -97,10 +97,7 @@ class ForumTrackerCog(commands.Cog):
                     msg = await channel.fetch_message(msg_id)
                 except discord.NotFound:
                     msg = await channel.send("正在初始化统计面板...")
-                    conn = sqlite3.connect(DB_PATH)
-                    conn.execute("UPDATE tracking_tasks SET msg_id = ? WHERE task_id = ?", (msg.id, task_id))
-                    conn.commit()
-                    conn.close()
+                    db.update_task_message(task_id, msg.id)
 
                 view = ForumStatsView(task_id=task_id, current_page=1)
                 total_count = db.get_total_valid_count(task_id)
@@ -0,0 +1,193 @@
+import re
+from typing import Iterable
+
+from cogs.shared.text_match import AhoCorasick
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+# 这几个字符在 IGNORECASE 下与 ASCII 字母互相匹配，但 str.lower() 不会把它们折叠成 ASCII
+_FOLD_TABLE = str.maketrans({"İ": "i", "ı": "i", "ſ": "s"})
+
+_REQUIRED_REPEATS = tuple(
+    op
+    for op in (
+        sre_constants.MAX_REPEAT,
+        sre_constants.MIN_REPEAT,
+        getattr(sre_constants, "POSSESSIVE_REPEAT", None),
+    )
+    if op is not None
+)
+_ATOMIC_GROUP = getattr(sre_constants, "ATOMIC_GROUP", None)
+
+PENDING_LITERAL_LIMIT = 32
+
+
+def fold_text(text: str) -> str:
+    """预筛用的大小写折叠：任何能被 IGNORECASE 匹配上的安全字面量，折叠后都是子串。"""
+    return str(text or "").translate(_FOLD_TABLE).lower()
+
+
+def _is_safe_literal_char(char: str) -> bool:
+    # ASCII 字符和无大小写的字符（中文、数字、标点）折叠后一一对应；其余字符不参与预筛
+    return char.isascii() or (char.lower() == char and char.upper() == char)
+
+
+def _collect_literal_runs(items, runs: list[str]) -> None:
+    current: list[str] = []
+    for op, av in items:
+        if op is sre_constants.LITERAL and _is_safe_literal_char(chr(av)):
+            current.append(chr(av))
+            continue
+        if current:
+            runs.append("".join(current))
+            current = []
+        if op is sre_constants.SUBPATTERN:
+            _collect_literal_runs(av[-1], runs)
+        elif op in _REQUIRED_REPEATS and av[0] >= 1:
+            _collect_literal_runs(av[2], runs)
+        elif _ATOMIC_GROUP is not None and op is _ATOMIC_GROUP:
+            _collect_literal_runs(av, runs)
+        # 分支、可选重复、断言等位置不保证出现，直接断开
+    if current:
+        runs.append("".join(current))
+
+
+def required_literal(pattern: str) -> str:
+    """提取正则每次命中都必然包含的最长字面量（已折叠）；提取不到时返回空串。"""
+    try:
+        parsed = sre_parse.parse(pattern, re.IGNORECASE)
+    except (re.error, RecursionError, OverflowError):
+        return ""
+    runs: list[str] = []
+    _collect_literal_runs(parsed, runs)
+    return fold_text(max(runs, key=len, default=""))
+
+
+class AdRule:
+    __slots__ = ("rule_id", "pattern", "regex", "literal")
+
+    def __init__(self, rule_id: int, pattern: str, regex: re.Pattern, literal: str):
+        self.rule_id = rule_id
+        self.pattern = pattern
+        self.regex = regex
+        self.literal = literal
+
+
+class AdRuleEngine:
+    """广告规则引擎：字面量预筛 + 正则确认。
+
+    每条规则提取一个必需字面量，全部并入一个 Aho-Corasick 自动机，消息只扫描一遍；
+    只有预筛命中的规则（以及提取不到字面量的少数规则）才真正执行正则。
+    多条规则同时命中时按规则 ID 取最小的一条，与逐条遍历的旧行为一致。
+    增删规则只改动索引，新字面量先放在待合并集合里，积累到一定数量才重建自动机。
+    """
+
+    def __init__(self, rules: Iterable[tuple[int, str]] = ()):
+        self._rules: dict[int, AdRule] = {}
+        self._literal_rules: dict[str, set[int]] = {}
+        self._residual: set[int] = set()
+        self._automaton = AhoCorasick(())
+        self._automaton_literals: list[str] = []
+        self._automaton_index: set[str] = set()
+        self._pending: set[str] = set()
+        self._stale = 0
+        self.load(rules)
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def __contains__(self, rule_id: int) -> bool:
+        return rule_id in self._rules
+
+    def load(self, rules: Iterable[tuple[int, str]]) -> None:
+        """整体替换规则集，只在启动或全量刷新时使用。"""
+        self._rules.clear()
+        self._literal_rules.clear()
+        self._residual.clear()
+        self._pending.clear()
+        for rule_id, pattern in rules:
+            rule = self._compile(rule_id, pattern)
+            if rule is None:
+                continue
+            self._rules[rule.rule_id] = rule
+            if rule.literal:
+                self._literal_rules.setdefault(rule.literal, set()).add(rule.rule_id)
+            else:
+                self._residual.add(rule.rule_id)
+        self._rebuild_automaton()
+
+    def add(self, rule_id: int, pattern: str) -> bool:
+        """增量加入一条规则；正则不合法时返回 False。"""
+        rule = self._compile(rule_id, pattern)
+        if rule is None:
+            return False
+        if rule.rule_id in self._rules:
+            self.remove(rule.rule_id)
+        self._rules[rule.rule_id] = rule
+        if not rule.literal:
+            self._residual.add(rule.rule_id)
+            return True
+        self._literal_rules.setdefault(rule.literal, set()).add(rule.rule_id)
+        if rule.literal not in self._automaton_index:
+            self._pending.add(rule.literal)
+            if len(self._pending) > PENDING_LITERAL_LIMIT:
+                self._rebuild_automaton()
+        return True
+
+    def remove(self, rule_id: int) -> bool:
+        rule = self._rules.pop(int(rule_id), None)
+        if rule is None:
+            return False
+        self._residual.discard(rule.rule_id)
+        owners = self._literal_rules.get(rule.literal)
+        if owners is not None:
+            owners.discard(rule.rule_id)
+            if not owners:
+                del self._literal_rules[rule.literal]
+                if rule.literal in self._pending:
+                    self._pending.discard(rule.literal)
+                else:
+                    self._stale += 1
+                    if self._stale > max(PENDING_LITERAL_LIMIT, len(self._automaton_literals) // 4):
+                        self._rebuild_automaton()
+        return True
+
+    def match(self, content: str) -> AdRule | None:
+        """返回第一条命中的规则；没有命中时返回 None。"""
+        if not content or not self._rules:
+            return None
+        folded = fold_text(content)
+        candidates = set(self._residual)
+        if self._automaton:
+            literal_rules = self._literal_rules
+            for index in self._automaton.matched_indices(folded):
+                owners = literal_rules.get(self._automaton_literals[index])
+                if owners:
+                    candidates.update(owners)
+        for literal in self._pending:
+            if literal in folded:
+                candidates.update(self._literal_rules[literal])
+        for rule_id in sorted(candidates):
+            rule = self._rules[rule_id]
+            if rule.regex.search(content):
+                return rule
+        return None
+
+    @staticmethod
+    def _compile(rule_id: int, pattern: str) -> AdRule | None:
+        try:
+            regex = re.compile(pattern, re.IGNORECASE)
+        except re.error:
+            return None
+        return AdRule(int(rule_id), pattern, regex, required_literal(pattern))
+
+    def _rebuild_automaton(self) -> None:
+        self._automaton_literals = list(self._literal_rules)
+        self._automaton_index = set(self._automaton_literals)
+        self._automaton = AhoCorasick(self._automaton_literals)
+        self._pending.clear()
+        self._stale = 0
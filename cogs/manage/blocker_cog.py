@@ -1,14 +1,15 @@
+import asyncio
 import math
 import re
 import time
 import datetime
-from collections import defaultdict
 
 import discord
 from discord import Option
 from discord.ext import commands, tasks
 
-from config import IDS
+from config import IDS, SCAM_BLOCKER
+from .ad_rules import AdRuleEngine
 from .blocker_db import scam_db
 from .blocker_ui import (
     build_context_feedback,
@@ -17,12 +18,18 @@ from .blocker_ui import (
     build_notice_embed,
 )
 from .punishment_db import db as punishment_db
+from .spam_tracker import SpamTracker
 from ..shared.utils import is_super_egg
 
 PUBLIC_NOTICE_CHANNEL_ID = IDS.get("PUBLIC_NOTICE_CHANNEL_ID")
 LOG_CHANNEL_ID = IDS.get("LOG_CHANNEL_ID")
 AUTO_AD_PUNISH_CHANNEL_ID = IDS.get("AUTO_AD_PUNISH_CHANNEL_ID")
 AUTO_AD_PUNISH_MUTE_SECONDS = 3 * 24 * 60 * 60
+MESSAGE_LOG_FLUSH_SECONDS = max(1, int(SCAM_BLOCKER.get("MESSAGE_LOG_FLUSH_SECONDS", 2)))
+MESSAGE_LOG_FLUSH_MAX_ROWS = max(1, int(SCAM_BLOCKER.get("MESSAGE_LOG_FLUSH_MAX_ROWS", 500)))
+PURGE_CHANNEL_CONCURRENCY = max(1, int(SCAM_BLOCKER.get("PURGE_CHANNEL_CONCURRENCY", 4)))
+# 批量删除只接受 14 天内的消息，留几分钟余量避免边界上整批失败
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
 
 
 class ScamBlockerCog(commands.Cog, name="广告拦截"):
@@ -30,35 +37,64 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
 
     def __init__(self, bot):
         self.bot = bot
-        self.rules_cache: list[re.Pattern] = []
+        self.rule_engine = AdRuleEngine()
         self._punishing: set[int] = set()
 
-        self.message_tracker: dict[int, list[dict]] = defaultdict(list)
-        self.spam_time_window = 10
-        self.spam_channel_limit = 8
+        self.spam_tracker = SpamTracker(
+            window_seconds=SCAM_BLOCKER.get("SPAM_WINDOW_SECONDS", 10),
+            channel_limit=SCAM_BLOCKER.get("SPAM_CHANNEL_LIMIT", 8),
+            history_size=SCAM_BLOCKER.get("SPAM_HISTORY_PER_USER", 32),
+            max_users=SCAM_BLOCKER.get("SPAM_MAX_TRACKED_USERS", 5000),
+        )
+        self.log_flush_task: asyncio.Task | None = None
+        # 所有处罚共享的清理并发上限；同一频道只由一个任务处理，天然落在同一个限速桶里
+        self._purge_semaphore = asyncio.Semaphore(PURGE_CHANNEL_CONCURRENCY)
 
     async def cog_load(self):
         await self.refresh_rules_cache()
         self.clean_db_task.start()
+        if not self.log_flush_loop.is_running():
+            self.log_flush_loop.change_interval(seconds=MESSAGE_LOG_FLUSH_SECONDS)
+            self.log_flush_loop.start()
 
     def cog_unload(self):
         if self.clean_db_task.is_running():
             self.clean_db_task.cancel()
+        self.log_flush_loop.cancel()
+        try:
+            scam_db.flush_logs_sync()
+        except Exception as e:
+            print(f"[广告拦截] 卸载前消息日志落库失败 error={e!r}")
 
     @tasks.loop(hours=1)
     async def clean_db_task(self):
         await scam_db.clean_old_logs()
-        self.message_tracker.clear()
+        self.spam_tracker.prune(time.time())
+        try:
+            await punishment_db.flush_signature_hits_async()
+        except Exception as e:
+            print(f"[广告拦截] 特征命中计数写回失败 error={e!r}")
+        stats = scam_db.log_stats()
+        if stats["dropped"]:
+            print(f"[广告拦截] 消息日志积压超限，累计丢弃 {stats['dropped']} 条，当前积压 {stats['pending']} 条")
+
+    @tasks.loop(seconds=2)
+    async def log_flush_loop(self):
+        await self._flush_message_logs()
+
+    async def _flush_message_logs(self) -> None:
+        try:
+            await scam_db.flush_logs()
+        except Exception as e:
+            print(f"[广告拦截] 消息日志批量落库失败，已保留待下次重试 error={e!r}")
+
+    def _schedule_log_flush(self) -> None:
+        if self.log_flush_task is None or self.log_flush_task.done():
+            self.log_flush_task = self.bot.loop.create_task(self._flush_message_logs())
 
     async def refresh_rules_cache(self):
         rules = await scam_db.get_all_rules()
-        compiled = []
-        for _, pattern in rules:
-            try:
-                compiled.append(re.compile(pattern, re.IGNORECASE))
-            except re.error:
-                continue
-        self.rules_cache = compiled
+        self.rule_engine.load(rules)
 
     async def punish_user(
         self,
@@ -80,7 +116,7 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
                 await self._timeout_member(guild, user_id, reason, member, mute_seconds, result)
 
             if result["role_removed"] or result["deleted_count"] > 0 or result.get("muted"):
-                punishment_db.add_strike(user_id)
+                await punishment_db.add_strike_async(user_id)
                 await self._send_notifications(
                     guild=guild,
                     user_id=user_id,
@@ -136,24 +172,62 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
             channel_msg_map.setdefault(ch_id, []).append(discord.Object(id=msg_id))
 
         result["channel_ids"] = set(channel_msg_map.keys())
+        result["channel_timings"] = {}
+
+        purged = await asyncio.gather(
+            *(
+                self._purge_channel(guild, ch_id, msg_objs, reason)
+                for ch_id, msg_objs in channel_msg_map.items()
+            )
+        )
+        for ch_id, outcome in zip(channel_msg_map, purged):
+            if outcome is None:
+                continue
+            deleted, elapsed = outcome
+            result["deleted_count"] += deleted
+            result["channel_timings"][ch_id] = (deleted, elapsed)
+
+        await scam_db.delete_user_logs(user_id)
+        return result
 
-        for ch_id, msg_objs in channel_msg_map.items():
-            channel = await self._fetch_channel(guild, ch_id)
+    async def _purge_channel(
+        self,
+        guild: discord.Guild,
+        channel_id: int,
+        msg_objs: list[discord.Object],
+        reason: str,
+    ) -> tuple[int, float] | None:
+        """清理单个频道的消息，返回 (删除条数, 耗时秒)；频道不可用时返回 None。"""
+        async with self._purge_semaphore:
+            started = time.perf_counter()
+            channel = await self._fetch_channel(guild, channel_id)
             if not channel or not isinstance(
                 channel, (discord.TextChannel, discord.VoiceChannel, discord.Thread)
             ):
-                continue
+                return None
+
+            cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+            recent = [obj for obj in msg_objs if obj.created_at > cutoff]
+            expired = [obj for obj in msg_objs if obj.created_at <= cutoff]
+            deleted = 0
 
-            for i in range(0, len(msg_objs), 100):
-                chunk = msg_objs[i : i + 100]
+            for i in range(0, len(recent), 100):
+                chunk = recent[i : i + 100]
                 try:
                     await channel.delete_messages(chunk, reason=reason)
-                    result["deleted_count"] += len(chunk)
+                    deleted += len(chunk)
                 except discord.HTTPException:
                     pass
 
-        await scam_db.delete_user_logs(user_id)
-        return result
+            # 超出批量删除窗口的消息只能逐条删除
+            for obj in expired:
+                try:
+                    await channel.get_partial_message(obj.id).delete(reason=reason)
+                    deleted += 1
+                except discord.HTTPException:
+                    pass
+
+            return deleted, time.perf_counter() - started
 
     async def _timeout_member(
         self,
@@ -208,6 +282,10 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
         )
         target_mention = target_user.mention if target_user else f"<@{user_id}>"
 
+        def channel_label(cid: int) -> str:
+            ch = guild.get_channel(cid) or guild.get_thread(cid)
+            return f"#{ch.name}" if ch else f"#{cid}"
+
         detail_text = None
         if trigger_detail:
             parts = [f"触发方式: {trigger_detail}"]
@@ -215,13 +293,20 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
                 parts.append(f"处罚动作: {result['mute_text']}")
             ch_ids = result.get("channel_ids", set())
             if ch_ids:
-                ch_names = []
-                for cid in ch_ids:
-                    ch = guild.get_channel(cid) or guild.get_thread(cid)
-                    ch_names.append(f"#{ch.name}" if ch else f"#{cid}")
-                parts.append(f"涉及频道: {'  '.join(ch_names)}")
+                parts.append(f"涉及频道: {'  '.join(channel_label(cid) for cid in ch_ids)}")
             detail_text = "\n".join(parts)
 
+        purge_text = None
+        timings = result.get("channel_timings") or {}
+        if timings:
+            slowest = sorted(timings.items(), key=lambda item: item[1][1], reverse=True)
+            purge_lines = [
+                f"{channel_label(cid)}: {deleted} 条 / {elapsed:.1f}s" for cid, (deleted, elapsed) in slowest[:10]
+            ]
+            if len(slowest) > 10:
+                purge_lines.append(f"... 以及其余 {len(slowest) - 10} 个频道")
+            purge_text = "\n".join(purge_lines)
+
         notice_url = None
         notice_ch = await self._fetch_channel(guild, PUBLIC_NOTICE_CHANNEL_ID)
         if notice_ch:
@@ -248,6 +333,7 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
                     target_mention=target_mention,
                     notice_url=notice_url,
                     detail_text=detail_text,
+                    purge_text=purge_text,
                 )
                 await log_ch.send(
                     embed=log_embed,
@@ -263,11 +349,13 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
         if self._is_privileged(message.author):
             return
 
-        await scam_db.log_message(
+        pending = scam_db.queue_message_log(
             message_id=message.id,
             user_id=message.author.id,
             channel_id=message.channel.id,
         )
+        if pending >= MESSAGE_LOG_FLUSH_MAX_ROWS:
+            self._schedule_log_flush()
 
         if AUTO_AD_PUNISH_CHANNEL_ID and message.channel.id == int(AUTO_AD_PUNISH_CHANNEL_ID):
             try:
@@ -286,26 +374,23 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
             )
             return
 
-        if self.rules_cache and message.content:
-            for regex in self.rules_cache:
-                if regex.search(message.content):
-                    try:
-                        await message.delete(reason="命中广告规则")
-                    except (discord.Forbidden, discord.NotFound, discord.HTTPException):
-                        pass
+        rule = self.rule_engine.match(message.content)
+        if rule is not None:
+            try:
+                await message.delete(reason="命中广告规则")
+            except (discord.Forbidden, discord.NotFound, discord.HTTPException):
+                pass
 
-                    pat_display = (
-                        regex.pattern if len(regex.pattern) <= 80 else regex.pattern[:77] + "..."
-                    )
-                    await self.punish_user(
-                        guild=message.guild,
-                        user_id=message.author.id,
-                        reason="恶意广告自动触发",
-                        executor=self.bot.user,
-                        member=message.author if isinstance(message.author, discord.Member) else None,
-                        trigger_detail=f"正则匹配: `{pat_display}`",
-                    )
-                    return
+            pat_display = rule.pattern if len(rule.pattern) <= 80 else rule.pattern[:77] + "..."
+            await self.punish_user(
+                guild=message.guild,
+                user_id=message.author.id,
+                reason="恶意广告自动触发",
+                executor=self.bot.user,
+                member=message.author if isinstance(message.author, discord.Member) else None,
+                trigger_detail=f"正则匹配 #{rule.rule_id}: `{pat_display}`",
+            )
+            return
 
         spam_contents = self._check_spam(message)
         if spam_contents is not None:
@@ -336,28 +421,13 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
                     pass
 
     def _check_spam(self, message: discord.Message) -> list[str] | None:
-        user_id = message.author.id
-        now = time.time()
-
-        self.message_tracker[user_id].append(
-            {
-                "time": now,
-                "channel_id": message.channel.id,
-                "content": message.content or "",
-            }
+        return self.spam_tracker.record(
+            message.author.id,
+            message.channel.id,
+            message.content or "",
+            time.time(),
         )
 
-        self.message_tracker[user_id] = [
-            r for r in self.message_tracker[user_id] if now - r["time"] <= self.spam_time_window
-        ]
-
-        unique_channels = {r["channel_id"] for r in self.message_tracker[user_id]}
-        if len(unique_channels) >= self.spam_channel_limit:
-            contents = [r["content"] for r in self.message_tracker[user_id] if r["content"]]
-            self.message_tracker.pop(user_id, None)
-            return contents
-        return None
-
     async def _extract_and_save_links(self, content: str, author_id: int) -> tuple[int, list[str]]:
         link_re = re.compile(r"((?:https?://)?[\w-]+(?:\.[\w-]+)+(?:/[^\s]*)?)", re.IGNORECASE)
         added = 0
@@ -372,12 +442,13 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
                 clean = match.rstrip(".,!?;:'\"。，！？；：”’])】}")
                 if len(clean) < 5:
                     continue
-                if await scam_db.add_rule(re.escape(clean), author_id):
+                pattern = re.escape(clean)
+                rule_id = await scam_db.add_rule(pattern, author_id)
+                if rule_id:
+                    self.rule_engine.add(rule_id, pattern)
                     added += 1
                     extracted.append(clean)
 
-        if added > 0:
-            await self.refresh_rules_cache()
         return added, extracted
 
     @staticmethod
@@ -497,12 +568,12 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
             await ctx.respond(f"❌ 正则不合法: {e}", ephemeral=True)
             return
 
-        ok = await scam_db.add_rule(pattern, ctx.user.id)
-        if not ok:
+        rule_id = await scam_db.add_rule(pattern, ctx.user.id)
+        if not rule_id:
             await ctx.respond("⚠️ 规则已存在。", ephemeral=True)
             return
 
-        await self.refresh_rules_cache()
+        self.rule_engine.add(rule_id, pattern)
         await ctx.respond("✅ 规则添加成功。", ephemeral=True)
 
     @discord.slash_command(name="删除广告规则", description="按规则ID删除广告拦截规则")
@@ -519,5 +590,5 @@ class ScamBlockerCog(commands.Cog, name="广告拦截"):
             return
 
         await scam_db.delete_rule(rule_id)
-        await self.refresh_rules_cache()
+        self.rule_engine.remove(rule_id)
         await ctx.respond("✅ 规则删除成功。", ephemeral=True)
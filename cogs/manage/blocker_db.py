@@ -3,14 +3,37 @@ import os
 import sqlite3
 import threading
 import time
+from collections import deque
+
+from config import SCAM_BLOCKER
+
+
+# 消息日志按小时分表：message_logs_<小时序号>，过期时整表 DROP，查询时 UNION 所有存活分表。
+LOG_PARTITION_SECONDS = 3600
+_LOG_PARTITION_PREFIX = "message_logs_"
+# 单条复合查询里最多拼接的分表数，远低于 SQLite 默认的 500 上限
+_LOG_UNION_CHUNK = 100
+
+
+def _log_partition_name(bucket: int) -> str:
+    return f"{_LOG_PARTITION_PREFIX}{int(bucket)}"
 
 
 class ScamDB:
-    def __init__(self, db_path: str = "./data/scam_blocker.db"):
+    def __init__(self, db_path: str = "./data/scam_blocker.db", log_backlog_max: int = 20000):
         self.db_path = db_path
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         self._lock = threading.Lock()
         self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # 消息日志先进内存队列，由定时任务或积压阈值触发一次 executemany 批量落库；
+        # 队列有上限，超出时丢弃最旧的记录并计数。
+        self._log_buffer: deque[tuple[int, int, int, float]] = deque()
+        self._log_buffer_lock = threading.Lock()
+        self._log_flush_lock = asyncio.Lock()
+        self.log_backlog_max = max(1, int(log_backlog_max))
+        self.logs_flushed = 0
+        self.logs_dropped = 0
+        self._log_partitions: set[int] = set()
         self._init_db()
 
     def _init_db(self):
@@ -20,15 +43,6 @@ class ScamDB:
                 PRAGMA journal_mode = WAL;
                 PRAGMA synchronous  = NORMAL;
 
-                CREATE TABLE IF NOT EXISTS message_logs (
-                    message_id  INTEGER PRIMARY KEY,
-                    user_id     INTEGER,
-                    channel_id  INTEGER,
-                    timestamp   REAL
-                );
-                CREATE INDEX IF NOT EXISTS idx_logs_user ON message_logs(user_id);
-                CREATE INDEX IF NOT EXISTS idx_logs_ts   ON message_logs(timestamp);
-
                 CREATE TABLE IF NOT EXISTS regex_rules (
                     id       INTEGER PRIMARY KEY AUTOINCREMENT,
                     pattern  TEXT UNIQUE,
@@ -37,54 +51,209 @@ class ScamDB:
                 );
                 """
             )
+            self._load_log_partitions()
+            self._migrate_legacy_logs()
 
-    def _exec(self, sql: str, params=()):
+    def _load_log_partitions(self):
+        self._log_partitions = {
+            int(name[len(_LOG_PARTITION_PREFIX):])
+            for (name,) in self._conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'message_logs_[0-9]*'"
+            )
+        }
+
+    def _ensure_log_partition(self, bucket: int) -> str:
+        # 调用方需持有 self._lock
+        table = _log_partition_name(bucket)
+        if bucket not in self._log_partitions:
+            self._conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    message_id  INTEGER PRIMARY KEY,
+                    user_id     INTEGER,
+                    channel_id  INTEGER,
+                    timestamp   REAL
+                )
+                """
+            )
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user ON {table}(user_id)")
+            self._log_partitions.add(bucket)
+        return table
+
+    def _migrate_legacy_logs(self):
+        """把旧版单表 message_logs 的数据按小时拆进分表，然后删除旧表。"""
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_logs'"
+        ).fetchone()
+        if not exists:
+            return
+        try:
+            buckets = [
+                int(bucket)
+                for (bucket,) in self._conn.execute(
+                    "SELECT DISTINCT CAST(timestamp / ? AS INTEGER) FROM message_logs WHERE timestamp IS NOT NULL",
+                    (LOG_PARTITION_SECONDS,),
+                )
+            ]
+            for bucket in buckets:
+                table = self._ensure_log_partition(bucket)
+                self._conn.execute(
+                    f"""
+                    INSERT OR IGNORE INTO {table} (message_id, user_id, channel_id, timestamp)
+                    SELECT message_id, user_id, channel_id, timestamp FROM message_logs
+                    WHERE CAST(timestamp / ? AS INTEGER) = ?
+                    """,
+                    (LOG_PARTITION_SECONDS, bucket),
+                )
+            self._conn.execute("DROP TABLE message_logs")
+            self._conn.commit()
+        except sqlite3.Error:
+            self._conn.rollback()
+            self._load_log_partitions()
+            raise
+
+    def _live_log_tables(self) -> list[str]:
+        return [_log_partition_name(bucket) for bucket in sorted(self._log_partitions)]
+
+    def _exec(self, sql: str, params=()) -> int | None:
         with self._lock:
-            self._conn.execute(sql, params)
+            cursor = self._conn.execute(sql, params)
             self._conn.commit()
+            return cursor.lastrowid
 
     def _query(self, sql: str, params=()) -> list:
         with self._lock:
             return self._conn.execute(sql, params).fetchall()
 
+    def queue_message_log(self, message_id: int, user_id: int, channel_id: int) -> int:
+        """把一条消息日志放入写入队列，返回当前积压条数。"""
+        with self._log_buffer_lock:
+            if len(self._log_buffer) >= self.log_backlog_max:
+                self._log_buffer.popleft()
+                self.logs_dropped += 1
+            self._log_buffer.append((message_id, user_id, channel_id, time.time()))
+            return len(self._log_buffer)
+
     async def log_message(self, message_id: int, user_id: int, channel_id: int):
-        await asyncio.to_thread(
-            self._exec,
-            "INSERT OR IGNORE INTO message_logs (message_id, user_id, channel_id, timestamp) VALUES (?, ?, ?, ?)",
-            (message_id, user_id, channel_id, time.time()),
-        )
+        self.queue_message_log(message_id, user_id, channel_id)
+
+    def pending_log_count(self) -> int:
+        with self._log_buffer_lock:
+            return len(self._log_buffer)
+
+    def log_stats(self) -> dict:
+        with self._log_buffer_lock:
+            pending = len(self._log_buffer)
+        return {"pending": pending, "flushed": self.logs_flushed, "dropped": self.logs_dropped}
+
+    def _drain_log_buffer(self) -> list[tuple[int, int, int, float]]:
+        with self._log_buffer_lock:
+            rows = list(self._log_buffer)
+            self._log_buffer.clear()
+            return rows
+
+    def _restore_log_buffer(self, rows: list[tuple[int, int, int, float]]) -> None:
+        # 写入失败的批次放回队首，仍受积压上限约束
+        with self._log_buffer_lock:
+            room = self.log_backlog_max - len(self._log_buffer)
+            kept = rows[-room:] if room > 0 else []
+            self.logs_dropped += len(rows) - len(kept)
+            self._log_buffer.extendleft(reversed(kept))
+
+    def _write_logs(self, rows: list[tuple[int, int, int, float]]) -> None:
+        by_bucket: dict[int, list[tuple[int, int, int, float]]] = {}
+        for row in rows:
+            by_bucket.setdefault(int(row[3] // LOG_PARTITION_SECONDS), []).append(row)
+        with self._lock:
+            try:
+                for bucket, bucket_rows in by_bucket.items():
+                    table = self._ensure_log_partition(bucket)
+                    self._conn.executemany(
+                        f"INSERT OR IGNORE INTO {table} (message_id, user_id, channel_id, timestamp) VALUES (?, ?, ?, ?)",
+                        bucket_rows,
+                    )
+                self._conn.commit()
+            except sqlite3.Error:
+                # 回滚可能撤销了本批新建的分表，重新以库内实际表为准
+                self._conn.rollback()
+                self._load_log_partitions()
+                raise
+
+    def flush_logs_sync(self) -> int:
+        rows = self._drain_log_buffer()
+        if not rows:
+            return 0
+        try:
+            self._write_logs(rows)
+        except sqlite3.Error:
+            self._restore_log_buffer(rows)
+            raise
+        with self._log_buffer_lock:
+            self.logs_flushed += len(rows)
+        return len(rows)
+
+    async def flush_logs(self) -> int:
+        """把积压的消息日志在一个事务里写入；并发调用会排队，返回时此前入队的记录都已落库。"""
+        async with self._log_flush_lock:
+            return await asyncio.to_thread(self.flush_logs_sync)
 
     async def get_user_messages(self, user_id: int) -> list:
-        return await asyncio.to_thread(
-            self._query,
-            "SELECT message_id, channel_id FROM message_logs WHERE user_id = ?",
-            (user_id,),
-        )
+        # 处罚前先把积压日志落库，保证刚发出的消息也能被清理
+        try:
+            await self.flush_logs()
+        except sqlite3.Error as e:
+            print(f"[广告拦截] 消息日志落库失败，已保留待下次重试 error={e!r}")
+        return await asyncio.to_thread(self._select_user_messages, user_id)
+
+    def _select_user_messages(self, user_id: int) -> list:
+        with self._lock:
+            tables = self._live_log_tables()
+            rows: list = []
+            for i in range(0, len(tables), _LOG_UNION_CHUNK):
+                chunk = tables[i : i + _LOG_UNION_CHUNK]
+                sql = " UNION ".join(
+                    f"SELECT message_id, channel_id FROM {table} WHERE user_id = ?" for table in chunk
+                )
+                rows.extend(self._conn.execute(sql, (user_id,) * len(chunk)).fetchall())
+            return rows if len(tables) <= _LOG_UNION_CHUNK else list(dict.fromkeys(rows))
+
+    def _delete_user_logs(self, user_id: int):
+        with self._lock:
+            try:
+                for table in self._live_log_tables():
+                    self._conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
 
     async def delete_user_logs(self, user_id: int):
-        await asyncio.to_thread(
-            self._exec,
-            "DELETE FROM message_logs WHERE user_id = ?",
-            (user_id,),
-        )
+        await asyncio.to_thread(self._delete_user_logs, user_id)
 
-    async def clean_old_logs(self, keep_seconds: int = 21600):
-        await asyncio.to_thread(
-            self._exec,
-            "DELETE FROM message_logs WHERE timestamp < ?",
-            (time.time() - keep_seconds,),
-        )
+    def _drop_expired_logs(self, keep_seconds: int, now: float | None = None) -> int:
+        # 只删除整段都早于保留窗口的分表，窗口内的记录一条不少
+        cutoff_bucket = int(((now or time.time()) - keep_seconds) // LOG_PARTITION_SECONDS)
+        with self._lock:
+            expired = sorted(bucket for bucket in self._log_partitions if bucket < cutoff_bucket)
+            for bucket in expired:
+                self._conn.execute(f"DROP TABLE IF EXISTS {_log_partition_name(bucket)}")
+                self._conn.commit()
+                self._log_partitions.discard(bucket)
+            return len(expired)
+
+    async def clean_old_logs(self, keep_seconds: int = 21600) -> int:
+        return await asyncio.to_thread(self._drop_expired_logs, keep_seconds)
 
-    async def add_rule(self, pattern: str, author_id: int) -> bool:
+    async def add_rule(self, pattern: str, author_id: int) -> int | None:
+        """新增规则并返回规则ID；规则已存在时返回 None。"""
         try:
-            await asyncio.to_thread(
+            return await asyncio.to_thread(
                 self._exec,
                 "INSERT INTO regex_rules (pattern, added_by, added_at) VALUES (?, ?, ?)",
                 (pattern, author_id, time.time()),
             )
-            return True
         except sqlite3.IntegrityError:
-            return False
+            return None
 
     async def get_all_rules(self) -> list:
         return await asyncio.to_thread(
@@ -100,4 +269,4 @@ class ScamDB:
         )
 
 
-scam_db = ScamDB()
+scam_db = ScamDB(log_backlog_max=SCAM_BLOCKER.get("MESSAGE_LOG_BACKLOG_MAX", 20000))
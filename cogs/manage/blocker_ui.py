@@ -57,6 +57,7 @@ def build_log_embed(
     target_mention: str,
     notice_url: str | None,
     detail_text: str | None,
+    purge_text: str | None = None,
 ) -> discord.Embed:
     embed = discord.Embed(title="防盗号广告拦截日志", color=0xA0AAB0)
     embed.add_field(name="执行者", value=executor_mention, inline=True)
@@ -66,6 +67,9 @@ def build_log_embed(
     if detail_text:
         embed.add_field(name="拦截详情", value=detail_text[:1024], inline=False)
 
+    if purge_text:
+        embed.add_field(name="清理耗时", value=purge_text[:1024], inline=False)
+
     if notice_url:
         embed.add_field(name="公示链接", value=notice_url, inline=False)
 
@@ -167,7 +167,7 @@ class PunishmentCog(commands.Cog, name="处罚系统"):
                     except discord.Forbidden:
                         pass
 
-                strike = db.add_strike(target_id)
+                strike = await db.add_strike_async(target_id)
                 linked_action = "无"
                 try:
                     if strike == 1:
@@ -197,7 +197,7 @@ class PunishmentCog(commands.Cog, name="处罚系统"):
                 }
 
             elif action == "unwarn":
-                strike = db.remove_strike(target_id)
+                strike = await db.remove_strike_async(target_id)
                 return {
                     "ok": True,
                     "target_id": target_id,
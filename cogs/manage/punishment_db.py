@@ -1,112 +1,201 @@
 # cogs/manage/punishment_db.py
 
+import asyncio
+import atexit
 import sqlite3
 import datetime
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from cogs.shared.sqlite_pool import pooled_connection
 
 # --- 配置常量 ---
 DB_PATH = "./data/punishments.db"
+# 待写入的特征命中计数达到该数量时，提交一次后台批量写入
+SIGNATURE_HIT_FLUSH_THRESHOLD = 50
+
+# SQL 固定为模块常量，配合连接池的语句缓存复用预编译语句
+_ADD_STRIKE_SQL = """
+    INSERT INTO strikes (user_id, count, last_updated)
+    VALUES (?, 1, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+    count = count + 1,
+    last_updated = excluded.last_updated
+    RETURNING count
+"""
+_REMOVE_STRIKE_SQL = """
+    UPDATE strikes
+    SET count = count - 1,
+        last_updated = ?
+    WHERE user_id = ? AND count > 0
+    RETURNING count
+"""
+_MARK_SIGNATURE_HITS_SQL = """
+    UPDATE ad_signatures
+    SET hit_count = hit_count + ?,
+        last_hit = ?
+    WHERE pattern = ?
+"""
+
 
 class PunishmentDB:
+    """处罚记录库。
+
+    警告次数与广告特征在内存里各有一份写穿缓存，读取不访问数据库；
+    写操作串行执行，异步调用方通过 *_async 方法把写入放到专用线程里，不阻塞事件循环。
+    特征命中计数先在内存累加，再批量写回。
+    """
+
     def __init__(self, db_path=DB_PATH):
         # 确保目录存在
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        self.conn = sqlite3.connect(db_path)
-        self.cursor = self.conn.cursor()
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="punishment-db")
+        self._write_lock = threading.Lock()
+        self._hits_lock = threading.Lock()
+        self._strikes: dict[int, int] = {}
+        self._signatures: list[str] = []
+        self._signature_set: set[str] = set()
+        self._pending_hits: dict[str, tuple[int, datetime.datetime]] = {}
         self._create_table()
+        self._load_cache()
+        atexit.register(self.flush_signature_hits)
+
+    def _connection(self):
+        return pooled_connection(self.db_path, row_factory=None)
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
 
     def _create_table(self):
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS strikes (
-                user_id INTEGER PRIMARY KEY,
-                count INTEGER DEFAULT 0,
-                last_updated TIMESTAMP
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS ad_signatures (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                pattern TEXT UNIQUE,
-                source_url TEXT,
-                created_by INTEGER,
-                created_at TIMESTAMP,
-                hit_count INTEGER DEFAULT 0,
-                last_hit TIMESTAMP
-            )
-        """)
-        self.conn.commit()
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS strikes (
+                    user_id INTEGER PRIMARY KEY,
+                    count INTEGER DEFAULT 0,
+                    last_updated TIMESTAMP
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ad_signatures (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    pattern TEXT UNIQUE,
+                    source_url TEXT,
+                    created_by INTEGER,
+                    created_at TIMESTAMP,
+                    hit_count INTEGER DEFAULT 0,
+                    last_hit TIMESTAMP
+                )
+            """)
+
+    def _load_cache(self):
+        with self._connection() as conn:
+            strikes = conn.execute("SELECT user_id, count FROM strikes").fetchall()
+            signatures = conn.execute("SELECT pattern FROM ad_signatures ORDER BY id ASC").fetchall()
+        with self._write_lock:
+            self._strikes = {int(user_id): int(count or 0) for user_id, count in strikes}
+            self._signatures = [row[0] for row in signatures]
+            self._signature_set = set(self._signatures)
 
     def add_strike(self, user_id: int):
-        self.cursor.execute("""
-            INSERT INTO strikes (user_id, count, last_updated)
-            VALUES (?, 1, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-            count = count + 1,
-            last_updated = ?
-        """, (user_id, datetime.datetime.now(), datetime.datetime.now()))
-        self.conn.commit()
-        return self.get_strikes(user_id)
+        with self._write_lock:
+            with self._connection() as conn:
+                rows = conn.execute(_ADD_STRIKE_SQL, (user_id, datetime.datetime.now())).fetchall()
+            count = int(rows[0][0])
+            self._strikes[user_id] = count
+        return count
 
     def remove_strike(self, user_id: int):
-        current = self.get_strikes(user_id)
-        new_count = max(0, current - 1)
-        if current == 0:
-            return 0
-
-        self.cursor.execute(
-            """
-            INSERT INTO strikes (user_id, count, last_updated)
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET
-            count = excluded.count,
-            last_updated = excluded.last_updated
-            """,
-            (user_id, new_count, datetime.datetime.now()),
-        )
-        self.conn.commit()
+        with self._write_lock:
+            if self._strikes.get(user_id, 0) == 0:
+                return 0
+            with self._connection() as conn:
+                rows = conn.execute(_REMOVE_STRIKE_SQL, (datetime.datetime.now(), user_id)).fetchall()
+            new_count = int(rows[0][0]) if rows else 0
+            self._strikes[user_id] = new_count
         return new_count
 
     def get_strikes(self, user_id: int) -> int:
-        self.cursor.execute("SELECT count FROM strikes WHERE user_id = ?", (user_id,))
-        res = self.cursor.fetchone()
-        return res[0] if res else 0
+        return self._strikes.get(user_id, 0)
 
     def reset_strikes(self, user_id: int):
-        self.cursor.execute("DELETE FROM strikes WHERE user_id = ?", (user_id,))
-        self.conn.commit()
+        with self._write_lock:
+            with self._connection() as conn:
+                conn.execute("DELETE FROM strikes WHERE user_id = ?", (user_id,))
+            self._strikes.pop(user_id, None)
 
     def add_ad_signature(self, pattern: str, source_url: str | None = None, created_by: int | None = None) -> bool:
         now = datetime.datetime.now()
-        try:
-            self.cursor.execute(
-                """
-                INSERT INTO ad_signatures (pattern, source_url, created_by, created_at)
-                VALUES (?, ?, ?, ?)
-                """,
-                (pattern, source_url, created_by, now),
-            )
-            self.conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False
+        with self._write_lock:
+            try:
+                with self._connection() as conn:
+                    conn.execute(
+                        """
+                        INSERT INTO ad_signatures (pattern, source_url, created_by, created_at)
+                        VALUES (?, ?, ?, ?)
+                        """,
+                        (pattern, source_url, created_by, now),
+                    )
+            except sqlite3.IntegrityError:
+                return False
+            self._signatures.append(pattern)
+            self._signature_set.add(pattern)
+        return True
 
     def list_ad_signatures(self) -> list[str]:
-        self.cursor.execute("SELECT pattern FROM ad_signatures ORDER BY id ASC")
-        rows = self.cursor.fetchall()
-        return [row[0] for row in rows]
+        return list(self._signatures)
 
     def mark_ad_signature_hit(self, pattern: str):
-        now = datetime.datetime.now()
-        self.cursor.execute(
-            """
-            UPDATE ad_signatures
-            SET hit_count = hit_count + 1,
-                last_hit = ?
-            WHERE pattern = ?
-            """,
-            (now, pattern),
-        )
-        self.conn.commit()
+        """只在内存里累加命中次数；积累够一批后交给后台线程统一写回。"""
+        if pattern not in self._signature_set:
+            return
+        with self._hits_lock:
+            count, _ = self._pending_hits.get(pattern, (0, None))
+            self._pending_hits[pattern] = (count + 1, datetime.datetime.now())
+            pending = len(self._pending_hits)
+        if pending >= SIGNATURE_HIT_FLUSH_THRESHOLD:
+            self._executor.submit(self.flush_signature_hits)
+
+    def flush_signature_hits(self) -> int:
+        with self._hits_lock:
+            pending = self._pending_hits
+            self._pending_hits = {}
+        if not pending:
+            return 0
+        params = [(count, last_hit, pattern) for pattern, (count, last_hit) in pending.items()]
+        try:
+            with self._write_lock:
+                with self._connection() as conn:
+                    conn.executemany(_MARK_SIGNATURE_HITS_SQL, params)
+        except sqlite3.Error:
+            # 写入失败时把计数合并回去，等下一次再写
+            with self._hits_lock:
+                for pattern, (count, last_hit) in pending.items():
+                    current, _ = self._pending_hits.get(pattern, (0, None))
+                    self._pending_hits[pattern] = (current + count, last_hit)
+            raise
+        return len(params)
+
+    async def add_strike_async(self, user_id: int) -> int:
+        return await self._run(self.add_strike, user_id)
+
+    async def remove_strike_async(self, user_id: int) -> int:
+        return await self._run(self.remove_strike, user_id)
+
+    async def reset_strikes_async(self, user_id: int):
+        await self._run(self.reset_strikes, user_id)
+
+    async def add_ad_signature_async(
+        self, pattern: str, source_url: str | None = None, created_by: int | None = None
+    ) -> bool:
+        return await self._run(self.add_ad_signature, pattern, source_url, created_by)
+
+    async def flush_signature_hits_async(self) -> int:
+        return await self._run(self.flush_signature_hits)
 
 # 创建一个全局数据库实例，供其他模块调用
-db = PunishmentDB()
\ No newline at end of file
+db = PunishmentDB()
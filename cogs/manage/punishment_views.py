@@ -433,7 +433,7 @@ class ManagementControlView(ui.View):
         await interaction.response.defer(ephemeral=True)
         count = 0
         for tid in sorted(set(self.target_ids)):
-            db.reset_strikes(tid)
+            await db.reset_strikes_async(tid)
             count += 1
 
         if count == 1:
@@ -623,7 +623,7 @@ class ManagementControlView(ui.View):
                     except (discord.Forbidden, IndexError):
                         pass # 无法私信或无附件
 
-                new_count = db.add_strike(tid)
+                new_count = await db.add_strike_async(tid)
                 try:
                     if new_count == 1:
                         await member.timeout(
@@ -647,7 +647,7 @@ class ManagementControlView(ui.View):
 
             elif act == "unwarn":
                 msg_act, color = "撤销警告", 0x66CC99
-                new_count = db.remove_strike(tid)
+                new_count = await db.remove_strike_async(tid)
                 linked_action = "仅撤销累计，不自动反向解除处罚"
 
             elif act == "mute":
@@ -0,0 +1,107 @@
+from collections import OrderedDict, deque
+
+
+class _UserWindow:
+    __slots__ = ("events", "channel_counts", "hash_counts", "contents")
+
+    def __init__(self, history_size: int):
+        self.events: deque[tuple[float, int, int | None]] = deque(maxlen=history_size)
+        self.channel_counts: dict[int, int] = {}
+        self.hash_counts: dict[int, int] = {}
+        self.contents: dict[int, str] = {}
+
+
+class SpamTracker:
+    """跨频道刷屏检测：每个用户一个定长环形窗口，频道计数随进出窗口增量维护。
+
+    窗口里只存 (时间, 频道ID, 内容哈希)，相同内容只保留一份完整文本用于提取链接，
+    截断会把跨越截断点的链接变成残缺规则；文本条数受 history_size 限制，单条长度受
+    Discord 消息长度上限限制。跟踪的用户数超过上限时按最久未发言淘汰，因此内存和
+    单条消息的开销都是常数级。
+    """
+
+    def __init__(
+        self,
+        window_seconds: float = 10,
+        channel_limit: int = 8,
+        history_size: int = 32,
+        max_users: int = 5000,
+    ):
+        self.window_seconds = float(window_seconds)
+        self.channel_limit = max(1, int(channel_limit))
+        self.history_size = max(self.channel_limit, int(history_size))
+        self.max_users = max(1, int(max_users))
+        self.evicted_users = 0
+        self._users: OrderedDict[int, _UserWindow] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def record(self, user_id: int, channel_id: int, content: str, now: float) -> list[str] | None:
+        """记录一条消息；窗口内涉及的频道数达到阈值时返回窗口内的去重内容并重置该用户。"""
+        window = self._users.get(user_id)
+        if window is None:
+            window = _UserWindow(self.history_size)
+            self._users[user_id] = window
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.evicted_users += 1
+        else:
+            self._users.move_to_end(user_id)
+            self._expire(window, now)
+
+        if len(window.events) == self.history_size:
+            self._drop_oldest(window)
+        content_hash = hash(content) if content else None
+        window.events.append((now, channel_id, content_hash))
+        window.channel_counts[channel_id] = window.channel_counts.get(channel_id, 0) + 1
+        if content:
+            window.hash_counts[content_hash] = window.hash_counts.get(content_hash, 0) + 1
+            if content_hash not in window.contents:
+                window.contents[content_hash] = content
+
+        if len(window.channel_counts) >= self.channel_limit:
+            self._users.pop(user_id, None)
+            return list(window.contents.values())
+        return None
+
+    def prune(self, now: float) -> int:
+        """淘汰窗口已整体过期的用户；从最久未发言的一端开始，遇到仍活跃的用户即停止。"""
+        removed = 0
+        cutoff = now - self.window_seconds
+        while self._users:
+            window = next(iter(self._users.values()))
+            if window.events and window.events[-1][0] >= cutoff:
+                break
+            self._users.popitem(last=False)
+            removed += 1
+        return removed
+
+    def forget(self, user_id: int) -> None:
+        self._users.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._users.clear()
+
+    def _expire(self, window: _UserWindow, now: float) -> None:
+        cutoff = now - self.window_seconds
+        events = window.events
+        while events and events[0][0] < cutoff:
+            self._drop_oldest(window)
+
+    @staticmethod
+    def _drop_oldest(window: _UserWindow) -> None:
+        _, channel_id, content_hash = window.events.popleft()
+        remaining = window.channel_counts[channel_id] - 1
+        if remaining:
+            window.channel_counts[channel_id] = remaining
+        else:
+            del window.channel_counts[channel_id]
+        if content_hash is None:
+            return
+        count = window.hash_counts[content_hash]
+        if count > 1:
+            window.hash_counts[content_hash] = count - 1
+        else:
+            del window.hash_counts[content_hash]
+            window.contents.pop(content_hash, None)
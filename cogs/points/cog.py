@@ -10,15 +10,21 @@ from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 
 import config
 from .storage import (
+    compact_point_transactions,
+    flush_message_activity,
     format_shells,
     initialize_points_storage,
     get_successful_praise_scan_record,
-    record_message_activity,
+    get_successful_praise_scan_records,
+    get_praise_scan_cursor,
+    queue_message_activity,
     record_praise_scan_log,
+    save_praise_scan_cursor,
     reward_daily_forum_post,
     reward_daily_kimi_praise,
     settle_monthly_card_daily_rewards,
-    load_praise_rules,
+    PraiseRuleSet,
+    load_praise_ruleset,
     match_praise_rule,
 )
 
@@ -31,6 +37,15 @@ POINTS_MSG_COOLDOWN = getattr(
 )
 PRAISE_KIMI_CHANNEL_ID = int(getattr(config, "PRAISE_KIMI_CHANNEL_ID", 1450480250210484357))
 PRAISE_RESCAN_MINUTES = max(1, int(getattr(config, "PRAISE_KIMI_RESCAN_MINUTES", 5)))
+PRAISE_RECHECK_MINUTES = max(1, int(getattr(config, "PRAISE_KIMI_RECHECK_MINUTES", 30)))
+PRAISE_FULL_RESCAN_MINUTES = max(PRAISE_RESCAN_MINUTES, int(getattr(config, "PRAISE_KIMI_FULL_RESCAN_MINUTES", 180)))
+# 与 Discord 历史消息接口单页条数一致：每页只查一次已发放记录。
+PRAISE_RESCAN_PAGE_SIZE = 100
+# 这些结果表示消息还需要再处理一次，高水位不能越过它们（超出复查窗口的除外）。
+PRAISE_UNSETTLED_RESULTS = {"pending", "cleanup_failed", "marker_failed"}
+ACTIVITY_FLUSH_SECONDS = max(1, int(getattr(config, "ACTIVITY_FLUSH_SECONDS", 5)))
+ACTIVITY_FLUSH_MAX_EVENTS = max(1, int(getattr(config, "ACTIVITY_FLUSH_MAX_EVENTS", 200)))
+LEDGER_COMPACT_MINUTES = max(1, int(getattr(config, "LEDGER_COMPACT_MINUTES", 60)))
 PRAISE_REWARD_EMOJIS = {
     0: "0️⃣",
     1: "1️⃣",
@@ -79,9 +94,11 @@ class PointListener(commands.Cog):
         self.bot = bot
         self.user_cooldowns = {}
         self.praise_scanner_started = False
+        self.last_full_praise_rescan = 0.0
         self.monthly_card_settlement_started = False
         self.forum_reward_rescan_started = False
         self.activity_write_lock = asyncio.Lock()
+        self.activity_flush_task: asyncio.Task | None = None
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -97,6 +114,12 @@ class PointListener(commands.Cog):
         if not self.monthly_card_settlement_started:
             self.monthly_card_settlement_started = True
             self.monthly_card_daily_settlement.start()
+        if not self.activity_flush_loop.is_running():
+            self.activity_flush_loop.change_interval(seconds=ACTIVITY_FLUSH_SECONDS)
+            self.activity_flush_loop.start()
+        if not self.ledger_compaction.is_running():
+            self.ledger_compaction.change_interval(minutes=LEDGER_COMPACT_MINUTES)
+            self.ledger_compaction.start()
         if not self.forum_reward_rescan_started:
             self.forum_reward_rescan_started = True
             self.bot.loop.create_task(self._rescan_today_forum_posts())
@@ -104,6 +127,28 @@ class PointListener(commands.Cog):
     def cog_unload(self):
         self.praise_reward_rescan.cancel()
         self.monthly_card_daily_settlement.cancel()
+        self.activity_flush_loop.cancel()
+        self.ledger_compaction.cancel()
+        try:
+            flush_message_activity()
+        except Exception as error:
+            print(f"[蛋壳系统] 卸载前发言计数落库失败 error={error!r}")
+
+    async def _flush_activity(self) -> None:
+        # 批量写入仍在线程池执行；锁保证定时落库与阈值落库不会同时抢写。
+        async with self.activity_write_lock:
+            try:
+                await asyncio.to_thread(flush_message_activity)
+            except Exception as error:
+                print(f"[蛋壳系统] 发言计数批量落库失败，已保留待下次重试 error={error!r}")
+
+    def _schedule_activity_flush(self) -> None:
+        if self.activity_flush_task is None or self.activity_flush_task.done():
+            self.activity_flush_task = self.bot.loop.create_task(self._flush_activity())
+
+    @tasks.loop(seconds=5)
+    async def activity_flush_loop(self):
+        await self._flush_activity()
 
     @tasks.loop(minutes=10)
     async def monthly_card_daily_settlement(self):
@@ -118,6 +163,18 @@ class PointListener(commands.Cog):
                 f"users={result.get('rewarded_users')} total={format_shells(result.get('total_reward', 0))}"
             )
 
+    @tasks.loop(minutes=60)
+    async def ledger_compaction(self):
+        try:
+            result = await asyncio.to_thread(compact_point_transactions)
+        except Exception as error:
+            print(f"[蛋壳系统] 流水归档失败 error={error!r}")
+            return
+        if result.get("archived_rows", 0):
+            print(
+                f"[蛋壳系统] 流水归档 rows={result.get('archived_rows')} chunks={result.get('archived_chunks')}"
+            )
+
     @monthly_card_daily_settlement.before_loop
     async def before_monthly_card_daily_settlement(self):
         await self.bot.wait_until_ready()
@@ -300,7 +357,14 @@ class PointListener(commands.Cog):
                 f"reason={reason} error={log_error!r} content={message.content!r}"
             )
 
-    async def _reward_praise_message(self, message: discord.Message, *, recovered: bool = False, rules: list[dict] | None = None) -> bool | str | None:
+    async def _reward_praise_message(
+        self,
+        message: discord.Message,
+        *,
+        recovered: bool = False,
+        rules: PraiseRuleSet | None = None,
+        scan_records: dict[tuple[str, str], dict] | None = None,
+    ) -> bool | str | None:
         if not message.guild:
             return None
         if message.channel.id != PRAISE_KIMI_CHANNEL_ID:
@@ -338,12 +402,15 @@ class PointListener(commands.Cog):
 
         if recovered:
             try:
-                already_recorded = await asyncio.to_thread(
-                    get_successful_praise_scan_record,
-                    message.guild.id,
-                    message.id,
-                    rule["id"],
-                )
+                if scan_records is not None:
+                    already_recorded = scan_records.get((str(message.id), str(rule["id"])[:64]))
+                else:
+                    already_recorded = await asyncio.to_thread(
+                        get_successful_praise_scan_record,
+                        message.guild.id,
+                        message.id,
+                        rule["id"],
+                    )
             except Exception as error:
                 await self._mark_praise_pending(
                     message,
@@ -468,6 +535,15 @@ class PointListener(commands.Cog):
 
     @tasks.loop(minutes=5)
     async def praise_reward_rescan(self):
+        full = time.monotonic() - self.last_full_praise_rescan >= PRAISE_FULL_RESCAN_MINUTES * 60
+        await self.rescan_praise_channel(full=full)
+
+    async def rescan_praise_channel(self, *, full: bool = False) -> None:
+        """补发赞美奇米蛋奖励。
+
+        默认只拉取高水位之后的新消息；未结算的消息在复查窗口内会被反复重扫，
+        超出窗口后高水位越过它们，交给定期的全天对账（full=True）兜底。
+        """
         channel = self.bot.get_channel(PRAISE_KIMI_CHANNEL_ID)
         if channel is None:
             try:
@@ -479,42 +555,101 @@ class PointListener(commands.Cog):
         after_cn = datetime.datetime.combine(today_cn, datetime.time.min, tzinfo=config.TZ_CN)
         after_utc = after_cn.astimezone(datetime.timezone.utc)
         try:
-            rules = await asyncio.to_thread(load_praise_rules)
-            scanned = rewarded = pending = invalid = duplicate = reaction_errors = errors = skipped = 0
-            async for message in channel.history(limit=None, after=after_utc, oldest_first=True):
-                scanned += 1
+            stored_cursor = await asyncio.to_thread(get_praise_scan_cursor, PRAISE_KIMI_CHANNEL_ID)
+        except Exception as error:
+            print(f"[蛋壳系统][赞美奇米蛋] 读取重扫高水位失败，改为全天对账 error={error!r}")
+            stored_cursor = 0
+        if stored_cursor < discord.utils.time_snowflake(after_utc):
+            full = True
+        start_after = after_utc if full else discord.Object(id=stored_cursor)
+        recheck_before = discord.utils.utcnow() - datetime.timedelta(minutes=PRAISE_RECHECK_MINUTES)
+        cursor = 0
+        cursor_blocked = False
+        try:
+            rules = await asyncio.to_thread(load_praise_ruleset)
+            stats = dict.fromkeys(
+                ("scanned", "rewarded", "pending", "invalid", "duplicate", "reaction_errors", "errors", "skipped"), 0
+            )
+            page: list[discord.Message] = []
+
+            async def settle_page() -> None:
+                nonlocal cursor, cursor_blocked
+                results = await self._rescan_praise_page(page, rules, stats)
+                for message, result in zip(page, results):
+                    if cursor_blocked:
+                        break
+                    if result in PRAISE_UNSETTLED_RESULTS and message.created_at >= recheck_before:
+                        cursor_blocked = True
+                    else:
+                        cursor = message.id
+
+            async for message in channel.history(limit=None, after=start_after, oldest_first=True):
+                page.append(message)
+                if len(page) >= PRAISE_RESCAN_PAGE_SIZE:
+                    await settle_page()
+                    page = []
+            if page:
+                await settle_page()
+            if full:
+                self.last_full_praise_rescan = time.monotonic()
+            if cursor:
                 try:
-                    result = await self._reward_praise_message(message, recovered=True, rules=rules)
+                    await asyncio.to_thread(save_praise_scan_cursor, PRAISE_KIMI_CHANNEL_ID, cursor)
                 except Exception as error:
-                    await self._mark_praise_pending(
-                        message,
-                        reason=f"unexpected_scan_error:{type(error).__name__}:{error}",
-                        recovered=True,
-                    )
-                    result = "pending"
-                if result is True:
-                    rewarded += 1
-                elif result == "pending":
-                    pending += 1
-                elif result == "invalid":
-                    invalid += 1
-                elif result == "duplicate":
-                    duplicate += 1
-                elif result in {"cleanup_failed", "marker_failed"}:
-                    reaction_errors += 1
-                elif result == "failed" or result is False:
-                    errors += 1
-                else:
-                    skipped += 1
+                    print(f"[蛋壳系统][赞美奇米蛋] 保存重扫高水位失败 error={error!r}")
             print(
-                f"[蛋壳系统][赞美奇米蛋] 今日重扫完成 channel={PRAISE_KIMI_CHANNEL_ID} "
-                f"scanned={scanned} rewarded={rewarded} pending={pending} "
-                f"invalid={invalid} duplicate={duplicate} reaction_errors={reaction_errors} "
-                f"errors={errors} skipped={skipped}"
+                f"[蛋壳系统][赞美奇米蛋] {'全天对账' if full else '增量重扫'}完成 channel={PRAISE_KIMI_CHANNEL_ID} "
+                f"scanned={stats['scanned']} rewarded={stats['rewarded']} pending={stats['pending']} "
+                f"invalid={stats['invalid']} duplicate={stats['duplicate']} "
+                f"reaction_errors={stats['reaction_errors']} errors={stats['errors']} skipped={stats['skipped']} "
+                f"cursor={max(cursor, stored_cursor)}"
             )
         except (discord.Forbidden, discord.HTTPException) as error:
             print(f"[蛋壳系统] 赞美奇米蛋补发扫描失败: {error}")
 
+    async def _rescan_praise_page(self, page: list[discord.Message], rules: PraiseRuleSet, stats: dict) -> list:
+        """一页历史消息只做一次批量查询，判断哪些 (消息, 规则) 已经发放过；按顺序返回每条的处理结果。"""
+        guild = page[0].guild
+        try:
+            scan_records = await asyncio.to_thread(
+                get_successful_praise_scan_records,
+                guild.id if guild else 0,
+                [message.id for message in page],
+            )
+        except Exception as error:
+            print(f"[蛋壳系统][赞美奇米蛋] 批量查询扫描记录失败，本页逐条查询 error={error!r}")
+            scan_records = None
+        results = []
+        for message in page:
+            stats["scanned"] += 1
+            try:
+                result = await self._reward_praise_message(
+                    message, recovered=True, rules=rules, scan_records=scan_records
+                )
+            except Exception as error:
+                await self._mark_praise_pending(
+                    message,
+                    reason=f"unexpected_scan_error:{type(error).__name__}:{error}",
+                    recovered=True,
+                )
+                result = "pending"
+            results.append(result)
+            if result is True:
+                stats["rewarded"] += 1
+            elif result == "pending":
+                stats["pending"] += 1
+            elif result == "invalid":
+                stats["invalid"] += 1
+            elif result == "duplicate":
+                stats["duplicate"] += 1
+            elif result in {"cleanup_failed", "marker_failed"}:
+                stats["reaction_errors"] += 1
+            elif result == "failed" or result is False:
+                stats["errors"] += 1
+            else:
+                stats["skipped"] += 1
+        return results
+
     @praise_reward_rescan.before_loop
     async def before_praise_reward_rescan(self):
         await self.bot.wait_until_ready()
@@ -553,15 +688,11 @@ class PointListener(commands.Cog):
             return
 
         self.user_cooldowns[message.author.id] = now
-        # user_points.json 会随用户量增长。整文件读写不能占用 Discord 的
-        # asyncio 事件循环，否则同一时刻到达的按钮交互可能错过首次响应。
-        # 串行化写入也可避免两条并发消息互相覆盖数据。
-        async with self.activity_write_lock:
-            await asyncio.to_thread(
-                record_message_activity,
-                user_id=message.author.id,
-                guild_id=message.guild.id,
-            )
+        # 发言计数只进内存累加器，按 (服务器, 用户, 日期) 合并后由定时任务
+        # 或积压阈值触发一次事务批量落库，避免每条消息一个写事务。
+        pending = queue_message_activity(user_id=message.author.id, guild_id=message.guild.id)
+        if pending >= ACTIVITY_FLUSH_MAX_EVENTS:
+            self._schedule_activity_flush()
 
     async def _reward_forum_thread(
         self,
@@ -1,5 +1,6 @@
 # cogs/points/storage.py
 
+import atexit
 import json
 import math
 import os
@@ -9,6 +10,7 @@ import sqlite3
 import threading
 import unicodedata
 import uuid
+import zlib
 from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 from functools import wraps
@@ -16,6 +18,8 @@ from pathlib import Path
 from typing import Any
 
 import config
+from cogs.shared.sqlite_pool import pooled_connection
+from cogs.shared.text_match import AhoCorasick
 
 POINTS_DATA_FILE = "data/user_points.json"
 POINTS_DB_FILE = "data/user_points.sqlite3"
@@ -30,6 +34,12 @@ _POINTS_DB_READY = False
 _RANDOM_EVENTS_CACHE: list[dict] | None = None
 _RANDOM_EVENTS_MTIME_NS = -1
 _PRAISE_RULES_LOCK = threading.RLock()
+_PRAISE_RULESET_CACHE: "PraiseRuleSet | None" = None
+_PRAISE_RULES_MTIME_NS = -1
+_ACTIVITY_BUFFER_LOCK = threading.Lock()
+_PENDING_ACTIVITY: dict[tuple[int, int, str], int] = {}
+_PENDING_ACTIVITY_EVENTS = 0
+LEDGER_ARCHIVE_CHUNK_ROWS = 200
 
 DEFAULT_MONTHLY_CARD_CONFIG = {
     "enabled": True,
@@ -81,28 +91,46 @@ def _normalize_praise_rule(raw: dict | None) -> dict | None:
     }
 
 
-def load_praise_rules() -> list[dict]:
+def _read_praise_rules_file() -> list[dict]:
+    if not os.path.exists(PRAISE_RULES_FILE):
+        return [_default_praise_rule()]
+    try:
+        with open(PRAISE_RULES_FILE, "r", encoding="utf-8") as file:
+            raw = json.load(file)
+    except (json.JSONDecodeError, FileNotFoundError, OSError):
+        return [_default_praise_rule()]
+    items = raw.get("rules", []) if isinstance(raw, dict) else raw
+    if not isinstance(items, list):
+        return [_default_praise_rule()]
+    rules, seen = [], set()
+    for item in items:
+        rule = _normalize_praise_rule(item)
+        if rule and rule["id"] not in seen:
+            seen.add(rule["id"])
+            rules.append(rule)
+    return rules
+
+
+def load_praise_ruleset() -> "PraiseRuleSet":
+    """返回编译好的识别规则集；规则文件 mtime 不变时直接复用缓存。"""
+    global _PRAISE_RULESET_CACHE, _PRAISE_RULES_MTIME_NS
+    try:
+        mtime_ns = os.stat(PRAISE_RULES_FILE).st_mtime_ns
+    except OSError:
+        mtime_ns = -1
     with _PRAISE_RULES_LOCK:
-        if not os.path.exists(PRAISE_RULES_FILE):
-            return [_default_praise_rule()]
-        try:
-            with open(PRAISE_RULES_FILE, "r", encoding="utf-8") as file:
-                raw = json.load(file)
-        except (json.JSONDecodeError, FileNotFoundError, OSError):
-            return [_default_praise_rule()]
-        items = raw.get("rules", []) if isinstance(raw, dict) else raw
-        if not isinstance(items, list):
-            return [_default_praise_rule()]
-        rules, seen = [], set()
-        for item in items:
-            rule = _normalize_praise_rule(item)
-            if rule and rule["id"] not in seen:
-                seen.add(rule["id"])
-                rules.append(rule)
-        return rules
+        if _PRAISE_RULESET_CACHE is None or mtime_ns != _PRAISE_RULES_MTIME_NS:
+            _PRAISE_RULESET_CACHE = PraiseRuleSet(_read_praise_rules_file())
+            _PRAISE_RULES_MTIME_NS = mtime_ns
+        return _PRAISE_RULESET_CACHE
+
+
+def load_praise_rules() -> list[dict]:
+    return [dict(rule) for rule in load_praise_ruleset().rules]
 
 
 def save_praise_rules(rules: list[dict]) -> list[dict]:
+    global _PRAISE_RULESET_CACHE
     normalized, seen = [], set()
     for item in rules or []:
         rule = _normalize_praise_rule(item)
@@ -113,6 +141,8 @@ def save_praise_rules(rules: list[dict]) -> list[dict]:
         os.makedirs(os.path.dirname(PRAISE_RULES_FILE), exist_ok=True)
         with open(PRAISE_RULES_FILE, "w", encoding="utf-8") as file:
             json.dump({"version": 1, "rules": normalized}, file, indent=4, ensure_ascii=False)
+        # mtime 精度不足时同一时刻的两次保存可能看不出差别，直接丢弃缓存。
+        _PRAISE_RULESET_CACHE = None
     return normalized
 
 
@@ -140,28 +170,75 @@ def _normalize_praise_text(value: str) -> str:
     return text
 
 
-def match_praise_rule(content: str, occurred_at: datetime | None = None, rules: list[dict] | None = None) -> dict | None:
-    raw_text = str(content or "").strip()
-    text = _normalize_praise_text(raw_text)
-    if not text:
+class PraiseRuleSet:
+    """编译后的识别规则集：字段预先归一化、时间窗预先解析。
+
+    exact 规则走字典查找，contains 规则合并进一个 Aho-Corasick 自动机，
+    一条消息只需扫描一遍；多条规则同时命中时仍按配置顺序取第一条。
+    """
+
+    __slots__ = ("rules", "_windows", "_exact", "_contains", "_contains_rule_index")
+
+    def __init__(self, rules: list[dict]):
+        self.rules = [dict(rule) for rule in rules]
+        self._windows: list[tuple[datetime | None, datetime | None]] = []
+        self._exact: dict[str, list[int]] = {}
+        contains_fields: list[str] = []
+        self._contains_rule_index: list[int] = []
+        for index, rule in enumerate(self.rules):
+            self._windows.append(
+                (_parse_praise_time(rule.get("start_at", "")), _parse_praise_time(rule.get("end_at", "")))
+            )
+            field = _normalize_praise_text(rule.get("field", ""))
+            if not field:
+                continue
+            if rule.get("match_mode") == "exact":
+                self._exact.setdefault(field, []).append(index)
+            else:
+                contains_fields.append(field)
+                self._contains_rule_index.append(index)
+        self._contains = AhoCorasick(contains_fields)
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def match(self, content: str, occurred_at: datetime | None = None) -> dict | None:
+        text = _normalize_praise_text(str(content or "").strip())
+        if not text:
+            return None
+        candidates = set(self._exact.get(text, ()))
+        if self._contains:
+            candidates.update(self._contains_rule_index[index] for index in self._contains.matched_indices(text))
+        if not candidates:
+            return None
+        moment = occurred_at or datetime.now(TZ_CN)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=TZ_CN)
+        else:
+            moment = moment.astimezone(TZ_CN)
+        for index in sorted(candidates):
+            start, end = self._windows[index]
+            if (start and moment < start) or (end and moment > end):
+                continue
+            return dict(self.rules[index])
         return None
-    moment = occurred_at or datetime.now(TZ_CN)
-    if moment.tzinfo is None:
-        moment = moment.replace(tzinfo=TZ_CN)
+
+
+def match_praise_rule(
+    content: str,
+    occurred_at: datetime | None = None,
+    rules: "list[dict] | PraiseRuleSet | None" = None,
+) -> dict | None:
+    if rules is None:
+        ruleset = load_praise_ruleset()
+    elif isinstance(rules, PraiseRuleSet):
+        ruleset = rules
     else:
-        moment = moment.astimezone(TZ_CN)
-    for rule in rules if rules is not None else load_praise_rules():
-        start = _parse_praise_time(rule.get("start_at", ""))
-        end = _parse_praise_time(rule.get("end_at", ""))
-        if (start and moment < start) or (end and moment > end):
-            continue
-        field = _normalize_praise_text(rule.get("field", ""))
-        if not field:
-            continue
-        matched = text == field if rule.get("match_mode") == "exact" else field in text
-        if matched:
-            return rule
-    return None
+        ruleset = PraiseRuleSet(rules)
+    return ruleset.match(content, occurred_at)
 
 
 def _locked_points_data(func):
@@ -349,7 +426,6 @@ def _normalize_record(record: dict[str, Any]) -> dict[str, Any]:
     record.setdefault("daily_msg_date", "")
     record.setdefault("daily_post_pts", 0)
     record.setdefault("daily_post_date", "")
-    record.setdefault("transactions", [])
     record.setdefault("acceleration_days", 0)
     record.setdefault("acceleration_cards", [])
     record["monthly_card_periods"] = _normalize_monthly_periods(record.get("monthly_card_periods", []))
@@ -438,8 +514,6 @@ def _append_transaction(
     }
     if idempotency_key:
         tx["idempotency_key"] = str(idempotency_key)
-    record.setdefault("transactions", []).append(tx)
-    record["transactions"] = record["transactions"][-50:]
     data.setdefault("transactions", []).append(tx)
     data["transactions"] = data["transactions"][-500:]
 
@@ -448,7 +522,6 @@ _DICT_SECTIONS = (
     "daily_signins",
     "daily_forum_rewards",
     "daily_praise_rewards",
-    "daily_praise_scan_records",
     "daily_task_rewards",
 )
 _LIST_SECTIONS = ("acceleration_purchases", "monthly_card_purchases")
@@ -467,23 +540,124 @@ def _json_load(value: str | None, default: Any) -> Any:
         return default
 
 
-def _connect_points_db() -> sqlite3.Connection:
-    os.makedirs(os.path.dirname(POINTS_DB_FILE), exist_ok=True)
-    connection = sqlite3.connect(POINTS_DB_FILE, timeout=30)
-    connection.row_factory = sqlite3.Row
-    connection.execute("PRAGMA synchronous=NORMAL")
-    connection.execute("PRAGMA busy_timeout=30000")
-    return connection
-
-
 @contextmanager
 def _points_connection():
-    connection = _connect_points_db()
-    try:
-        with connection:
-            yield connection
-    finally:
-        connection.close()
+    with pooled_connection(POINTS_DB_FILE) as connection:
+        yield connection
+
+
+# 高频字段独立成列；data 只保留低频扩展字段。"points" 是 shells 的旧别名，不落库。
+_USER_COLUMN_DEFS = (
+    ("shells", "REAL NOT NULL DEFAULT 0"),
+    ("streak_days", "INTEGER NOT NULL DEFAULT 0"),
+    ("last_sign_date", "TEXT NOT NULL DEFAULT ''"),
+    ("daily_msg_date", "TEXT NOT NULL DEFAULT ''"),
+    ("daily_msg_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("monthly_card_periods", "TEXT NOT NULL DEFAULT '[]'"),
+)
+_USER_COLUMNS = tuple(name for name, _ in _USER_COLUMN_DEFS)
+_USER_COLUMN_SQL = ", ".join(_USER_COLUMNS)
+# 旧记录内嵌的 transactions 只在迁移时导入 point_transactions，不再随用户行保存。
+_USER_DERIVED_KEYS = frozenset(_USER_COLUMNS) | {"points", "transactions"}
+USER_COLUMNS_SCHEMA_VERSION = "2"
+
+
+def _user_column_value(name: str, value: Any) -> Any:
+    if name == "shells":
+        return _round_shells(value)
+    if name in {"streak_days", "daily_msg_count"}:
+        try:
+            return int(value or 0)
+        except (TypeError, ValueError):
+            return 0
+    if name == "monthly_card_periods":
+        return _json_dump(_normalize_monthly_periods(value))
+    return str(value or "")
+
+
+def _user_row_params(key: str, record: dict) -> tuple:
+    normalized = _normalize_record(record)
+    extras = {name: value for name, value in normalized.items() if name not in _USER_DERIVED_KEYS}
+    return (
+        key,
+        _json_dump(extras),
+        int(bool(normalized.get("monthly_card_periods"))),
+        *(_user_column_value(name, normalized.get(name)) for name in _USER_COLUMNS),
+    )
+
+
+_UPSERT_USER_SQL = (
+    f"INSERT INTO point_users(user_key, data, has_monthly_card, {_USER_COLUMN_SQL}) "
+    f"VALUES (?, ?, ?, {', '.join('?' for _ in _USER_COLUMNS)}) "
+    "ON CONFLICT(user_key) DO UPDATE SET data=excluded.data, has_monthly_card=excluded.has_monthly_card, "
+    + ", ".join(f"{name}=excluded.{name}" for name in _USER_COLUMNS)
+)
+
+
+def _user_record_from_row(row: sqlite3.Row | None) -> dict:
+    if row is None:
+        return _normalize_record({})
+    extras = _json_load(row["data"], {})
+    record = dict(extras) if isinstance(extras, dict) else {}
+    for name in _USER_COLUMNS:
+        record[name] = row[name]
+    record["monthly_card_periods"] = _json_load(row["monthly_card_periods"], [])
+    return _normalize_record(record)
+
+
+def _import_embedded_transactions(connection: sqlite3.Connection, user_key: str, record: dict) -> None:
+    """把旧记录内嵌的最近流水补进总账；已存在的同一笔不会重复写入。"""
+    embedded = record.get("transactions") if isinstance(record, dict) else None
+    if not isinstance(embedded, list):
+        return
+    guild_part, _, user_part = user_key.rpartition(":")
+    for tx in embedded:
+        if not isinstance(tx, dict):
+            continue
+        params = (
+            str(tx.get("time", "")), str(tx.get("guild_id", guild_part)), str(tx.get("user_id", user_part)),
+            _round_delta(tx.get("amount", 0)), str(tx.get("source", "")), str(tx.get("reason", "")),
+        )
+        exists = connection.execute(
+            """SELECT 1 FROM point_transactions
+               WHERE guild_id=? AND user_id=? AND time=? AND amount=? AND source=? AND reason=?""",
+            (params[1], params[2], params[0], params[3], params[4], params[5]),
+        ).fetchone()
+        if exists is not None:
+            continue
+        connection.execute(
+            """INSERT OR IGNORE INTO point_transactions
+               (time, guild_id, user_id, amount, balance, source, reason, idempotency_key)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (*params[:4], _round_shells(tx.get("balance", 0)), *params[4:], str(tx.get("idempotency_key", ""))),
+        )
+
+
+def _migrate_point_user_columns(connection: sqlite3.Connection) -> None:
+    """把旧版整条 JSON 用户记录拆出热字段列并移除内嵌流水；幂等，可由 downgrade 逆转。"""
+    marker = connection.execute(
+        "SELECT value FROM points_meta WHERE key='user_columns'"
+    ).fetchone()
+    if marker is not None and marker["value"] == USER_COLUMNS_SCHEMA_VERSION:
+        return
+    connection.execute("BEGIN IMMEDIATE")
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(point_users)")}
+    for name, declaration in _USER_COLUMN_DEFS:
+        if name not in columns:
+            connection.execute(f"ALTER TABLE point_users ADD COLUMN {name} {declaration}")
+    rows = connection.execute("SELECT user_key, data FROM point_users").fetchall()
+    records = [(row["user_key"], _json_load(row["data"], {})) for row in rows]
+    for user_key, record in records:
+        _import_embedded_transactions(connection, user_key, record)
+    connection.executemany(
+        _UPSERT_USER_SQL,
+        (_user_row_params(user_key, record) for user_key, record in records),
+    )
+    connection.execute(
+        "INSERT OR REPLACE INTO points_meta(key, value) VALUES ('user_columns', ?)",
+        (USER_COLUMNS_SCHEMA_VERSION,),
+    )
+    connection.commit()
 
 
 def _create_points_schema(connection: sqlite3.Connection) -> None:
@@ -497,7 +671,13 @@ def _create_points_schema(connection: sqlite3.Connection) -> None:
         CREATE TABLE IF NOT EXISTS point_users (
             user_key TEXT PRIMARY KEY,
             data TEXT NOT NULL,
-            has_monthly_card INTEGER NOT NULL DEFAULT 0
+            has_monthly_card INTEGER NOT NULL DEFAULT 0,
+            shells REAL NOT NULL DEFAULT 0,
+            streak_days INTEGER NOT NULL DEFAULT 0,
+            last_sign_date TEXT NOT NULL DEFAULT '',
+            daily_msg_date TEXT NOT NULL DEFAULT '',
+            daily_msg_count INTEGER NOT NULL DEFAULT 0,
+            monthly_card_periods TEXT NOT NULL DEFAULT '[]'
         );
         CREATE TABLE IF NOT EXISTS point_sections (
             namespace TEXT NOT NULL,
@@ -521,6 +701,53 @@ def _create_points_schema(connection: sqlite3.Connection) -> None:
         CREATE UNIQUE INDEX IF NOT EXISTS idx_point_transactions_idempotency
             ON point_transactions(guild_id, user_id, idempotency_key)
             WHERE idempotency_key <> '';
+        CREATE TABLE IF NOT EXISTS point_transaction_archive (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            first_tx_id INTEGER NOT NULL,
+            last_tx_id INTEGER NOT NULL,
+            first_time TEXT NOT NULL,
+            last_time TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            archived_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_point_transaction_archive_user
+            ON point_transaction_archive(guild_id, user_id, last_tx_id DESC);
+        CREATE TRIGGER IF NOT EXISTS point_transaction_archive_no_update
+            BEFORE UPDATE ON point_transaction_archive
+            BEGIN SELECT RAISE(ABORT, 'point_transaction_archive is append-only'); END;
+        CREATE TRIGGER IF NOT EXISTS point_transaction_archive_no_delete
+            BEFORE DELETE ON point_transaction_archive
+            BEGIN SELECT RAISE(ABORT, 'point_transaction_archive is append-only'); END;
+        CREATE TABLE IF NOT EXISTS praise_scan_records (
+            guild_id TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            rule_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            amount REAL NOT NULL DEFAULT 0,
+            scan_date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            channel_id TEXT NOT NULL DEFAULT '',
+            author_id TEXT NOT NULL DEFAULT '',
+            author_name TEXT NOT NULL DEFAULT '',
+            content TEXT NOT NULL DEFAULT '',
+            reason TEXT NOT NULL DEFAULT '',
+            rule_field TEXT NOT NULL DEFAULT '',
+            recovered INTEGER NOT NULL DEFAULT 0,
+            message_created_at TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY(guild_id, message_id, rule_id, status)
+        );
+        CREATE INDEX IF NOT EXISTS idx_praise_scan_records_date
+            ON praise_scan_records(scan_date);
+        CREATE TABLE IF NOT EXISTS point_archived_idempotency (
+            guild_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            idempotency_key TEXT NOT NULL,
+            amount REAL NOT NULL,
+            PRIMARY KEY(guild_id, user_id, idempotency_key)
+        ) WITHOUT ROWID;
         """
     )
     columns = {row[1] for row in connection.execute("PRAGMA table_info(point_users)")}
@@ -528,6 +755,24 @@ def _create_points_schema(connection: sqlite3.Connection) -> None:
         connection.execute(
             "ALTER TABLE point_users ADD COLUMN has_monthly_card INTEGER NOT NULL DEFAULT 0"
         )
+    _migrate_point_user_columns(connection)
+    _migrate_praise_scan_sections(connection)
+
+
+def _migrate_praise_scan_sections(connection: sqlite3.Connection) -> None:
+    """把旧版按日 JSON 存放的扫描日志导入 praise_scan_records 表。"""
+    sections = connection.execute(
+        "SELECT item_key, data FROM point_sections WHERE namespace='daily_praise_scan_records'"
+    ).fetchall()
+    if not sections:
+        return
+    connection.execute("BEGIN IMMEDIATE")
+    for section in sections:
+        rows = _json_load(section["data"], {})
+        if isinstance(rows, dict):
+            _db_put_praise_scan_rows(connection, section["item_key"], rows.values())
+    connection.execute("DELETE FROM point_sections WHERE namespace='daily_praise_scan_records'")
+    connection.commit()
 
 
 def _read_legacy_points_json() -> dict:
@@ -552,14 +797,12 @@ def _read_legacy_points_json() -> dict:
 def _replace_database_snapshot(connection: sqlite3.Connection, data: dict) -> None:
     normalized = _normalize_points_data(data)
     connection.execute("DELETE FROM point_users")
-    connection.execute("DELETE FROM point_sections")
+    # 重扫游标属于运行状态，不在快照里，整份覆盖时保留。
+    connection.execute("DELETE FROM point_sections WHERE namespace<>'praise_scan_cursors'")
     connection.execute("DELETE FROM point_transactions")
     connection.executemany(
-        "INSERT INTO point_users(user_key, data, has_monthly_card) VALUES (?, ?, ?)",
-        (
-            (str(key), _json_dump(value), int(bool(value.get("monthly_card_periods"))))
-            for key, value in normalized["users"].items()
-        ),
+        _UPSERT_USER_SQL,
+        (_user_row_params(str(key), value) for key, value in normalized["users"].items()),
     )
     for namespace in _DICT_SECTIONS:
         rows = normalized.get(namespace, {})
@@ -590,6 +833,12 @@ def _replace_database_snapshot(connection: sqlite3.Connection, data: dict) -> No
                 str(tx.get("source", "")), str(tx.get("reason", "")), str(tx.get("idempotency_key", "")),
             ),
         )
+    for key, value in normalized["users"].items():
+        _import_embedded_transactions(connection, str(key), value)
+    # 扫描日志独立成表，不随整份快照清空；这里只导入快照里带来的记录。
+    for scan_date, rows in normalized.get("daily_praise_scan_records", {}).items():
+        if isinstance(rows, dict):
+            _db_put_praise_scan_rows(connection, scan_date, rows.values())
 
 
 def _ensure_points_db() -> None:
@@ -627,6 +876,39 @@ def initialize_points_storage() -> None:
     _ensure_points_db()
 
 
+@_locked_points_data
+def downgrade_point_user_columns() -> int:
+    """逆转热字段列迁移：把列值折回 data JSON 并恢复旧版三列表结构。
+
+    仅在回退到旧版代码前手动执行；返回折回的用户数。之后任何新版调用都会重新迁移。
+    """
+    global _POINTS_DB_READY
+    _ensure_points_db()
+    with _points_connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        rows = connection.execute(f"SELECT user_key, data, {_USER_COLUMN_SQL} FROM point_users").fetchall()
+        connection.execute(
+            """CREATE TABLE point_users_legacy (
+                   user_key TEXT PRIMARY KEY,
+                   data TEXT NOT NULL,
+                   has_monthly_card INTEGER NOT NULL DEFAULT 0
+               )"""
+        )
+        records = ((row["user_key"], _user_record_from_row(row)) for row in rows)
+        connection.executemany(
+            "INSERT INTO point_users_legacy(user_key, data, has_monthly_card) VALUES (?, ?, ?)",
+            (
+                (key, _json_dump(record), int(bool(record.get("monthly_card_periods"))))
+                for key, record in records
+            ),
+        )
+        connection.execute("DROP TABLE point_users")
+        connection.execute("ALTER TABLE point_users_legacy RENAME TO point_users")
+        connection.execute("DELETE FROM points_meta WHERE key='user_columns'")
+    _POINTS_DB_READY = False
+    return len(rows)
+
+
 def _db_get_section(connection: sqlite3.Connection, namespace: str, item_key: str, default: Any) -> Any:
     row = connection.execute(
         "SELECT data FROM point_sections WHERE namespace=? AND item_key=?",
@@ -645,17 +927,53 @@ def _db_put_section(connection: sqlite3.Connection, namespace: str, item_key: st
 
 def _db_get_user(connection: sqlite3.Connection, user_id: int, guild_id: int | None) -> tuple[dict, str]:
     key = _make_user_key(user_id, guild_id)
-    row = connection.execute("SELECT data FROM point_users WHERE user_key=?", (key,)).fetchone()
-    return _normalize_record(_json_load(row["data"] if row else None, {})), key
+    row = connection.execute(
+        f"SELECT data, {_USER_COLUMN_SQL} FROM point_users WHERE user_key=?", (key,)
+    ).fetchone()
+    return _user_record_from_row(row), key
 
 
 def _db_put_user(connection: sqlite3.Connection, key: str, record: dict) -> None:
-    normalized = _normalize_record(record)
+    connection.execute(_UPSERT_USER_SQL, _user_row_params(key, record))
+
+
+def _db_get_shells(connection: sqlite3.Connection, key: str) -> float:
+    row = connection.execute("SELECT shells FROM point_users WHERE user_key=?", (key,)).fetchone()
+    return _round_shells(row["shells"] if row else 0)
+
+
+def _db_add_shells(connection: sqlite3.Connection, key: str, delta: float) -> None:
+    """余额增减只改 shells 列，不解码/重编码 JSON 扩展字段。"""
+    connection.execute(
+        """INSERT INTO point_users(user_key, data, shells) VALUES (:key, '{}', ROUND(MAX(0, :delta), :precision))
+           ON CONFLICT(user_key) DO UPDATE SET shells=ROUND(MAX(0, shells + :delta), :precision)""",
+        {"key": key, "delta": float(delta), "precision": SHELL_PRECISION},
+    )
+
+
+def _db_get_balance_view(connection: sqlite3.Connection, key: str) -> dict:
+    """只读余额与月卡周期两列，供只改余额的发奖路径计算月卡倍率。"""
+    row = connection.execute(
+        "SELECT shells, monthly_card_periods FROM point_users WHERE user_key=?", (key,)
+    ).fetchone()
+    return {
+        "shells": _round_shells(row["shells"] if row else 0),
+        "monthly_card_periods": _normalize_monthly_periods(
+            _json_load(row["monthly_card_periods"] if row else None, [])
+        ),
+    }
+
+
+def _db_set_user_fields(connection: sqlite3.Connection, key: str, fields: dict) -> None:
+    """只写给定的热字段列；monthly_card_periods 需连同标记列一起写，走 _db_put_user。"""
+    names = [name for name in _USER_COLUMNS if name in fields and name != "monthly_card_periods"]
+    if not names:
+        return
     connection.execute(
-        """INSERT INTO point_users(user_key, data, has_monthly_card) VALUES (?, ?, ?)
-           ON CONFLICT(user_key) DO UPDATE SET
-               data=excluded.data, has_monthly_card=excluded.has_monthly_card""",
-        (key, _json_dump(normalized), int(bool(normalized.get("monthly_card_periods")))),
+        f"INSERT INTO point_users(user_key, data, {', '.join(names)}) "
+        f"VALUES (?, '{{}}', {', '.join('?' for _ in names)}) "
+        "ON CONFLICT(user_key) DO UPDATE SET " + ", ".join(f"{name}=excluded.{name}" for name in names),
+        (key, *(_user_column_value(name, fields[name]) for name in names)),
     )
 
 
@@ -667,7 +985,7 @@ def _db_monthly_config(connection: sqlite3.Connection) -> dict:
 
 def _db_append_transaction(
     connection: sqlite3.Connection,
-    record: dict,
+    record: dict | None,
     *,
     user_id: int,
     guild_id: int | None,
@@ -675,37 +993,221 @@ def _db_append_transaction(
     source: str,
     reason: str = "",
     idempotency_key: str = "",
+    balance: float | None = None,
 ) -> dict | None:
     if amount == 0:
         return None
+    if balance is None:
+        balance = (record or {}).get("shells", 0)
     tx = {
         "time": _now_iso(), "guild_id": str(guild_id) if guild_id else "", "user_id": str(user_id),
-        "amount": _round_delta(amount), "balance": _round_shells(record.get("shells", 0)),
+        "amount": _round_delta(amount), "balance": _round_shells(balance),
         "source": str(source), "reason": str(reason),
     }
     if idempotency_key:
         tx["idempotency_key"] = str(idempotency_key)
+    _db_insert_transaction(connection, tx)
+    return tx
+
+
+def _db_insert_transaction(connection: sqlite3.Connection, tx: dict) -> None:
     connection.execute(
         """INSERT INTO point_transactions
            (time, guild_id, user_id, amount, balance, source, reason, idempotency_key)
            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-        (tx["time"], tx["guild_id"], tx["user_id"], tx["amount"], tx["balance"], tx["source"], tx["reason"], str(idempotency_key)),
+        (
+            tx["time"], tx["guild_id"], tx["user_id"], tx["amount"], tx["balance"],
+            tx["source"], tx["reason"], str(tx.get("idempotency_key", "")),
+        ),
     )
-    record.setdefault("transactions", []).append(tx)
-    record["transactions"] = record["transactions"][-50:]
+
+
+def _db_find_idempotent_amount(
+    connection: sqlite3.Connection,
+    guild_id: int | None,
+    user_id: int,
+    idempotency_key: str,
+) -> float | None:
+    """按幂等键查找已入账金额；已归档流水的键单独保留，归档后仍能去重。"""
+    params = (str(guild_id) if guild_id else "", str(user_id), str(idempotency_key))
+    row = connection.execute(
+        "SELECT amount FROM point_transactions WHERE guild_id=? AND user_id=? AND idempotency_key=?",
+        params,
+    ).fetchone()
+    if row is None:
+        row = connection.execute(
+            "SELECT amount FROM point_archived_idempotency WHERE guild_id=? AND user_id=? AND idempotency_key=?",
+            params,
+        ).fetchone()
+    return None if row is None else _round_delta(row["amount"])
+
+
+_TRANSACTION_COLUMNS_SQL = "time, guild_id, user_id, amount, balance, source, reason, idempotency_key"
+
+
+def _transaction_from_row(row: sqlite3.Row) -> dict:
+    tx = dict(row)
+    if not tx.get("idempotency_key"):
+        tx.pop("idempotency_key", None)
+    return tx
+
+
+def _db_recent_transactions(
+    connection: sqlite3.Connection,
+    user_id: int,
+    guild_id: int | None,
+    limit: int,
+    since: str = "",
+) -> list[dict]:
+    # 沿 idx_point_transactions_user 倒序取最近 limit 条，再按时间正序返回。
+    query = f"SELECT {_TRANSACTION_COLUMNS_SQL} FROM point_transactions WHERE guild_id=? AND user_id=?"
+    params: list[Any] = [str(guild_id) if guild_id else "", str(user_id)]
+    if since:
+        query += " AND time>=?"
+        params.append(str(since))
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(max(0, int(limit)))
+    rows = connection.execute(query, params).fetchall()
+    return [_transaction_from_row(row) for row in reversed(rows)]
+
+
+def get_recent_transactions(
+    user_id: int,
+    guild_id: int | None,
+    limit: int = 50,
+    *,
+    since: str = "",
+) -> list[dict]:
+    """读取用户最近的蛋壳流水（按时间正序）；since 为 ISO 日期/时间下限。"""
+    _ensure_points_db()
+    with _points_connection() as connection:
+        return _db_recent_transactions(connection, user_id, guild_id, limit, since)
+
+
+def _ledger_retention_policy(guild_id: str) -> tuple[int, int]:
+    """返回 (保留天数, 每用户至少保留的最近条数)；LEDGER_RETENTION_GUILDS 可按服务器覆盖。"""
+    days = getattr(config, "LEDGER_RETENTION_DAYS", 90)
+    keep = getattr(config, "LEDGER_RETENTION_PER_USER", 200)
+    overrides = getattr(config, "LEDGER_RETENTION_GUILDS", {})
+    override = None
+    if isinstance(overrides, dict):
+        override = {str(key): value for key, value in overrides.items()}.get(str(guild_id))
+    if isinstance(override, dict):
+        days = override.get("days", days)
+        keep = override.get("per_user", keep)
+    try:
+        return max(0, int(days)), max(0, int(keep))
+    except (TypeError, ValueError):
+        return 90, 200
+
+
+def _archive_transaction_chunk(connection: sqlite3.Connection, guild_id: str, user_id: str, rows: list) -> None:
+    txs = [_transaction_from_row(row) for row in rows]
+    for tx in txs:
+        tx.pop("guild_id", None)
+        tx.pop("user_id", None)
     connection.execute(
-        "DELETE FROM point_transactions WHERE id NOT IN (SELECT id FROM point_transactions ORDER BY id DESC LIMIT 500)"
+        """INSERT INTO point_transaction_archive
+           (guild_id, user_id, first_tx_id, last_tx_id, first_time, last_time, row_count, payload, archived_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (
+            guild_id, user_id, rows[0]["id"], rows[-1]["id"], rows[0]["time"], rows[-1]["time"],
+            len(rows), zlib.compress(_json_dump(txs).encode("utf-8")), _now_iso(),
+        ),
     )
-    return tx
+    connection.executemany(
+        """INSERT OR IGNORE INTO point_archived_idempotency(guild_id, user_id, idempotency_key, amount)
+           VALUES (?, ?, ?, ?)""",
+        (
+            (guild_id, user_id, row["idempotency_key"], row["amount"])
+            for row in rows if row["idempotency_key"]
+        ),
+    )
+    connection.executemany("DELETE FROM point_transactions WHERE id=?", ((row["id"],) for row in rows))
 
 
-def load_points_data():
-    """兼容管理/报表调用的完整快照；高频业务不应调用此函数。"""
+def compact_point_transactions(*, now: datetime | None = None, max_rows: int = 5000) -> dict:
+    """把超出保留策略的流水压缩后移入只追加的归档表；由后台定时任务分批调用。
+
+    同时满足“早于保留天数”和“不在该用户最近 N 条内”的流水才会归档。
+    每个服务器单独一个事务，单次最多处理 max_rows 条，避免长时间占用写锁。
+    """
+    _ensure_points_db()
+    now = now or datetime.now(TZ_CN)
+    archived_rows = 0
+    archived_chunks = 0
+    with _points_connection() as connection:
+        guild_ids = [
+            row["guild_id"] for row in connection.execute("SELECT DISTINCT guild_id FROM point_transactions")
+        ]
+    for guild_id in guild_ids:
+        budget = max_rows - archived_rows
+        if budget <= 0:
+            break
+        days, keep = _ledger_retention_policy(guild_id)
+        query = f"""SELECT id, {_TRANSACTION_COLUMNS_SQL} FROM (
+                       SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY id DESC) AS user_rank
+                       FROM point_transactions WHERE guild_id=?
+                   ) WHERE user_rank > ?"""
+        params: list[Any] = [guild_id, keep]
+        if days > 0:
+            query += " AND time < ?"
+            params.append((now - timedelta(days=days)).isoformat(timespec="seconds"))
+        query += " ORDER BY user_id, id LIMIT ?"
+        params.append(budget)
+        with _POINTS_DATA_LOCK, _points_connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute(query, params).fetchall()
+            chunk: list = []
+            for row in rows:
+                if chunk and (row["user_id"] != chunk[0]["user_id"] or len(chunk) >= LEDGER_ARCHIVE_CHUNK_ROWS):
+                    _archive_transaction_chunk(connection, guild_id, chunk[0]["user_id"], chunk)
+                    archived_chunks += 1
+                    chunk = []
+                chunk.append(row)
+            if chunk:
+                _archive_transaction_chunk(connection, guild_id, chunk[0]["user_id"], chunk)
+                archived_chunks += 1
+            archived_rows += len(rows)
+    return {"archived_rows": archived_rows, "archived_chunks": archived_chunks}
+
+
+def get_archived_transactions(user_id: int, guild_id: int | None, limit: int = 200) -> list[dict]:
+    """读取已归档的历史流水（按时间正序），最多返回最近 limit 条。"""
+    _ensure_points_db()
+    remaining = max(0, int(limit))
+    chunks: list[list[dict]] = []
+    with _points_connection() as connection:
+        rows = connection.execute(
+            """SELECT guild_id, user_id, payload FROM point_transaction_archive
+               WHERE guild_id=? AND user_id=? ORDER BY last_tx_id DESC""",
+            (str(guild_id) if guild_id else "", str(user_id)),
+        )
+        for row in rows:
+            if remaining <= 0:
+                break
+            txs = _json_load(zlib.decompress(row["payload"]).decode("utf-8"), [])
+            for tx in txs:
+                tx["guild_id"] = row["guild_id"]
+                tx["user_id"] = row["user_id"]
+            txs = txs[-remaining:]
+            remaining -= len(txs)
+            chunks.append(txs)
+    return [tx for txs in reversed(chunks) for tx in txs]
+
+
+def load_points_data(*, include_transactions: bool = True):
+    """兼容管理/报表调用的完整快照；高频业务不应调用此函数。
+
+    流水会保留 90 天，只看用户与配置的面板应传 include_transactions=False，
+    需要流水条数时用 count_point_transactions。不含流水的快照没有 "transactions" 键，
+    不能交给 save_points_data 回写。
+    """
     _ensure_points_db()
     with _POINTS_DATA_LOCK, _points_connection() as connection:
         data = _empty_points_data()
-        for row in connection.execute("SELECT user_key, data FROM point_users"):
-            data["users"][row["user_key"]] = _normalize_record(_json_load(row["data"], {}))
+        for row in connection.execute(f"SELECT user_key, data, {_USER_COLUMN_SQL} FROM point_users"):
+            data["users"][row["user_key"]] = _user_record_from_row(row)
         for namespace in _DICT_SECTIONS:
             data[namespace] = {
                 row["item_key"]: _json_load(row["data"], {})
@@ -715,19 +1217,29 @@ def load_points_data():
             }
         for namespace in _LIST_SECTIONS:
             data[namespace] = _db_get_section(connection, namespace, "value", [])
+        scan_rows = data["daily_praise_scan_records"]
+        for row in connection.execute(f"SELECT scan_date, {_PRAISE_SCAN_COLUMN_SQL} FROM praise_scan_records"):
+            item = _praise_scan_row_to_dict(row)
+            scan_rows.setdefault(row["scan_date"], {})[_praise_scan_key(item)] = item
         data["monthly_card_config"] = _db_monthly_config(connection)
-        data["transactions"] = [
-            dict(row) for row in connection.execute(
-                """SELECT time, guild_id, user_id, amount, balance, source, reason, idempotency_key
-                   FROM point_transactions ORDER BY id ASC"""
-            )
-        ]
-        for tx in data["transactions"]:
-            if not tx.get("idempotency_key"):
-                tx.pop("idempotency_key", None)
+        if include_transactions:
+            data["transactions"] = [
+                _transaction_from_row(row) for row in connection.execute(
+                    f"SELECT {_TRANSACTION_COLUMNS_SQL} FROM point_transactions ORDER BY id ASC"
+                )
+            ]
+        else:
+            del data["transactions"]
         return data
 
 
+def count_point_transactions() -> int:
+    """在库流水条数（不含已归档部分）。"""
+    _ensure_points_db()
+    with _points_connection() as connection:
+        return int(connection.execute("SELECT COUNT(*) FROM point_transactions").fetchone()[0])
+
+
 def save_points_data(data):
     """兼容低频管理写入；将完整快照事务性写入 SQLite。"""
     _ensure_points_db()
@@ -735,7 +1247,97 @@ def save_points_data(data):
         _replace_database_snapshot(connection, data)
 
 
-@_locked_points_data
+@contextmanager
+def points_write_transaction(attach: dict[str, str] | None = None):
+    """借出蛋壳库连接并开启 BEGIN IMMEDIATE，with 块内的写入一次提交、异常时整体回滚。
+
+    attach 形如 {别名: 库文件}，用于和其他模块的库在同一事务里结算。WAL 模式下
+    SQLite 保证每个库各自原子；只有整机在提交瞬间崩溃时，多个库之间才可能不一致。
+    """
+    _ensure_points_db()
+    with _POINTS_DATA_LOCK, _points_connection() as connection:
+        # 池化连接跨调用复用，先卸下上次异常退出时可能残留的同名附加库
+        leftover = {row[1] for row in connection.execute("PRAGMA database_list")}
+        for alias in attach or {}:
+            if alias in leftover:
+                connection.execute(f"DETACH DATABASE {alias}")
+        attached = []
+        try:
+            for alias, path in (attach or {}).items():
+                connection.execute(f"ATTACH DATABASE ? AS {alias}", (os.path.abspath(path),))
+                attached.append(alias)
+            connection.execute("BEGIN IMMEDIATE")
+            yield connection
+            connection.commit()
+        except BaseException:
+            # 提交失败（如 SQLITE_BUSY）时事务仍然打开，必须先回滚才能 DETACH
+            if connection.in_transaction:
+                try:
+                    connection.rollback()
+                except sqlite3.Error as error:
+                    print(f"[蛋壳系统] 结算事务回滚失败 error={error!r}")
+            raise
+        finally:
+            for alias in attached:
+                try:
+                    connection.execute(f"DETACH DATABASE {alias}")
+                except sqlite3.Error as error:
+                    # 不能掩盖原始异常；残留的附加库会在下次借用时先被卸下
+                    print(f"[蛋壳系统] 卸下附加库失败 alias={alias} error={error!r}")
+
+
+def get_user_points_in(connection: sqlite3.Connection, user_id: int, guild_id: int | None = None) -> float:
+    """在调用方的事务里读取余额。"""
+    return _db_get_shells(connection, _make_user_key(user_id, guild_id))
+
+
+def modify_user_points_in(
+    connection: sqlite3.Connection,
+    user_id: int,
+    amount: float,
+    guild_id: int | None = None,
+    *,
+    source: str = "manual",
+    reason: str = "",
+) -> float:
+    """在调用方的事务里增减蛋壳并记流水，返回最新余额。"""
+    key = _make_user_key(user_id, guild_id)
+    current_shells = _db_get_shells(connection, key)
+    new_shells = _round_shells(current_shells + _round_delta(amount))
+    actual_delta = _round_delta(new_shells - current_shells)
+    _db_add_shells(connection, key, actual_delta)
+    _db_append_transaction(
+        connection, None, user_id=user_id, guild_id=guild_id,
+        amount=actual_delta, source=source, reason=reason, balance=new_shells,
+    )
+    return new_shells
+
+
+def spend_user_points_in(
+    connection: sqlite3.Connection,
+    user_id: int,
+    amount: float,
+    guild_id: int,
+    *,
+    source: str,
+    reason: str = "",
+) -> dict:
+    """在调用方的事务里检查并扣除蛋壳；余额不足时不写入任何内容。"""
+    cost = _round_delta(max(0.0, float(amount)))
+    key = _make_user_key(user_id, guild_id)
+    balance = _db_get_shells(connection, key)
+    if balance < cost:
+        return {"success": False, "reason": "insufficient_shells", "cost": cost, "balance": balance}
+    after = _round_shells(balance - cost)
+    actual_delta = _round_delta(after - balance)
+    _db_add_shells(connection, key, actual_delta)
+    _db_append_transaction(
+        connection, None, user_id=user_id, guild_id=guild_id,
+        amount=actual_delta, source=source, reason=reason, balance=after,
+    )
+    return {"success": True, "reason": "spent", "cost": abs(actual_delta), "balance": after}
+
+
 def modify_user_points(
     user_id: int,
     amount: float,
@@ -748,17 +1350,7 @@ def modify_user_points(
     _ensure_points_db()
     with _points_connection() as connection:
         connection.execute("BEGIN IMMEDIATE")
-        record, key = _db_get_user(connection, user_id, guild_id)
-        current_shells = _round_shells(record.get("shells", 0))
-        new_shells = _round_shells(current_shells + _round_delta(amount))
-        actual_delta = _round_delta(new_shells - current_shells)
-        record["shells"] = record["points"] = new_shells
-        _db_append_transaction(
-            connection, record, user_id=user_id, guild_id=guild_id,
-            amount=actual_delta, source=source, reason=reason,
-        )
-        _db_put_user(connection, key, record)
-        return new_shells
+        return modify_user_points_in(connection, user_id, amount, guild_id, source=source, reason=reason)
 
 
 @_locked_points_data
@@ -771,23 +1363,10 @@ def spend_user_points(
     reason: str = "",
 ) -> dict:
     """原子检查并扣除蛋壳，避免余额检查与抽卡扣款之间被其他消费穿插。"""
-    cost = _round_delta(max(0.0, float(amount)))
     _ensure_points_db()
     with _points_connection() as connection:
         connection.execute("BEGIN IMMEDIATE")
-        record, key = _db_get_user(connection, user_id, guild_id)
-        balance = _round_shells(record.get("shells", 0))
-        if balance < cost:
-            return {"success": False, "reason": "insufficient_shells", "cost": cost, "balance": balance}
-        after = _round_shells(balance - cost)
-        actual_delta = _round_delta(after - balance)
-        record["shells"] = record["points"] = after
-        _db_append_transaction(
-            connection, record, user_id=user_id, guild_id=guild_id,
-            amount=actual_delta, source=source, reason=reason,
-        )
-        _db_put_user(connection, key, record)
-        return {"success": True, "reason": "spent", "cost": abs(actual_delta), "balance": after}
+        return spend_user_points_in(connection, user_id, amount, guild_id, source=source, reason=reason)
 
 
 @_locked_points_data
@@ -834,8 +1413,8 @@ def _reconcile_daily_task_bonus_sql(
             }
         if not qualified and not existing:
             return {"success": False, "reason": "not_qualified", "amount": 0.0}
-        record, user_key = _db_get_user(connection, user_id, guild_id)
-        before = _round_shells(record.get("shells", 0))
+        user_key = _make_user_key(user_id, guild_id)
+        before = _db_get_shells(connection, user_key)
         if qualified:
             after = _round_shells(before + _round_delta(amount))
             actual_delta = _round_delta(after - before)
@@ -851,12 +1430,11 @@ def _reconcile_daily_task_bonus_sql(
             source = "daily_task_bonus_revoke"
             reason = f"bonus={normalized_key};recheck=not_qualified"
             result_reason = "revoked"
-        record["shells"] = record["points"] = after
+        _db_add_shells(connection, user_key, actual_delta)
         _db_append_transaction(
-            connection, record, user_id=user_id, guild_id=guild_id,
-            amount=actual_delta, source=source, reason=reason,
+            connection, None, user_id=user_id, guild_id=guild_id,
+            amount=actual_delta, source=source, reason=reason, balance=after,
         )
-        _db_put_user(connection, user_key, record)
         _db_put_section(connection, "daily_task_rewards", reward_key, rows)
         return {
             "success": True, "reason": result_reason,
@@ -877,6 +1455,7 @@ def get_user_summary(user_id: int, guild_id: int | None = None) -> dict:
     _ensure_points_db()
     with _points_connection() as connection:
         record, _ = _db_get_user(connection, user_id, guild_id)
+        _overlay_pending_activity(record, user_id, guild_id)
         monthly_card = _monthly_card_status(record, _db_monthly_config(connection))
         return {
             "shells": _round_shells(record.get("shells", 0)),
@@ -889,30 +1468,18 @@ def get_user_summary(user_id: int, guild_id: int | None = None) -> dict:
 
 
 def get_user_daily_snapshot(user_id: int, guild_id: int) -> dict:
-    """只读取每日任务所需的当前用户、今日流水和今日识别奖励。"""
+    """只读取每日任务所需的当前用户和今日识别奖励；今日流水见 get_recent_transactions。"""
     _ensure_points_db()
     today = _today()
     user_key = _make_user_key(user_id, guild_id)
     praise_key = f"{guild_id}:{today}"
     with _points_connection() as connection:
         record, _ = _db_get_user(connection, user_id, guild_id)
-        transactions = []
-        for row in connection.execute(
-            """SELECT time, guild_id, user_id, amount, balance, source, reason, idempotency_key
-               FROM point_transactions
-               WHERE guild_id=? AND user_id=? AND substr(time, 1, 10)=?
-               ORDER BY id ASC""",
-            (str(guild_id), str(user_id), today),
-        ):
-            tx = dict(row)
-            if not tx.get("idempotency_key"):
-                tx.pop("idempotency_key", None)
-            transactions.append(tx)
+        _overlay_pending_activity(record, user_id, guild_id)
         praise_rows = _db_get_section(connection, "daily_praise_rewards", praise_key, {})
     return {
         "version": 3,
         "users": {user_key: record},
-        "transactions": transactions,
         "daily_praise_rewards": {praise_key: praise_rows},
     }
 
@@ -1047,6 +1614,23 @@ def _grant_monthly_daily_reward(
     return actual_delta
 
 
+def _db_grant_monthly_daily_reward(
+    connection: sqlite3.Connection,
+    record: dict,
+    config_data: dict,
+    *,
+    user_id: int,
+    guild_id: int,
+    now: datetime | None = None,
+) -> float:
+    """补发月卡每日奖励并写入流水；调用方负责保存 record。"""
+    local_data = {"monthly_card_config": config_data, "transactions": []}
+    reward = _grant_monthly_daily_reward(local_data, record, user_id=user_id, guild_id=guild_id, now=now)
+    for tx in local_data["transactions"]:
+        _db_insert_transaction(connection, tx)
+    return reward
+
+
 def get_monthly_card_config() -> dict:
     _ensure_points_db()
     with _points_connection() as connection:
@@ -1088,123 +1672,132 @@ def get_monthly_card_status(user_id: int, guild_id: int) -> dict:
 
 @_locked_points_data
 def purchase_monthly_card(user_id: int, guild_id: int) -> dict:
-    data = load_points_data()
-    config_data = _normalize_monthly_card_config(data.get("monthly_card_config"))
-    record, _ = _ensure_user_record(data, user_id, guild_id)
-    if not config_data["enabled"]:
-        return {"success": False, "reason": "disabled", "status": _monthly_card_status(record, config_data)}
+    _ensure_points_db()
+    with _points_connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        config_data = _db_monthly_config(connection)
+        record, key = _db_get_user(connection, user_id, guild_id)
+        if not config_data["enabled"]:
+            return {"success": False, "reason": "disabled", "status": _monthly_card_status(record, config_data)}
+
+        now = datetime.now(TZ_CN)
+        catch_up_reward = _db_grant_monthly_daily_reward(
+            connection,
+            record,
+            config_data,
+            user_id=user_id,
+            guild_id=guild_id,
+            now=now,
+        )
+        if catch_up_reward > 0:
+            _db_put_user(connection, key, record)
+        all_periods = _normalize_monthly_periods(record.get("monthly_card_periods", []))
+        active_periods = []
+        for item in all_periods:
+            expires_at = _parse_iso_datetime(item.get("expires_at"))
+            if expires_at and expires_at > now:
+                active_periods.append(item)
+        record["monthly_card_periods"] = all_periods
+        if len(active_periods) >= config_data["max_cards"]:
+            return {
+                "success": False,
+                "reason": "max_cards_reached",
+                "status": _monthly_card_status(record, config_data, now),
+            }
 
-    now = datetime.now(TZ_CN)
-    catch_up_reward = _grant_monthly_daily_reward(
-        data,
-        record,
-        user_id=user_id,
-        guild_id=guild_id,
-        now=now,
-    )
-    if catch_up_reward > 0:
-        save_points_data(data)
-    all_periods = _normalize_monthly_periods(record.get("monthly_card_periods", []))
-    active_periods = []
-    for item in all_periods:
-        expires_at = _parse_iso_datetime(item.get("expires_at"))
-        if expires_at and expires_at > now:
-            active_periods.append(item)
-    record["monthly_card_periods"] = all_periods
-    if len(active_periods) >= config_data["max_cards"]:
-        return {
-            "success": False,
-            "reason": "max_cards_reached",
-            "status": _monthly_card_status(record, config_data, now),
-        }
+        price = _round_delta(config_data["price"])
+        balance = _round_shells(record.get("shells", 0))
+        if balance < price:
+            return {
+                "success": False,
+                "reason": "insufficient_shells",
+                "cost": price,
+                "balance": balance,
+                "status": _monthly_card_status(record, config_data, now),
+            }
 
-    price = _round_delta(config_data["price"])
-    balance = _round_shells(record.get("shells", 0))
-    if balance < price:
-        return {
-            "success": False,
-            "reason": "insufficient_shells",
-            "cost": price,
-            "balance": balance,
-            "status": _monthly_card_status(record, config_data, now),
+        last_expiry = max(
+            (_parse_iso_datetime(item.get("expires_at")) for item in active_periods),
+            default=None,
+        )
+        starts_at = max(now, last_expiry) if last_expiry else now
+        expires_at = starts_at + timedelta(days=config_data["duration_days"])
+        purchase_id = uuid.uuid4().hex[:16]
+        purchase = {
+            "purchase_id": purchase_id,
+            "purchased_at": now.isoformat(timespec="seconds"),
+            "starts_at": starts_at.isoformat(timespec="seconds"),
+            "expires_at": expires_at.isoformat(timespec="seconds"),
+            "cost": price,
+            "reward_days": int(config_data["duration_days"]),
+            "daily_rewards_granted": 0,
+        }
+        all_periods.append(purchase)
+        record["monthly_card_periods"] = all_periods[-24:]
+
+        first_purchase = not bool(record.get("monthly_card_ever_purchased", False))
+        record["monthly_card_ever_purchased"] = True
+        if first_purchase and not int(record.get("monthly_card_first_role_id", 0) or 0):
+            record["monthly_card_first_role_pending"] = True
+
+        before = balance
+        after_purchase = _round_shells(before - price)
+        actual_cost = _round_delta(after_purchase - before)
+        record["shells"] = after_purchase
+        record["points"] = after_purchase
+        _db_append_transaction(
+            connection,
+            record,
+            user_id=user_id,
+            guild_id=guild_id,
+            amount=actual_cost,
+            source="monthly_card_purchase",
+            reason=f"purchase_id={purchase_id};expires_at={expires_at.isoformat(timespec='seconds')}",
+        )
+        record.setdefault("monthly_card_purchases", []).append(dict(purchase))
+        record["monthly_card_purchases"] = record["monthly_card_purchases"][-20:]
+        top_purchase = dict(purchase)
+        top_purchase.update({"user_id": str(user_id), "guild_id": str(guild_id)})
+        purchases = _db_get_section(connection, "monthly_card_purchases", "value", [])
+        if not isinstance(purchases, list):
+            purchases = []
+        purchases.append(top_purchase)
+        _db_put_section(connection, "monthly_card_purchases", "value", purchases[-500:])
+
+        current_reward = _db_grant_monthly_daily_reward(
+            connection,
+            record,
+            config_data,
+            user_id=user_id,
+            guild_id=guild_id,
+            now=now,
+        )
+        daily_reward = _round_delta(catch_up_reward + current_reward)
+        _db_put_user(connection, key, record)
+        return {
+            "success": True,
+            "reason": "purchased",
+            "cost": price,
+            "daily_reward": daily_reward,
+            "first_purchase": first_purchase,
+            "balance": _round_shells(record.get("shells", 0)),
+            "status": _monthly_card_status(record, config_data, now),
         }
-
-    last_expiry = max(
-        (_parse_iso_datetime(item.get("expires_at")) for item in active_periods),
-        default=None,
-    )
-    starts_at = max(now, last_expiry) if last_expiry else now
-    expires_at = starts_at + timedelta(days=config_data["duration_days"])
-    purchase_id = uuid.uuid4().hex[:16]
-    purchase = {
-        "purchase_id": purchase_id,
-        "purchased_at": now.isoformat(timespec="seconds"),
-        "starts_at": starts_at.isoformat(timespec="seconds"),
-        "expires_at": expires_at.isoformat(timespec="seconds"),
-        "cost": price,
-        "reward_days": int(config_data["duration_days"]),
-        "daily_rewards_granted": 0,
-    }
-    all_periods.append(purchase)
-    record["monthly_card_periods"] = all_periods[-24:]
-
-    first_purchase = not bool(record.get("monthly_card_ever_purchased", False))
-    record["monthly_card_ever_purchased"] = True
-    if first_purchase and not int(record.get("monthly_card_first_role_id", 0) or 0):
-        record["monthly_card_first_role_pending"] = True
-
-    before = balance
-    after_purchase = _round_shells(before - price)
-    actual_cost = _round_delta(after_purchase - before)
-    record["shells"] = after_purchase
-    record["points"] = after_purchase
-    _append_transaction(
-        data,
-        record,
-        user_id=user_id,
-        guild_id=guild_id,
-        amount=actual_cost,
-        source="monthly_card_purchase",
-        reason=f"purchase_id={purchase_id};expires_at={expires_at.isoformat(timespec='seconds')}",
-    )
-    record.setdefault("monthly_card_purchases", []).append(dict(purchase))
-    record["monthly_card_purchases"] = record["monthly_card_purchases"][-20:]
-    top_purchase = dict(purchase)
-    top_purchase.update({"user_id": str(user_id), "guild_id": str(guild_id)})
-    data.setdefault("monthly_card_purchases", []).append(top_purchase)
-    data["monthly_card_purchases"] = data["monthly_card_purchases"][-500:]
-
-    current_reward = _grant_monthly_daily_reward(
-        data,
-        record,
-        user_id=user_id,
-        guild_id=guild_id,
-        now=now,
-    )
-    daily_reward = _round_delta(catch_up_reward + current_reward)
-    save_points_data(data)
-    return {
-        "success": True,
-        "reason": "purchased",
-        "cost": price,
-        "daily_reward": daily_reward,
-        "first_purchase": first_purchase,
-        "balance": _round_shells(record.get("shells", 0)),
-        "status": _monthly_card_status(record, config_data, now),
-    }
 
 
 @_locked_points_data
 def claim_monthly_card_first_role(user_id: int, guild_id: int, role_id: int) -> dict:
-    data = load_points_data()
-    record, _ = _ensure_user_record(data, user_id, guild_id)
-    if not record.get("monthly_card_ever_purchased", False):
-        return {"success": False, "reason": "not_purchased"}
-    if not record.get("monthly_card_first_role_pending", False):
-        return {"success": False, "reason": "already_claimed", "role_id": int(record.get("monthly_card_first_role_id", 0) or 0)}
-    record["monthly_card_first_role_pending"] = False
-    record["monthly_card_first_role_id"] = int(role_id)
-    save_points_data(data)
+    _ensure_points_db()
+    with _points_connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        record, key = _db_get_user(connection, user_id, guild_id)
+        if not record.get("monthly_card_ever_purchased", False):
+            return {"success": False, "reason": "not_purchased"}
+        if not record.get("monthly_card_first_role_pending", False):
+            return {"success": False, "reason": "already_claimed", "role_id": int(record.get("monthly_card_first_role_id", 0) or 0)}
+        record["monthly_card_first_role_pending"] = False
+        record["monthly_card_first_role_id"] = int(role_id)
+        _db_put_user(connection, key, record)
     return {"success": True, "reason": "claimed", "role_id": int(role_id)}
 
 
@@ -1218,7 +1811,7 @@ def settle_monthly_card_daily_rewards() -> dict:
         connection.execute("BEGIN IMMEDIATE")
         config_data = _db_monthly_config(connection)
         candidates = connection.execute(
-            "SELECT user_key, data FROM point_users WHERE has_monthly_card=1"
+            f"SELECT user_key, data, {_USER_COLUMN_SQL} FROM point_users WHERE has_monthly_card=1"
         ).fetchall()
         for row in candidates:
             key = str(row["user_key"])
@@ -1228,30 +1821,15 @@ def settle_monthly_card_daily_rewards() -> dict:
                 guild_id, user_id = (int(value) for value in key.split(":", 1))
             except ValueError:
                 continue
-            record = _normalize_record(_json_load(row["data"], {}))
-            local_data = {"monthly_card_config": config_data, "transactions": []}
-            reward = _grant_monthly_daily_reward(
-                local_data, record, user_id=user_id, guild_id=guild_id, now=now
+            record = _user_record_from_row(row)
+            reward = _db_grant_monthly_daily_reward(
+                connection, record, config_data, user_id=user_id, guild_id=guild_id, now=now
             )
             if reward <= 0:
                 continue
-            tx = local_data["transactions"][-1]
-            connection.execute(
-                """INSERT INTO point_transactions
-                   (time, guild_id, user_id, amount, balance, source, reason, idempotency_key)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, '')""",
-                (
-                    tx["time"], tx["guild_id"], tx["user_id"], tx["amount"],
-                    tx["balance"], tx["source"], tx["reason"],
-                ),
-            )
             _db_put_user(connection, key, record)
             rewarded_users += 1
             total_reward = _round_delta(total_reward + reward)
-        if rewarded_users:
-            connection.execute(
-                "DELETE FROM point_transactions WHERE id NOT IN (SELECT id FROM point_transactions ORDER BY id DESC LIMIT 500)"
-            )
     return {"date": now.date().isoformat(), "rewarded_users": rewarded_users, "total_reward": total_reward}
 
 
@@ -1269,20 +1847,17 @@ def grant_monthly_eligible_reward(
     normalized_key = str(idempotency_key or "").strip()
     with _points_connection() as connection:
         connection.execute("BEGIN IMMEDIATE")
-        record, key = _db_get_user(connection, user_id, guild_id)
+        key = _make_user_key(user_id, guild_id)
+        record = _db_get_balance_view(connection, key)
         if normalized_key:
-            existing = connection.execute(
-                """SELECT amount FROM point_transactions
-                   WHERE guild_id=? AND user_id=? AND idempotency_key=?""",
-                (str(guild_id), str(user_id), normalized_key),
-            ).fetchone()
-            if existing:
+            existing = _db_find_idempotent_amount(connection, guild_id, user_id, normalized_key)
+            if existing is not None:
                 return {
                     "success": True,
                     "duplicate": True,
                     "base_amount": 0.0,
                     "monthly_bonus": 0.0,
-                    "amount": _round_delta(existing["amount"]),
+                    "amount": existing,
                     "multiplier": 1.0,
                     "balance": _round_shells(record.get("shells", 0)),
                 }
@@ -1291,15 +1866,14 @@ def grant_monthly_eligible_reward(
         before = _round_shells(record.get("shells", 0))
         after = _round_shells(before + total)
         actual_delta = _round_delta(after - before)
-        record["shells"] = record["points"] = after
         detail = reason
         if monthly_bonus > 0:
             detail = f"{reason};monthly_card={multiplier}x;base={format_shells(base)}".strip(";")
+        _db_add_shells(connection, key, actual_delta)
         _db_append_transaction(
-            connection, record, user_id=user_id, guild_id=guild_id,
-            amount=actual_delta, source=source, reason=detail, idempotency_key=normalized_key,
+            connection, None, user_id=user_id, guild_id=guild_id, amount=actual_delta,
+            source=source, reason=detail, idempotency_key=normalized_key, balance=after,
         )
-        _db_put_user(connection, key, record)
         return {
             "success": True,
             "duplicate": False,
@@ -1362,54 +1936,58 @@ def purchase_acceleration_card(user_id: int, guild_id: int, tier_id: str) -> dic
     if not tier:
         return {"success": False, "reason": "unknown_tier"}
 
-    data = load_points_data()
-    record, _ = _ensure_user_record(data, user_id, guild_id)
+    _ensure_points_db()
     max_days = int(getattr(config, "ACCELERATION_CARD_MAX_DAYS", 25))
-    current_days = min(max_days, max(0, int(record.get("acceleration_days", 0))))
-    if current_days >= max_days:
-        return {"success": False, "reason": "max_reached", "status": get_acceleration_status(user_id, guild_id)}
+    with _points_connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        record, key = _db_get_user(connection, user_id, guild_id)
+        current_days = min(max_days, max(0, int(record.get("acceleration_days", 0))))
+        if current_days >= max_days:
+            return {"success": False, "reason": "max_reached", "status": get_acceleration_status(user_id, guild_id)}
 
-    cost = _round_delta(tier["cost"])
-    balance = _round_shells(record.get("shells", 0))
-    if balance < cost:
-        return {
-            "success": False,
-            "reason": "insufficient_shells",
-            "balance": balance,
+        cost = _round_delta(tier["cost"])
+        balance = _round_shells(record.get("shells", 0))
+        if balance < cost:
+            return {
+                "success": False,
+                "reason": "insufficient_shells",
+                "balance": balance,
+                "cost": cost,
+                "tier": tier,
+            }
+
+        effective_days = min(int(tier["days"]), max_days - current_days)
+        after = _round_shells(balance - cost)
+        record["shells"] = after
+        record["points"] = after
+        record["acceleration_days"] = current_days + effective_days
+        card_record = {
+            "time": _now_iso(),
+            "guild_id": str(guild_id),
+            "user_id": str(user_id),
+            "tier_id": tier["id"],
+            "label": tier["label"],
+            "configured_days": int(tier["days"]),
+            "effective_days": effective_days,
             "cost": cost,
-            "tier": tier,
+            "balance": after,
         }
-
-    effective_days = min(int(tier["days"]), max_days - current_days)
-    after = _round_shells(balance - cost)
-    record["shells"] = after
-    record["points"] = after
-    record["acceleration_days"] = current_days + effective_days
-    card_record = {
-        "time": _now_iso(),
-        "guild_id": str(guild_id),
-        "user_id": str(user_id),
-        "tier_id": tier["id"],
-        "label": tier["label"],
-        "configured_days": int(tier["days"]),
-        "effective_days": effective_days,
-        "cost": cost,
-        "balance": after,
-    }
-    record.setdefault("acceleration_cards", []).append(card_record)
-    data.setdefault("acceleration_purchases", []).append(card_record)
-    data["acceleration_purchases"] = data["acceleration_purchases"][-500:]
-
-    _append_transaction(
-        data,
-        record,
-        user_id=user_id,
-        guild_id=guild_id,
-        amount=-cost,
-        source="acceleration_card",
-        reason=f"tier={tier['id']};days={effective_days}",
-    )
-    save_points_data(data)
+        record.setdefault("acceleration_cards", []).append(card_record)
+        purchases = _db_get_section(connection, "acceleration_purchases", "value", [])
+        if not isinstance(purchases, list):
+            purchases = []
+        purchases.append(card_record)
+        _db_put_section(connection, "acceleration_purchases", "value", purchases[-500:])
+        _db_append_transaction(
+            connection,
+            record,
+            user_id=user_id,
+            guild_id=guild_id,
+            amount=-cost,
+            source="acceleration_card",
+            reason=f"tier={tier['id']};days={effective_days}",
+        )
+        _db_put_user(connection, key, record)
     return {
         "success": True,
         "tier": tier,
@@ -1553,11 +2131,24 @@ def get_daily_signin_summary(guild_id: int) -> dict:
 def sign_in_user(user_id: int, guild_id: int, reward: float = 1.0) -> dict:
     """每日报到，返回详细蛋壳结算结果。"""
     _ensure_points_db()
+    # 活跃加成依赖今日发言数：先取走该用户尚未落库的累加值，与报到同事务写入。
+    pending = _drain_pending_activity(user_id, guild_id)
+    try:
+        return _sign_in_user_sql(user_id, guild_id, reward, pending)
+    except Exception:
+        _restore_pending_activity(pending)
+        raise
+
+
+def _sign_in_user_sql(user_id: int, guild_id: int, reward: float, pending: dict) -> dict:
     today = _today()
     with _points_connection() as connection:
         connection.execute("BEGIN IMMEDIATE")
         record, key = _db_get_user(connection, user_id, guild_id)
+        activity_changed = _apply_pending_activity(record, pending)
         if record.get("last_sign_date", "") == today:
+            if activity_changed:
+                _db_set_user_fields(connection, key, record)
             daily_key = f"{guild_id}:{today}"
             signers = _db_get_section(connection, "daily_signins", daily_key, [])
             uid = str(user_id)
@@ -1596,10 +2187,11 @@ def sign_in_user(user_id: int, guild_id: int, reward: float = 1.0) -> dict:
         actual_delta = _round_delta(after - before)
         record.update({"last_sign_date": today, "streak_days": streak_days, "shells": after, "points": after})
         _db_append_transaction(
-            connection, record, user_id=user_id, guild_id=guild_id, amount=actual_delta,
+            connection, None, user_id=user_id, guild_id=guild_id, amount=actual_delta,
             source="sign_in", reason=f"rank={rank};event={event['id']};monthly_card={monthly_multiplier}x",
+            balance=after,
         )
-        _db_put_user(connection, key, record)
+        _db_set_user_fields(connection, key, record)
         _db_put_section(connection, "daily_signins", daily_key, signers)
         return {
             "success": True, "balance": after, "base_reward": base_reward,
@@ -1611,20 +2203,148 @@ def sign_in_user(user_id: int, guild_id: int, reward: float = 1.0) -> dict:
         }
 
 
+def queue_message_activity(user_id: int, guild_id: int) -> int:
+    """把一次有效发言计入内存累加器（不落库），返回当前待写入的事件总数。"""
+    global _PENDING_ACTIVITY_EVENTS
+    key = (int(guild_id), int(user_id), _today())
+    with _ACTIVITY_BUFFER_LOCK:
+        _PENDING_ACTIVITY[key] = _PENDING_ACTIVITY.get(key, 0) + 1
+        _PENDING_ACTIVITY_EVENTS += 1
+        return _PENDING_ACTIVITY_EVENTS
+
+
+def pending_message_activity_events() -> int:
+    with _ACTIVITY_BUFFER_LOCK:
+        return _PENDING_ACTIVITY_EVENTS
+
+
+def _drain_pending_activity(user_id: int | None = None, guild_id: int | None = None) -> dict:
+    global _PENDING_ACTIVITY_EVENTS
+    with _ACTIVITY_BUFFER_LOCK:
+        if user_id is None:
+            drained = dict(_PENDING_ACTIVITY)
+            _PENDING_ACTIVITY.clear()
+        else:
+            drained = {
+                key: _PENDING_ACTIVITY.pop(key)
+                for key in [
+                    key for key in _PENDING_ACTIVITY
+                    if key[1] == int(user_id) and (guild_id is None or key[0] == int(guild_id))
+                ]
+            }
+        _PENDING_ACTIVITY_EVENTS -= sum(drained.values())
+        return drained
+
+
+def _restore_pending_activity(items: dict) -> None:
+    global _PENDING_ACTIVITY_EVENTS
+    if not items:
+        return
+    with _ACTIVITY_BUFFER_LOCK:
+        for key, count in items.items():
+            _PENDING_ACTIVITY[key] = _PENDING_ACTIVITY.get(key, 0) + count
+        _PENDING_ACTIVITY_EVENTS += sum(items.values())
+
+
+def _apply_pending_activity(record: dict, pending: dict) -> bool:
+    """按日期顺序把累加值并入用户记录；比记录更旧的日期直接丢弃。"""
+    changed = False
+    for (_, _, day), count in sorted(pending.items(), key=lambda item: item[0][2]):
+        current_day = str(record.get("daily_msg_date", "") or "")
+        if current_day > day:
+            continue
+        if current_day != day:
+            record["daily_msg_date"] = day
+            record["daily_msg_count"] = 0
+        record["daily_msg_count"] = int(record.get("daily_msg_count", 0)) + int(count)
+        changed = True
+    return changed
+
+
+def _overlay_pending_activity(record: dict, user_id: int, guild_id: int | None) -> dict:
+    """只读视图：把尚未落库的发言数叠加到记录上，不取走累加器中的值。"""
+    if guild_id is None:
+        return record
+    with _ACTIVITY_BUFFER_LOCK:
+        pending = {
+            key: count for key, count in _PENDING_ACTIVITY.items()
+            if key[0] == int(guild_id) and key[1] == int(user_id)
+        }
+    if pending:
+        _apply_pending_activity(record, pending)
+    return record
+
+
+# SET 子句中的列引用均为更新前的旧值，因此日期与计数可在同一条语句中按日切换。
+_ACTIVITY_UPSERT_SQL = """
+    INSERT INTO point_users(user_key, data, daily_msg_date, daily_msg_count) VALUES (?, '{}', ?, ?)
+    ON CONFLICT(user_key) DO UPDATE SET
+        daily_msg_count = CASE
+            WHEN daily_msg_date = excluded.daily_msg_date THEN daily_msg_count + excluded.daily_msg_count
+            WHEN daily_msg_date < excluded.daily_msg_date THEN excluded.daily_msg_count
+            ELSE daily_msg_count
+        END,
+        daily_msg_date = MAX(daily_msg_date, excluded.daily_msg_date)
+"""
+
+
+def _db_apply_activity(connection: sqlite3.Connection, pending: dict) -> None:
+    connection.executemany(
+        _ACTIVITY_UPSERT_SQL,
+        (
+            (_make_user_key(user_id, guild_id), day, int(count))
+            for (guild_id, user_id, day), count in sorted(pending.items(), key=lambda item: item[0][2])
+        ),
+    )
+
+
+@_locked_points_data
+def flush_message_activity() -> int:
+    """把累加器中的全部发言计数在一个事务内批量写入，返回写入的事件数。"""
+    pending = _drain_pending_activity()
+    if not pending:
+        return 0
+    try:
+        _ensure_points_db()
+        with _points_connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            _db_apply_activity(connection, pending)
+    except Exception:
+        _restore_pending_activity(pending)
+        raise
+    return sum(pending.values())
+
+
+def _flush_message_activity_at_exit() -> None:
+    try:
+        flush_message_activity()
+    except Exception as error:
+        print(f"[蛋壳系统] 退出前发言计数落库失败 error={error!r}")
+
+
+atexit.register(_flush_message_activity_at_exit)
+
+
 @_locked_points_data
 def record_message_activity(user_id: int, guild_id: int) -> int:
-    """记录每日有效发言次数，不直接发放蛋壳。"""
+    """立即记录一次有效发言并落库；聊天热路径请改用 queue_message_activity。"""
     _ensure_points_db()
-    today = _today()
-    with _points_connection() as connection:
-        connection.execute("BEGIN IMMEDIATE")
-        record, key = _db_get_user(connection, user_id, guild_id)
-        if record.get("daily_msg_date", "") != today:
-            record["daily_msg_date"] = today
-            record["daily_msg_count"] = 0
-        record["daily_msg_count"] = int(record.get("daily_msg_count", 0)) + 1
-        _db_put_user(connection, key, record)
-        return int(record["daily_msg_count"])
+    pending = _drain_pending_activity(user_id, guild_id)
+    key = (int(guild_id), int(user_id), _today())
+    pending[key] = pending.get(key, 0) + 1
+    try:
+        with _points_connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            _db_apply_activity(connection, pending)
+            row = connection.execute(
+                "SELECT daily_msg_count FROM point_users WHERE user_key=?",
+                (_make_user_key(user_id, guild_id),),
+            ).fetchone()
+            return int(row["daily_msg_count"])
+    except Exception:
+        pending[key] -= 1
+        _restore_pending_activity({item: count for item, count in pending.items() if count})
+        raise
 
 
 def add_message_points(
@@ -1648,37 +2368,38 @@ def add_post_points(
     if amount <= 0 or daily_cap <= 0:
         return 0.0
 
-    data = load_points_data()
-    record, _ = _ensure_user_record(data, user_id, guild_id)
-
+    _ensure_points_db()
     today = _today()
-    if record.get("daily_post_date", "") != today:
-        record["daily_post_date"] = today
-        record["daily_post_pts"] = 0.0
+    with _points_connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        record, key = _db_get_user(connection, user_id, guild_id)
+        if record.get("daily_post_date", "") != today:
+            record["daily_post_date"] = today
+            record["daily_post_pts"] = 0.0
 
-    today_pts = _round_shells(record.get("daily_post_pts", 0))
-    if today_pts >= daily_cap:
-        return 0.0
+        today_pts = _round_shells(record.get("daily_post_pts", 0))
+        if today_pts >= daily_cap:
+            return 0.0
 
-    can_add = _round_delta(min(amount, daily_cap - today_pts))
-    credited, monthly_bonus, multiplier = _monthly_reward_amount(record, data.get("monthly_card_config"), can_add)
-    before = _round_shells(record.get("shells", 0))
-    after = _round_shells(before + credited)
-    actual_delta = _round_delta(after - before)
+        can_add = _round_delta(min(amount, daily_cap - today_pts))
+        credited, monthly_bonus, multiplier = _monthly_reward_amount(record, _db_monthly_config(connection), can_add)
+        before = _round_shells(record.get("shells", 0))
+        after = _round_shells(before + credited)
+        actual_delta = _round_delta(after - before)
 
-    record["daily_post_pts"] = _round_delta(today_pts + can_add)
-    record["shells"] = after
-    record["points"] = after
-    _append_transaction(
-        data,
-        record,
-        user_id=user_id,
-        guild_id=guild_id,
-        amount=actual_delta,
-        source="forum_post",
-        reason=f"legacy_forum_post_reward;monthly_card={multiplier}x;base={format_shells(can_add)}",
-    )
-    save_points_data(data)
+        record["daily_post_pts"] = _round_delta(today_pts + can_add)
+        record["shells"] = after
+        record["points"] = after
+        _db_append_transaction(
+            connection,
+            record,
+            user_id=user_id,
+            guild_id=guild_id,
+            amount=actual_delta,
+            source="forum_post",
+            reason=f"legacy_forum_post_reward;monthly_card={multiplier}x;base={format_shells(can_add)}",
+        )
+        _db_put_user(connection, key, record)
     return actual_delta
 
 
@@ -1693,76 +2414,79 @@ def reward_daily_forum_post(
     daily_limit: int,
 ) -> dict:
     """用户每日前 N 次论坛发帖奖励，额度跨所有论坛频道累计。"""
-    data = load_points_data()
+    _ensure_points_db()
     today = _today()
     reward_key = f"user:{guild_id}:{user_id}:{today}"
-    reward_rows = data.setdefault("daily_forum_rewards", {})
-    rewards = reward_rows.setdefault(reward_key, [])
-
-    # 当天可能还留有旧版“按频道”记录；迁移期间一并计入个人额度，避免重复发放。
-    existing_by_thread: dict[str, dict] = {}
-    for key, rows in reward_rows.items():
-        key_parts = str(key).split(":")
-        if len(key_parts) < 3 or key_parts[-1] != today:
-            continue
-        key_guild_id = key_parts[1] if key_parts[0] == "user" and len(key_parts) >= 4 else key_parts[0]
-        if key_guild_id != str(guild_id) or not isinstance(rows, list):
-            continue
-        for row in rows:
-            if not isinstance(row, dict) or str(row.get("user_id")) != str(user_id):
+    with _points_connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        rewards = _db_get_section(connection, "daily_forum_rewards", reward_key, [])
+        if not isinstance(rewards, list):
+            rewards = []
+        # 当天可能还留有旧版“按频道”记录（guild:channel:date）；迁移期间一并计入个人额度，避免重复发放。
+        legacy_rows = connection.execute(
+            """SELECT data FROM point_sections
+               WHERE namespace='daily_forum_rewards' AND item_key GLOB ?""",
+            (f"{guild_id}:*:{today}",),
+        ).fetchall()
+        existing_by_thread: dict[str, dict] = {}
+        for rows in [rewards, *(_json_load(row["data"], []) for row in legacy_rows)]:
+            if not isinstance(rows, list):
                 continue
-            existing_thread_id = str(row.get("thread_id", ""))
-            if existing_thread_id:
-                existing_by_thread[existing_thread_id] = row
-
-    thread_id_str = str(thread_id)
-    if thread_id_str in existing_by_thread:
-        return {
-            "success": False,
-            "reason": "duplicate_thread",
-            "daily_count": len(existing_by_thread),
-            "amount": 0.0,
-        }
-
-    if len(existing_by_thread) >= daily_limit:
-        return {
-            "success": False,
-            "reason": "daily_limit_reached",
-            "daily_count": len(existing_by_thread),
-            "amount": 0.0,
-        }
+            for row in rows:
+                if not isinstance(row, dict) or str(row.get("user_id")) != str(user_id):
+                    continue
+                existing_thread_id = str(row.get("thread_id", ""))
+                if existing_thread_id:
+                    existing_by_thread[existing_thread_id] = row
+
+        thread_id_str = str(thread_id)
+        if thread_id_str in existing_by_thread:
+            return {
+                "success": False,
+                "reason": "duplicate_thread",
+                "daily_count": len(existing_by_thread),
+                "amount": 0.0,
+            }
 
-    record, _ = _ensure_user_record(data, user_id, guild_id)
-    before = _round_shells(record.get("shells", 0))
-    base_amount = _round_delta(amount)
-    delta, monthly_bonus, multiplier = _monthly_reward_amount(record, data.get("monthly_card_config"), base_amount)
-    after = _round_shells(before + delta)
-    actual_delta = _round_delta(after - before)
+        if len(existing_by_thread) >= daily_limit:
+            return {
+                "success": False,
+                "reason": "daily_limit_reached",
+                "daily_count": len(existing_by_thread),
+                "amount": 0.0,
+            }
 
-    row = {
-        "thread_id": thread_id_str,
-        "user_id": str(user_id),
-        "channel_id": str(channel_id),
-        "time": _now_iso(),
-        "amount": actual_delta,
-        "base_amount": base_amount,
-        "monthly_bonus": monthly_bonus,
-        "daily_count": len(existing_by_thread) + 1,
-    }
-    rewards.append(row)
+        user_key = _make_user_key(user_id, guild_id)
+        record = _db_get_balance_view(connection, user_key)
+        before = _round_shells(record.get("shells", 0))
+        base_amount = _round_delta(amount)
+        delta, monthly_bonus, multiplier = _monthly_reward_amount(record, _db_monthly_config(connection), base_amount)
+        after = _round_shells(before + delta)
+        actual_delta = _round_delta(after - before)
 
-    record["shells"] = after
-    record["points"] = after
-    _append_transaction(
-        data,
-        record,
-        user_id=user_id,
-        guild_id=guild_id,
-        amount=actual_delta,
-        source="daily_forum_post",
-        reason=f"channel={channel_id};thread={thread_id};daily_count={row['daily_count']};monthly_card={multiplier}x",
-    )
-    save_points_data(data)
+        row = {
+            "thread_id": thread_id_str,
+            "user_id": str(user_id),
+            "channel_id": str(channel_id),
+            "time": _now_iso(),
+            "amount": actual_delta,
+            "base_amount": base_amount,
+            "monthly_bonus": monthly_bonus,
+            "daily_count": len(existing_by_thread) + 1,
+        }
+        rewards.append(row)
+        _db_put_section(connection, "daily_forum_rewards", reward_key, rewards)
+        _db_add_shells(connection, user_key, actual_delta)
+        _db_append_transaction(
+            connection,
+            None,
+            user_id=user_id,
+            guild_id=guild_id,
+            amount=actual_delta,
+            source="daily_forum_post",
+            reason=f"channel={channel_id};thread={thread_id};daily_count={row['daily_count']};monthly_card={multiplier}x",
+            balance=after,
+        )
     return {"success": True, "reason": "rewarded", "daily_count": row["daily_count"], "amount": actual_delta}
 
 
@@ -1781,9 +2505,44 @@ def _get_praise_weights() -> list[int]:
     return weights
 
 
-def _praise_scan_key(guild_id: int, message_id: int, rule_id: str | None = None) -> str:
-    rule = str(rule_id or "no_rule")[:64]
-    return f"{guild_id}:{message_id}:{rule}"
+_PRAISE_SCAN_COLUMNS = (
+    "time", "guild_id", "channel_id", "message_id", "author_id", "author_name", "content",
+    "status", "reason", "rule_id", "rule_field", "amount", "recovered", "message_created_at",
+)
+_PRAISE_SCAN_COLUMN_SQL = ", ".join(_PRAISE_SCAN_COLUMNS)
+
+
+def _praise_scan_key(item: dict) -> str:
+    """旧版 JSON 快照中的日志键：成功记录按规则去重，其余按规则+状态去重。"""
+    rule = str(item.get("rule_id") or "")[:64]
+    status = str(item.get("status") or "unknown")
+    key_rule = rule if status == "rewarded" and rule else f"{rule or 'no_rule'}:{status}"
+    return f"{item.get('guild_id', '')}:{item.get('message_id', '')}:{key_rule}"
+
+
+def _praise_scan_row_to_dict(row: sqlite3.Row) -> dict:
+    item = {name: row[name] for name in _PRAISE_SCAN_COLUMNS}
+    item["recovered"] = bool(item["recovered"])
+    return item
+
+
+def _db_put_praise_scan_rows(connection: sqlite3.Connection, scan_date: str, rows) -> None:
+    connection.executemany(
+        f"INSERT OR REPLACE INTO praise_scan_records(scan_date, {_PRAISE_SCAN_COLUMN_SQL}) "
+        f"VALUES (?, {', '.join('?' for _ in _PRAISE_SCAN_COLUMNS)})",
+        (
+            (
+                str(scan_date),
+                str(item.get("time", "")), str(item.get("guild_id", "")), str(item.get("channel_id", "")),
+                str(item.get("message_id", "")), str(item.get("author_id", "")), str(item.get("author_name", "")),
+                str(item.get("content", "")), str(item.get("status") or "unknown")[:32], str(item.get("reason", "")),
+                str(item.get("rule_id") or "")[:64], str(item.get("rule_field", "")),
+                _round_delta(item.get("amount", 0)), int(bool(item.get("recovered"))),
+                str(item.get("message_created_at", "")),
+            )
+            for item in rows if isinstance(item, dict)
+        ),
+    )
 
 
 def _discord_snowflake_date_cn(message_id: int | str) -> str | None:
@@ -1798,10 +2557,14 @@ def _discord_snowflake_date_cn(message_id: int | str) -> str | None:
     return _date_cn(occurred_at)
 
 
-def _repair_praise_reward_dates(data: dict, guild_id: int, reward_date: str) -> int:
-    rewards = data.setdefault("daily_praise_rewards", {})
-    source_key = f"{guild_id}:{reward_date}"
-    source_rows = rewards.setdefault(source_key, {})
+def _db_repair_praise_reward_dates(
+    connection: sqlite3.Connection,
+    guild_id: int,
+    reward_date: str,
+    source_rows: dict,
+) -> int:
+    """把误记到 reward_date 的识别奖励按消息 ID 的真实日期挪回对应日；只读写涉及的日期行。"""
+    targets: dict[str, dict] = {}
     repaired = 0
     for claim_key, item in list(source_rows.items()):
         if not isinstance(item, dict):
@@ -1811,22 +2574,83 @@ def _repair_praise_reward_dates(data: dict, guild_id: int, reward_date: str) ->
             continue
 
         source_rows.pop(claim_key, None)
-        target_rows = rewards.setdefault(f"{guild_id}:{actual_date}", {})
-        target_key = str(claim_key)
-        if target_key in target_rows:
-            target_key = f"{target_key}:recovered:{item.get('message_id', repaired)}"
-        target_rows[target_key] = item
+        target_key = f"{guild_id}:{actual_date}"
+        if target_key not in targets:
+            loaded = _db_get_section(connection, "daily_praise_rewards", target_key, {})
+            targets[target_key] = loaded if isinstance(loaded, dict) else {}
+        target_rows = targets[target_key]
+        target_claim = str(claim_key)
+        if target_claim in target_rows:
+            target_claim = f"{target_claim}:recovered:{item.get('message_id', repaired)}"
+        target_rows[target_claim] = item
         repaired += 1
+    for target_key, rows in targets.items():
+        _db_put_section(connection, "daily_praise_rewards", target_key, rows)
     return repaired
 
 
-@_locked_points_data
 def get_successful_praise_scan_record(guild_id: int, message_id: int, rule_id: str) -> dict | None:
-    data = load_points_data()
-    today = _today()
-    rows = data.setdefault("daily_praise_scan_records", {}).setdefault(today, {})
-    item = rows.get(_praise_scan_key(guild_id, message_id, rule_id))
-    return dict(item) if isinstance(item, dict) and item.get("status") == "rewarded" else None
+    _ensure_points_db()
+    with _points_connection() as connection:
+        row = connection.execute(
+            f"""SELECT {_PRAISE_SCAN_COLUMN_SQL} FROM praise_scan_records
+               WHERE guild_id=? AND message_id=? AND rule_id=? AND status='rewarded'""",
+            (str(guild_id), str(message_id), str(rule_id or "")[:64]),
+        ).fetchone()
+    return _praise_scan_row_to_dict(row) if row is not None else None
+
+
+def get_successful_praise_scan_records(guild_id: int, message_ids) -> dict[tuple[str, str], dict]:
+    """批量查询一页消息中已成功发放的识别记录，返回 {(message_id, rule_id): 记录}。"""
+    ids = list(dict.fromkeys(str(message_id) for message_id in message_ids))
+    if not ids:
+        return {}
+    _ensure_points_db()
+    found: dict[tuple[str, str], dict] = {}
+    with _points_connection() as connection:
+        # SQLite 默认单条语句最多 999 个参数，超长列表分段查询。
+        for start in range(0, len(ids), 900):
+            chunk = ids[start:start + 900]
+            rows = connection.execute(
+                f"""SELECT {_PRAISE_SCAN_COLUMN_SQL} FROM praise_scan_records
+                   WHERE guild_id=? AND status='rewarded' AND message_id IN ({', '.join('?' for _ in chunk)})""",
+                (str(guild_id), *chunk),
+            )
+            for row in rows:
+                found[(row["message_id"], row["rule_id"])] = _praise_scan_row_to_dict(row)
+    return found
+
+
+def get_praise_scan_cursor(channel_id: int) -> int:
+    """返回频道已完整结算到的最后一条消息 ID（增量重扫的高水位）；没有记录时返回 0。"""
+    _ensure_points_db()
+    with _points_connection() as connection:
+        cursor = _db_get_section(connection, "praise_scan_cursors", str(channel_id), {})
+    try:
+        return int(cursor.get("message_id", 0) or 0) if isinstance(cursor, dict) else 0
+    except (TypeError, ValueError):
+        return 0
+
+
+def save_praise_scan_cursor(channel_id: int, message_id: int) -> int:
+    """推进频道高水位；只前进不后退，返回保存后的值。"""
+    _ensure_points_db()
+    with _points_connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        cursor = _db_get_section(connection, "praise_scan_cursors", str(channel_id), {})
+        try:
+            current = int(cursor.get("message_id", 0) or 0) if isinstance(cursor, dict) else 0
+        except (TypeError, ValueError):
+            current = 0
+        if int(message_id) <= current:
+            return current
+        _db_put_section(
+            connection,
+            "praise_scan_cursors",
+            str(channel_id),
+            {"message_id": str(int(message_id)), "updated_at": _now_iso()},
+        )
+    return int(message_id)
 
 
 def has_successful_praise_scan_record(guild_id: int, message_id: int, rule_id: str) -> bool:
@@ -1850,12 +2674,8 @@ def record_praise_scan_log(
     recovered: bool = False,
     message_created_at: str = "",
 ) -> dict:
-    data = load_points_data()
+    _ensure_points_db()
     today = _today()
-    rows = data.setdefault("daily_praise_scan_records", {}).setdefault(today, {})
-    normalized_rule = str(rule_id or "")[:64]
-    key_rule = normalized_rule if status == "rewarded" and normalized_rule else f"{normalized_rule or 'no_rule'}:{status}"
-    key = _praise_scan_key(guild_id, message_id, key_rule)
     row = {
         "time": _now_iso(),
         "guild_id": str(guild_id),
@@ -1872,8 +2692,11 @@ def record_praise_scan_log(
         "recovered": bool(recovered),
         "message_created_at": str(message_created_at or "")[:40],
     }
-    rows[key] = row
-    save_points_data(data)
+    with _points_connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        _db_put_praise_scan_rows(connection, today, (row,))
+        # 扫描日志只保留当天。
+        connection.execute("DELETE FROM praise_scan_records WHERE scan_date<?", (today,))
     return row
 
 
@@ -1889,74 +2712,79 @@ def reward_daily_kimi_praise(
     occurred_at: datetime | None = None,
 ) -> dict:
     """Reward each configured recognition rule at most once per user per day."""
-    data = load_points_data()
+    _ensure_points_db()
     today = _date_cn(occurred_at)
     reward_key = f"{guild_id}:{today}"
-    rows = data.setdefault("daily_praise_rewards", {}).setdefault(reward_key, {})
-    repaired = _repair_praise_reward_dates(data, guild_id, today)
-    if repaired:
-        save_points_data(data)
     uid = str(user_id)
     message_id_str = str(message_id)
     normalized_rule_id = str(rule_id or "default_kimi_praise")[:64]
     claim_key = f"{uid}:{normalized_rule_id}"
+    with _points_connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        rows = _db_get_section(connection, "daily_praise_rewards", reward_key, {})
+        if not isinstance(rows, dict):
+            rows = {}
+        repaired = _db_repair_praise_reward_dates(connection, guild_id, today, rows)
+        if repaired:
+            _db_put_section(connection, "daily_praise_rewards", reward_key, rows)
+
+        for existing_key, existing in rows.items():
+            if (
+                isinstance(existing, dict)
+                and str(existing.get("message_id", "")) == message_id_str
+                and str(existing.get("rule_id", "default_kimi_praise")) == normalized_rule_id
+            ):
+                return {
+                    "success": False,
+                    "reason": "duplicate_message",
+                    "amount": _round_delta(existing.get("amount", 0)),
+                    "message_id": message_id_str,
+                    "claim_key": str(existing_key),
+                }
 
-    for existing_key, existing in rows.items():
-        if (
-            isinstance(existing, dict)
-            and str(existing.get("message_id", "")) == message_id_str
-            and str(existing.get("rule_id", "default_kimi_praise")) == normalized_rule_id
-        ):
+        # The former single-trigger format used the bare user ID. Preserve its daily claim.
+        legacy_claimed = normalized_rule_id == "default_kimi_praise" and uid in rows
+        if claim_key in rows or legacy_claimed:
+            existing = rows.get(claim_key, rows.get(uid, {}))
             return {
                 "success": False,
-                "reason": "duplicate_message",
-                "amount": _round_delta(existing.get("amount", 0)),
-                "message_id": message_id_str,
-                "claim_key": str(existing_key),
+                "reason": "already_claimed",
+                "amount": _round_delta(existing.get("amount", 0)) if isinstance(existing, dict) else 0.0,
+                "message_id": str(existing.get("message_id", "")) if isinstance(existing, dict) else "",
             }
 
-    # The former single-trigger format used the bare user ID. Preserve its daily claim.
-    legacy_claimed = normalized_rule_id == "default_kimi_praise" and uid in rows
-    if claim_key in rows or legacy_claimed:
-        existing = rows.get(claim_key, rows.get(uid, {}))
-        return {
-            "success": False,
-            "reason": "already_claimed",
-            "amount": _round_delta(existing.get("amount", 0)) if isinstance(existing, dict) else 0.0,
-            "message_id": str(existing.get("message_id", "")) if isinstance(existing, dict) else "",
-        }
-
-    minimum = max(1, int(round(float(min_reward) * 10)))
-    maximum = max(1, int(round(float(max_reward) * 10)))
-    if maximum < minimum:
-        minimum, maximum = maximum, minimum
-    base_amount = random.randint(minimum, maximum) / 10
-    record, _ = _ensure_user_record(data, user_id, guild_id)
-    amount, monthly_bonus, multiplier = _monthly_reward_amount(record, data.get("monthly_card_config"), base_amount)
-    before = _round_shells(record.get("shells", 0))
-    after = _round_shells(before + amount)
-    actual_delta = _round_delta(after - before)
+        minimum = max(1, int(round(float(min_reward) * 10)))
+        maximum = max(1, int(round(float(max_reward) * 10)))
+        if maximum < minimum:
+            minimum, maximum = maximum, minimum
+        base_amount = random.randint(minimum, maximum) / 10
+        user_key = _make_user_key(user_id, guild_id)
+        record = _db_get_balance_view(connection, user_key)
+        amount, monthly_bonus, multiplier = _monthly_reward_amount(record, _db_monthly_config(connection), base_amount)
+        before = _round_shells(record.get("shells", 0))
+        after = _round_shells(before + amount)
+        actual_delta = _round_delta(after - before)
 
-    rows[claim_key] = {
-        "time": _now_iso(),
-        "message_id": message_id_str,
-        "amount": actual_delta,
-        "base_amount": _round_delta(base_amount),
-        "monthly_bonus": monthly_bonus,
-        "rule_id": normalized_rule_id,
-    }
-    record["shells"] = after
-    record["points"] = after
-    _append_transaction(
-        data,
-        record,
-        user_id=user_id,
-        guild_id=guild_id,
-        amount=actual_delta,
-        source="kimi_praise",
-        reason=f"message_id={message_id};rule={normalized_rule_id};monthly_card={multiplier}x",
-    )
-    save_points_data(data)
+        rows[claim_key] = {
+            "time": _now_iso(),
+            "message_id": message_id_str,
+            "amount": actual_delta,
+            "base_amount": _round_delta(base_amount),
+            "monthly_bonus": monthly_bonus,
+            "rule_id": normalized_rule_id,
+        }
+        _db_put_section(connection, "daily_praise_rewards", reward_key, rows)
+        _db_add_shells(connection, user_key, actual_delta)
+        _db_append_transaction(
+            connection,
+            None,
+            user_id=user_id,
+            guild_id=guild_id,
+            amount=actual_delta,
+            source="kimi_praise",
+            reason=f"message_id={message_id};rule={normalized_rule_id};monthly_card={multiplier}x",
+            balance=after,
+        )
     return {
         "success": True,
         "reason": "rewarded",
@@ -1,6 +1,9 @@
+import asyncio
+import time
+
 import discord
 from discord import Option
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 from cogs.points.storage import get_user_points, modify_user_points
 
@@ -9,6 +12,10 @@ from . import storage
 
 MAX_PACKET_COUNT = 50
 MIN_PACKET_UNIT = 0.1
+# 到期调度器每次只按到期索引武装一个唤醒；这个上限只是兜底，防止时钟跳变后睡过头
+EXPIRY_MAX_SLEEP_SECONDS = 3600
+# 处理或读索引失败后的退避时间；否则逾期的到期时间会让调度器原地空转重试
+EXPIRY_RETRY_SECONDS = 60
 RED_PACKET_IMAGE_URL = (
     "https://i.postimg.cc/kMKjMnc1/"
     "qi-mi-dan-hong-bao-feng-mian-2-cong-cong-da-wang123-lai-zi-xiao-hong-shu-wang-ye-ban.jpg"
@@ -107,17 +114,27 @@ class RedPacketCog(commands.Cog, name="蛋壳红包"):
     def __init__(self, bot):
         self.bot = bot
         self._registered_packet_ids: set[str] = set()
+        self._expiry_task: asyncio.Task | None = None
+        self._expiry_wakeup = asyncio.Event()
 
     async def cog_load(self):
-        if not self.cleanup_expired_packets.is_running():
-            self.cleanup_expired_packets.start()
+        self._start_expiry_scheduler()
 
     def cog_unload(self):
-        if self.cleanup_expired_packets.is_running():
-            self.cleanup_expired_packets.cancel()
+        if self._expiry_task and not self._expiry_task.done():
+            self._expiry_task.cancel()
+
+    def _start_expiry_scheduler(self):
+        if self._expiry_task is None or self._expiry_task.done():
+            self._expiry_task = asyncio.create_task(self._run_expiry_scheduler())
+
+    def _rearm_expiry_scheduler(self):
+        """有新红包或状态变化时让调度器重新读取最早到期时间。"""
+        self._expiry_wakeup.set()
 
     @commands.Cog.listener()
     async def on_ready(self):
+        self._start_expiry_scheduler()
         for packet in storage.get_active_packets():
             packet_id = str(packet.get("id", ""))
             if not packet_id or packet_id in self._registered_packet_ids:
@@ -188,6 +205,7 @@ class RedPacketCog(commands.Cog, name="蛋壳红包"):
         view = RedPacketView(self, packet["id"])
         self.bot.add_view(view)
         self._registered_packet_ids.add(packet["id"])
+        self._rearm_expiry_scheduler()
 
         try:
             response = await ctx.interaction.edit_original_response(
@@ -223,8 +241,8 @@ class RedPacketCog(commands.Cog, name="蛋壳红包"):
             await self._send_claim_result(interaction, "红包只能在服务器里领取哦。")
             return
 
-        result = storage.claim_packet(packet_id, interaction.user.id)
-        packet = result.get("packet") or storage.get_packet(packet_id)
+        result = await asyncio.to_thread(storage.claim_packet, packet_id, interaction.user.id)
+        packet = result.get("packet")
 
         if not result.get("success"):
             reason = result.get("reason")
@@ -272,35 +290,71 @@ class RedPacketCog(commands.Cog, name="蛋壳红包"):
             # unusually long time. The claim itself is already safely persisted.
             return
 
-    @tasks.loop(minutes=30)
-    async def cleanup_expired_packets(self):
-        expired_packets = storage.expire_due_packets()
-        for packet in expired_packets:
-            refund_amount = await self._refund_expired_packet(packet)
-            if packet.get("admin_free"):
-                closed_note = f"已自动清理，未领取的 **{storage.format_shells(refund_amount)}** 蛋壳不再发放。"
-            else:
-                closed_note = f"已自动清理，未领取部分退还 **{storage.format_shells(refund_amount)}** 蛋壳。"
-            await self._refresh_packet_message(
-                storage.get_packet(packet["id"]) or packet,
-                closed_note=closed_note,
-            )
-
-    @cleanup_expired_packets.before_loop
-    async def before_cleanup_expired_packets(self):
+    async def _run_expiry_scheduler(self):
         await self.bot.wait_until_ready()
+        while True:
+            # 先处理到期与遗留退款（启动时即补做中断前未完成的部分），再按索引武装下一次唤醒
+            self._expiry_wakeup.clear()
+            failed = False
+            try:
+                await self._process_expired_packets()
+            except Exception as e:
+                print(f"[RedPackets] expiry-scheduler-failed: {e}")
+                failed = True
+            try:
+                next_due = await asyncio.to_thread(storage.next_expiry_ts)
+            except Exception as e:
+                print(f"[RedPackets] expiry-index-read-failed: {e}")
+                next_due = None
+                failed = True
+            if failed:
+                delay = EXPIRY_RETRY_SECONDS
+            elif next_due is None:
+                delay = EXPIRY_MAX_SLEEP_SECONDS
+            else:
+                delay = min(EXPIRY_MAX_SLEEP_SECONDS, max(0.0, next_due - time.time()))
+            if delay <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._expiry_wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process_expired_packets(self):
+        await asyncio.to_thread(storage.expire_due_packets)
+        pending = await asyncio.to_thread(storage.get_unrefunded_expired_packets)
+        for packet in pending:
+            # 单个红包退款或刷新失败只记日志，不能挡住排在后面的红包；失败的下次唤醒再重试
+            try:
+                refund_amount = await self._refund_expired_packet(packet)
+                if packet.get("admin_free"):
+                    closed_note = f"已自动清理，未领取的 **{storage.format_shells(refund_amount)}** 蛋壳不再发放。"
+                else:
+                    closed_note = f"已自动清理，未领取部分退还 **{storage.format_shells(refund_amount)}** 蛋壳。"
+                await self._refresh_packet_message(
+                    storage.get_packet(packet["id"]) or packet,
+                    closed_note=closed_note,
+                )
+            except Exception as e:
+                print(f"[RedPackets] expired-packet-refund-failed packet={packet.get('id')}: {e!r}")
 
     async def _refund_expired_packet(self, packet: dict) -> float:
         refund_amount = storage.round_shells(packet.get("refund_amount", packet.get("remaining_amount", 0)))
-        if refund_amount > 0 and not packet.get("admin_free") and not packet.get("refunded"):
-            modify_user_points(
-                int(packet["sender_id"]),
-                refund_amount,
-                int(packet["guild_id"]),
-                source="red_packet_refund",
-                reason=f"packet={packet['id']};expired",
-            )
-        storage.mark_refunded(packet["id"])
+        # 先原子认领退款，点击过期红包与调度器同时处理时只有一方会真正退款
+        if not await asyncio.to_thread(storage.mark_refunded, packet["id"]):
+            return refund_amount
+        if refund_amount > 0 and not packet.get("admin_free"):
+            try:
+                modify_user_points(
+                    int(packet["sender_id"]),
+                    refund_amount,
+                    int(packet["guild_id"]),
+                    source="red_packet_refund",
+                    reason=f"packet={packet['id']};expired",
+                )
+            except Exception:
+                await asyncio.to_thread(storage.unmark_refunded, packet["id"])
+                raise
         return refund_amount
 
     async def _refresh_packet_message(self, packet: dict, *, closed_note: str | None = None):
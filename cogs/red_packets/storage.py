@@ -3,11 +3,13 @@ import os
 import random
 import secrets
 import threading
+from contextlib import contextmanager
 from functools import wraps
 from datetime import datetime, timedelta, timezone
 from typing import Any
 
-from cogs.shared.sqlite_store import load_json_namespace, save_json_namespace
+from cogs.shared import sqlite_store
+from cogs.shared.sqlite_store import app_state_connection
 
 DATA_FILE = "data/red_packets.json"
 TZ_CN = timezone(timedelta(hours=8))
@@ -15,6 +17,93 @@ SHELL_PRECISION = 1
 EXPIRE_HOURS = 24
 _DATA_LOCK = threading.RLock()
 
+# 红包、预生成的份额、领取记录各占一张表，金额统一以 0.1 蛋壳为单位存整数。
+# 领取只在一个短事务里用 UPDATE ... RETURNING 认领该红包下一份未领取的份额，
+# 不再读写全部红包；(packet_id, user_id) 主键保证每人只能领一次。
+_UNITS_PER_SHELL = 10 ** SHELL_PRECISION
+_PACKET_COLUMNS = (
+    "id",
+    "guild_id",
+    "channel_id",
+    "message_id",
+    "sender_id",
+    "sender_name",
+    "message",
+    "created_at",
+    "expires_at",
+    "status",
+    "expired_at",
+    "refunded_at",
+)
+_BLOB_TABLES = ("red_packets", "red_packet_allocations", "red_packet_claims")
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS red_packet_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS red_packets (
+    id TEXT PRIMARY KEY,
+    guild_id TEXT NOT NULL DEFAULT '',
+    channel_id TEXT NOT NULL DEFAULT '',
+    message_id TEXT NOT NULL DEFAULT '',
+    sender_id TEXT NOT NULL DEFAULT '',
+    sender_name TEXT NOT NULL DEFAULT '',
+    message TEXT NOT NULL DEFAULT '',
+    total_units INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    remaining_units INTEGER NOT NULL DEFAULT 0,
+    remaining_count INTEGER NOT NULL DEFAULT 0,
+    admin_free INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT '',
+    expires_at TEXT NOT NULL DEFAULT '',
+    expires_ts REAL NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'active',
+    refunded INTEGER NOT NULL DEFAULT 0,
+    refund_units INTEGER,
+    expired_at TEXT NOT NULL DEFAULT '',
+    refunded_at TEXT NOT NULL DEFAULT '',
+    payload TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS red_packet_allocations (
+    packet_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    amount_units INTEGER NOT NULL,
+    claimed_by TEXT,
+    PRIMARY KEY(packet_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_red_packet_allocations_open
+    ON red_packet_allocations(packet_id, seq) WHERE claimed_by IS NULL;
+CREATE TABLE IF NOT EXISTS red_packet_claims (
+    packet_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    seq INTEGER,
+    amount_units INTEGER NOT NULL,
+    claimed_at TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY(packet_id, user_id)
+);
+"""
+
+# 到期索引：只覆盖进行中的红包，调度器每次只取最早的一个到期时间；
+# 已过期但尚未退款的红包另有一个小索引，供启动时补做退款。
+_DUE_INDEX_SQL = """
+DROP INDEX IF EXISTS idx_red_packets_active;
+CREATE INDEX IF NOT EXISTS idx_red_packets_due
+    ON red_packets(expires_ts) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS idx_red_packets_unrefunded
+    ON red_packets(expires_ts) WHERE status = 'expired' AND refunded = 0;
+"""
+
+_CLAIM_ALLOCATION_SQL = """
+UPDATE red_packet_allocations SET claimed_by = ?
+WHERE packet_id = ? AND seq = (
+    SELECT seq FROM red_packet_allocations
+    WHERE packet_id = ? AND claimed_by IS NULL
+    ORDER BY seq LIMIT 1
+)
+RETURNING seq, amount_units
+"""
+
 
 def _locked(func):
     @wraps(func)
@@ -57,24 +146,6 @@ def format_shells(value: float | int | str) -> str:
     return f"{amount:.1f}"
 
 
-def load_data() -> dict[str, Any]:
-    data = load_json_namespace(
-        "red_packets", legacy_file=DATA_FILE, default={"version": 1, "packets": {}}
-    )
-
-    if not isinstance(data, dict):
-        return {"version": 1, "packets": {}}
-    data.setdefault("version", 1)
-    data.setdefault("packets", {})
-    if not isinstance(data["packets"], dict):
-        data["packets"] = {}
-    return data
-
-
-def save_data(data: dict[str, Any]) -> None:
-    save_json_namespace("red_packets", data)
-
-
 def generate_allocations(total_amount: float, count: int) -> list[float]:
     total_units = int(round(round_shells(total_amount) * 10))
     if count <= 0 or total_units < count:
@@ -88,7 +159,190 @@ def generate_allocations(total_amount: float, count: int) -> list[float]:
     return [round(u / 10, SHELL_PRECISION) for u in units]
 
 
+def _to_units(value: float | int | str) -> int:
+    return int(round(round_shells(value) * _UNITS_PER_SHELL))
+
+
+def _from_units(units: int | None) -> float:
+    return round((units or 0) / _UNITS_PER_SHELL, SHELL_PRECISION)
+
+
+def _empty_data() -> dict[str, Any]:
+    return {"version": 1, "packets": {}}
+
+
+def _insert_packet(connection, packet: dict[str, Any]) -> None:
+    """写入一个完整红包（含剩余份额和领取记录）；调用方负责事务。"""
+    packet_id = str(packet.get("id", ""))
+    allocations = packet.get("allocations") if isinstance(packet.get("allocations"), list) else []
+    claims = packet.get("claims") if isinstance(packet.get("claims"), dict) else {}
+    payload = {
+        key: value
+        for key, value in packet.items()
+        if key not in _PACKET_COLUMNS
+        and key
+        not in (
+            "total_amount",
+            "count",
+            "remaining_amount",
+            "remaining_count",
+            "admin_free",
+            "refunded",
+            "refund_amount",
+            "allocations",
+            "claims",
+        )
+    }
+    refund_amount = packet.get("refund_amount")
+    connection.execute(
+        f"""INSERT OR REPLACE INTO red_packets(
+               {", ".join(_PACKET_COLUMNS)}, total_units, count, remaining_units, remaining_count,
+               admin_free, refunded, refund_units, expires_ts, payload
+           ) VALUES ({", ".join("?" for _ in _PACKET_COLUMNS)}, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (
+            *(str(packet.get(column, "") or "") for column in _PACKET_COLUMNS[:-3]),
+            str(packet.get("status") or "active"),
+            str(packet.get("expired_at", "") or ""),
+            str(packet.get("refunded_at", "") or ""),
+            _to_units(packet.get("total_amount", 0)),
+            int(packet.get("count", 0) or 0),
+            _to_units(packet.get("remaining_amount", sum(round_shells(x) for x in allocations))),
+            int(packet.get("remaining_count", len(allocations)) or 0),
+            1 if packet.get("admin_free") else 0,
+            1 if packet.get("refunded") else 0,
+            None if refund_amount is None else _to_units(refund_amount),
+            parse_time(packet.get("expires_at", "")).timestamp(),
+            json.dumps(payload, ensure_ascii=False, separators=(",", ":")),
+        ),
+    )
+    connection.execute("DELETE FROM red_packet_allocations WHERE packet_id=?", (packet_id,))
+    connection.execute("DELETE FROM red_packet_claims WHERE packet_id=?", (packet_id,))
+    # 旧版从列表末尾弹出份额，倒序编号后“最小序号优先”与原顺序一致
+    connection.executemany(
+        "INSERT INTO red_packet_allocations(packet_id, seq, amount_units) VALUES (?, ?, ?)",
+        [(packet_id, seq, _to_units(amount)) for seq, amount in enumerate(reversed(allocations))],
+    )
+    connection.executemany(
+        "INSERT INTO red_packet_claims(packet_id, user_id, amount_units, claimed_at) VALUES (?, ?, ?, ?)",
+        [
+            (packet_id, str(user_id), _to_units(claim.get("amount", 0)), str(claim.get("claimed_at", "") or ""))
+            for user_id, claim in claims.items()
+            if isinstance(claim, dict)
+        ],
+    )
+
+
+def _import_blob(connection, data: dict[str, Any]) -> None:
+    packets = data.get("packets")
+    for packet_id, packet in (packets if isinstance(packets, dict) else {}).items():
+        if isinstance(packet, dict):
+            _insert_packet(connection, {**packet, "id": str(packet.get("id") or packet_id)})
+
+
+def _prepare_tables(connection) -> None:
+    _ensure_due_column(connection)
+    connection.executescript(_DUE_INDEX_SQL)
+
+
+def _ensure_packet_tables() -> None:
+    sqlite_store.ensure_blob_tables(
+        "red_packets",
+        schema_sql=_SCHEMA_SQL,
+        meta_table="red_packet_meta",
+        legacy_file=DATA_FILE,
+        default=_empty_data(),
+        importer=_import_blob,
+        lock=_DATA_LOCK,
+        prepare=_prepare_tables,
+    )
+
+
+def _ensure_due_column(connection) -> None:
+    # 早期建出的表没有数值到期时间列，补列后按 expires_at 回填一次
+    columns = {row["name"] for row in connection.execute("PRAGMA table_info(red_packets)")}
+    if "expires_ts" in columns:
+        return
+    connection.execute("ALTER TABLE red_packets ADD COLUMN expires_ts REAL NOT NULL DEFAULT 0")
+    rows = connection.execute("SELECT id, expires_at FROM red_packets").fetchall()
+    connection.executemany(
+        "UPDATE red_packets SET expires_ts=? WHERE id=?",
+        [(parse_time(row["expires_at"]).timestamp(), row["id"]) for row in rows],
+    )
+    connection.commit()
+
+
+@contextmanager
+def _connection():
+    _ensure_packet_tables()
+    with app_state_connection() as connection:
+        yield connection
+
+
+def initialize_red_packet_storage() -> None:
+    """启动时建表、补到期列并导入旧红包，调度器随后只读到期索引。"""
+    _ensure_packet_tables()
+
+
+def _packet_from_row(row) -> dict[str, Any]:
+    """红包主记录；份额和领取明细不在其中，需要时单独查询。"""
+    try:
+        packet = json.loads(row["payload"] or "{}")
+    except json.JSONDecodeError:
+        packet = {}
+    if not isinstance(packet, dict):
+        packet = {}
+    for column in _PACKET_COLUMNS:
+        if column not in ("expired_at", "refunded_at") or row[column]:
+            packet[column] = row[column]
+    packet.update(
+        total_amount=_from_units(row["total_units"]),
+        count=int(row["count"]),
+        remaining_amount=_from_units(row["remaining_units"]),
+        remaining_count=int(row["remaining_count"]),
+        admin_free=bool(row["admin_free"]),
+        refunded=bool(row["refunded"]),
+    )
+    if row["refund_units"] is not None:
+        packet["refund_amount"] = _from_units(row["refund_units"])
+    return packet
+
+
+def _packet_details(connection, packet: dict[str, Any]) -> dict[str, Any]:
+    packet_id = packet["id"]
+    packet["allocations"] = [
+        _from_units(row["amount_units"])
+        for row in connection.execute(
+            """SELECT amount_units FROM red_packet_allocations
+               WHERE packet_id=? AND claimed_by IS NULL ORDER BY seq DESC""",
+            (packet_id,),
+        )
+    ]
+    packet["claims"] = {
+        row["user_id"]: {"amount": _from_units(row["amount_units"]), "claimed_at": row["claimed_at"]}
+        for row in connection.execute(
+            "SELECT user_id, amount_units, claimed_at FROM red_packet_claims WHERE packet_id=? ORDER BY rowid",
+            (packet_id,),
+        )
+    }
+    return packet
+
+
+def load_data() -> dict[str, Any]:
+    """每个红包连同份额与领取明细，逐个查询，管理面板请用 packet_stats。"""
+    data = _empty_data()
+    with _connection() as connection:
+        for row in connection.execute("SELECT * FROM red_packets ORDER BY rowid").fetchall():
+            data["packets"][row["id"]] = _packet_details(connection, _packet_from_row(row))
+    return data
+
+
 @_locked
+def save_data(data: dict[str, Any]) -> None:
+    """整体替换红包、份额和领取三张表。"""
+    with _connection() as connection:
+        sqlite_store.replace_blob_tables(connection, _BLOB_TABLES, _import_blob, data)
+
+
 def create_packet(
     *,
     guild_id: int,
@@ -125,127 +379,176 @@ def create_packet(
         "refunded": False,
     }
 
-    data = load_data()
-    data["packets"][packet_id] = packet
-    save_data(data)
+    with _connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        _insert_packet(connection, packet)
     return packet
 
 
-@_locked
 def set_packet_message(packet_id: str, message_id: int) -> None:
-    data = load_data()
-    packet = data["packets"].get(packet_id)
-    if not packet:
-        return
-    packet["message_id"] = str(message_id)
-    save_data(data)
+    with _connection() as connection:
+        connection.execute("UPDATE red_packets SET message_id=? WHERE id=?", (str(message_id), str(packet_id)))
 
 
 def get_packet(packet_id: str) -> dict[str, Any] | None:
-    data = load_data()
-    packet = data["packets"].get(packet_id)
-    return packet if isinstance(packet, dict) else None
+    with _connection() as connection:
+        row = connection.execute("SELECT * FROM red_packets WHERE id=?", (str(packet_id),)).fetchone()
+    return _packet_from_row(row) if row is not None else None
 
 
-@_locked
 def claim_packet(packet_id: str, user_id: int) -> dict[str, Any]:
-    data = load_data()
-    packet = data["packets"].get(packet_id)
-    if not isinstance(packet, dict):
-        return {"success": False, "reason": "not_found"}
-
-    if packet.get("sender_id") == str(user_id):
-        return {"success": False, "reason": "sender_blocked", "packet": packet}
-
-    if packet.get("status") != "active":
-        return {"success": False, "reason": packet.get("status", "closed"), "packet": packet}
-
-    if parse_time(packet.get("expires_at", "")) <= now_cn():
-        packet["status"] = "expired"
-        packet["remaining_amount"] = round_shells(packet.get("remaining_amount", 0))
-        packet["refund_amount"] = packet["remaining_amount"]
-        packet["expired_at"] = now_iso()
-        save_data(data)
-        return {"success": False, "reason": "expired", "packet": packet}
-
-    claims = packet.setdefault("claims", {})
-    if str(user_id) in claims:
-        return {
-            "success": False,
-            "reason": "already_claimed",
-            "amount": round_shells(claims[str(user_id)].get("amount", 0)),
-            "packet": packet,
-        }
+    uid = str(user_id)
+    with _connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        row = connection.execute("SELECT * FROM red_packets WHERE id=?", (str(packet_id),)).fetchone()
+        if row is None:
+            return {"success": False, "reason": "not_found"}
+        packet = _packet_from_row(row)
+
+        if row["sender_id"] == uid:
+            return {"success": False, "reason": "sender_blocked", "packet": packet}
+
+        if row["status"] != "active":
+            return {"success": False, "reason": row["status"] or "closed", "packet": packet}
+
+        if parse_time(row["expires_at"]) <= now_cn():
+            row = connection.execute(
+                """UPDATE red_packets SET status='expired', refund_units=remaining_units, expired_at=?
+                   WHERE id=? RETURNING *""",
+                (now_iso(), row["id"]),
+            ).fetchone()
+            return {"success": False, "reason": "expired", "packet": _packet_from_row(row)}
+
+        claimed = connection.execute(
+            "SELECT amount_units FROM red_packet_claims WHERE packet_id=? AND user_id=?", (row["id"], uid)
+        ).fetchone()
+        if claimed is not None:
+            return {
+                "success": False,
+                "reason": "already_claimed",
+                "amount": _from_units(claimed["amount_units"]),
+                "packet": packet,
+            }
+
+        allocation = connection.execute(_CLAIM_ALLOCATION_SQL, (uid, row["id"], row["id"])).fetchone()
+        if allocation is None:
+            row = connection.execute(
+                """UPDATE red_packets SET status='empty', remaining_units=0, remaining_count=0
+                   WHERE id=? RETURNING *""",
+                (row["id"],),
+            ).fetchone()
+            return {"success": False, "reason": "empty", "packet": _packet_from_row(row)}
+
+        units = int(allocation["amount_units"])
+        connection.execute(
+            """INSERT INTO red_packet_claims(packet_id, user_id, seq, amount_units, claimed_at)
+               VALUES (?, ?, ?, ?, ?)""",
+            (row["id"], uid, allocation["seq"], units, now_iso()),
+        )
+        row = connection.execute(
+            """UPDATE red_packets
+               SET remaining_units = MAX(0, remaining_units - ?),
+                   remaining_count = MAX(0, remaining_count - 1),
+                   status = CASE WHEN remaining_count <= 1 THEN 'empty' ELSE status END
+               WHERE id=? RETURNING *""",
+            (units, row["id"]),
+        ).fetchone()
+    return {"success": True, "amount": _from_units(units), "packet": _packet_from_row(row)}
 
-    allocations = packet.setdefault("allocations", [])
-    if not allocations:
-        packet["status"] = "empty"
-        packet["remaining_amount"] = 0.0
-        packet["remaining_count"] = 0
-        save_data(data)
-        return {"success": False, "reason": "empty", "packet": packet}
 
-    amount = round_shells(allocations.pop())
-    claims[str(user_id)] = {"amount": amount, "claimed_at": now_iso()}
-    packet["remaining_count"] = len(allocations)
-    packet["remaining_amount"] = round_shells(sum(round_shells(x) for x in allocations))
-    if not allocations:
-        packet["status"] = "empty"
-
-    save_data(data)
-    return {"success": True, "amount": amount, "packet": packet}
+def mark_packet_cancelled(packet_id: str) -> None:
+    with _connection() as connection:
+        connection.execute("UPDATE red_packets SET status='cancelled' WHERE id=?", (str(packet_id),))
 
 
-@_locked
-def mark_packet_cancelled(packet_id: str) -> None:
-    data = load_data()
-    packet = data["packets"].get(packet_id)
-    if not isinstance(packet, dict):
-        return
-    packet["status"] = "cancelled"
-    save_data(data)
+def next_expiry_ts() -> float | None:
+    """最早到期的进行中红包的时间戳；没有进行中的红包时返回 None。"""
+    with _connection() as connection:
+        row = connection.execute(
+            "SELECT MIN(expires_ts) AS due FROM red_packets WHERE status='active'"
+        ).fetchone()
+    return None if row["due"] is None else float(row["due"])
 
 
-@_locked
 def expire_due_packets() -> list[dict[str, Any]]:
-    data = load_data()
-    expired = []
-    changed = False
+    """把已到期的进行中红包标记为过期；只经由到期索引读取到期的那几行。"""
     now = now_cn()
-
-    for packet in data.get("packets", {}).values():
-        if not isinstance(packet, dict) or packet.get("status") != "active":
-            continue
-        if parse_time(packet.get("expires_at", "")) > now:
-            continue
-
-        packet["status"] = "expired"
-        refund_amount = round_shells(packet.get("remaining_amount", 0))
-        packet["refund_amount"] = refund_amount
-        packet["expired_at"] = now.isoformat(timespec="seconds")
-        expired.append(dict(packet))
-        changed = True
-
-    if changed:
-        save_data(data)
+    expired = []
+    with _connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        due = [
+            row["id"]
+            for row in connection.execute(
+                "SELECT id FROM red_packets WHERE status='active' AND expires_ts <= ? ORDER BY expires_ts",
+                (now.timestamp(),),
+            )
+        ]
+        for packet_id in due:
+            row = connection.execute(
+                """UPDATE red_packets SET status='expired', refund_units=remaining_units, expired_at=?
+                   WHERE id=? RETURNING *""",
+                (now.isoformat(timespec="seconds"), packet_id),
+            ).fetchone()
+            expired.append(_packet_from_row(row))
     return expired
 
 
-@_locked
-def mark_refunded(packet_id: str) -> None:
-    data = load_data()
-    packet = data["packets"].get(packet_id)
-    if not isinstance(packet, dict):
-        return
-    packet["refunded"] = True
-    packet["refunded_at"] = now_iso()
-    save_data(data)
+def get_unrefunded_expired_packets() -> list[dict[str, Any]]:
+    """已过期但还没完成退款处理的红包，例如退款前进程中断留下的。"""
+    with _connection() as connection:
+        return [
+            _packet_from_row(row)
+            for row in connection.execute(
+                "SELECT * FROM red_packets WHERE status='expired' AND refunded=0 ORDER BY expires_ts"
+            )
+        ]
+
+
+def mark_refunded(packet_id: str) -> bool:
+    """原子地认领退款处理权；已处理过时返回 False，避免重复退款。"""
+    with _connection() as connection:
+        return (
+            connection.execute(
+                "UPDATE red_packets SET refunded=1, refunded_at=? WHERE id=? AND refunded=0",
+                (now_iso(), str(packet_id)),
+            ).rowcount
+            > 0
+        )
+
+
+def unmark_refunded(packet_id: str) -> None:
+    """退款入账失败时撤销认领，留待下次重试。"""
+    with _connection() as connection:
+        connection.execute("UPDATE red_packets SET refunded=0, refunded_at='' WHERE id=?", (str(packet_id),))
 
 
 def get_active_packets() -> list[dict[str, Any]]:
-    data = load_data()
-    return [
-        packet
-        for packet in data.get("packets", {}).values()
-        if isinstance(packet, dict) and packet.get("status") == "active"
-    ]
+    with _connection() as connection:
+        return [
+            _packet_from_row(row)
+            for row in connection.execute("SELECT * FROM red_packets WHERE status='active' ORDER BY expires_ts")
+        ]
+
+
+def packet_stats() -> dict[str, Any]:
+    """管理面板用的汇总：只跑几条聚合查询，不组装每个红包的份额与领取明细。"""
+    with _connection() as connection:
+        status_counts = {
+            row["status"]: int(row["total"])
+            for row in connection.execute("SELECT status, COUNT(*) AS total FROM red_packets GROUP BY status")
+        }
+        totals = connection.execute(
+            """SELECT COALESCE(SUM(total_units), 0) AS total_units,
+                      COALESCE(SUM(remaining_units), 0) AS remaining_units,
+                      COALESCE(SUM(admin_free != 0), 0) AS admin_free
+               FROM red_packets"""
+        ).fetchone()
+        claims = connection.execute("SELECT COUNT(*) FROM red_packet_claims").fetchone()[0]
+    return {
+        "packets": sum(status_counts.values()),
+        "status_counts": status_counts,
+        "total_amount": _from_units(totals["total_units"]),
+        "remaining_amount": _from_units(totals["remaining_units"]),
+        "claims": int(claims),
+        "admin_free": int(totals["admin_free"]),
+    }
@@ -21,6 +21,12 @@ from .storage import (
     reconcile_cached_member_ownership,
 )
 
+# 归属以 on_member_update 增量补记为主，全量巡检只兜底离线期间漏掉的变化
+OWNERSHIP_SWEEP_HOURS = 24
+OWNERSHIP_SWEEP_CHUNK = 500
+OWNERSHIP_SWEEP_PAUSE_SECONDS = 0.5
+
+
 class RolesCog(commands.Cog):
     """负责自助身份组领取、通知订阅和相关管理命令。"""
 
@@ -50,18 +56,39 @@ class RolesCog(commands.Cog):
     def cog_unload(self):
         self.cached_ownership_reconcile.cancel()
 
-    @tasks.loop(hours=6)
+    @staticmethod
+    def _tracked_role_ids(role_data) -> set[int]:
+        return (
+            set(role_data.get("lottery_roles", []))
+            | set(role_data.get("redeem_roles", []))
+            | set(get_collection_reward_role_ids(role_data))
+        )
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        """成员新获得身份组时只补记这一位用户的归属行。"""
+        if after.bot:
+            return
+        gained = {role.id for role in after.roles} - {role.id for role in before.roles}
+        if not gained:
+            return
+        try:
+            role_data = await asyncio.to_thread(load_role_data)
+            matched = gained & self._tracked_role_ids(role_data)
+            if matched:
+                await asyncio.to_thread(reconcile_cached_member_ownership, {after.id: matched}, role_data)
+        except Exception as error:
+            # 漏记的归属会由低频全量巡检补上
+            print(f"[Roles] 成员身份组归属补记失败 user={after.id} error={error!r}")
+
+    @tasks.loop(hours=OWNERSHIP_SWEEP_HOURS)
     async def cached_ownership_reconcile(self):
-        """Silently import pre-existing collectible roles from the member cache."""
+        """Low-frequency safety sweep for roles gained while the bot was offline or events were missed."""
         try:
             role_data = await asyncio.to_thread(load_role_data)
         except Exception:
             return
-        relevant_ids = (
-            set(role_data.get("lottery_roles", []))
-            | set(role_data.get("redeem_roles", []))
-            | set(get_collection_reward_role_ids(role_data))
-        )
+        relevant_ids = self._tracked_role_ids(role_data)
         if not relevant_ids:
             return
 
@@ -78,13 +105,20 @@ class RolesCog(commands.Cog):
                 if scanned % 250 == 0:
                     # Pure cache work, but yield regularly so other bot events stay responsive.
                     await asyncio.sleep(0)
-
+                if len(member_roles) >= OWNERSHIP_SWEEP_CHUNK:
+                    await self._reconcile_sweep_chunk(member_roles, role_data)
+                    member_roles = {}
         if member_roles:
-            try:
-                await asyncio.to_thread(reconcile_cached_member_ownership, member_roles, role_data)
-            except Exception:
-                # This maintenance pass is intentionally silent and will retry next cycle.
-                return
+            await self._reconcile_sweep_chunk(member_roles, role_data)
+
+    async def _reconcile_sweep_chunk(self, member_roles: dict[int, set[int]], role_data) -> None:
+        try:
+            await asyncio.to_thread(reconcile_cached_member_ownership, member_roles, role_data)
+        except Exception:
+            # This maintenance pass is intentionally silent and will retry next cycle.
+            pass
+        # 分块之间让出写锁和事件循环
+        await asyncio.sleep(OWNERSHIP_SWEEP_PAUSE_SECONDS)
 
     @cached_ownership_reconcile.before_loop
     async def before_cached_ownership_reconcile(self):
@@ -0,0 +1,346 @@
+import random
+from collections import OrderedDict
+from typing import Hashable, Iterable
+
+from .storage import (
+    LOTTERY_KIND_COLOR,
+    LOTTERY_KIND_ICON,
+    LOTTERY_OUTCOME_EMPTY,
+    LOTTERY_OUTCOME_ROLE,
+    LOTTERY_OUTCOME_SHELLS,
+    RARITY_JUNK,
+    RARITY_LEGENDARY,
+    RARITY_NORMAL,
+    RARITY_RARE,
+)
+
+EMPTY_PITY_LIMIT = 5
+ROLE_PITY_LIMIT = 20
+LEGENDARY_PITY_LIMIT = 80
+
+OUTCOME_ORDER = (LOTTERY_OUTCOME_ROLE, LOTTERY_OUTCOME_SHELLS, LOTTERY_OUTCOME_EMPTY)
+_ROLE_INDEX, _SHELLS_INDEX, _EMPTY_INDEX = range(len(OUTCOME_ORDER))
+RARITY_ORDER = (RARITY_JUNK, RARITY_NORMAL, RARITY_RARE, RARITY_LEGENDARY)
+KIND_ORDER = (LOTTERY_KIND_COLOR, LOTTERY_KIND_ICON)
+DEFAULT_OUTCOME_WEIGHTS = (23, 32, 45)
+DEFAULT_RARITY_WEIGHTS = (52, 38, 7, 3)
+
+# 单次抽取中触发的保底规则
+PITY_EMPTY = "empty"
+PITY_ROLE = "role"
+PITY_LEGENDARY = "legendary"
+PITY_LEGENDARY_FALLBACK = "legendary_fallback"
+
+ENGINE_CACHE_SIZE = 16
+SIMULATION_BLOCK_SIZE = 4096
+_engine_cache: "OrderedDict[Hashable, LotteryEngine]" = OrderedDict()
+
+
+class AliasTable:
+    """Walker 别名表：O(n) 构建后每次按权重抽样只需一次随机数和一次比较。"""
+
+    __slots__ = ("size", "_prob", "_alias")
+
+    def __init__(self, weights: Iterable[float]):
+        weights = [max(0.0, float(w)) for w in weights]
+        total = sum(weights)
+        if not weights or total <= 0:
+            raise ValueError("别名表至少需要一个正权重")
+        self.size = len(weights)
+        scaled = [w * self.size / total for w in weights]
+        self._prob = [1.0] * self.size
+        self._alias = list(range(self.size))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self._prob[less] = scaled[less]
+            self._alias[less] = more
+            scaled[more] += scaled[less] - 1.0
+            (small if scaled[more] < 1.0 else large).append(more)
+        # 剩余项只差浮点误差，概率按 1 处理
+
+    def sample(self, rng=random) -> int:
+        u = rng.random() * self.size
+        index = min(int(u), self.size - 1)
+        return index if u - index < self._prob[index] else self._alias[index]
+
+    def sample_many(self, count: int, rng=random) -> list[int]:
+        size, prob, alias = self.size, self._prob, self._alias
+        last = size - 1
+        picks = []
+        append = picks.append
+        for u in (rng.random() * size for _ in range(max(0, int(count)))):
+            index = min(int(u), last)
+            append(index if u - index < prob[index] else alias[index])
+        return picks
+
+
+class PityState:
+    """三条保底计数；抽取结果按状态转移更新它们。"""
+
+    __slots__ = ("empty_streak", "no_role_streak", "no_legendary_streak")
+
+    def __init__(self, empty_streak: int = 0, no_role_streak: int = 0, no_legendary_streak: int = 0):
+        self.empty_streak = int(empty_streak)
+        self.no_role_streak = int(no_role_streak)
+        self.no_legendary_streak = int(no_legendary_streak)
+
+    @classmethod
+    def from_stats(cls, stats: dict) -> "PityState":
+        return cls(
+            stats.get("empty_streak", 0),
+            stats.get("no_role_streak", 0),
+            stats.get("no_legendary_streak", 0),
+        )
+
+
+class LotteryEngine:
+    """把一份抽奖配置和奖池编译成别名表，负责单抽与批量模拟。
+
+    奖池形如 {kind: {rarity: [item, ...]}}，item 可以是身份组 ID 或任意对象，
+    抽中时原样返回。稀有度只在有可抽内容的档位之间按权重抽取；抽中稀有度后
+    先等概率选分类，再等概率选身份组，与旧版逐抽重建列表的概率完全一致。
+    """
+
+    def __init__(
+        self,
+        lottery_config: dict,
+        pools_by_kind_rarity: dict,
+        *,
+        fallback_cost: float = 1.0,
+        fallback_refund: float = 1.0,
+    ):
+        cfg = lottery_config or {}
+        self.cost_single = max(0.1, float(cfg.get("cost_single", fallback_cost)))
+
+        outcome_cfg = cfg.get("outcome_weights", {})
+        outcome_weights = [max(0, int(outcome_cfg.get(outcome, 1))) for outcome in OUTCOME_ORDER]
+        if sum(outcome_weights) <= 0:
+            outcome_weights = list(DEFAULT_OUTCOME_WEIGHTS)
+        else:
+            # 身份结果必须保留最低权重，否则三星在硬保底前没有出现机会。
+            outcome_weights[0] = max(1, outcome_weights[0])
+        self.outcome_weights = tuple(outcome_weights)
+        self._outcome_table = AliasTable(outcome_weights)
+
+        self._pools: dict[int, tuple[tuple[str, tuple], ...]] = {}
+        for rarity in RARITY_ORDER:
+            kinds = tuple(
+                (kind, tuple(pools_by_kind_rarity.get(kind, {}).get(rarity, ())))
+                for kind in KIND_ORDER
+            )
+            self._pools[rarity] = tuple((kind, items) for kind, items in kinds if items)
+
+        weights_cfg = cfg.get("weights", {})
+        rarity_weights = [max(0, int(weights_cfg.get(str(r), 1))) for r in RARITY_ORDER]
+        if sum(rarity_weights) <= 0:
+            rarity_weights = list(DEFAULT_RARITY_WEIGHTS)
+        if self._pools[RARITY_LEGENDARY]:
+            legendary_index = RARITY_ORDER.index(RARITY_LEGENDARY)
+            rarity_weights[legendary_index] = max(1, rarity_weights[legendary_index])
+        self.rarity_weights = tuple(rarity_weights)
+
+        self._candidate_rarities = tuple(r for r in RARITY_ORDER if self._pools[r])
+        candidate_weights = [rarity_weights[RARITY_ORDER.index(r)] for r in self._candidate_rarities]
+        if self._candidate_rarities and sum(candidate_weights) <= 0:
+            candidate_weights = [1] * len(self._candidate_rarities)
+        self._rarity_table = AliasTable(candidate_weights) if self._candidate_rarities else None
+
+        shell_cfg = cfg.get("shell_reward", {})
+        shell_min = max(0.0, float(shell_cfg.get("min", 0.1)))
+        shell_max = max(shell_min, float(shell_cfg.get("max", 1.0)))
+        min_steps = int(round(shell_min * 10))
+        max_steps = max(min_steps, int(round(shell_max * 10)))
+        self._shell_values = tuple(round(step / 10, 1) for step in range(min_steps, max_steps + 1))
+        self._shell_table = AliasTable(
+            1 / ((step - min_steps + 1) ** 1.35) for step in range(min_steps, max_steps + 1)
+        )
+
+        refund_cfg = cfg.get("refund", {})
+        self.refunds = {r: max(0.0, float(refund_cfg.get(str(r), fallback_refund))) for r in RARITY_ORDER}
+
+    @property
+    def has_roles(self) -> bool:
+        return bool(self._candidate_rarities)
+
+    def _pick_from(self, rarity: int, rng) -> tuple:
+        kinds = self._pools[rarity]
+        kind, items = kinds[0] if len(kinds) == 1 else kinds[int(rng.random() * len(kinds))]
+        return items[int(rng.random() * len(items))], kind
+
+    def pick_role(self, rng=random, *, forced_rarity: int | None = None) -> tuple:
+        """返回 (item, rarity, kind)；没有可抽内容时返回 (None, 0, None)。"""
+        if forced_rarity is not None:
+            if not self._pools.get(forced_rarity):
+                return None, 0, None
+            item, kind = self._pick_from(forced_rarity, rng)
+            return item, forced_rarity, kind
+        if self._rarity_table is None:
+            return None, 0, None
+        rarity = self._candidate_rarities[self._rarity_table.sample(rng)]
+        item, kind = self._pick_from(rarity, rng)
+        return item, rarity, kind
+
+    def shell_reward(self, rng=random) -> float:
+        return self._shell_values[self._shell_table.sample(rng)]
+
+    def draw(self, state: PityState, rng=random) -> tuple[dict, list[str]]:
+        """抽一次并更新保底状态，返回 (结果, 触发的保底规则列表)。"""
+        notes = []
+        force_legendary = state.no_legendary_streak >= LEGENDARY_PITY_LIMIT - 1
+        force_role = force_legendary or state.no_role_streak >= ROLE_PITY_LIMIT - 1
+        if force_role:
+            outcome = LOTTERY_OUTCOME_ROLE
+            notes.append(PITY_LEGENDARY if force_legendary else PITY_ROLE)
+        else:
+            outcome = OUTCOME_ORDER[self._outcome_table.sample(rng)]
+            if outcome == LOTTERY_OUTCOME_EMPTY and state.empty_streak >= EMPTY_PITY_LIMIT - 1:
+                outcome = LOTTERY_OUTCOME_SHELLS
+                notes.append(PITY_EMPTY)
+
+        if outcome == LOTTERY_OUTCOME_EMPTY:
+            state.empty_streak += 1
+            state.no_role_streak += 1
+            state.no_legendary_streak += 1
+            return {"type": "empty"}, notes
+
+        if outcome == LOTTERY_OUTCOME_SHELLS:
+            state.empty_streak = 0
+            state.no_role_streak += 1
+            state.no_legendary_streak += 1
+            return {"type": "shells", "shell_reward": self.shell_reward(rng)}, notes
+
+        item, rarity, kind = self.pick_role(rng, forced_rarity=RARITY_LEGENDARY if force_legendary else None)
+        if item is None and force_legendary:
+            notes.append(PITY_LEGENDARY_FALLBACK)
+            item, rarity, kind = self.pick_role(rng)
+        if item is None:
+            state.empty_streak += 1
+            state.no_role_streak += 1
+            state.no_legendary_streak += 1
+            return {"type": "empty", "reason": "no_role"}, notes
+
+        state.empty_streak = 0
+        state.no_role_streak = 0
+        state.no_legendary_streak = 0 if rarity == RARITY_LEGENDARY else state.no_legendary_streak + 1
+        return {"type": "role", "item": item, "rarity": rarity, "kind": kind}, notes
+
+    def simulate(
+        self,
+        draws: int,
+        *,
+        state: PityState | None = None,
+        owned: Iterable = (),
+        rng: random.Random | None = None,
+        seed: int | None = None,
+    ) -> dict:
+        """模拟同一名用户连续抽 draws 次，统计掉率、保底触发与期望花费。
+
+        与逐次调用 draw 的状态转移相同，但随机下标用 sample_many 分块预抽，
+        省去每抽一次的方法调用与结果字典。
+        """
+        rng = rng or random.Random(seed)
+        state = state or PityState()
+        owned = set(owned)
+        draws = max(0, int(draws))
+        outcomes = {outcome: 0 for outcome in OUTCOME_ORDER}
+        rarity_hits = {rarity: 0 for rarity in RARITY_ORDER}
+        pity = {PITY_EMPTY: 0, PITY_ROLE: 0, PITY_LEGENDARY: 0, PITY_LEGENDARY_FALLBACK: 0}
+        new_roles = dupes = 0
+        shells = refunds = 0.0
+        empty_streak, no_role_streak, no_legendary_streak = (
+            state.empty_streak, state.no_role_streak, state.no_legendary_streak,
+        )
+        pools, candidates, shell_values = self._pools, self._candidate_rarities, self._shell_values
+        legendary_pool = bool(pools[RARITY_LEGENDARY])
+        remaining = draws
+        while remaining > 0:
+            # 结果、稀有度、蛋壳档位按块预抽，循环内只做保底状态转移
+            block = min(remaining, SIMULATION_BLOCK_SIZE)
+            remaining -= block
+            outcome_picks = self._outcome_table.sample_many(block, rng)
+            rarity_picks = self._rarity_table.sample_many(block, rng) if self._rarity_table else None
+            shell_picks = self._shell_table.sample_many(block, rng)
+            for i in range(block):
+                force_legendary = no_legendary_streak >= LEGENDARY_PITY_LIMIT - 1
+                if force_legendary or no_role_streak >= ROLE_PITY_LIMIT - 1:
+                    pity[PITY_LEGENDARY if force_legendary else PITY_ROLE] += 1
+                    outcome = _ROLE_INDEX
+                else:
+                    outcome = outcome_picks[i]
+                    if outcome == _EMPTY_INDEX and empty_streak >= EMPTY_PITY_LIMIT - 1:
+                        outcome = _SHELLS_INDEX
+                        pity[PITY_EMPTY] += 1
+
+                if outcome == _SHELLS_INDEX:
+                    outcomes[LOTTERY_OUTCOME_SHELLS] += 1
+                    shells += shell_values[shell_picks[i]]
+                    empty_streak = 0
+                    no_role_streak += 1
+                    no_legendary_streak += 1
+                    continue
+
+                rarity = None
+                if outcome == _ROLE_INDEX:
+                    if force_legendary and legendary_pool:
+                        rarity = RARITY_LEGENDARY
+                    else:
+                        if force_legendary:
+                            pity[PITY_LEGENDARY_FALLBACK] += 1
+                        if rarity_picks is not None:
+                            rarity = candidates[rarity_picks[i]]
+                if rarity is None:
+                    outcomes[LOTTERY_OUTCOME_EMPTY] += 1
+                    empty_streak += 1
+                    no_role_streak += 1
+                    no_legendary_streak += 1
+                    continue
+
+                item, _ = self._pick_from(rarity, rng)
+                outcomes[LOTTERY_OUTCOME_ROLE] += 1
+                rarity_hits[rarity] += 1
+                empty_streak = no_role_streak = 0
+                no_legendary_streak = 0 if rarity == RARITY_LEGENDARY else no_legendary_streak + 1
+                if item in owned:
+                    dupes += 1
+                    refunds += self.refunds[rarity]
+                else:
+                    owned.add(item)
+                    new_roles += 1
+        state.empty_streak, state.no_role_streak, state.no_legendary_streak = (
+            empty_streak, no_role_streak, no_legendary_streak,
+        )
+
+        cost = draws * self.cost_single
+        role_hits = outcomes[LOTTERY_OUTCOME_ROLE]
+        legendary_hits = rarity_hits[RARITY_LEGENDARY]
+        return {
+            "draws": draws,
+            "outcomes": outcomes,
+            "rarity_hits": rarity_hits,
+            "pity": pity,
+            "new_roles": new_roles,
+            "dupes": dupes,
+            "cost": round(cost, 1),
+            "shell_rewards": round(shells, 1),
+            "refunds": round(refunds, 1),
+            "net_cost": round(cost - shells - refunds, 1),
+            "role_rate": role_hits / draws if draws else 0.0,
+            "legendary_rate": legendary_hits / draws if draws else 0.0,
+            "cost_per_role": round(cost / role_hits, 2) if role_hits else None,
+            "cost_per_legendary": round(cost / legendary_hits, 2) if legendary_hits else None,
+        }
+
+
+def get_engine(cache_key: Hashable, lottery_config: dict, pools_by_kind_rarity: dict, **options) -> LotteryEngine:
+    """按配置版本与可用奖池缓存编译好的引擎；配置、奖池或兜底参数变化时 cache_key 随之改变。"""
+    engine = _engine_cache.get(cache_key)
+    if engine is not None:
+        _engine_cache.move_to_end(cache_key)
+        return engine
+    engine = LotteryEngine(lottery_config, pools_by_kind_rarity, **options)
+    _engine_cache[cache_key] = engine
+    while len(_engine_cache) > ENGINE_CACHE_SIZE:
+        _engine_cache.popitem(last=False)
+    return engine
@@ -0,0 +1,167 @@
+import random
+
+from cogs.points.storage import (
+    get_user_points_in,
+    modify_user_points_in,
+    points_write_transaction,
+    spend_user_points_in,
+)
+from cogs.shared import sqlite_store
+
+from . import storage as role_storage
+from .lottery_engine import LotteryEngine, PityState
+
+COLLECTION_REWARDS_NAMESPACE = "role_collection_rewards"
+_collection_claims_ready = False
+
+
+def _ensure_settlement_storage() -> None:
+    global _collection_claims_ready
+    role_storage.initialize_role_state_storage()
+    sqlite_store.initialize_app_state_storage()
+    if not _collection_claims_ready:
+        # 首次读取会把旧版领取记录 JSON 导入 app_state，结算事务里只读库内记录
+        role_storage.load_collection_reward_claims()
+        _collection_claims_ready = True
+
+
+def _claim_collection_rewards_in(connection, user_id: int, guild_id: int, owned: set[int], role_data: dict) -> list[dict]:
+    """图鉴奖励的领取、发蛋壳和奖励身份组入藏，与抽奖写入同一事务。"""
+    cfg = role_storage.get_collection_config(role_data)
+    pool_ids = set(role_data.get("lottery_roles", []))
+    claims = sqlite_store.read_json_namespace_in(connection, COLLECTION_REWARDS_NAMESPACE, {})
+    if not isinstance(claims, dict):
+        claims = {}
+    record = claims.get(str(user_id))
+    if not isinstance(record, dict):
+        record = claims[str(user_id)] = {"groups": [], "full": False}
+
+    all_rewards = []
+    # 奖励身份组本身可能又凑齐另一个系列
+    for _ in range(len(cfg.get("groups", [])) + 2):
+        rewards = role_storage._claim_rewards_in_record(record, cfg, pool_ids, owned)
+        if not rewards:
+            break
+        all_rewards.extend(rewards)
+        for reward in rewards:
+            shells = float(reward.get("reward_shells", 0) or 0)
+            if shells > 0:
+                modify_user_points_in(
+                    connection, user_id, shells, guild_id,
+                    source="role_collection_reward", reason=reward.get("key", "collection"),
+                )
+            reward_role_id = int(reward.get("reward_role_id", 0) or 0)
+            if reward_role_id:
+                owned.add(reward_role_id)
+    if all_rewards:
+        sqlite_store.save_json_namespace_in(connection, COLLECTION_REWARDS_NAMESPACE, claims)
+    return all_rewards
+
+
+def settle_lottery_draw(
+    user_id: int,
+    guild_id: int,
+    *,
+    engine: LotteryEngine,
+    draw_count: int,
+    cost: float,
+    role_data: dict,
+    drawn_at: str,
+    rng=random,
+) -> dict:
+    """在一次工作线程调用里完成整次抽奖结算。
+
+    蛋壳库 ATTACH 身份组状态库与 app_state，扣费、抽取、入藏、重复返还、蛋壳奖励、
+    图鉴奖励和战报统计在同一个事务里提交；任何一步失败都整体回滚，不会出现扣了费却
+    没有记录结果的情况。余额不足时返回 spend 的失败结果且不写入任何内容。
+    """
+    _ensure_settlement_storage()
+    reason = f"draw_count={draw_count}"
+    attach = {
+        "role_state": role_storage.ROLE_STATE_DB_FILE,
+        "app_state": sqlite_store.APP_STATE_DB_FILE,
+    }
+    with (
+        role_storage._collection_reward_lock,
+        role_storage._ownership_lock,
+        role_storage._lottery_stats_lock,
+        role_storage._role_state_write_lock,
+        points_write_transaction(attach) as connection,
+    ):
+        spend = spend_user_points_in(connection, user_id, cost, guild_id, source="role_lottery", reason=reason)
+        if not spend.get("success"):
+            return spend
+
+        owned_before = set(role_storage._uniq_ids(role_storage._db_get_role_state(connection, "collections", user_id, [])))
+        owned = set(owned_before)
+        stats_key = role_storage._make_lottery_user_key(user_id, guild_id)
+        stats = role_storage._normalize_lottery_stats(
+            role_storage._db_get_role_state(connection, "lottery_stats", stats_key, {})
+        )
+        pity_state = PityState.from_stats(stats)
+
+        results, pity_notes, granted_role_ids = [], [], []
+        total_refund = total_shell_reward = 0.0
+        for _ in range(draw_count):
+            drawn, notes = engine.draw(pity_state, rng)
+            pity_notes.extend(notes)
+            if drawn["type"] == "role":
+                role_id, rarity = drawn["item"], drawn["rarity"]
+                dupe = role_id in owned
+                refund = engine.refunds[rarity] if dupe else 0
+                total_refund += refund
+                if not dupe:
+                    owned.add(role_id)
+                    granted_role_ids.append(role_id)
+                results.append({
+                    "type": "role", "role_id": role_id, "rarity": rarity, "kind": drawn["kind"],
+                    "dupe": dupe, "refund": refund, "shell_reward": 0,
+                })
+            elif drawn["type"] == "shells":
+                total_shell_reward += drawn["shell_reward"]
+                results.append({
+                    "type": "shells", "role_id": None, "rarity": 0, "dupe": False, "refund": 0,
+                    "shell_reward": drawn["shell_reward"],
+                })
+            else:
+                results.append({
+                    "type": "empty", "role_id": None, "rarity": 0, "dupe": False, "refund": 0,
+                    "shell_reward": 0, **drawn,
+                })
+
+        if total_refund > 0:
+            modify_user_points_in(
+                connection, user_id, total_refund, guild_id, source="role_lottery_refund", reason=reason
+            )
+        if total_shell_reward > 0:
+            modify_user_points_in(
+                connection, user_id, total_shell_reward, guild_id, source="role_lottery_shell_reward", reason=reason
+            )
+        collection_rewards = _claim_collection_rewards_in(connection, user_id, guild_id, owned, role_data)
+        if owned != owned_before:
+            role_storage._db_put_role_state(connection, "collections", user_id, sorted(owned))
+
+        stats = role_storage._apply_lottery_results(
+            stats,
+            results,
+            spent_shells=cost,
+            refund_shells=total_refund,
+            reward_shells=total_shell_reward,
+            drawn_at=drawn_at,
+        )
+        role_storage._db_put_role_state(connection, "lottery_stats", stats_key, stats)
+        balance = get_user_points_in(connection, user_id, guild_id)
+
+    return {
+        "success": True,
+        "cost": spend["cost"],
+        "balance": balance,
+        "results": results,
+        "pity_notes": pity_notes,
+        "granted_role_ids": granted_role_ids,
+        "refund_shells": round(total_refund, 1),
+        "reward_shells": round(total_shell_reward, 1),
+        "collection_rewards": collection_rewards,
+        "collection_ids": sorted(owned),
+        "stats": stats,
+    }
@@ -2,13 +2,13 @@
 
 import json
 import os
-import copy
-import sqlite3
 import threading
+import time
 import uuid
 from contextlib import contextmanager
 from typing import Dict, List
 
+from cogs.shared.sqlite_pool import pooled_connection
 from cogs.shared.sqlite_store import load_json_namespace, save_json_namespace
 
 ROLES_DATA_FILE = "data/general_roles.json"
@@ -23,8 +23,13 @@ _ownership_lock = threading.RLock()
 _lottery_stats_lock = threading.RLock()
 _role_state_write_lock = threading.RLock()
 _role_data_lock = threading.RLock()
-_role_data_cache: dict | None = None
-_role_data_cache_mtime_ns = -1
+# 配置快照在进程内共享、只读；最多每隔这么久才 stat 一次文件以感知手工改动
+ROLE_DATA_STAT_INTERVAL = 2.0
+_role_snapshot: "RoleConfigSnapshot | None" = None
+_role_snapshot_path = ""
+_role_snapshot_mtime_ns = -1
+_role_snapshot_checked_at = 0.0
+_role_snapshot_version = 0
 _role_state_ready = False
 
 RARITY_NORMAL = 1
@@ -309,29 +314,147 @@ def _normalize_role_data(data: dict) -> dict:
     }
 
 # --- 身份组配置数据 ---
-def load_role_data():
-    """读取低频变更的奖池配置，并按文件 mtime 缓存规范化结果。"""
-    global _role_data_cache, _role_data_cache_mtime_ns
+def _readonly(self, *args, **kwargs):
+    raise TypeError("身份组配置快照是只读的，修改请使用 load_role_data_for_update()")
+
+
+class _FrozenDict(dict):
+    """只读 dict：读取接口与 dict 完全一致，任何原地修改都会直接报错。"""
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    setdefault = pop = popitem = clear = update = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return _thaw(self)
+
+    def __reduce__(self):
+        return (dict, (_thaw(self),))
+
+
+class _FrozenList(list):
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = remove = pop = clear = sort = reverse = _readonly
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return _thaw(self)
+
+    def __reduce__(self):
+        return (list, (_thaw(self),))
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return _FrozenDict((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return _FrozenList(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, dict):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_thaw(item) for item in value]
+    return value
+
+
+class RoleConfigSnapshot(_FrozenDict):
+    """规范化后的奖池配置快照，附带预先算好的派生索引。
+
+    快照在所有调用方之间共享、不可修改；保存配置时整体换成一个新版本的快照，
+    已经拿到旧快照的调用方仍看到一致的旧数据。
+    """
+
+    __slots__ = (
+        "version",
+        "role_rarity",
+        "role_kind",
+        "rarity_pools",
+        "kind_rarity_pools",
+        "redeem_prices",
+        "lottery_config",
+        "collection_config",
+        "collection_groups",
+        "collection_reward_role_ids",
+    )
+
+    def __init__(self, normalized: dict, version: int):
+        super().__init__((key, _freeze(value)) for key, value in normalized.items())
+        self.version = version
+        role_meta = self["lottery_role_meta"]
+        self.role_rarity = {rid: role_meta[str(rid)]["rarity"] for rid in self["lottery_roles"]}
+        self.role_kind = {rid: role_meta[str(rid)]["kind"] for rid in self["lottery_roles"]}
+        pools = {kind: {r: [] for r in SUPPORTED_RARITIES} for kind in SUPPORTED_LOTTERY_KINDS}
+        for rid in self["lottery_roles"]:
+            pools[self.role_kind[rid]][self.role_rarity[rid]].append(rid)
+        self.kind_rarity_pools = _freeze(pools)
+        self.rarity_pools = _freeze(
+            {r: [rid for rid in self["lottery_roles"] if self.role_rarity[rid] == r] for r in SUPPORTED_RARITIES}
+        )
+        self.redeem_prices = _FrozenDict((rid, self["redeem_role_meta"][str(rid)]) for rid in self["redeem_roles"])
+        self.lottery_config = self["lottery_config"]
+        self.collection_config = self["collection_config"]
+        self.collection_groups = self.collection_config["groups"]
+        reward_ids = [group.get("reward_role_id", 0) for group in self.collection_groups]
+        reward_ids.append(self.collection_config["full_reward"].get("reward_role_id", 0))
+        self.collection_reward_role_ids = tuple(rid for rid in _uniq_ids(reward_ids) if rid > 0)
+
+
+def _install_role_snapshot(normalized: dict, mtime_ns: int) -> "RoleConfigSnapshot":
+    # 调用方需持有 _role_data_lock
+    global _role_snapshot, _role_snapshot_path, _role_snapshot_mtime_ns
+    global _role_snapshot_checked_at, _role_snapshot_version
+    _role_snapshot_version += 1
+    snapshot = RoleConfigSnapshot(normalized, _role_snapshot_version)
+    _role_snapshot_path = ROLES_DATA_FILE
+    _role_snapshot_mtime_ns = mtime_ns
+    _role_snapshot_checked_at = time.monotonic()
+    _role_snapshot = snapshot
+    return snapshot
+
+
+def load_role_data() -> RoleConfigSnapshot:
+    """返回共享的只读配置快照；不复制，文件改动最迟 ROLE_DATA_STAT_INTERVAL 秒后生效。"""
+    global _role_snapshot_checked_at
+    snapshot = _role_snapshot
+    if (
+        snapshot is not None
+        and _role_snapshot_path == ROLES_DATA_FILE
+        and time.monotonic() - _role_snapshot_checked_at < ROLE_DATA_STAT_INTERVAL
+    ):
+        return snapshot
     with _role_data_lock:
         try:
             mtime_ns = os.stat(ROLES_DATA_FILE).st_mtime_ns
         except OSError:
             mtime_ns = -1
-        if _role_data_cache is not None and mtime_ns == _role_data_cache_mtime_ns:
-            return copy.deepcopy(_role_data_cache)
+        snapshot = _role_snapshot
+        if snapshot is not None and _role_snapshot_path == ROLES_DATA_FILE and mtime_ns == _role_snapshot_mtime_ns:
+            _role_snapshot_checked_at = time.monotonic()
+            return snapshot
         try:
             with open(ROLES_DATA_FILE, "r", encoding="utf-8") as file:
                 normalized = _normalize_role_data(json.load(file))
         except (OSError, json.JSONDecodeError):
             normalized = _normalize_role_data({})
-        _role_data_cache = normalized
-        _role_data_cache_mtime_ns = mtime_ns
-        return copy.deepcopy(normalized)
+        return _install_role_snapshot(normalized, mtime_ns)
+
 
+def load_role_data_for_update() -> dict:
+    """返回当前配置的可写深拷贝，改完后交给 save_role_data。"""
+    return _thaw(load_role_data())
 
-def save_role_data(data):
-    """保存身份组配置文件。"""
-    global _role_data_cache, _role_data_cache_mtime_ns
+
+def save_role_data(data) -> RoleConfigSnapshot:
+    """保存身份组配置文件，并以新版本快照替换共享快照（写时复制）。"""
     normalized = _normalize_role_data(data)
     with _role_data_lock:
         os.makedirs(os.path.dirname(ROLES_DATA_FILE), exist_ok=True)
@@ -341,12 +464,25 @@ def save_role_data(data):
             file.flush()
             os.fsync(file.fileno())
         os.replace(temp_file, ROLES_DATA_FILE)
-        _role_data_cache = normalized
-        _role_data_cache_mtime_ns = os.stat(ROLES_DATA_FILE).st_mtime_ns
+        return _install_role_snapshot(normalized, os.stat(ROLES_DATA_FILE).st_mtime_ns)
+
+
+def update_role_data(mutator) -> RoleConfigSnapshot:
+    """在锁内基于最新快照的可写副本执行 mutator 并保存，避免并发修改互相覆盖。
+
+    mutator 返回 False 时放弃保存，原样返回当前快照。
+    """
+    with _role_data_lock:
+        data = load_role_data_for_update()
+        if mutator(data) is False:
+            return load_role_data()
+        return save_role_data(data)
 
 
 def get_lottery_role_rarity(role_id: int, role_data: dict | None = None) -> int:
     data = role_data if role_data is not None else load_role_data()
+    if isinstance(data, RoleConfigSnapshot):
+        return data.role_rarity.get(int(role_id), RARITY_NORMAL)
     meta = data.get("lottery_role_meta", {})
     rarity = int(meta.get(str(role_id), {}).get("rarity", RARITY_NORMAL))
     return rarity if rarity in SUPPORTED_RARITIES else RARITY_NORMAL
@@ -354,6 +490,8 @@ def get_lottery_role_rarity(role_id: int, role_data: dict | None = None) -> int:
 
 def get_lottery_role_kind(role_id: int, role_data: dict | None = None) -> str:
     data = role_data if role_data is not None else load_role_data()
+    if isinstance(data, RoleConfigSnapshot):
+        return data.role_kind.get(int(role_id), LOTTERY_KIND_COLOR)
     meta = data.get("lottery_role_meta", {})
     kind = str(meta.get(str(role_id), {}).get("kind", LOTTERY_KIND_COLOR))
     return kind if kind in SUPPORTED_LOTTERY_KINDS else LOTTERY_KIND_COLOR
@@ -361,6 +499,8 @@ def get_lottery_role_kind(role_id: int, role_data: dict | None = None) -> str:
 
 def get_lottery_pools_by_rarity(role_data: dict | None = None) -> Dict[int, List[int]]:
     data = role_data if role_data is not None else load_role_data()
+    if isinstance(data, RoleConfigSnapshot):
+        return data.rarity_pools
     pools = {r: [] for r in SUPPORTED_RARITIES}
     for rid in data.get("lottery_roles", []):
         rarity = get_lottery_role_rarity(rid, data)
@@ -370,6 +510,8 @@ def get_lottery_pools_by_rarity(role_data: dict | None = None) -> Dict[int, List
 
 def get_lottery_pools_by_kind_and_rarity(role_data: dict | None = None) -> Dict[str, Dict[int, List[int]]]:
     data = role_data if role_data is not None else load_role_data()
+    if isinstance(data, RoleConfigSnapshot):
+        return data.kind_rarity_pools
     pools = {
         LOTTERY_KIND_COLOR: {r: [] for r in SUPPORTED_RARITIES},
         LOTTERY_KIND_ICON: {r: [] for r in SUPPORTED_RARITIES},
@@ -382,13 +524,19 @@ def get_lottery_pools_by_kind_and_rarity(role_data: dict | None = None) -> Dict[
 
 
 def get_lottery_config(role_data: dict | None = None) -> dict:
+    """返回可写的抽奖配置副本；只读场景可直接用快照的 lottery_config。"""
     data = role_data if role_data is not None else load_role_data()
+    if isinstance(data, RoleConfigSnapshot):
+        return _thaw(data.lottery_config)
     cfg = data.get("lottery_config", DEFAULT_LOTTERY_CONFIG)
     return _normalize_role_data({"lottery_config": cfg}).get("lottery_config", DEFAULT_LOTTERY_CONFIG)
 
 
 def get_redeem_role_config(role_id: int, role_data: dict | None = None) -> dict:
     data = role_data if role_data is not None else load_role_data()
+    if isinstance(data, RoleConfigSnapshot):
+        meta = data.redeem_prices.get(int(role_id))
+        return dict(meta) if meta is not None else _normalize_redeem_role_config({})
     meta = data.get("redeem_role_meta", {})
     return _normalize_redeem_role_config(meta.get(str(role_id), {}) if isinstance(meta, dict) else {})
 
@@ -402,55 +550,55 @@ def set_redeem_role_config(
     discount_start: str = "",
     discount_end: str = "",
 ) -> bool:
-    data = load_role_data()
-    if role_id not in data.get("redeem_roles", []):
-        return False
-
-    data.setdefault("redeem_role_meta", {})[str(role_id)] = _normalize_redeem_role_config(
-        {
-            "price": price,
-            "sale_mode": sale_mode,
-            "discount_price": discount_price,
-            "discount_start": discount_start,
-            "discount_end": discount_end,
-        }
-    )
-    save_role_data(data)
-    return True
+    def apply(data: dict) -> bool:
+        if role_id not in data.get("redeem_roles", []):
+            return False
+        data.setdefault("redeem_role_meta", {})[str(role_id)] = _normalize_redeem_role_config(
+            {
+                "price": price,
+                "sale_mode": sale_mode,
+                "discount_price": discount_price,
+                "discount_start": discount_start,
+                "discount_end": discount_end,
+            }
+        )
+        return True
+
+    return role_id in update_role_data(apply).redeem_prices
 
 
 def set_lottery_role_rarity(role_id: int, rarity: int) -> bool:
     if rarity not in SUPPORTED_RARITIES:
         return False
 
-    data = load_role_data()
-    if role_id not in data.get("lottery_roles", []):
-        return False
+    def apply(data: dict) -> bool:
+        if role_id not in data.get("lottery_roles", []):
+            return False
+        current = data.setdefault("lottery_role_meta", {}).get(str(role_id), {})
+        kind = str(current.get("kind", LOTTERY_KIND_COLOR))
+        if kind not in SUPPORTED_LOTTERY_KINDS:
+            kind = LOTTERY_KIND_COLOR
+        data["lottery_role_meta"][str(role_id)] = {"rarity": rarity, "kind": kind}
+        return True
 
-    current = data.setdefault("lottery_role_meta", {}).get(str(role_id), {})
-    kind = str(current.get("kind", LOTTERY_KIND_COLOR))
-    if kind not in SUPPORTED_LOTTERY_KINDS:
-        kind = LOTTERY_KIND_COLOR
-    data.setdefault("lottery_role_meta", {})[str(role_id)] = {"rarity": rarity, "kind": kind}
-    save_role_data(data)
-    return True
+    return update_role_data(apply).role_rarity.get(role_id) == rarity
 
 
 def set_lottery_role_kind(role_id: int, kind: str) -> bool:
     if kind not in SUPPORTED_LOTTERY_KINDS:
         return False
 
-    data = load_role_data()
-    if role_id not in data.get("lottery_roles", []):
-        return False
+    def apply(data: dict) -> bool:
+        if role_id not in data.get("lottery_roles", []):
+            return False
+        current = data.setdefault("lottery_role_meta", {}).get(str(role_id), {})
+        rarity = int(current.get("rarity", RARITY_NORMAL))
+        if rarity not in SUPPORTED_RARITIES:
+            rarity = RARITY_NORMAL
+        data["lottery_role_meta"][str(role_id)] = {"rarity": rarity, "kind": kind}
+        return True
 
-    current = data.setdefault("lottery_role_meta", {}).get(str(role_id), {})
-    rarity = int(current.get("rarity", RARITY_NORMAL))
-    if rarity not in SUPPORTED_RARITIES:
-        rarity = RARITY_NORMAL
-    data.setdefault("lottery_role_meta", {})[str(role_id)] = {"rarity": rarity, "kind": kind}
-    save_role_data(data)
-    return True
+    return update_role_data(apply).role_kind.get(role_id) == kind
 
 
 def update_lottery_config(
@@ -463,55 +611,62 @@ def update_lottery_config(
     shell_reward: dict | None = None,
     refund: dict | None = None,
 ) -> dict:
-    data = load_role_data()
-    cfg = get_lottery_config(data)
-
-    if cost_single is not None:
-        cfg["cost_single"] = round(max(0.1, float(cost_single)), 1)
-    if cost_five is not None:
-        cfg["cost_five"] = round(max(cfg["cost_single"], float(cost_five)), 1)
-    if cost_ten is not None:
-        cfg["cost_ten"] = round(max(cfg.get("cost_five", cfg["cost_single"]), float(cost_ten)), 1)
-
-    if isinstance(weights, dict):
-        for rarity in SUPPORTED_RARITIES:
-            key = str(rarity)
-            if key in weights:
-                cfg["weights"][key] = max(0, int(weights[key]))
-
-    if isinstance(outcome_weights, dict):
-        for outcome in SUPPORTED_LOTTERY_OUTCOMES:
-            if outcome in outcome_weights:
-                cfg["outcome_weights"][outcome] = max(0, int(outcome_weights[outcome]))
-
-    if isinstance(shell_reward, dict):
-        cfg["shell_reward"] = _normalize_shell_reward(shell_reward)
-
-    if isinstance(refund, dict):
-        for rarity in SUPPORTED_RARITIES:
-            key = str(rarity)
-            if key in refund:
-                cfg["refund"][key] = round(max(0.0, float(refund[key])), 1)
-
-    data["lottery_config"] = cfg
-    save_role_data(data)
+    with _role_data_lock:
+        data = load_role_data_for_update()
+        cfg = get_lottery_config(data)
+
+        if cost_single is not None:
+            cfg["cost_single"] = round(max(0.1, float(cost_single)), 1)
+        if cost_five is not None:
+            cfg["cost_five"] = round(max(cfg["cost_single"], float(cost_five)), 1)
+        if cost_ten is not None:
+            cfg["cost_ten"] = round(max(cfg.get("cost_five", cfg["cost_single"]), float(cost_ten)), 1)
+
+        if isinstance(weights, dict):
+            for rarity in SUPPORTED_RARITIES:
+                key = str(rarity)
+                if key in weights:
+                    cfg["weights"][key] = max(0, int(weights[key]))
+
+        if isinstance(outcome_weights, dict):
+            for outcome in SUPPORTED_LOTTERY_OUTCOMES:
+                if outcome in outcome_weights:
+                    cfg["outcome_weights"][outcome] = max(0, int(outcome_weights[outcome]))
+
+        if isinstance(shell_reward, dict):
+            cfg["shell_reward"] = _normalize_shell_reward(shell_reward)
+
+        if isinstance(refund, dict):
+            for rarity in SUPPORTED_RARITIES:
+                key = str(rarity)
+                if key in refund:
+                    cfg["refund"][key] = round(max(0.0, float(refund[key])), 1)
+
+        data["lottery_config"] = cfg
+        save_role_data(data)
     return cfg
 
 
 def get_collection_config(role_data: dict | None = None) -> dict:
+    """返回可写的图鉴配置副本；只读场景可直接用快照的 collection_config。"""
     data = role_data if role_data is not None else load_role_data()
+    if isinstance(data, RoleConfigSnapshot):
+        return _thaw(data.collection_config)
     return _normalize_collection_config(data.get("collection_config"), data.get("lottery_roles", []))
 
 
 def save_collection_config(config_data: dict) -> dict:
-    data = load_role_data()
-    data["collection_config"] = _normalize_collection_config(config_data, data.get("lottery_roles", []))
-    save_role_data(data)
-    return data["collection_config"]
+    def apply(data: dict) -> None:
+        data["collection_config"] = _normalize_collection_config(config_data, data.get("lottery_roles", []))
+
+    return _thaw(update_role_data(apply).collection_config)
 
 
 def get_collection_reward_role_ids(role_data: dict | None = None) -> list[int]:
-    cfg = get_collection_config(role_data)
+    data = role_data if role_data is not None else load_role_data()
+    if isinstance(data, RoleConfigSnapshot):
+        return list(data.collection_reward_role_ids)
+    cfg = get_collection_config(data)
     ids = [g.get("reward_role_id", 0) for g in cfg.get("groups", [])]
     ids.append(cfg.get("full_reward", {}).get("reward_role_id", 0))
     return [rid for rid in _uniq_ids(ids) if rid > 0]
@@ -531,28 +686,35 @@ def _save_collection_reward_claims(data: dict) -> None:
     save_json_namespace("role_collection_rewards", data)
 
 
+def _claim_rewards_in_record(record: dict, cfg: dict, pool_ids: set[int], owned: set[int]) -> list[dict]:
+    """在一个用户的领取记录上标记新达成的成就，返回本次可发放的奖励。"""
+    eligible = []
+    claimed = set(str(v) for v in record.get("groups", []))
+    for group in cfg.get("groups", []):
+        required = set(group.get("role_ids", [])) & pool_ids
+        group_id = str(group.get("id", ""))
+        has_reward = float(group.get("reward_shells", 0) or 0) > 0 or int(group.get("reward_role_id", 0) or 0) > 0
+        if required and required <= owned and has_reward and group_id not in claimed:
+            eligible.append({"key": f"group:{group_id}", **group})
+            claimed.add(group_id)
+    record["groups"] = sorted(claimed)
+    full_reward = cfg.get("full_reward", {})
+    has_full_reward = float(full_reward.get("reward_shells", 0) or 0) > 0 or int(full_reward.get("reward_role_id", 0) or 0) > 0
+    if pool_ids and pool_ids <= owned and has_full_reward and not record.get("full", False):
+        eligible.append({"key": "full", **full_reward})
+        record["full"] = True
+    return eligible
+
+
 def claim_completed_collection_rewards(user_id: int, owned_role_ids, role_data: dict | None = None) -> list[dict]:
     """Reserve newly completed achievements atomically; each reward is returned once."""
     data = role_data if role_data is not None else load_role_data()
     cfg = get_collection_config(data)
-    owned, pool_ids, eligible = set(_uniq_ids(owned_role_ids)), set(data.get("lottery_roles", [])), []
+    owned, pool_ids = set(_uniq_ids(owned_role_ids)), set(data.get("lottery_roles", []))
     with _collection_reward_lock:
         claims = load_collection_reward_claims()
         record = claims.setdefault(str(user_id), {"groups": [], "full": False})
-        claimed = set(str(v) for v in record.get("groups", []))
-        for group in cfg.get("groups", []):
-            required = set(group.get("role_ids", [])) & pool_ids
-            group_id = str(group.get("id", ""))
-            has_reward = float(group.get("reward_shells", 0) or 0) > 0 or int(group.get("reward_role_id", 0) or 0) > 0
-            if required and required <= owned and has_reward and group_id not in claimed:
-                eligible.append({"key": f"group:{group_id}", **group})
-                claimed.add(group_id)
-        record["groups"] = sorted(claimed)
-        full_reward = cfg.get("full_reward", {})
-        has_full_reward = float(full_reward.get("reward_shells", 0) or 0) > 0 or int(full_reward.get("reward_role_id", 0) or 0) > 0
-        if pool_ids and pool_ids <= owned and has_full_reward and not record.get("full", False):
-            eligible.append({"key": "full", **full_reward})
-            record["full"] = True
+        eligible = _claim_rewards_in_record(record, cfg, pool_ids, owned)
         if eligible:
             _save_collection_reward_claims(claims)
     return eligible
@@ -562,23 +724,10 @@ def get_collection_reward_claim_status(user_id: int) -> dict:
     return load_collection_reward_claims().get(str(user_id), {"groups": [], "full": False})
 
 
-def _connect_role_state_db() -> sqlite3.Connection:
-    os.makedirs(os.path.dirname(ROLE_STATE_DB_FILE), exist_ok=True)
-    connection = sqlite3.connect(ROLE_STATE_DB_FILE, timeout=30)
-    connection.row_factory = sqlite3.Row
-    connection.execute("PRAGMA synchronous=NORMAL")
-    connection.execute("PRAGMA busy_timeout=30000")
-    return connection
-
-
 @contextmanager
 def _role_state_connection():
-    connection = _connect_role_state_db()
-    try:
-        with connection:
-            yield connection
-    finally:
-        connection.close()
+    with pooled_connection(ROLE_STATE_DB_FILE) as connection:
+        yield connection
 
 
 def _read_json_dict(path: str) -> dict:
@@ -647,6 +796,49 @@ def initialize_role_state_storage() -> None:
     _ensure_role_state_db()
 
 
+def _db_get_role_state(connection, namespace: str, user_key: str, default=None):
+    row = connection.execute(
+        "SELECT data FROM role_user_state WHERE namespace=? AND user_key=?", (namespace, str(user_key))
+    ).fetchone()
+    return json.loads(row[0]) if row else default
+
+
+_UPSERT_ROLE_STATE_SQL = """INSERT INTO role_user_state(namespace, user_key, data) VALUES (?, ?, ?)
+    ON CONFLICT(namespace, user_key) DO UPDATE SET data=excluded.data"""
+
+
+def _dump_role_state(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _db_put_role_state(connection, namespace: str, user_key: str, value) -> None:
+    connection.execute(_UPSERT_ROLE_STATE_SQL, (namespace, str(user_key), _dump_role_state(value)))
+
+
+# 单条 IN 查询里最多放的用户数，远低于 SQLite 默认的变量上限
+_ROLE_STATE_QUERY_CHUNK = 400
+
+
+def _db_get_role_state_texts(connection, namespace: str, user_keys) -> dict[str, str]:
+    """按用户批量读取某个命名空间的原始 JSON 文本，只查给定用户。"""
+    keys = [str(key) for key in user_keys]
+    found = {}
+    for start in range(0, len(keys), _ROLE_STATE_QUERY_CHUNK):
+        chunk = keys[start : start + _ROLE_STATE_QUERY_CHUNK]
+        placeholders = ", ".join("?" for _ in chunk)
+        found.update(
+            connection.execute(
+                f"SELECT user_key, data FROM role_user_state WHERE namespace=? AND user_key IN ({placeholders})",
+                (namespace, *chunk),
+            ).fetchall()
+        )
+    return found
+
+
+def _db_get_role_states(connection, namespace: str, user_keys) -> dict:
+    return {key: json.loads(data) for key, data in _db_get_role_state_texts(connection, namespace, user_keys).items()}
+
+
 def _load_role_namespace(namespace: str) -> dict:
     _ensure_role_state_db()
     with _role_state_connection() as connection:
@@ -658,18 +850,51 @@ def _load_role_namespace(namespace: str) -> dict:
         }
 
 
-def _save_role_namespace(namespace: str, data: dict) -> None:
+def write_role_states(namespace: str, rows: dict, *, delete_missing: bool = False) -> dict:
+    """按差异批量写入一个命名空间，只对内容变化的用户执行 upsert。
+
+    delete_missing=True 时 rows 视为整个命名空间的新内容，库里多出的用户会被删除；
+    否则只合并给定用户。返回 inserted/updated/deleted/unchanged 计数。
+    """
     _ensure_role_state_db()
+    wanted = {str(key): _dump_role_state(value) for key, value in (rows or {}).items()}
+    counts = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
     with _role_state_write_lock:
         with _role_state_connection() as connection:
-            connection.execute("DELETE FROM role_user_state WHERE namespace=?", (namespace,))
-            connection.executemany(
-                "INSERT INTO role_user_state(namespace, user_key, data) VALUES (?, ?, ?)",
-                (
-                    (namespace, str(key), json.dumps(value, ensure_ascii=False, separators=(",", ":")))
-                    for key, value in (data or {}).items()
-                ),
-            )
+            connection.execute("BEGIN IMMEDIATE")
+            if delete_missing:
+                existing = {
+                    row[0]: row[1]
+                    for row in connection.execute(
+                        "SELECT user_key, data FROM role_user_state WHERE namespace=?", (namespace,)
+                    )
+                }
+            else:
+                existing = _db_get_role_state_texts(connection, namespace, wanted)
+
+            upserts = []
+            for key, data in wanted.items():
+                old = existing.get(key)
+                if old is None:
+                    counts["inserted"] += 1
+                elif old == data or json.loads(old) == json.loads(data):
+                    counts["unchanged"] += 1
+                    continue
+                else:
+                    counts["updated"] += 1
+                upserts.append((namespace, key, data))
+            deletes = [(namespace, key) for key in existing if key not in wanted] if delete_missing else []
+            counts["deleted"] = len(deletes)
+
+            if upserts:
+                connection.executemany(_UPSERT_ROLE_STATE_SQL, upserts)
+            if deletes:
+                connection.executemany("DELETE FROM role_user_state WHERE namespace=? AND user_key=?", deletes)
+    return counts
+
+
+def _save_role_namespace(namespace: str, data: dict) -> dict:
+    return write_role_states(namespace, data, delete_missing=True)
 
 
 def load_collections_data():
@@ -678,7 +903,7 @@ def load_collections_data():
 
 
 def save_collections_data(data):
-    _save_role_namespace("collections", {str(uid): _uniq_ids(ids) for uid, ids in (data or {}).items()})
+    return _save_role_namespace("collections", {str(uid): _uniq_ids(ids) for uid, ids in (data or {}).items()})
 
 def add_to_collection(user_id: int, role_id: int):
     """将一个稀有身份组添加到用户的永久藏品中。"""
@@ -690,18 +915,10 @@ def add_many_to_collection(user_id: int, role_ids) -> list[int]:
     _ensure_role_state_db()
     with _ownership_lock, _role_state_write_lock:
         with _role_state_connection() as connection:
-            uid = str(user_id)
-            row = connection.execute(
-                "SELECT data FROM role_user_state WHERE namespace='collections' AND user_key=?", (uid,)
-            ).fetchone()
-            owned = set(_uniq_ids(json.loads(row["data"]) if row else []))
+            owned = set(_uniq_ids(_db_get_role_state(connection, "collections", user_id, [])))
             owned.update(_uniq_ids(role_ids))
             normalized = sorted(owned)
-            connection.execute(
-                """INSERT INTO role_user_state(namespace, user_key, data) VALUES ('collections', ?, ?)
-                   ON CONFLICT(namespace, user_key) DO UPDATE SET data=excluded.data""",
-                (uid, json.dumps(normalized, separators=(",", ":"))),
-            )
+            _db_put_role_state(connection, "collections", user_id, normalized)
             return normalized
 
 def get_user_collection(user_id: int) -> list:
@@ -719,7 +936,7 @@ def load_redeem_ownership_data():
 
 
 def save_redeem_ownership_data(data):
-    _save_role_namespace("redeem", {str(uid): _uniq_ids(role_ids) for uid, role_ids in (data or {}).items()})
+    return _save_role_namespace("redeem", {str(uid): _uniq_ids(role_ids) for uid, role_ids in (data or {}).items()})
 
 
 def add_redeem_ownership(user_id: int, role_id: int):
@@ -749,54 +966,45 @@ def get_user_redeem_ownership(user_id: int) -> list[int]:
 
 
 def reconcile_cached_member_ownership(member_role_ids: dict[int, set[int]], role_data: dict | None = None) -> dict:
-    """Bulk-import configured roles already present on cached guild members.
+    """Import configured roles already present on cached members, writing only the rows that change.
 
-    This function performs only local JSON reads/writes. It never calls Discord.
+    Only the listed users' rows are read, and only users with newly found roles are upserted,
+    so a single member update or one sweep chunk holds the write lock briefly. It never calls Discord.
     """
     data = role_data if role_data is not None else load_role_data()
     collectible_ids = set(data.get("lottery_roles", [])) | set(get_collection_reward_role_ids(data))
     redeem_ids = set(data.get("redeem_roles", []))
-    collection_added = redeem_added = users_changed = 0
-
-    with _ownership_lock, _role_state_write_lock:
-        collections = load_collections_data()
-        redeem_ownership = load_redeem_ownership_data()
-        collections_changed = redeem_changed = False
-
-        for user_id, raw_role_ids in member_role_ids.items():
-            role_ids = set(_uniq_ids(raw_role_ids))
-            found_collection = role_ids & collectible_ids
-            found_redeem = role_ids & redeem_ids
-            user_changed = False
-
-            if found_collection:
-                owned = set(_uniq_ids(collections.get(str(user_id), [])))
-                missing = found_collection - owned
-                if missing:
-                    collections[str(user_id)] = sorted(owned | missing)
-                    collection_added += len(missing)
-                    collections_changed = user_changed = True
-
-            if found_redeem:
-                owned = set(_uniq_ids(redeem_ownership.get(str(user_id), [])))
-                missing = found_redeem - owned
-                if missing:
-                    redeem_ownership[str(user_id)] = sorted(owned | missing)
-                    redeem_added += len(missing)
-                    redeem_changed = user_changed = True
-
-            if user_changed:
-                users_changed += 1
-
-        if collections_changed:
-            save_collections_data(collections)
-        if redeem_changed:
-            save_redeem_ownership_data(redeem_ownership)
+    found = {"collections": {}, "redeem": {}}
+    for user_id, raw_role_ids in member_role_ids.items():
+        role_ids = set(_uniq_ids(raw_role_ids))
+        if role_ids & collectible_ids:
+            found["collections"][str(user_id)] = role_ids & collectible_ids
+        if role_ids & redeem_ids:
+            found["redeem"][str(user_id)] = role_ids & redeem_ids
+
+    added = {"collections": 0, "redeem": 0}
+    changed_users: set[str] = set()
+    if found["collections"] or found["redeem"]:
+        _ensure_role_state_db()
+        with _ownership_lock, _role_state_write_lock:
+            with _role_state_connection() as connection:
+                connection.execute("BEGIN IMMEDIATE")
+                for namespace, wanted in found.items():
+                    if not wanted:
+                        continue
+                    existing = _db_get_role_states(connection, namespace, wanted)
+                    for user_key, role_ids in wanted.items():
+                        owned = set(_uniq_ids(existing.get(user_key, [])))
+                        missing = role_ids - owned
+                        if missing:
+                            _db_put_role_state(connection, namespace, user_key, sorted(owned | missing))
+                            added[namespace] += len(missing)
+                            changed_users.add(user_key)
 
     return {
-        "users_changed": users_changed,
-        "collection_roles_added": collection_added,
-        "redeem_roles_added": redeem_added,
+        "users_changed": len(changed_users),
+        "collection_roles_added": added["collections"],
+        "redeem_roles_added": added["redeem"],
     }
 
 
@@ -880,7 +1088,7 @@ def load_lottery_stats_data() -> dict:
 
 
 def save_lottery_stats_data(data: dict):
-    _save_role_namespace(
+    return _save_role_namespace(
         "lottery_stats",
         {str(key): _normalize_lottery_stats(value) for key, value in (data or {}).items()},
     )
@@ -897,6 +1105,56 @@ def get_lottery_stats(user_id: int, guild_id: int | None = None) -> dict:
             return _normalize_lottery_stats(json.loads(row["data"]) if row else {})
 
 
+def _apply_lottery_results(
+    stats: dict,
+    results: list[dict],
+    *,
+    spent_shells: float,
+    refund_shells: float,
+    reward_shells: float,
+    drawn_at: str,
+) -> dict:
+    """把一次抽奖的结果累加进已规范化的统计。"""
+    stats["total_draws"] += len(results or [])
+    stats["spent_shells"] = _normalize_shell_amount(stats["spent_shells"] + float(spent_shells or 0), 0.0)
+    stats["refund_shells"] = _normalize_shell_amount(stats["refund_shells"] + float(refund_shells or 0), 0.0)
+    stats["reward_shells"] = _normalize_shell_amount(stats["reward_shells"] + float(reward_shells or 0), 0.0)
+
+    for row in results or []:
+        row_type = row.get("type")
+        if row_type == LOTTERY_OUTCOME_EMPTY or row_type == "empty":
+            stats["empty_hits"] += 1
+            stats["empty_streak"] += 1
+            stats["no_role_streak"] += 1
+            stats["no_legendary_streak"] += 1
+            continue
+        if row_type == LOTTERY_OUTCOME_SHELLS or row_type == "shells":
+            stats["shell_hits"] += 1
+            stats["empty_streak"] = 0
+            stats["no_role_streak"] += 1
+            stats["no_legendary_streak"] += 1
+            continue
+        if row_type == LOTTERY_OUTCOME_ROLE or row_type == "role":
+            stats["role_hits"] += 1
+            stats["empty_streak"] = 0
+            stats["no_role_streak"] = 0
+            stats["duplicate_roles"] += int(bool(row.get("dupe")))
+            stats["new_roles"] += int(not bool(row.get("dupe")))
+            rarity = str(row.get("rarity", ""))
+            if rarity in stats["rarity_hits"]:
+                stats["rarity_hits"][rarity] += 1
+            if rarity == str(RARITY_LEGENDARY):
+                stats["no_legendary_streak"] = 0
+            else:
+                stats["no_legendary_streak"] += 1
+            kind = str(row.get("kind", ""))
+            if kind in stats["kind_hits"]:
+                stats["kind_hits"][kind] += 1
+
+    stats["last_draw_at"] = str(drawn_at or "")
+    return stats
+
+
 def record_lottery_draw(
     user_id: int,
     guild_id: int | None,
@@ -912,50 +1170,14 @@ def record_lottery_draw(
         key = _make_lottery_user_key(user_id, guild_id)
         with _role_state_connection() as connection:
             connection.execute("BEGIN IMMEDIATE")
-            existing = connection.execute(
-                "SELECT data FROM role_user_state WHERE namespace='lottery_stats' AND user_key=?", (key,)
-            ).fetchone()
-            stats = _normalize_lottery_stats(json.loads(existing["data"]) if existing else {})
-            stats["total_draws"] += len(results or [])
-            stats["spent_shells"] = _normalize_shell_amount(stats["spent_shells"] + float(spent_shells or 0), 0.0)
-            stats["refund_shells"] = _normalize_shell_amount(stats["refund_shells"] + float(refund_shells or 0), 0.0)
-            stats["reward_shells"] = _normalize_shell_amount(stats["reward_shells"] + float(reward_shells or 0), 0.0)
-
-            for row in results or []:
-                row_type = row.get("type")
-                if row_type == LOTTERY_OUTCOME_EMPTY or row_type == "empty":
-                    stats["empty_hits"] += 1
-                    stats["empty_streak"] += 1
-                    stats["no_role_streak"] += 1
-                    stats["no_legendary_streak"] += 1
-                    continue
-                if row_type == LOTTERY_OUTCOME_SHELLS or row_type == "shells":
-                    stats["shell_hits"] += 1
-                    stats["empty_streak"] = 0
-                    stats["no_role_streak"] += 1
-                    stats["no_legendary_streak"] += 1
-                    continue
-                if row_type == LOTTERY_OUTCOME_ROLE or row_type == "role":
-                    stats["role_hits"] += 1
-                    stats["empty_streak"] = 0
-                    stats["no_role_streak"] = 0
-                    stats["duplicate_roles"] += int(bool(row.get("dupe")))
-                    stats["new_roles"] += int(not bool(row.get("dupe")))
-                    rarity = str(row.get("rarity", ""))
-                    if rarity in stats["rarity_hits"]:
-                        stats["rarity_hits"][rarity] += 1
-                    if rarity == str(RARITY_LEGENDARY):
-                        stats["no_legendary_streak"] = 0
-                    else:
-                        stats["no_legendary_streak"] += 1
-                    kind = str(row.get("kind", ""))
-                    if kind in stats["kind_hits"]:
-                        stats["kind_hits"][kind] += 1
-
-            stats["last_draw_at"] = str(drawn_at or "")
-            connection.execute(
-                """INSERT INTO role_user_state(namespace, user_key, data) VALUES ('lottery_stats', ?, ?)
-                   ON CONFLICT(namespace, user_key) DO UPDATE SET data=excluded.data""",
-                (key, json.dumps(stats, ensure_ascii=False, separators=(",", ":"))),
+            stats = _normalize_lottery_stats(_db_get_role_state(connection, "lottery_stats", key, {}))
+            stats = _apply_lottery_results(
+                stats,
+                results,
+                spent_shells=spent_shells,
+                refund_shells=refund_shells,
+                reward_shells=reward_shells,
+                drawn_at=drawn_at,
             )
+            _db_put_role_state(connection, "lottery_stats", key, stats)
             return stats
@@ -11,9 +11,9 @@ from datetime import datetime, timezone, timedelta
 
 from .storage import (
     load_role_data,
+    load_role_data_for_update,
     save_role_data,
     add_to_collection,
-    add_many_to_collection,
     get_user_collection,
     get_lottery_pools_by_kind_and_rarity,
     get_lottery_config,
@@ -23,7 +23,6 @@ from .storage import (
     get_lottery_stats,
     add_redeem_ownership,
     get_user_redeem_ownership,
-    record_lottery_draw,
     set_lottery_role_rarity,
     set_lottery_role_kind,
     set_redeem_role_config,
@@ -42,19 +41,31 @@ from .storage import (
     LOTTERY_OUTCOME_SHELLS,
     LOTTERY_OUTCOME_EMPTY,
 )
+from .settlement import settle_lottery_draw
+from .lottery_engine import (
+    EMPTY_PITY_LIMIT,
+    LEGENDARY_PITY_LIMIT,
+    PITY_EMPTY,
+    PITY_LEGENDARY,
+    PITY_LEGENDARY_FALLBACK,
+    PITY_ROLE,
+    ROLE_PITY_LIMIT,
+    get_engine,
+)
 from cogs.points.storage import (
     format_shells,
     get_user_points,
     get_user_summary,
     modify_user_points,
     sign_in_user,
-    spend_user_points,
 )
 from cogs.points.storage import (
     get_acceleration_tiers,
     get_daily_signin_summary,
+    get_recent_transactions,
     get_user_daily_snapshot,
     load_points_data,
+    count_point_transactions,
     load_random_events,
     load_praise_rules,
     save_praise_rules,
@@ -75,6 +86,7 @@ from discord.ui import Select
 
 EMBED_FIELD_VALUE_LIMIT = 1024
 MONTHLY_ROLE_PAGE_SIZE = 10
+DAILY_TASK_TX_LIMIT = 200
 
 # The points store serializes one JSON file internally. Without this async
 # gate, a sign-in burst can occupy every executor worker waiting on the same
@@ -150,9 +162,12 @@ def _lottery_kind_label(kind: str) -> str:
 
 
 BEIJING_TZ = timezone(timedelta(hours=8))
-EMPTY_PITY_LIMIT = 5
-ROLE_PITY_LIMIT = 20
-LEGENDARY_PITY_LIMIT = 80
+LOTTERY_PITY_NOTES = {
+    PITY_LEGENDARY: f"连续 {LEGENDARY_PITY_LIMIT - 1} 抽未出三星，本抽触发最迟兜底",
+    PITY_ROLE: f"触发 {ROLE_PITY_LIMIT} 抽身份组保底",
+    PITY_EMPTY: f"触发 {EMPTY_PITY_LIMIT} 空保护，空抽转蛋壳",
+    PITY_LEGENDARY_FALLBACK: "三星池为空，三星保底暂退为身份组保底",
+}
 
 
 def _parse_beijing_time(raw: str) -> datetime | None:
@@ -249,16 +264,6 @@ def _percent(numerator: int | float, denominator: int | float) -> str:
     return f"{value:.1f}%"
 
 
-def _weighted_shell_reward(min_amount: float, max_amount: float) -> float:
-    min_steps = int(round(min_amount * 10))
-    max_steps = int(round(max_amount * 10))
-    if max_steps < min_steps:
-        max_steps = min_steps
-    steps = list(range(min_steps, max_steps + 1))
-    weights = [1 / ((step - min_steps + 1) ** 1.35) for step in steps]
-    return round(random.choices(steps, weights=weights, k=1)[0] / 10, 1)
-
-
 def _settle_collection_rewards(user_id: int, guild_id: int, owned_ids: set[int], role_data: dict) -> list[dict]:
     all_rewards = []
     owned = set(owned_ids)
@@ -466,40 +471,29 @@ class CollectionCatalogView(discord.ui.View):
         self.add_item(CollectionPageButton(1, disabled=self.page >= self.total_pages - 1))
 
 
-def _pick_available_role(
-    pools_by_kind_rarity: dict,
-    rarity_pool: list[int],
-    weights: list[int],
-    *,
-    forced_rarity: int | None = None,
-) -> tuple[discord.Role | None, int, str | None]:
-    if forced_rarity is not None:
-        candidate_rarities = [forced_rarity]
-    else:
-        candidate_rarities = [
-            rarity for rarity in rarity_pool
-            if any(pools_by_kind_rarity.get(kind, {}).get(rarity, []) for kind in (LOTTERY_KIND_COLOR, LOTTERY_KIND_ICON))
-        ]
-        if not candidate_rarities:
-            return None, 0, None
-        candidate_weights = [
-            max(0, int(weights[rarity_pool.index(rarity)])) if rarity in rarity_pool else 1
-            for rarity in candidate_rarities
-        ]
-        if sum(candidate_weights) <= 0:
-            candidate_weights = [1 for _ in candidate_rarities]
-        candidate_rarities = [random.choices(candidate_rarities, weights=candidate_weights, k=1)[0]]
-
-    for rarity in candidate_rarities:
-        available_kinds = [
-            kind for kind in (LOTTERY_KIND_COLOR, LOTTERY_KIND_ICON)
-            if pools_by_kind_rarity.get(kind, {}).get(rarity, [])
-        ]
-        if not available_kinds:
-            continue
-        picked_kind = random.choice(available_kinds)
-        return random.choice(pools_by_kind_rarity[picked_kind][rarity]), rarity, picked_kind
-    return None, 0, None
+def _lottery_engine_for_guild(guild: discord.Guild, data: dict):
+    """用服务器里仍然存在的奖池身份组编译（或复用）抽奖引擎。"""
+    available_ids = {
+        kind: {
+            rarity: tuple(rid for rid in ids if guild.get_role(rid))
+            for rarity, ids in rarity_map.items()
+        }
+        for kind, rarity_map in get_lottery_pools_by_kind_and_rarity(data).items()
+    }
+    fallback_cost = float(getattr(config, "LOTTERY_COST", 1.0))
+    fallback_refund = float(getattr(config, "LOTTERY_REFUND", 1.0))
+    # 快照带版本号，直接作为配置键；普通 dict 只能退回用配置内容做键
+    config_key = getattr(data, "version", None)
+    cfg = data.lottery_config if config_key is not None else get_lottery_config(data)
+    if config_key is None:
+        config_key = repr(cfg)
+    return get_engine(
+        (config_key, fallback_cost, fallback_refund, repr(sorted(available_ids.items()))),
+        cfg,
+        available_ids,
+        fallback_cost=fallback_cost,
+        fallback_refund=fallback_refund,
+    )
 
 
 def _lottery_luck_lines(stats: dict) -> tuple[str, str]:
@@ -832,12 +826,11 @@ class RoleLotteryView(discord.ui.View):
         user = interaction.user
         guild_id = interaction.guild_id
         data = await asyncio.to_thread(load_role_data)
-        cfg = get_lottery_config(data)
+        cfg = data.lottery_config
 
         fallback_single = float(getattr(config, "LOTTERY_COST", 1.0))
         fallback_five = float(getattr(config, "LOTTERY_FIVE_COST", 5.0))
         fallback_ten = float(getattr(config, "LOTTERY_TEN_COST", 10.0))
-        fallback_refund = float(getattr(config, "LOTTERY_REFUND", 1.0))
 
         cost_single = max(0.1, float(cfg.get("cost_single", fallback_single)))
         cost_five = max(cost_single, float(cfg.get("cost_five", fallback_five)))
@@ -849,20 +842,6 @@ class RoleLotteryView(discord.ui.View):
         else:
             cost = cost_single * draw_count
 
-        current_points, collection_ids, stats_before = await asyncio.gather(
-            asyncio.to_thread(get_user_points, user.id, guild_id),
-            asyncio.to_thread(get_user_collection, user.id),
-            asyncio.to_thread(get_lottery_stats, user.id, guild_id),
-        )
-        if current_points < cost:
-            return await self._show_lottery_notice(
-                interaction,
-                "💸 蛋壳不足",
-                f"本次抽奖需要 **{format_shells(cost)}** 蛋壳，"
-                f"你当前只有 **{format_shells(current_points)}**。",
-                color=0xF0B232,
-            )
-
         pool_ids = data.get("lottery_roles", [])
         if not pool_ids:
             return await self._show_lottery_notice(
@@ -872,18 +851,8 @@ class RoleLotteryView(discord.ui.View):
                 color=0x747F8D,
             )
 
-        pools_by_kind_rarity = {
-            LOTTERY_KIND_COLOR: {r: [] for r in (RARITY_JUNK, RARITY_NORMAL, RARITY_RARE, RARITY_LEGENDARY)},
-            LOTTERY_KIND_ICON: {r: [] for r in (RARITY_JUNK, RARITY_NORMAL, RARITY_RARE, RARITY_LEGENDARY)},
-        }
-        for kind, rarity_map in get_lottery_pools_by_kind_and_rarity(data).items():
-            for rarity, ids in rarity_map.items():
-                for rid in ids:
-                    role = interaction.guild.get_role(rid)
-                    if role:
-                        pools_by_kind_rarity[kind][rarity].append(role)
-
-        if not any(pools_by_kind_rarity[k][r] for k in (LOTTERY_KIND_COLOR, LOTTERY_KIND_ICON) for r in (RARITY_JUNK, RARITY_NORMAL, RARITY_RARE, RARITY_LEGENDARY)):
+        engine = _lottery_engine_for_guild(interaction.guild, data)
+        if not engine.has_roles:
             return await self._show_lottery_notice(
                 interaction,
                 "⚠️ 奖池暂时不可用",
@@ -891,169 +860,35 @@ class RoleLotteryView(discord.ui.View):
                 color=0x747F8D,
             )
 
-        spend_result = await asyncio.to_thread(
-            spend_user_points,
+        settlement = await asyncio.to_thread(
+            settle_lottery_draw,
             user.id,
-            cost,
             guild_id,
-            source="role_lottery",
-            reason=f"draw_count={draw_count}",
+            engine=engine,
+            draw_count=draw_count,
+            cost=cost,
+            role_data=data,
+            drawn_at=datetime.now(BEIJING_TZ).isoformat(timespec="seconds"),
         )
-        if not spend_result.get("success"):
+        if not settlement.get("success"):
             return await self._show_lottery_notice(
                 interaction,
-                "💸 蛋壳余额刚刚发生了变化",
+                "💸 蛋壳不足",
                 f"本次抽奖需要 **{format_shells(cost)}** 蛋壳，"
-                f"你当前剩余 **{format_shells(spend_result.get('balance', 0))}**。",
+                f"你当前只有 **{format_shells(settlement.get('balance', 0))}**。",
                 color=0xF0B232,
             )
 
-        outcome_cfg = cfg.get("outcome_weights", {})
-        outcome_pool = [LOTTERY_OUTCOME_ROLE, LOTTERY_OUTCOME_SHELLS, LOTTERY_OUTCOME_EMPTY]
-        outcome_weights = [
-            max(0, int(outcome_cfg.get(outcome, 1)))
-            for outcome in outcome_pool
+        results = [
+            {**row, "role": interaction.guild.get_role(row["role_id"]) if row["role_id"] else None}
+            for row in settlement["results"]
         ]
-        if sum(outcome_weights) <= 0:
-            outcome_weights = [23, 32, 45]
-        else:
-            # 身份结果必须保留最低权重，否则三星在硬保底前没有出现机会。
-            role_outcome_index = outcome_pool.index(LOTTERY_OUTCOME_ROLE)
-            outcome_weights[role_outcome_index] = max(1, outcome_weights[role_outcome_index])
-
-        weights_cfg = cfg.get("weights", {})
-        rarity_pool = [RARITY_JUNK, RARITY_NORMAL, RARITY_RARE, RARITY_LEGENDARY]
-        weights = [
-            max(0, int(weights_cfg.get(str(r), 1)))
-            for r in rarity_pool
-        ]
-        if sum(weights) <= 0:
-            weights = [52, 38, 7, 3]
-        has_legendary_pool = any(
-            pools_by_kind_rarity[kind][RARITY_LEGENDARY]
-            for kind in (LOTTERY_KIND_COLOR, LOTTERY_KIND_ICON)
-        )
-        if has_legendary_pool:
-            legendary_index = rarity_pool.index(RARITY_LEGENDARY)
-            weights[legendary_index] = max(1, weights[legendary_index])
-
-        user_collection_ids = set(collection_ids)
-        refund_cfg = cfg.get("refund", {})
-        shell_reward_cfg = cfg.get("shell_reward", {})
-        shell_reward_min = max(0.0, float(shell_reward_cfg.get("min", 0.1)))
-        shell_reward_max = max(shell_reward_min, float(shell_reward_cfg.get("max", 1.0)))
-
-        results = []
-        granted_roles = []
-        total_refund = 0
-        total_shell_reward = 0.0
-        empty_streak = int(stats_before.get("empty_streak", 0))
-        no_role_streak = int(stats_before.get("no_role_streak", 0))
-        no_legendary_streak = int(stats_before.get("no_legendary_streak", 0))
-        guarantee_notes = []
-
-        for _ in range(draw_count):
-            force_legendary = no_legendary_streak >= LEGENDARY_PITY_LIMIT - 1
-            force_role = force_legendary or no_role_streak >= ROLE_PITY_LIMIT - 1
-            if force_role:
-                outcome = LOTTERY_OUTCOME_ROLE
-                if force_legendary:
-                    guarantee_notes.append("连续 79 抽未出三星，本抽触发最迟兜底")
-                else:
-                    guarantee_notes.append("触发 20 抽身份组保底")
-            else:
-                outcome = random.choices(outcome_pool, weights=outcome_weights, k=1)[0]
-                if outcome == LOTTERY_OUTCOME_EMPTY and empty_streak >= EMPTY_PITY_LIMIT - 1:
-                    outcome = LOTTERY_OUTCOME_SHELLS
-                    guarantee_notes.append("触发 5 空保护，空抽转蛋壳")
-
-            if outcome == LOTTERY_OUTCOME_EMPTY:
-                results.append({"type": "empty", "role": None, "rarity": 0, "dupe": False, "refund": 0, "shell_reward": 0})
-                empty_streak += 1
-                no_role_streak += 1
-                no_legendary_streak += 1
-                continue
-
-            if outcome == LOTTERY_OUTCOME_SHELLS:
-                shell_reward = _weighted_shell_reward(shell_reward_min, shell_reward_max)
-                total_shell_reward += shell_reward
-                results.append({"type": "shells", "role": None, "rarity": 0, "dupe": False, "refund": 0, "shell_reward": shell_reward})
-                empty_streak = 0
-                no_role_streak += 1
-                no_legendary_streak += 1
-                continue
-
-            forced_rarity = RARITY_LEGENDARY if force_legendary else None
-            won_role, rarity, picked_kind = _pick_available_role(
-                pools_by_kind_rarity,
-                rarity_pool,
-                weights,
-                forced_rarity=forced_rarity,
-            )
-            if not won_role and force_legendary:
-                guarantee_notes.append("三星池为空，三星保底暂退为身份组保底")
-                won_role, rarity, picked_kind = _pick_available_role(
-                    pools_by_kind_rarity,
-                    rarity_pool,
-                    weights,
-                )
-            if not won_role:
-                results.append({"type": "empty", "role": None, "rarity": 0, "dupe": False, "refund": 0, "shell_reward": 0, "reason": "no_role"})
-                empty_streak += 1
-                no_role_streak += 1
-                no_legendary_streak += 1
-                continue
-
-            if won_role.id in user_collection_ids:
-                refund_amt = max(0.0, float(refund_cfg.get(str(rarity), fallback_refund)))
-                total_refund += refund_amt
-                results.append({"type": "role", "role": won_role, "rarity": rarity, "kind": picked_kind, "dupe": True, "refund": refund_amt, "shell_reward": 0})
-            else:
-                user_collection_ids.add(won_role.id)
-                granted_roles.append(won_role)
-                results.append({"type": "role", "role": won_role, "rarity": rarity, "kind": picked_kind, "dupe": False, "refund": 0, "shell_reward": 0})
-            empty_streak = 0
-            no_role_streak = 0
-            no_legendary_streak = 0 if rarity == RARITY_LEGENDARY else no_legendary_streak + 1
-
-        if granted_roles:
-            await asyncio.to_thread(add_many_to_collection, user.id, [role.id for role in granted_roles])
-
-        if total_refund > 0:
-            await asyncio.to_thread(
-                modify_user_points,
-                user.id,
-                total_refund,
-                guild_id,
-                source="role_lottery_refund",
-                reason=f"draw_count={draw_count}",
-            )
-        if total_shell_reward > 0:
-            await asyncio.to_thread(
-                modify_user_points,
-                user.id,
-                total_shell_reward,
-                guild_id,
-                source="role_lottery_shell_reward",
-                reason=f"draw_count={draw_count}",
-            )
-        collection_rewards = await asyncio.to_thread(
-            _settle_collection_rewards,
-            user.id,
-            guild_id,
-            user_collection_ids,
-            data,
-        )
-        await asyncio.to_thread(
-            record_lottery_draw,
-            user.id,
-            guild_id,
-            results=results,
-            spent_shells=cost,
-            refund_shells=total_refund,
-            reward_shells=total_shell_reward,
-            drawn_at=datetime.now(BEIJING_TZ).isoformat(timespec="seconds"),
-        )
+        granted_roles = [role for role in map(interaction.guild.get_role, settlement["granted_role_ids"]) if role]
+        total_refund = settlement["refund_shells"]
+        total_shell_reward = settlement["reward_shells"]
+        collection_rewards = settlement["collection_rewards"]
+        final_points = settlement["balance"]
+        guarantee_notes = [LOTTERY_PITY_NOTES[note] for note in settlement["pity_notes"]]
 
         equipped_role = granted_roles[-1] if granted_roles else None
         equip_error = None
@@ -1071,9 +906,7 @@ class RoleLotteryView(discord.ui.View):
             except Exception as e:
                 equip_error = str(e)
 
-        final_points = await asyncio.to_thread(get_user_points, user.id, guild_id)
-
-        new_count = sum(1 for row in results if row["role"] and not row["dupe"])
+        new_count = sum(1 for row in results if row["role_id"] and not row["dupe"])
         dupe_count = sum(1 for row in results if row["dupe"])
         shell_count = sum(1 for row in results if row.get("type") == "shells")
         miss_count = sum(1 for row in results if row.get("type") == "empty")
@@ -1096,15 +929,15 @@ class RoleLotteryView(discord.ui.View):
                 lines.append(f"🥚 抽到蛋壳 +{format_shells(row.get('shell_reward', 0))} 蛋壳")
                 continue
 
-            role = row["role"]
+            role_mention = row["role"].mention if row["role"] else f"<@&{row['role_id']}>"
             rarity = row["rarity"]
             kind = row.get("kind", LOTTERY_KIND_COLOR)
             rarity_text = _rarity_label(rarity)
             kind_text = _lottery_kind_label(kind)
             if row["dupe"]:
-                lines.append(f"♻️ [{kind_text}] {rarity_text} · {role.mention} (重复 +{format_shells(row['refund'])} 蛋壳)")
+                lines.append(f"♻️ [{kind_text}] {rarity_text} · {role_mention} (重复 +{format_shells(row['refund'])} 蛋壳)")
             else:
-                lines.append(f"✨ [{kind_text}] {rarity_text} · {role.mention} (新解锁)")
+                lines.append(f"✨ [{kind_text}] {rarity_text} · {role_mention} (新解锁)")
 
         embed.description = "\n".join(lines) if lines else "本次没有可展示的结果。"
         embed.add_field(
@@ -2020,38 +1853,6 @@ def _user_points_record(points_data: dict, user_id: int, guild_id: int) -> dict:
     return record if isinstance(record, dict) else {}
 
 
-def _today_user_transactions(points_data: dict, user_id: int, guild_id: int) -> list[dict]:
-    today = _today_cn()
-    rows = []
-    seen = set()
-    record = _user_points_record(points_data, user_id, guild_id)
-    sources = []
-    if isinstance(record.get("transactions", []), list):
-        sources.extend(record.get("transactions", []))
-    if isinstance(points_data.get("transactions", []), list):
-        sources.extend(points_data.get("transactions", []))
-    for tx in sources:
-        if not isinstance(tx, dict):
-            continue
-        if str(tx.get("user_id", "")) != str(user_id):
-            continue
-        if str(tx.get("guild_id", "")) != str(guild_id):
-            continue
-        if not str(tx.get("time", "")).startswith(today):
-            continue
-        marker = (
-            str(tx.get("time", "")),
-            str(tx.get("source", "")),
-            str(tx.get("reason", "")),
-            str(tx.get("amount", "")),
-        )
-        if marker in seen:
-            continue
-        seen.add(marker)
-        rows.append(tx)
-    return rows
-
-
 def _sum_tx(rows: list[dict], *, sources: set[str] | None = None, prefixes: tuple[str, ...] = ()) -> float:
     total = 0.0
     for tx in rows:
@@ -2129,10 +1930,12 @@ def _task_line(done: bool, label: str, detail: str) -> str:
 
 
 async def build_daily_tasks_embed(user: discord.Member | discord.User, guild_id: int) -> discord.Embed:
+    today = _today_cn()
     points_data = await asyncio.to_thread(get_user_daily_snapshot, user.id, guild_id)
-    tx_rows = _today_user_transactions(points_data, user.id, guild_id)
+    tx_rows = await asyncio.to_thread(
+        get_recent_transactions, user.id, guild_id, DAILY_TASK_TX_LIMIT, since=today
+    )
     record = _user_points_record(points_data, user.id, guild_id)
-    today = _today_cn()
 
     signed = str(record.get("last_sign_date", "")) == today
     sign_amount = _sum_tx(tx_rows, sources={"sign_in"})
@@ -2762,7 +2565,7 @@ class AdminAddRoleSelect(discord.ui.Select):
         if not selected_ids:
             return await interaction.response.send_message("❌ 未选择任何身份组。", ephemeral=True)
 
-        data = load_role_data()
+        data = load_role_data_for_update()
 
         # 映射 key
         key_map = {
@@ -2869,7 +2672,7 @@ class AdminRemoveSelect(Select):
         if not self.values or self.values[0] == "none":
             return await interaction.response.send_message("这里什么也没有。", ephemeral=True)
 
-        data = load_role_data()
+        data = load_role_data_for_update()
         target_ids = {int(v) for v in self.values}
         removed_count = 0
 
@@ -3760,7 +3563,7 @@ class RolePoolAddSelect(discord.ui.Select):
         if not isinstance(panel, RolePoolManagerView):
             return await interaction.response.defer()
         selected_ids = [int(value) for value in interaction.data.get("values", [])]
-        data = load_role_data()
+        data = load_role_data_for_update()
         target_key = ROLE_POOL_META[panel.pool_type]["key"]
         all_keys = [meta["key"] for meta in ROLE_POOL_META.values()] + ["redeem_roles"]
         added, skipped = [], []
@@ -3846,7 +3649,7 @@ class RolePoolActionButton(discord.ui.Button):
         if self.action == "remove":
             if not panel.selected_role_ids:
                 return await interaction.response.send_message("请先在第 ③ 步勾选要移除的身份组。", ephemeral=True)
-            data = load_role_data()
+            data = load_role_data_for_update()
             target_key = ROLE_POOL_META[panel.pool_type]["key"]
             selected = set(panel.selected_role_ids)
             before = data.get(target_key, [])
@@ -3944,9 +3747,72 @@ class RolePoolManagerView(discord.ui.View):
         return embed
 
 
+LOTTERY_SIMULATION_DRAWS = 100000
+
+
+def _build_lottery_simulation_embed(guild: discord.Guild, draws: int = LOTTERY_SIMULATION_DRAWS) -> discord.Embed:
+    """按当前配置模拟一名新用户连续单抽，供管理员调整概率时参考期望花费。"""
+    engine = _lottery_engine_for_guild(guild, load_role_data())
+    if not engine.has_roles:
+        return discord.Embed(title="🧪 掉率模拟", description="奖池里没有可抽取的身份组，无法模拟。", color=0x747F8D)
+    result = engine.simulate(draws)
+    outcomes = result["outcomes"]
+    rarity_hits = result["rarity_hits"]
+    pity = result["pity"]
+
+    def rate(count: int) -> str:
+        return _percent(count, result["draws"])
+
+    def per(value) -> str:
+        return "—" if value is None else format_shells(value)
+
+    embed = discord.Embed(
+        title="🧪 掉率模拟",
+        description=f"按当前配置模拟一名新用户连续单抽 **{result['draws']}** 次（含保底与重复补偿）。",
+        color=0x2B2D31,
+    )
+    embed.add_field(
+        name="结果分布",
+        value=(
+            f"身份组：**{rate(outcomes[LOTTERY_OUTCOME_ROLE])}**\n"
+            f"蛋壳：**{rate(outcomes[LOTTERY_OUTCOME_SHELLS])}**\n"
+            f"空抽：**{rate(outcomes[LOTTERY_OUTCOME_EMPTY])}**"
+        ),
+        inline=True,
+    )
+    embed.add_field(
+        name="稀有度",
+        value="\n".join(
+            f"{_rarity_label(rarity)}：**{rate(rarity_hits[rarity])}**"
+            for rarity in (RARITY_JUNK, RARITY_NORMAL, RARITY_RARE, RARITY_LEGENDARY)
+        ),
+        inline=True,
+    )
+    embed.add_field(
+        name="保底触发",
+        value=(
+            f"空抽转蛋壳：**{pity[PITY_EMPTY]}**\n"
+            f"身份组保底：**{pity[PITY_ROLE]}**\n"
+            f"三星保底：**{pity[PITY_LEGENDARY]}**"
+        ),
+        inline=True,
+    )
+    embed.add_field(
+        name="期望花费",
+        value=(
+            f"每个身份组：**{per(result['cost_per_role'])}** 蛋壳\n"
+            f"每个三星：**{per(result['cost_per_legendary'])}** 蛋壳\n"
+            f"总消耗 **{format_shells(result['cost'])}**，返还蛋壳 **{format_shells(result['shell_rewards'])}**，"
+            f"重复补偿 **{format_shells(result['refunds'])}**，净花费 **{format_shells(result['net_cost'])}**"
+        ),
+        inline=False,
+    )
+    return embed
+
+
 class AdminActionButton(discord.ui.Button):
-    def __init__(self, parent_view: "RoleManagerView", action: str, *, label: str, emoji: str):
-        super().__init__(label=label, emoji=emoji, style=discord.ButtonStyle.secondary, row=0)
+    def __init__(self, parent_view: "RoleManagerView", action: str, *, label: str, emoji: str, row: int = 0):
+        super().__init__(label=label, emoji=emoji, style=discord.ButtonStyle.secondary, row=row)
         self.parent_view = parent_view
         self.action = action
 
@@ -3979,6 +3845,11 @@ class AdminActionButton(discord.ui.Button):
             redeem_view = RedeemManagerView(self.parent_view, interaction.guild)
             await interaction.response.edit_message(embed=redeem_view.build_embed(), view=redeem_view)
             return
+        if self.action == "simulate":
+            await interaction.response.defer(ephemeral=True, thinking=True)
+            embed = await asyncio.to_thread(_build_lottery_simulation_embed, interaction.guild)
+            await interaction.followup.send(embed=embed, ephemeral=True)
+            return
 
         await interaction.response.send_message("❌ 未知操作。", ephemeral=True)
 
@@ -4000,6 +3871,7 @@ class RoleManagerView(discord.ui.View):
         self.add_item(AdminActionButton(self, "cost", label="抽奖消耗", emoji="💳"))
         self.add_item(AdminActionButton(self, "weights", label="概率/补偿", emoji="🎚️"))
         self.add_item(AdminActionButton(self, "redeem", label="兑换配置", emoji="🥚"))
+        self.add_item(AdminActionButton(self, "simulate", label="掉率模拟", emoji="🧪", row=1))
 
     def build_dashboard_embed(self):
         data = load_role_data()
@@ -4284,7 +4156,7 @@ class PraiseRuleManagerView(discord.ui.View):
 
 def build_monthly_card_admin_embed() -> discord.Embed:
     config_data = get_monthly_card_config()
-    points_data = load_points_data()
+    points_data = load_points_data(include_transactions=False)
     purchases = points_data.get("monthly_card_purchases", [])
     users = points_data.get("users", {})
     pending_gifts = sum(
@@ -4344,7 +4216,8 @@ class MonthlyCardConfigModal(discord.ui.Modal):
             daily_reward=daily_reward,
             reward_multiplier=multiplier,
         )
-        await interaction.response.edit_message(embed=build_monthly_card_admin_embed(), view=MonthlyCardAdminView())
+        embed = await asyncio.to_thread(build_monthly_card_admin_embed)
+        await interaction.response.edit_message(embed=embed, view=MonthlyCardAdminView())
 
 
 class MonthlyCardAdminView(discord.ui.View):
@@ -4365,7 +4238,8 @@ class MonthlyCardAdminView(discord.ui.View):
             reward_multiplier=config_data["reward_multiplier"],
             enabled=not config_data["enabled"],
         )
-        await interaction.response.edit_message(embed=build_monthly_card_admin_embed(), view=self)
+        embed = await asyncio.to_thread(build_monthly_card_admin_embed)
+        await interaction.response.edit_message(embed=embed, view=self)
 
 
 class CommunityPanelManageView(discord.ui.View):
@@ -4482,23 +4356,23 @@ class CommunityPanelManageView(discord.ui.View):
 
     @discord.ui.button(label="加速配置", style=discord.ButtonStyle.secondary, emoji="⚡", custom_id="community_admin_acceleration")
     async def acceleration_admin_callback(self, button, interaction: discord.Interaction):
-        await interaction.response.send_message(embed=build_acceleration_admin_embed(), ephemeral=True)
+        embed = await asyncio.to_thread(build_acceleration_admin_embed)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
     @discord.ui.button(label="月卡配置", style=discord.ButtonStyle.secondary, emoji="📅", custom_id="community_admin_monthly_card")
     async def monthly_card_admin_callback(self, button, interaction: discord.Interaction):
-        await interaction.response.send_message(
-            embed=build_monthly_card_admin_embed(),
-            view=MonthlyCardAdminView(),
-            ephemeral=True,
-        )
+        embed = await asyncio.to_thread(build_monthly_card_admin_embed)
+        await interaction.response.send_message(embed=embed, view=MonthlyCardAdminView(), ephemeral=True)
 
     @discord.ui.button(label="红包统计", style=discord.ButtonStyle.secondary, emoji="🧧", custom_id="community_admin_red_packets")
     async def red_packet_admin_callback(self, button, interaction: discord.Interaction):
-        await interaction.response.send_message(embed=build_red_packet_admin_embed(), ephemeral=True)
+        embed = await asyncio.to_thread(build_red_packet_admin_embed)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
     @discord.ui.button(label="数据总览", style=discord.ButtonStyle.primary, emoji="📊", custom_id="community_admin_data_overview")
     async def data_overview_callback(self, button, interaction: discord.Interaction):
-        await interaction.response.send_message(embed=build_data_overview_embed(), ephemeral=True)
+        embed = await asyncio.to_thread(build_data_overview_embed)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
 
 def build_community_manage_embed(guild: discord.Guild | None):
@@ -4547,7 +4421,7 @@ async def deploy_notification_panel(channel) -> discord.Message:
 
 
 def build_acceleration_admin_embed() -> discord.Embed:
-    data = load_points_data()
+    data = load_points_data(include_transactions=False)
     users = data.get("users", {})
     accelerated_users = [
         record for record in users.values()
@@ -4587,38 +4461,18 @@ def build_acceleration_admin_embed() -> discord.Embed:
 
 
 def build_red_packet_admin_embed() -> discord.Embed:
-    from cogs.red_packets.storage import DATA_FILE, format_shells as fmt_shells, load_data
-
-    data = load_data()
-    packets = data.get("packets", {})
-    if not isinstance(packets, dict):
-        packets = {}
-
-    status_counts = {"active": 0, "empty": 0, "expired": 0, "cancelled": 0}
-    total_amount = 0.0
-    remaining_amount = 0.0
-    claim_count = 0
-    admin_free_count = 0
-    for packet in packets.values():
-        if not isinstance(packet, dict):
-            continue
-        status = str(packet.get("status", "active"))
-        status_counts[status] = status_counts.get(status, 0) + 1
-        total_amount += float(packet.get("total_amount", 0) or 0)
-        remaining_amount += float(packet.get("remaining_amount", 0) or 0)
-        claims = packet.get("claims", {})
-        if isinstance(claims, dict):
-            claim_count += len(claims)
-        if packet.get("admin_free"):
-            admin_free_count += 1
+    from cogs.red_packets.storage import DATA_FILE, format_shells as fmt_shells, packet_stats
+
+    stats = packet_stats()
+    status_counts = stats["status_counts"]
 
     embed = discord.Embed(
         title="🧧 红包统计",
         description=(
             f"数据表：`{DATA_FILE}`\n"
-            f"红包总数：**{len(packets)}**\n"
-            f"领取记录：**{claim_count}**\n"
-            f"管理员福利红包：**{admin_free_count}**"
+            f"红包总数：**{stats['packets']}**\n"
+            f"领取记录：**{stats['claims']}**\n"
+            f"管理员福利红包：**{stats['admin_free']}**"
         ),
         color=0xF05A5A,
     )
@@ -4635,8 +4489,8 @@ def build_red_packet_admin_embed() -> discord.Embed:
     embed.add_field(
         name="金额",
         value=(
-            f"累计发出：**{fmt_shells(total_amount)}** 蛋壳\n"
-            f"当前剩余：**{fmt_shells(remaining_amount)}** 蛋壳"
+            f"累计发出：**{fmt_shells(stats['total_amount'])}** 蛋壳\n"
+            f"当前剩余：**{fmt_shells(stats['remaining_amount'])}** 蛋壳"
         ),
         inline=True,
     )
@@ -4651,16 +4505,16 @@ def _schema_line(name: str, ok: bool, detail: str) -> str:
 
 def build_data_overview_embed() -> discord.Embed:
     from cogs.prequiz.storage import PREQUIZ_DATA_FILE, load_attempts
-    from cogs.red_packets.storage import DATA_FILE as RED_PACKET_DATA_FILE, load_data as load_red_packet_data
+    from cogs.red_packets.storage import DATA_FILE as RED_PACKET_DATA_FILE, packet_stats
 
-    points = load_points_data()
+    points = load_points_data(include_transactions=False)
     users = points.get("users", {})
-    transactions = points.get("transactions", [])
+    transaction_count = count_point_transactions()
     accel_purchases = points.get("acceleration_purchases", [])
     monthly_purchases = points.get("monthly_card_purchases", [])
 
-    point_keys = {"users", "daily_signins", "daily_forum_rewards", "transactions", "acceleration_purchases", "monthly_card_config", "monthly_card_purchases"}
-    point_ok = point_keys.issubset(points.keys()) and isinstance(users, dict) and isinstance(transactions, list)
+    point_keys = {"users", "daily_signins", "daily_forum_rewards", "acceleration_purchases", "monthly_card_config", "monthly_card_purchases"}
+    point_ok = point_keys.issubset(points.keys()) and isinstance(users, dict)
     user_rows = len(users) if isinstance(users, dict) else 0
     accel_users = sum(
         1 for record in users.values()
@@ -4681,14 +4535,7 @@ def build_data_overview_embed() -> discord.Embed:
     attempt_rows = attempts.get("attempts", {})
     prequiz_ok = isinstance(attempt_rows, dict)
 
-    red_data = load_red_packet_data()
-    packets = red_data.get("packets", {})
-    red_ok = isinstance(packets, dict)
-    claim_rows = sum(
-        len(packet.get("claims", {}))
-        for packet in packets.values()
-        if isinstance(packet, dict) and isinstance(packet.get("claims", {}), dict)
-    ) if isinstance(packets, dict) else 0
+    red_stats = packet_stats()
 
     embed = discord.Embed(
         title="📊 数据总览",
@@ -4698,7 +4545,7 @@ def build_data_overview_embed() -> discord.Embed:
     embed.add_field(
         name="蛋壳/用户",
         value="\n".join([
-            _schema_line("user_points", point_ok, f"`data/user_points.sqlite3`，用户 **{user_rows}**，流水 **{len(transactions) if isinstance(transactions, list) else 0}**"),
+            _schema_line("user_points", point_ok, f"`data/user_points.sqlite3`，用户 **{user_rows}**，流水 **{transaction_count}**"),
             _schema_line("acceleration", isinstance(accel_purchases, list), f"已加速用户 **{accel_users}**，顶层购卡流水 **{len(accel_purchases) if isinstance(accel_purchases, list) else 0}**"),
             _schema_line("monthly_card", isinstance(monthly_purchases, list), f"启用/叠加用户 **{monthly_users}**，月卡购买流水 **{len(monthly_purchases) if isinstance(monthly_purchases, list) else 0}**"),
             _schema_line("daily_signins", isinstance(points.get("daily_signins", {}), dict), f"签到日表 **{len(points.get('daily_signins', {})) if isinstance(points.get('daily_signins', {}), dict) else 0}**"),
@@ -4709,7 +4556,7 @@ def build_data_overview_embed() -> discord.Embed:
         name="答题/红包",
         value="\n".join([
             _schema_line("prequiz_attempts", prequiz_ok, f"`{PREQUIZ_DATA_FILE}`，答题记录 **{len(attempt_rows) if isinstance(attempt_rows, dict) else 0}**"),
-            _schema_line("red_packets", red_ok, f"`{RED_PACKET_DATA_FILE}`，红包 **{len(packets) if isinstance(packets, dict) else 0}**，领取 **{claim_rows}**"),
+            _schema_line("red_packets", True, f"`{RED_PACKET_DATA_FILE}`，红包 **{red_stats['packets']}**，领取 **{red_stats['claims']}**"),
         ]),
         inline=False,
     )
@@ -4747,6 +4594,7 @@ async def deploy_role_panel(channel, guild, user_avatar_url):
         message = await channel.send(embed=embed, view=view, allowed_mentions=discord.AllowedMentions.none())
 
         # 4. 保存新的消息ID到数据库
+        data = load_role_data_for_update()
         data["panel_info"] = {
             "channel_id": channel.id,
             "message_id": message.id
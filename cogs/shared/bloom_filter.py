@@ -0,0 +1,52 @@
+import hashlib
+import math
+from typing import Iterable
+
+
+class BloomFilter:
+    """定长布隆过滤器：判断“一定不在集合里”，命中时仍需回源确认。
+
+    位数组和哈希次数按预期容量与目标误判率计算；元素统一转成字符串后取一次 blake2b，
+    再用双重哈希派生出 k 个位置。不支持删除，删除多了应整体重建。
+    """
+
+    __slots__ = ("capacity", "error_rate", "bit_count", "hash_count", "_bits", "_items")
+
+    def __init__(self, capacity: int, error_rate: float = 0.001, items: Iterable = ()):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = min(max(float(error_rate), 1e-9), 0.5)
+        self.bit_count = max(8, math.ceil(-self.capacity * math.log(self.error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.bit_count / self.capacity * math.log(2)))
+        self._bits = bytearray((self.bit_count + 7) // 8)
+        self._items = 0
+        for item in items:
+            self.add(item)
+
+    def __len__(self) -> int:
+        return self._items
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(str(item).encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        bit_count = self.bit_count
+        for i in range(self.hash_count):
+            yield (first + i * second) % bit_count
+
+    def add(self, item) -> None:
+        bits = self._bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self._items += 1
+
+    def __contains__(self, item) -> bool:
+        bits = self._bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def estimated_false_positive_rate(self) -> float:
+        """按当前置位比例估算的误判率。"""
+        set_bits = sum(bin(byte).count("1") for byte in self._bits)
+        return (set_bits / self.bit_count) ** self.hash_count
@@ -0,0 +1,118 @@
+import atexit
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any
+
+
+CONNECT_TIMEOUT_SECONDS = 30
+BUSY_TIMEOUT_MS = 30000
+STATEMENT_CACHE_SIZE = 256
+
+_ROW_FACTORY_DEFAULT: Any = sqlite3.Row
+_registry_lock = threading.Lock()
+_open_connections: list[sqlite3.Connection] = []
+_generation = 0
+_local = threading.local()
+
+
+class _PooledEntry:
+    __slots__ = ("connection", "generation", "busy")
+
+    def __init__(self, connection: sqlite3.Connection, generation: int):
+        self.connection = connection
+        self.generation = generation
+        self.busy = False
+
+
+def _pool_key(path: str | os.PathLike[str]) -> str:
+    return os.path.abspath(os.fspath(path))
+
+
+def _open(path: str, row_factory: Any) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # 连接只在创建它的线程里使用；关闭放宽线程检查仅为了进程退出时统一 close。
+    connection = sqlite3.connect(
+        path,
+        timeout=CONNECT_TIMEOUT_SECONDS,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    connection.row_factory = row_factory
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return connection
+
+
+def _thread_entries() -> dict[str, _PooledEntry]:
+    entries = getattr(_local, "entries", None)
+    if entries is None:
+        entries = _local.entries = {}
+    return entries
+
+
+def _checkout(key: str, row_factory: Any) -> _PooledEntry:
+    entries = _thread_entries()
+    entry = entries.get(key)
+    if entry is not None and entry.generation == _generation:
+        return entry
+    connection = _open(key, row_factory)
+    with _registry_lock:
+        _open_connections.append(connection)
+        entry = _PooledEntry(connection, _generation)
+    entries[key] = entry
+    return entry
+
+
+@contextmanager
+def pooled_connection(
+    path: str | os.PathLike[str],
+    *,
+    row_factory: Any = _ROW_FACTORY_DEFAULT,
+):
+    """借出当前线程对该数据库文件的长连接，退出时提交或回滚。
+
+    同一线程嵌套借用时不会复用外层连接（避免内层提交外层事务），
+    而是临时打开一条独立连接并在用完后关闭，语义与旧的逐次 connect 一致。
+    """
+    key = _pool_key(path)
+    entry = _checkout(key, row_factory)
+    if entry.busy:
+        connection = _open(key, row_factory)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+        return
+
+    connection = entry.connection
+    connection.row_factory = row_factory
+    if connection.in_transaction:
+        connection.rollback()
+    entry.busy = True
+    try:
+        with connection:
+            yield connection
+    finally:
+        entry.busy = False
+
+
+def close_all_connections() -> None:
+    """关闭所有线程持有的池化连接；仅用于进程退出或测试切换数据库文件。"""
+    global _generation
+    with _registry_lock:
+        connections = list(_open_connections)
+        _open_connections.clear()
+        _generation += 1
+    for connection in connections:
+        try:
+            connection.close()
+        except sqlite3.Error:
+            pass
+
+
+atexit.register(close_all_connections)
@@ -2,17 +2,19 @@ import copy
 import json
 import os
 import shutil
-import sqlite3
 import threading
 from contextlib import contextmanager
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterable
 
+from cogs.shared.sqlite_pool import pooled_connection
 
 APP_STATE_DB_FILE = "data/app_state.sqlite3"
 _SCHEMA_LOCK = threading.RLock()
 _SCHEMA_READY = False
+# 已完成拆表迁移的 (数据库文件, 数据域)
+_blob_tables_ready: set[tuple[str, str]] = set()
 
 
 def _dump(value: Any) -> str:
@@ -21,16 +23,8 @@ def _dump(value: Any) -> str:
 
 @contextmanager
 def _connection():
-    os.makedirs(os.path.dirname(APP_STATE_DB_FILE), exist_ok=True)
-    connection = sqlite3.connect(APP_STATE_DB_FILE, timeout=30)
-    connection.row_factory = sqlite3.Row
-    connection.execute("PRAGMA synchronous=NORMAL")
-    connection.execute("PRAGMA busy_timeout=30000")
-    try:
-        with connection:
-            yield connection
-    finally:
-        connection.close()
+    with pooled_connection(APP_STATE_DB_FILE) as connection:
+        yield connection
 
 
 def _ensure_schema() -> None:
@@ -57,6 +51,14 @@ def initialize_app_state_storage() -> None:
     _ensure_schema()
 
 
+@contextmanager
+def app_state_connection():
+    """借出 app_state 库的连接，供拥有独立表结构的模块使用。"""
+    _ensure_schema()
+    with _connection() as connection:
+        yield connection
+
+
 def migrate_runtime_json_namespaces() -> None:
     """启动期导入所有增长型运行数据；人工维护的配置 JSON 不在此列。"""
     try:
@@ -129,15 +131,92 @@ def load_json_namespace(
         return value
 
 
+def read_json_namespace_in(connection, namespace: str, default: Any) -> Any:
+    """在调用方的连接/事务里读取数据域；不做旧 JSON 导入，缺失时返回默认值。"""
+    row = connection.execute(
+        "SELECT payload FROM json_namespaces WHERE namespace=?", (str(namespace),)
+    ).fetchone()
+    if row is None:
+        return copy.deepcopy(default)
+    try:
+        return json.loads(row[0])
+    except json.JSONDecodeError:
+        return copy.deepcopy(default)
+
+
+def save_json_namespace_in(connection, namespace: str, value: Any) -> None:
+    """在调用方的连接/事务里覆盖单个数据域，供跨库结算与其他写入一起提交。"""
+    connection.execute(
+        """INSERT INTO json_namespaces(namespace, payload, migrated_from, updated_at)
+           VALUES (?, ?, '', ?)
+           ON CONFLICT(namespace) DO UPDATE SET
+               payload=excluded.payload,
+               updated_at=excluded.updated_at""",
+        (str(namespace), _dump(value), datetime.now(timezone.utc).isoformat(timespec="seconds")),
+    )
+
+
 def save_json_namespace(namespace: str, value: Any) -> None:
     """事务性覆盖单个数据域，不影响同一数据库中的其他模块。"""
     _ensure_schema()
     with _connection() as connection:
-        connection.execute(
-            """INSERT INTO json_namespaces(namespace, payload, migrated_from, updated_at)
-               VALUES (?, ?, '', ?)
-               ON CONFLICT(namespace) DO UPDATE SET
-                   payload=excluded.payload,
-                   updated_at=excluded.updated_at""",
-            (str(namespace), _dump(value), datetime.now(timezone.utc).isoformat(timespec="seconds")),
-        )
+        save_json_namespace_in(connection, namespace, value)
+
+
+def blob_tables_ready(namespace: str) -> bool:
+    return (APP_STATE_DB_FILE, str(namespace)) in _blob_tables_ready
+
+
+def ensure_blob_tables(
+    namespace: str,
+    *,
+    schema_sql: str,
+    meta_table: str,
+    legacy_file: str | os.PathLike[str] | None,
+    default: Any,
+    importer: Callable[[Any, dict], None],
+    lock=None,
+    prepare: Callable[[Any], None] | None = None,
+    on_ready: Callable[[Any], None] | None = None,
+) -> None:
+    """建表并一次性把 json_namespaces 中的整块数据拆入模块自己的表；旧整块数据保留作备份。
+
+    importer(connection, data) 把旧整块数据写入各表，不自行开启或提交事务，由这里和
+    replace_blob_tables 包在 BEGIN IMMEDIATE 里；meta_table 以 blob_migrated 行标记导入已完成。
+    prepare 在建表后补列或建索引，on_ready 在每个数据库首次就绪时执行，二者都在 lock 内。
+    拆表后各模块保留的 load_data/save_data 只是兼容旧接口，供导出或批量维护使用：
+    load_data 从各表组装整块数据，save_data 经 replace_blob_tables 整体替换，热路径直接读写各表。
+    """
+    key = (APP_STATE_DB_FILE, str(namespace))
+    if key in _blob_tables_ready:
+        return
+    with lock or _SCHEMA_LOCK:
+        if key in _blob_tables_ready:
+            return
+        with app_state_connection() as connection:
+            connection.executescript(schema_sql)
+            if prepare is not None:
+                prepare(connection)
+            migrated = connection.execute(f"SELECT value FROM {meta_table} WHERE key='blob_migrated'").fetchone()
+        if migrated is None:
+            raw = load_json_namespace(namespace, legacy_file=legacy_file, default=default)
+            with app_state_connection() as connection:
+                connection.execute("BEGIN IMMEDIATE")
+                if connection.execute(f"SELECT 1 FROM {meta_table} WHERE key='blob_migrated'").fetchone() is None:
+                    importer(connection, raw if isinstance(raw, dict) else {})
+                    connection.execute(
+                        f"INSERT INTO {meta_table}(key, value) VALUES ('blob_migrated', ?)",
+                        (datetime.now(timezone.utc).isoformat(timespec="seconds"),),
+                    )
+        if on_ready is not None:
+            with app_state_connection() as connection:
+                on_ready(connection)
+        _blob_tables_ready.add(key)
+
+
+def replace_blob_tables(connection, tables: Iterable[str], importer: Callable[[Any, dict], None], data: Any) -> None:
+    """save_data 的公共实现：在调用方连接的同一事务里清空各表，再交给 importer 重新导入。"""
+    connection.execute("BEGIN IMMEDIATE")
+    for table in tables:
+        connection.execute(f"DELETE FROM {table}")
+    importer(connection, data if isinstance(data, dict) else {})
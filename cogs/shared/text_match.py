@@ -0,0 +1,70 @@
+from collections import deque
+from typing import Iterable, Iterator
+
+
+class AhoCorasick:
+    """多模式子串匹配自动机：构建一次后，扫描一遍文本即可找出所有命中的模式。
+
+    命中结果用模式在构造参数中的下标表示；空模式会被忽略，重复模式各自保留下标。
+    """
+
+    __slots__ = ("patterns", "_goto", "_fail", "_output")
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = [str(pattern or "") for pattern in patterns]
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[tuple[int, ...]] = [()]
+        for index, pattern in enumerate(self.patterns):
+            if pattern:
+                self._insert(pattern, index)
+        self._build_fail_links()
+
+    def _insert(self, pattern: str, index: int) -> None:
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            node = next_node
+        self._output[node] += (index,)
+
+    def _build_fail_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] += self._output[self._fail[child]]
+
+    def __bool__(self) -> bool:
+        return len(self._goto) > 1
+
+    def iter_matches(self, text: str) -> Iterator[tuple[int, int]]:
+        """依次产出 (结束位置, 模式下标)；结束位置为命中子串最后一个字符之后的下标。"""
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for index in output[node]:
+                yield position + 1, index
+
+    def matched_indices(self, text: str) -> set[int]:
+        return {index for _, index in self.iter_matches(text)}
+
+    def first_match(self, text: str) -> int | None:
+        """返回最先在文本中结束的命中模式下标；没有命中时返回 None。"""
+        for _, index in self.iter_matches(text):
+            return index
+        return None
@@ -1,5 +1,8 @@
+import asyncio
+
 from discord.ext import commands
 
+from .storage import initialize_submission_storage
 from .views import (
     OwnerReplyView,
     RecommendationActionView,
@@ -18,6 +21,10 @@ class SubmissionsCog(commands.Cog):
 
     @commands.Cog.listener()
     async def on_ready(self):
+        try:
+            await asyncio.to_thread(initialize_submission_storage)
+        except Exception as e:
+            print(f"[Submissions] storage-init-failed: {e}")
         self.bot.add_view(SubmissionPanelView())
         self.bot.add_view(OwnerReplyView())
         self.bot.add_view(RecommendationActionView())
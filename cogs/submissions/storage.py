@@ -2,10 +2,12 @@ import json
 import os
 import random
 import threading
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 
 import config
-from cogs.shared.sqlite_store import load_json_namespace, save_json_namespace
+from cogs.shared import sqlite_store
+from cogs.shared.sqlite_store import app_state_connection
 
 
 DATA_FILE = "data/submissions.json"
@@ -22,6 +24,104 @@ STATUS_REPLIED = "replied"
 STATUS_EDITED = "edited"
 STATUS_DELETED = "deleted"
 
+# 投稿主表的独立列；其余字段（fields、attachments、replies、档位记录和界面状态）存入 payload。
+# 评论与“有用”投票各自一张表，只由 add_comment / toggle_useful 写入，整条保存不会覆盖它们。
+_SUBMISSION_COLUMNS = (
+    "id",
+    "request_id",
+    "guild_id",
+    "author_id",
+    "author_name",
+    "kind",
+    "status",
+    "channel_id",
+    "message_id",
+    "base_reward",
+    "extra_reward",
+    "delete_penalty",
+    "notifications_enabled",
+    "created_at",
+    "updated_at",
+    "deleted_at",
+)
+_RELATION_KEYS = ("comments", "useful_user_ids")
+_BLOB_TABLES = (
+    "submission_records",
+    "submission_comments",
+    "submission_useful_votes",
+    "submission_comment_rewards",
+)
+_SQLITE_IN_CHUNK = 900
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS submission_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS submission_records (
+    id TEXT PRIMARY KEY,
+    request_id TEXT NOT NULL DEFAULT '',
+    guild_id TEXT NOT NULL DEFAULT '',
+    author_id TEXT NOT NULL DEFAULT '',
+    author_name TEXT NOT NULL DEFAULT '',
+    kind TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'open',
+    channel_id TEXT NOT NULL DEFAULT '',
+    message_id TEXT NOT NULL DEFAULT '',
+    base_reward REAL NOT NULL DEFAULT 0,
+    extra_reward REAL NOT NULL DEFAULT 0,
+    delete_penalty REAL NOT NULL DEFAULT 0,
+    notifications_enabled INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT NOT NULL DEFAULT '',
+    created_day TEXT NOT NULL DEFAULT '',
+    updated_at TEXT NOT NULL DEFAULT '',
+    deleted_at TEXT NOT NULL DEFAULT '',
+    payload TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_submission_records_message
+    ON submission_records(message_id) WHERE message_id != '';
+CREATE INDEX IF NOT EXISTS idx_submission_records_daily
+    ON submission_records(guild_id, author_id, kind, created_day);
+CREATE INDEX IF NOT EXISTS idx_submission_records_author
+    ON submission_records(author_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_submission_records_status
+    ON submission_records(status, kind, created_at);
+CREATE INDEX IF NOT EXISTS idx_submission_records_request
+    ON submission_records(guild_id, author_id, request_id) WHERE request_id != '';
+CREATE TABLE IF NOT EXISTS submission_comments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    submission_id TEXT NOT NULL,
+    user_id TEXT NOT NULL DEFAULT '',
+    user_name TEXT NOT NULL DEFAULT '',
+    content TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_submission_comments_submission
+    ON submission_comments(submission_id, id);
+CREATE TABLE IF NOT EXISTS submission_useful_votes (
+    submission_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    voted_at TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY(submission_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS submission_comment_rewards (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    used REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY(guild_id, user_id, day)
+);
+"""
+
+_UPSERT_SUBMISSION_SQL = f"""
+    INSERT INTO submission_records({", ".join(_SUBMISSION_COLUMNS)}, created_day, payload)
+    VALUES ({", ".join("?" for _ in _SUBMISSION_COLUMNS)}, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        {", ".join(f"{column}=excluded.{column}" for column in _SUBMISSION_COLUMNS[1:])},
+        created_day=excluded.created_day,
+        payload=excluded.payload
+"""
+
 
 def _now_iso() -> str:
     return datetime.now(TZ_CN).isoformat(timespec="seconds")
@@ -93,6 +193,184 @@ def random_comment_reward() -> float:
     return round(random.randint(min_step, max_step) / 10, 1)
 
 
+def _dump(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _float(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _submission_row_params(record: dict) -> tuple:
+    created_at = str(record.get("created_at", "") or "")
+    payload = {
+        key: value
+        for key, value in record.items()
+        if key not in _SUBMISSION_COLUMNS and key not in _RELATION_KEYS
+    }
+    return (
+        str(record["id"]),
+        str(record.get("request_id", "") or ""),
+        str(record.get("guild_id", "") or ""),
+        str(record.get("author_id", "") or ""),
+        str(record.get("author_name", "") or ""),
+        str(record.get("kind", "") or ""),
+        str(record.get("status", "") or STATUS_OPEN),
+        str(record.get("channel_id", "") or ""),
+        str(record.get("message_id", "") or ""),
+        _float(record.get("base_reward")),
+        _float(record.get("extra_reward")),
+        _float(record.get("delete_penalty")),
+        1 if record.get("notifications_enabled", True) else 0,
+        created_at,
+        str(record.get("updated_at", "") or ""),
+        str(record.get("deleted_at", "") or ""),
+        created_at[:10],
+        _dump(payload),
+    )
+
+
+def _upsert_submission(connection, record: dict) -> None:
+    connection.execute(_UPSERT_SUBMISSION_SQL, _submission_row_params(record))
+
+
+def _import_blob(connection, data: dict) -> None:
+    """投稿拆成记录、评论和有用票三张表，评论奖励计数与面板信息另行入表。"""
+    for key, record in (data.get("submissions") or {}).items():
+        if not isinstance(record, dict):
+            continue
+        record = dict(record)
+        record.setdefault("id", str(key))
+        _upsert_submission(connection, record)
+        submission_id = str(record["id"])
+        comments = record.get("comments") if isinstance(record.get("comments"), list) else []
+        connection.executemany(
+            """INSERT INTO submission_comments(submission_id, user_id, user_name, content, created_at)
+               VALUES (?, ?, ?, ?, ?)""",
+            [
+                (
+                    submission_id,
+                    str(comment.get("user_id", "") or ""),
+                    str(comment.get("user_name", "") or ""),
+                    str(comment.get("content", "") or ""),
+                    str(comment.get("created_at", "") or ""),
+                )
+                for comment in comments
+                if isinstance(comment, dict)
+            ],
+        )
+        votes = record.get("useful_user_ids") if isinstance(record.get("useful_user_ids"), list) else []
+        connection.executemany(
+            "INSERT OR IGNORE INTO submission_useful_votes(submission_id, user_id) VALUES (?, ?)",
+            [(submission_id, str(user_id)) for user_id in votes],
+        )
+    for key, used in (data.get("comment_rewards") or {}).items():
+        parts = str(key).split(":")
+        if len(parts) != 3:
+            continue
+        connection.execute(
+            """INSERT INTO submission_comment_rewards(guild_id, user_id, day, used) VALUES (?, ?, ?, ?)
+               ON CONFLICT(guild_id, user_id, day) DO UPDATE SET used=excluded.used""",
+            (parts[0], parts[1], parts[2], _round_shells(used)),
+        )
+    panel_info = data.get("panel_info")
+    if isinstance(panel_info, dict) and panel_info:
+        _set_meta(connection, "panel_info", _dump(panel_info))
+
+
+def _replace_blob(connection, data: dict) -> None:
+    connection.execute("DELETE FROM submission_meta WHERE key='panel_info'")
+    _import_blob(connection, data)
+
+
+def _set_meta(connection, key: str, value: str) -> None:
+    connection.execute(
+        """INSERT INTO submission_meta(key, value) VALUES (?, ?)
+           ON CONFLICT(key) DO UPDATE SET value=excluded.value""",
+        (key, value),
+    )
+
+
+def _ensure_submission_tables() -> None:
+    sqlite_store.ensure_blob_tables(
+        "submissions",
+        schema_sql=_SCHEMA_SQL,
+        meta_table="submission_meta",
+        legacy_file=DATA_FILE,
+        default=_empty_data(),
+        importer=_import_blob,
+        lock=_DATA_LOCK,
+    )
+
+
+@contextmanager
+def _connection():
+    _ensure_submission_tables()
+    with app_state_connection() as connection:
+        yield connection
+
+
+def initialize_submission_storage() -> None:
+    """启动时完成投稿拆表，避免首个交互承担迁移。"""
+    _ensure_submission_tables()
+
+
+def _record_from_row(row, comments: list[dict], votes: list[str]) -> dict:
+    try:
+        record = json.loads(row["payload"] or "{}")
+    except json.JSONDecodeError:
+        record = {}
+    if not isinstance(record, dict):
+        record = {}
+    for column in _SUBMISSION_COLUMNS:
+        record[column] = row[column]
+    record["notifications_enabled"] = bool(row["notifications_enabled"])
+    record["comments"] = comments
+    record["useful_user_ids"] = votes
+    return record
+
+
+def _load_records(connection, where: str = "", params: tuple = (), order: str = "", limit: int | None = None) -> list[dict]:
+    sql = f"SELECT * FROM submission_records {where} {order}"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    rows = connection.execute(sql, params).fetchall()
+    if not rows:
+        return []
+    ids = [row["id"] for row in rows]
+    comments: dict[str, list[dict]] = {}
+    votes: dict[str, list[str]] = {}
+    for start in range(0, len(ids), _SQLITE_IN_CHUNK):
+        chunk = ids[start : start + _SQLITE_IN_CHUNK]
+        marks = ",".join("?" for _ in chunk)
+        for comment in connection.execute(
+            f"""SELECT submission_id, user_id, user_name, content, created_at FROM submission_comments
+                WHERE submission_id IN ({marks}) ORDER BY submission_id, id""",
+            chunk,
+        ):
+            comments.setdefault(comment["submission_id"], []).append({
+                "user_id": comment["user_id"],
+                "user_name": comment["user_name"],
+                "content": comment["content"],
+                "created_at": comment["created_at"],
+            })
+        for vote in connection.execute(
+            f"""SELECT submission_id, user_id FROM submission_useful_votes
+                WHERE submission_id IN ({marks}) ORDER BY rowid""",
+            chunk,
+        ):
+            votes.setdefault(vote["submission_id"], []).append(vote["user_id"])
+    return [_record_from_row(row, comments.get(row["id"], []), votes.get(row["id"], [])) for row in rows]
+
+
+def _get_submission(connection, submission_id: str) -> dict | None:
+    records = _load_records(connection, "WHERE id=?", (str(submission_id),))
+    return records[0] if records else None
+
+
 def grant_comment_reward(
     *,
     guild_id: int,
@@ -102,54 +380,68 @@ def grant_comment_reward(
     cfg = getattr(config, "SUBMISSIONS", {})
     daily_cap = float(cfg.get("COMMENT_DAILY_CAP", 15.0)) if isinstance(cfg, dict) else 15.0
     reward = random_comment_reward() if requested_reward is None else _round_shells(requested_reward)
-    data = load_data()
-    key = f"{guild_id}:{user_id}:{_today()}"
-    used = _round_shells(data.setdefault("comment_rewards", {}).get(key, 0.0))
-    if daily_cap <= 0 or used >= daily_cap:
-        return {"awarded": 0.0, "used": used, "cap": daily_cap, "remaining": 0.0, "capped": True}
-
-    remaining = _round_shells(daily_cap - used)
-    awarded = _round_shells(min(reward, remaining))
-    data["comment_rewards"][key] = _round_shells(used + awarded)
-    save_data(data)
+    key = (str(guild_id), str(user_id), _today())
+    with _connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        row = connection.execute(
+            "SELECT used FROM submission_comment_rewards WHERE guild_id=? AND user_id=? AND day=?", key
+        ).fetchone()
+        used = _round_shells(row["used"] if row else 0.0)
+        if daily_cap <= 0 or used >= daily_cap:
+            return {"awarded": 0.0, "used": used, "cap": daily_cap, "remaining": 0.0, "capped": True}
+
+        remaining = _round_shells(daily_cap - used)
+        awarded = _round_shells(min(reward, remaining))
+        total = _round_shells(used + awarded)
+        connection.execute(
+            """INSERT INTO submission_comment_rewards(guild_id, user_id, day, used) VALUES (?, ?, ?, ?)
+               ON CONFLICT(guild_id, user_id, day) DO UPDATE SET used=excluded.used""",
+            (*key, total),
+        )
     return {
         "awarded": awarded,
-        "used": data["comment_rewards"][key],
+        "used": total,
         "cap": daily_cap,
-        "remaining": _round_shells(max(0.0, daily_cap - data["comment_rewards"][key])),
-        "capped": awarded < reward or data["comment_rewards"][key] >= daily_cap,
+        "remaining": _round_shells(max(0.0, daily_cap - total)),
+        "capped": awarded < reward or total >= daily_cap,
     }
 
 
 def load_data() -> dict:
-    with _DATA_LOCK:
-        raw = load_json_namespace("submissions", legacy_file=DATA_FILE, default=_empty_data())
-        if not isinstance(raw, dict):
-            return _empty_data()
+    """组装投稿（含评论与有用票）、评论奖励计数和面板信息。"""
+    with _DATA_LOCK, _connection() as connection:
         data = _empty_data()
-        data.update(raw)
-        if not isinstance(data.get("submissions"), dict):
-            data["submissions"] = {}
-        if not isinstance(data.get("panel_info"), dict):
-            data["panel_info"] = {}
-        if not isinstance(data.get("comment_rewards"), dict):
-            data["comment_rewards"] = {}
+        for record in _load_records(connection, order="ORDER BY rowid"):
+            data["submissions"][record["id"]] = record
+        for row in connection.execute("SELECT guild_id, user_id, day, used FROM submission_comment_rewards"):
+            data["comment_rewards"][f"{row['guild_id']}:{row['user_id']}:{row['day']}"] = row["used"]
+        row = connection.execute("SELECT value FROM submission_meta WHERE key='panel_info'").fetchone()
+        if row is not None:
+            data["panel_info"] = json.loads(row["value"])
         return data
 
 
 def save_data(data: dict) -> None:
-    with _DATA_LOCK:
-        save_json_namespace("submissions", data)
+    """面板信息存在 submission_meta 里，替换时一并清掉。"""
+    with _DATA_LOCK, _connection() as connection:
+        sqlite_store.replace_blob_tables(connection, _BLOB_TABLES, _replace_blob, data)
 
 
 def set_panel_info(channel_id: int, message_id: int) -> None:
-    data = load_data()
-    data["panel_info"] = {"channel_id": str(channel_id), "message_id": str(message_id)}
-    save_data(data)
+    with _connection() as connection:
+        _set_meta(connection, "panel_info", _dump({"channel_id": str(channel_id), "message_id": str(message_id)}))
 
 
 def get_panel_info() -> dict:
-    return load_data().get("panel_info", {})
+    with _connection() as connection:
+        row = connection.execute("SELECT value FROM submission_meta WHERE key='panel_info'").fetchone()
+    if row is None:
+        return {}
+    try:
+        value = json.loads(row["value"])
+    except json.JSONDecodeError:
+        return {}
+    return value if isinstance(value, dict) else {}
 
 
 def create_submission(
@@ -184,23 +476,21 @@ def create_submission_once(
     request_id: str,
 ) -> tuple[dict, bool]:
     """按草稿请求 ID 原子创建投稿，返回 (记录, 是否首次创建)。"""
-    with _DATA_LOCK:
-        data = load_data()
+    with _DATA_LOCK, _connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
         normalized_request_id = str(request_id or "").strip()
         if normalized_request_id:
-            for existing in data.get("submissions", {}).values():
-                if not isinstance(existing, dict):
-                    continue
-                if (
-                    existing.get("request_id") == normalized_request_id
-                    and existing.get("guild_id") == str(guild_id)
-                    and existing.get("author_id") == str(author_id)
-                ):
-                    return existing, False
+            existing = connection.execute(
+                """SELECT id FROM submission_records
+                   WHERE guild_id=? AND author_id=? AND request_id=? ORDER BY rowid LIMIT 1""",
+                (str(guild_id), str(author_id), normalized_request_id),
+            ).fetchone()
+            if existing is not None:
+                return _get_submission(connection, existing["id"]), False
 
         now = _now_iso()
         submission_id = f"{int(datetime.now(TZ_CN).timestamp())}{random.randint(1000, 9999)}"
-        while submission_id in data["submissions"]:
+        while connection.execute("SELECT 1 FROM submission_records WHERE id=?", (submission_id,)).fetchone():
             submission_id = f"{int(datetime.now(TZ_CN).timestamp())}{random.randint(1000, 9999)}"
         record = {
             "id": submission_id,
@@ -226,22 +516,21 @@ def create_submission_once(
             "updated_at": now,
             "deleted_at": "",
         }
-        data["submissions"][submission_id] = record
-        save_data(data)
+        _upsert_submission(connection, record)
         return record, True
 
 
 def save_submission(record: dict) -> dict:
-    data = load_data()
+    """保存投稿主记录；评论和投票由各自的接口维护，这里不会改写。"""
     record["updated_at"] = _now_iso()
-    data.setdefault("submissions", {})[str(record["id"])] = record
-    save_data(data)
+    with _connection() as connection:
+        _upsert_submission(connection, record)
     return record
 
 
 def get_submission(submission_id: str) -> dict | None:
-    record = load_data().get("submissions", {}).get(str(submission_id))
-    return record if isinstance(record, dict) else None
+    with _connection() as connection:
+        return _get_submission(connection, submission_id)
 
 
 def submission_notifications_enabled(record: dict | None) -> bool:
@@ -255,56 +544,53 @@ def set_submission_notifications(
     enabled: bool,
 ) -> dict | None:
     """仅投稿者可修改单条投稿的提醒状态。"""
-    with _DATA_LOCK:
-        data = load_data()
-        record = data.get("submissions", {}).get(str(submission_id))
-        if not isinstance(record, dict):
+    with _DATA_LOCK, _connection() as connection:
+        updated = connection.execute(
+            """UPDATE submission_records SET notifications_enabled=?, updated_at=?
+               WHERE id=? AND author_id=? AND status!=?""",
+            (1 if enabled else 0, _now_iso(), str(submission_id), str(author_id), STATUS_DELETED),
+        ).rowcount
+        if not updated:
             return None
-        if record.get("author_id") != str(author_id) or record.get("status") == STATUS_DELETED:
-            return None
-        record["notifications_enabled"] = bool(enabled)
-        record["updated_at"] = _now_iso()
-        data["submissions"][str(submission_id)] = record
-        save_data(data)
-        return record
+        return _get_submission(connection, submission_id)
 
 
 def find_by_message_id(message_id: int) -> dict | None:
     msg_id = str(message_id)
-    for record in load_data().get("submissions", {}).values():
-        if isinstance(record, dict) and record.get("message_id") == msg_id:
-            return record
-    return None
+    if not msg_id:
+        return None
+    with _connection() as connection:
+        records = _load_records(connection, "WHERE message_id=? AND message_id!=''", (msg_id,), "ORDER BY rowid", 1)
+    return records[0] if records else None
 
 
 def list_user_submissions(user_id: int, guild_id: int | None = None, include_deleted: bool = False) -> list[dict]:
-    uid = str(user_id)
-    gid = str(guild_id) if guild_id else None
-    rows = []
-    for record in load_data().get("submissions", {}).values():
-        if not isinstance(record, dict):
-            continue
-        if record.get("author_id") != uid:
-            continue
-        if gid and record.get("guild_id") != gid:
-            continue
-        if not include_deleted and record.get("status") == STATUS_DELETED:
-            continue
-        rows.append(record)
-    return sorted(rows, key=lambda row: row.get("created_at", ""), reverse=True)
+    clauses = ["author_id=?"]
+    params: list = [str(user_id)]
+    if guild_id:
+        clauses.append("guild_id=?")
+        params.append(str(guild_id))
+    if not include_deleted:
+        clauses.append("status!=?")
+        params.append(STATUS_DELETED)
+    with _connection() as connection:
+        return _load_records(
+            connection, "WHERE " + " AND ".join(clauses), tuple(params), "ORDER BY created_at DESC, rowid"
+        )
 
 
 def list_submissions(kind: str | None = None, include_deleted: bool = False) -> list[dict]:
-    rows = []
-    for record in load_data().get("submissions", {}).values():
-        if not isinstance(record, dict):
-            continue
-        if kind and record.get("kind") != kind:
-            continue
-        if not include_deleted and record.get("status") == STATUS_DELETED:
-            continue
-        rows.append(record)
-    return sorted(rows, key=lambda row: row.get("created_at", ""), reverse=True)
+    clauses: list[str] = []
+    params: list = []
+    if kind:
+        clauses.append("kind=?")
+        params.append(kind)
+    if not include_deleted:
+        clauses.append("status!=?")
+        params.append(STATUS_DELETED)
+    where = "WHERE " + " AND ".join(clauses) if clauses else ""
+    with _connection() as connection:
+        return _load_records(connection, where, tuple(params), "ORDER BY created_at DESC, rowid")
 
 
 def count_daily_submissions(
@@ -314,22 +600,13 @@ def count_daily_submissions(
     kind: str,
     day: str | None = None,
 ) -> int:
-    gid = str(guild_id)
-    uid = str(author_id)
-    target_day = day or _today()
-    count = 0
-    for record in load_data().get("submissions", {}).values():
-        if not isinstance(record, dict):
-            continue
-        if record.get("guild_id") != gid:
-            continue
-        if record.get("author_id") != uid:
-            continue
-        if record.get("kind") != kind:
-            continue
-        if str(record.get("created_at", "")).startswith(target_day):
-            count += 1
-    return count
+    with _connection() as connection:
+        row = connection.execute(
+            """SELECT COUNT(*) AS total FROM submission_records
+               WHERE guild_id=? AND author_id=? AND kind=? AND created_day=?""",
+            (str(guild_id), str(author_id), kind, day or _today()),
+        ).fetchone()
+    return int(row["total"])
 
 
 def can_create_submission(
@@ -351,85 +628,103 @@ def can_create_submission(
 
 
 def update_submission_fields(submission_id: str, fields: dict) -> dict | None:
-    record = get_submission(submission_id)
-    if not record or record.get("status") == STATUS_DELETED:
-        return None
-    record["fields"].update(fields)
-    if record.get("status") == STATUS_OPEN:
-        record["status"] = STATUS_EDITED
-    return save_submission(record)
+    with _DATA_LOCK:
+        record = get_submission(submission_id)
+        if not record or record.get("status") == STATUS_DELETED:
+            return None
+        record["fields"].update(fields)
+        if record.get("status") == STATUS_OPEN:
+            record["status"] = STATUS_EDITED
+        return save_submission(record)
 
 
 def mark_deleted(submission_id: str, penalty: float) -> dict | None:
-    record = get_submission(submission_id)
-    if not record:
-        return None
-    record["status"] = STATUS_DELETED
-    record["deleted_at"] = _now_iso()
-    record["delete_penalty"] = _round_shells(penalty)
-    return save_submission(record)
+    with _DATA_LOCK:
+        record = get_submission(submission_id)
+        if not record:
+            return None
+        record["status"] = STATUS_DELETED
+        record["deleted_at"] = _now_iso()
+        record["delete_penalty"] = _round_shells(penalty)
+        return save_submission(record)
 
 
 def add_owner_reply(submission_id: str, user_id: int, user_name: str, content: str, reward: float) -> dict | None:
-    record = get_submission(submission_id)
-    if not record or record.get("status") == STATUS_DELETED:
-        return None
-    record.setdefault("replies", []).append({
-        "user_id": str(user_id),
-        "user_name": user_name,
-        "content": content,
-        "reward": _round_shells(reward),
-        "created_at": _now_iso(),
-    })
-    record["extra_reward"] = _round_shells(float(record.get("extra_reward", 0) or 0) + reward)
-    record["status"] = STATUS_REPLIED
-    return save_submission(record)
+    with _DATA_LOCK:
+        record = get_submission(submission_id)
+        if not record or record.get("status") == STATUS_DELETED:
+            return None
+        record.setdefault("replies", []).append({
+            "user_id": str(user_id),
+            "user_name": user_name,
+            "content": content,
+            "reward": _round_shells(reward),
+            "created_at": _now_iso(),
+        })
+        record["extra_reward"] = _round_shells(float(record.get("extra_reward", 0) or 0) + reward)
+        record["status"] = STATUS_REPLIED
+        return save_submission(record)
 
 
 def toggle_useful(submission_id: str, user_id: int) -> dict | None:
-    record = get_submission(submission_id)
-    if not record or record.get("status") == STATUS_DELETED:
-        return None
-    uid = str(user_id)
-    users = record.setdefault("useful_user_ids", [])
-    if uid in users:
-        users.remove(uid)
-        record["useful_user_ids"] = users
-        record["updated_at"] = _now_iso()
-        save_submission(record)
-        return {"record": record, "added": False, "new_tier_rewards": []}
-
-    users.append(uid)
-    count = len(users)
-    tiers = getattr(config, "SUBMISSION_USEFUL_TIERS", [
-        {"count": 3, "reward": 1.0},
-        {"count": 10, "reward": 3.0},
-        {"count": 30, "reward": 8.0},
-        {"count": 50, "reward": 15.0},
-    ])
-    triggered = set(str(x) for x in record.setdefault("useful_reward_tiers", []))
-    new_rewards = []
-    for tier in tiers:
-        tier_count = int(tier.get("count", 0))
-        if tier_count > 0 and count >= tier_count and str(tier_count) not in triggered:
-            reward = _round_shells(tier.get("reward", 0))
-            if reward > 0:
-                new_rewards.append({"count": tier_count, "reward": reward})
-                triggered.add(str(tier_count))
-    record["useful_reward_tiers"] = sorted(triggered, key=lambda value: int(value))
-    record["extra_reward"] = _round_shells(float(record.get("extra_reward", 0) or 0) + sum(x["reward"] for x in new_rewards))
-    saved = save_submission(record)
-    return {"record": saved, "added": True, "new_tier_rewards": new_rewards}
+    with _DATA_LOCK, _connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        record = _get_submission(connection, submission_id)
+        if not record or record.get("status") == STATUS_DELETED:
+            return None
+        sid = str(record["id"])
+        uid = str(user_id)
+        now = _now_iso()
+        if uid in record["useful_user_ids"]:
+            connection.execute(
+                "DELETE FROM submission_useful_votes WHERE submission_id=? AND user_id=?", (sid, uid)
+            )
+            connection.execute("UPDATE submission_records SET updated_at=? WHERE id=?", (now, sid))
+            record["useful_user_ids"].remove(uid)
+            record["updated_at"] = now
+            return {"record": record, "added": False, "new_tier_rewards": []}
+
+        connection.execute(
+            "INSERT INTO submission_useful_votes(submission_id, user_id, voted_at) VALUES (?, ?, ?)",
+            (sid, uid, now),
+        )
+        record["useful_user_ids"].append(uid)
+        count = len(record["useful_user_ids"])
+        tiers = getattr(config, "SUBMISSION_USEFUL_TIERS", [
+            {"count": 3, "reward": 1.0},
+            {"count": 10, "reward": 3.0},
+            {"count": 30, "reward": 8.0},
+            {"count": 50, "reward": 15.0},
+        ])
+        triggered = set(str(x) for x in record.setdefault("useful_reward_tiers", []))
+        new_rewards = []
+        for tier in tiers:
+            tier_count = int(tier.get("count", 0))
+            if tier_count > 0 and count >= tier_count and str(tier_count) not in triggered:
+                reward = _round_shells(tier.get("reward", 0))
+                if reward > 0:
+                    new_rewards.append({"count": tier_count, "reward": reward})
+                    triggered.add(str(tier_count))
+        record["useful_reward_tiers"] = sorted(triggered, key=lambda value: int(value))
+        record["extra_reward"] = _round_shells(float(record.get("extra_reward", 0) or 0) + sum(x["reward"] for x in new_rewards))
+        record["updated_at"] = now
+        _upsert_submission(connection, record)
+        return {"record": record, "added": True, "new_tier_rewards": new_rewards}
 
 
 def add_comment(submission_id: str, user_id: int, user_name: str, content: str) -> dict | None:
-    record = get_submission(submission_id)
-    if not record or record.get("status") == STATUS_DELETED:
-        return None
-    record.setdefault("comments", []).append({
-        "user_id": str(user_id),
-        "user_name": user_name,
-        "content": content,
-        "created_at": _now_iso(),
-    })
-    return save_submission(record)
+    with _connection() as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        exists = connection.execute(
+            "SELECT 1 FROM submission_records WHERE id=? AND status!=?", (str(submission_id), STATUS_DELETED)
+        ).fetchone()
+        if exists is None:
+            return None
+        now = _now_iso()
+        connection.execute(
+            """INSERT INTO submission_comments(submission_id, user_id, user_name, content, created_at)
+               VALUES (?, ?, ?, ?, ?)""",
+            (str(submission_id), str(user_id), user_name, content, now),
+        )
+        connection.execute("UPDATE submission_records SET updated_at=? WHERE id=?", (now, str(submission_id)))
+        return _get_submission(connection, submission_id)
@@ -55,6 +55,14 @@ POINTS = {
     "PRAISE_KIMI_TRIGGER": "赞美奇米蛋！",
     "PRAISE_KIMI_REWARD_WEIGHTS": [90, 70, 52, 36, 24, 15, 9, 4, 1],
     "PRAISE_KIMI_RESCAN_MINUTES": 5,
+    "PRAISE_KIMI_RECHECK_MINUTES": 30,
+    "PRAISE_KIMI_FULL_RESCAN_MINUTES": 180,
+    "ACTIVITY_FLUSH_SECONDS": 5,
+    "ACTIVITY_FLUSH_MAX_EVENTS": 200,
+    "LEDGER_RETENTION_DAYS": 90,
+    "LEDGER_RETENTION_PER_USER": 200,
+    "LEDGER_RETENTION_GUILDS": {},
+    "LEDGER_COMPACT_MINUTES": 60,
 }
 
 SHELLS = {
@@ -102,6 +110,17 @@ SUBMISSIONS = {
     "DELETE_PENALTY_RATE": 0.5,
 }
 
+SCAM_BLOCKER = {
+    "SPAM_WINDOW_SECONDS": 10,
+    "SPAM_CHANNEL_LIMIT": 8,
+    "SPAM_HISTORY_PER_USER": 32,
+    "SPAM_MAX_TRACKED_USERS": 5000,
+    "MESSAGE_LOG_FLUSH_SECONDS": 2,
+    "MESSAGE_LOG_FLUSH_MAX_ROWS": 500,
+    "MESSAGE_LOG_BACKLOG_MAX": 20000,
+    "PURGE_CHANNEL_CONCURRENCY": 4,
+}
+
 EGG_QA = {
     "BOTTOM_PANEL_CHANNEL_ID": 1536931285300154408,
 }
@@ -123,4 +142,5 @@ globals().update(LOTTERY)
 globals().update(POINTS)
 globals().update(SHELLS)
 globals().update(SUBMISSIONS)
+globals().update(SCAM_BLOCKER)
 globals().update(EGG_QA)
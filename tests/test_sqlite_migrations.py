@@ -1,11 +1,27 @@
+import asyncio
 import concurrent.futures
+import copy
 import importlib.util
 import json
+import os
+import random
+import re
+import sqlite3
+import statistics
 import tempfile
+import time
 import unittest
+from datetime import datetime, timedelta
 from pathlib import Path
+from unittest import mock
 
+from cogs.points import storage as live_points
+from cogs.red_packets import cog as red_packet_cog
+from cogs.roles import lottery_engine, settlement
+from cogs.roles import storage as live_roles
+from cogs.shared import sqlite_pool
 from cogs.shared import sqlite_store as app_store
+from cogs.shared import text_match
 
 
 def _load_module(name: str, relative_path: str):
@@ -17,10 +33,24 @@ def _load_module(name: str, relative_path: str):
     return module
 
 
+def _load_module_in_directory(name: str, relative_path: str, directory: str):
+    # 部分模块导入时会在当前目录创建默认库，放到临时目录里避免污染工作区
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        return _load_module(name, relative_path)
+    finally:
+        os.chdir(cwd)
+
+
 points = _load_module("points_storage_test", "cogs/points/storage.py")
 roles = _load_module("roles_storage_test", "cogs/roles/storage.py")
 red_packets = _load_module("red_packets_storage_test", "cogs/red_packets/storage.py")
 submissions = _load_module("submissions_storage_test", "cogs/submissions/storage.py")
+egg_qa = _load_module("egg_qa_storage_test", "cogs/egg_qa/storage.py")
+ad_rules = _load_module("ad_rules_test", "cogs/manage/ad_rules.py")
+spam_tracker = _load_module("spam_tracker_test", "cogs/manage/spam_tracker.py")
+bloom_filter = _load_module("bloom_filter_test", "cogs/shared/bloom_filter.py")
 
 
 class PointsSQLiteMigrationTests(unittest.TestCase):
@@ -38,6 +68,8 @@ class PointsSQLiteMigrationTests(unittest.TestCase):
 
     def tearDown(self):
         points._POINTS_DB_READY = False
+        points._drain_pending_activity()
+        sqlite_pool.close_all_connections()
         self.temp_dir.cleanup()
 
     def test_json_migrates_once_and_keeps_backup(self):
@@ -49,6 +81,43 @@ class PointsSQLiteMigrationTests(unittest.TestCase):
         points._POINTS_DB_READY = False
         self.assertEqual(points.get_user_points(1, 99), 14.5)
 
+    def test_attached_transaction_rolls_back_and_detaches_when_commit_fails(self):
+        extra = str(Path(self.temp_dir.name) / "extra.sqlite3")
+        with sqlite3.connect(extra) as connection:
+            connection.executescript(
+                """CREATE TABLE parent(id INTEGER PRIMARY KEY);
+                   CREATE TABLE child(parent_id INTEGER REFERENCES parent(id) DEFERRABLE INITIALLY DEFERRED);"""
+            )
+        connection.close()
+        points.get_user_points(1, 99)
+        with sqlite_pool.pooled_connection(points.POINTS_DB_FILE) as connection:
+            connection.execute("PRAGMA foreign_keys=ON")
+        try:
+            # 延迟外键约束只在 COMMIT 时检查，用它让提交本身失败
+            with self.assertRaises(sqlite3.IntegrityError):
+                with points.points_write_transaction({"extra": extra}) as connection:
+                    points.modify_user_points_in(connection, 1, 3.0, 99, source="test")
+                    connection.execute("INSERT INTO extra.child(parent_id) VALUES (42)")
+        finally:
+            with sqlite_pool.pooled_connection(points.POINTS_DB_FILE) as connection:
+                connection.execute("PRAGMA foreign_keys=OFF")
+                self.assertEqual([row[1] for row in connection.execute("PRAGMA database_list")], ["main"])
+        self.assertEqual(points.get_user_points(1, 99), 12.5)
+
+        with points.points_write_transaction({"extra": extra}) as connection:
+            connection.execute("INSERT INTO extra.parent(id) VALUES (42)")
+            points.modify_user_points_in(connection, 1, 3.0, 99, source="test")
+        self.assertEqual(points.get_user_points(1, 99), 15.5)
+
+    def test_admin_snapshot_can_skip_the_ledger(self):
+        for _ in range(3):
+            points.modify_user_points(1, 1.0, 99, source="test")
+        self.assertEqual(points.count_point_transactions(), 3)
+        snapshot = points.load_points_data(include_transactions=False)
+        self.assertNotIn("transactions", snapshot)
+        self.assertEqual(snapshot["users"]["99:1"]["shells"], 15.5)
+        self.assertEqual(len(points.load_points_data()["transactions"]), 3)
+
     def test_concurrent_signins_are_unique_and_ranked(self):
         user_ids = list(range(100, 150))
         with concurrent.futures.ThreadPoolExecutor(max_workers=12) as executor:
@@ -87,6 +156,106 @@ class PointsSQLiteMigrationTests(unittest.TestCase):
         snapshot = points.get_user_daily_snapshot(1, 99)
         self.assertEqual(snapshot["users"]["99:1"]["shells"], 22.5)
 
+    def test_recent_transactions_come_from_ledger_only(self):
+        for amount in (1.0, 2.0, 3.0):
+            points.modify_user_points(1, amount, 99, source="test_ledger")
+        points.modify_user_points(2, 4.0, 99, source="test_ledger")
+        recent = points.get_recent_transactions(1, 99, 2)
+        self.assertEqual([tx["amount"] for tx in recent], [2.0, 3.0])
+        self.assertEqual(recent[-1]["balance"], 18.5)
+        self.assertEqual(len(points.get_recent_transactions(1, 99, 10, since=points._today())), 3)
+        with sqlite3.connect(points.POINTS_DB_FILE) as connection:
+            blob = connection.execute("SELECT data FROM point_users WHERE user_key='99:1'").fetchone()[0]
+        connection.close()
+        self.assertNotIn("transactions", json.loads(blob))
+
+    def test_compaction_archives_expired_rows_and_keeps_idempotency(self):
+        points.grant_monthly_eligible_reward(1, 99, 1.0, source="test_reward", idempotency_key="old-event")
+        for amount in (1.0, 2.0, 3.0):
+            points.modify_user_points(1, amount, 99, source="test_ledger")
+        with sqlite3.connect(points.POINTS_DB_FILE) as connection:
+            connection.execute("UPDATE point_transactions SET time='2020-01-01T00:00:00+08:00'")
+        connection.close()
+
+        with mock.patch.object(points.config, "LEDGER_RETENTION_PER_USER", 2), \
+                mock.patch.object(points.config, "LEDGER_RETENTION_DAYS", 30):
+            result = points.compact_point_transactions()
+        self.assertEqual(result, {"archived_rows": 2, "archived_chunks": 1})
+        self.assertEqual([tx["amount"] for tx in points.get_recent_transactions(1, 99)], [2.0, 3.0])
+        archived = points.get_archived_transactions(1, 99)
+        self.assertEqual([tx["source"] for tx in archived], ["test_reward", "test_ledger"])
+
+        replay = points.grant_monthly_eligible_reward(1, 99, 1.0, source="test_reward", idempotency_key="old-event")
+        self.assertTrue(replay["duplicate"])
+        with sqlite3.connect(points.POINTS_DB_FILE) as connection:
+            with self.assertRaises(sqlite3.IntegrityError):
+                connection.execute("DELETE FROM point_transaction_archive")
+        connection.close()
+
+    def test_keyed_reward_paths_enforce_daily_limits(self):
+        first = points.reward_daily_forum_post(1, 99, 5, 500, amount=5.0, daily_limit=2)
+        self.assertTrue(first["success"])
+        self.assertEqual(points.reward_daily_forum_post(1, 99, 6, 500, amount=5.0, daily_limit=2)["reason"], "duplicate_thread")
+        self.assertTrue(points.reward_daily_forum_post(1, 99, 5, 501, amount=5.0, daily_limit=2)["success"])
+        self.assertEqual(points.reward_daily_forum_post(1, 99, 5, 502, amount=5.0, daily_limit=2)["reason"], "daily_limit_reached")
+        self.assertEqual(points.get_user_points(1, 99), 22.5)
+
+        points.modify_user_points(1, 20.0, 99, source="test")
+        self.assertTrue(points.purchase_monthly_card(1, 99)["success"])
+        self.assertTrue(points.claim_monthly_card_first_role(1, 99, 1234)["success"])
+        self.assertEqual(points.claim_monthly_card_first_role(1, 99, 1234)["reason"], "already_claimed")
+        self.assertEqual(len(points.load_points_data()["monthly_card_purchases"]), 1)
+
+    def test_praise_scan_records_support_batched_lookup(self):
+        common = {"guild_id": 99, "channel_id": 5, "author_id": 1, "author_name": "a", "content": "赞美奇米蛋！"}
+        points.record_praise_scan_log(message_id=10, status="pending", reason="r", rule_id="rule_a", **common)
+        points.record_praise_scan_log(message_id=10, status="rewarded", reason="ok", rule_id="rule_a", amount=3.0, **common)
+        points.record_praise_scan_log(message_id=11, status="failed", reason="x", rule_id="rule_a", **common)
+        found = points.get_successful_praise_scan_records(99, [10, 11, 12])
+        self.assertEqual(list(found), [("10", "rule_a")])
+        self.assertEqual(found[("10", "rule_a")]["amount"], 3.0)
+        self.assertTrue(points.has_successful_praise_scan_record(99, 10, "rule_a"))
+        self.assertFalse(points.has_successful_praise_scan_record(99, 11, "rule_a"))
+        self.assertEqual(len(points.load_points_data()["daily_praise_scan_records"][points._today()]), 3)
+
+    def test_praise_scan_cursor_only_moves_forward(self):
+        self.assertEqual(points.get_praise_scan_cursor(5), 0)
+        self.assertEqual(points.save_praise_scan_cursor(5, 200), 200)
+        self.assertEqual(points.save_praise_scan_cursor(5, 150), 200)
+        points.save_points_data(points.load_points_data())
+        self.assertEqual(points.get_praise_scan_cursor(5), 200)
+
+    def test_legacy_praise_scan_sections_move_to_table(self):
+        points.get_user_points(1, 99)
+        legacy_row = {"guild_id": "99", "message_id": "7", "rule_id": "rule_a", "status": "rewarded", "amount": 2.0}
+        with sqlite3.connect(points.POINTS_DB_FILE) as connection:
+            connection.execute(
+                "INSERT INTO point_sections(namespace, item_key, data) VALUES ('daily_praise_scan_records', ?, ?)",
+                (points._today(), json.dumps({"99:7:rule_a": legacy_row})),
+            )
+        connection.close()
+        points._POINTS_DB_READY = False
+        self.assertEqual(points.get_successful_praise_scan_record(99, 7, "rule_a")["amount"], 2.0)
+
+    def test_buffered_activity_is_visible_and_flushed_in_batches(self):
+        for _ in range(5):
+            points.queue_message_activity(1, 99)
+        points.queue_message_activity(2, 99)
+        self.assertEqual(points.pending_message_activity_events(), 6)
+        self.assertEqual(points.get_user_summary(1, 99)["daily_msg_count"], 5)
+
+        signed = points.sign_in_user(1, 99, 1.0)
+        self.assertEqual(signed["daily_msg_count"], 5)
+        self.assertEqual(signed["activity_rate"], 0.05)
+        self.assertEqual(points.pending_message_activity_events(), 1)
+
+        points.queue_message_activity(1, 99)
+        self.assertEqual(points.flush_message_activity(), 2)
+        self.assertEqual(points.pending_message_activity_events(), 0)
+        self.assertEqual(points.get_user_summary(1, 99)["daily_msg_count"], 6)
+        self.assertEqual(points.get_user_summary(2, 99)["daily_msg_count"], 1)
+        self.assertEqual(points.record_message_activity(2, 99), 2)
+
     def test_monthly_card_uses_indexed_candidate_marker(self):
         points.update_monthly_card_config(
             price=1.0, duration_days=3, daily_reward=2.0, reward_multiplier=1.5
@@ -98,6 +267,830 @@ class PointsSQLiteMigrationTests(unittest.TestCase):
         self.assertEqual(settlement["rewarded_users"], 0)
 
 
+class PointUserColumnMigrationTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.temp_dir.name)
+        points.POINTS_DATA_FILE = str(root / "user_points.json")
+        points.POINTS_DB_FILE = str(root / "user_points.sqlite3")
+        points._POINTS_DB_READY = False
+        legacy_record = {
+            "shells": 8.5, "points": 8.5, "streak_days": 4, "last_sign_date": "2026-08-19",
+            "daily_msg_date": "2026-08-19", "daily_msg_count": 7, "acceleration_days": 2,
+            "transactions": [{
+                "time": "2026-08-19T10:00:00+08:00", "guild_id": "99", "user_id": "1",
+                "amount": 1.0, "balance": 8.5, "source": "sign_in", "reason": "",
+            }],
+        }
+        with sqlite3.connect(points.POINTS_DB_FILE) as connection:
+            connection.executescript(
+                """
+                CREATE TABLE points_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+                CREATE TABLE point_users (
+                    user_key TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    has_monthly_card INTEGER NOT NULL DEFAULT 0
+                );
+                INSERT INTO points_meta(key, value) VALUES ('json_migrated', 'legacy');
+                """
+            )
+            connection.execute(
+                "INSERT INTO point_users(user_key, data) VALUES ('99:1', ?)",
+                (json.dumps(legacy_record),),
+            )
+        connection.close()
+
+    def tearDown(self):
+        points._POINTS_DB_READY = False
+        sqlite_pool.close_all_connections()
+        self.temp_dir.cleanup()
+
+    def _point_user_row(self) -> tuple[set[str], dict]:
+        with sqlite3.connect(points.POINTS_DB_FILE) as connection:
+            connection.row_factory = sqlite3.Row
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(point_users)")}
+            row = dict(connection.execute("SELECT * FROM point_users WHERE user_key='99:1'").fetchone())
+        connection.close()
+        return columns, row
+
+    def test_hot_fields_move_to_columns_and_migration_reverses(self):
+        self.assertEqual(points.get_user_points(1, 99), 8.5)
+        columns, row = self._point_user_row()
+        self.assertTrue({"shells", "streak_days", "daily_msg_count", "monthly_card_periods"} <= columns)
+        self.assertEqual((row["shells"], row["streak_days"], row["daily_msg_count"]), (8.5, 4, 7))
+        extras = json.loads(row["data"])
+        self.assertNotIn("shells", extras)
+        self.assertEqual(extras["acceleration_days"], 2)
+        self.assertNotIn("transactions", extras)
+        self.assertEqual([tx["source"] for tx in points.get_recent_transactions(1, 99)], ["sign_in"])
+
+        points.modify_user_points(1, 1.5, 99, source="test")
+        self.assertEqual(self._point_user_row()[1]["shells"], 10.0)
+
+        self.assertEqual(points.downgrade_point_user_columns(), 1)
+        columns, row = self._point_user_row()
+        self.assertEqual(columns, {"user_key", "data", "has_monthly_card"})
+        restored = json.loads(row["data"])
+        self.assertEqual((restored["shells"], restored["streak_days"]), (10.0, 4))
+        self.assertEqual(restored["acceleration_days"], 2)
+
+        summary = points.get_user_summary(1, 99)
+        self.assertEqual((summary["shells"], summary["streak_days"]), (10.0, 4))
+        self.assertIn("shells", self._point_user_row()[0])
+
+
+class PointsHotPathScalingTests(unittest.TestCase):
+    """奖励热路径只做按键查询：用户表从 1k 增长到 100k 时耗时应基本持平。"""
+
+    GUILD_ID = 99
+    CALLS = 15
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.temp_dir.name)
+        points.POINTS_DATA_FILE = str(root / "user_points.json")
+        points.POINTS_DB_FILE = str(root / "user_points.sqlite3")
+        points._POINTS_DB_READY = False
+        points.initialize_points_storage()
+        self.seeded = 0
+        self.next_user = 0
+
+    def tearDown(self):
+        points._POINTS_DB_READY = False
+        sqlite_pool.close_all_connections()
+        self.temp_dir.cleanup()
+
+    def _seed_users(self, total: int) -> None:
+        with sqlite3.connect(points.POINTS_DB_FILE) as connection:
+            connection.executemany(
+                "INSERT INTO point_users(user_key, data, shells) VALUES (?, '{}', 100)",
+                ((f"{self.GUILD_ID}:{uid}",) for uid in range(self.seeded, total)),
+            )
+        connection.close()
+        self.seeded = total
+
+    def _fresh_user(self) -> int:
+        user_id = self.next_user
+        self.next_user += 1
+        return user_id
+
+    def _hot_path_calls(self) -> dict:
+        guild_id = self.GUILD_ID
+        snowflake_now = (int(time.time() * 1000) - 1420070400000) << 22
+        return {
+            "purchase_monthly_card": lambda uid: self.assertTrue(
+                points.purchase_monthly_card(uid, guild_id)["success"]
+            ),
+            "purchase_acceleration_card": lambda uid: self.assertTrue(
+                points.purchase_acceleration_card(uid, guild_id, "day_1")["success"]
+            ),
+            "add_post_points": lambda uid: self.assertGreater(points.add_post_points(uid, guild_id, 1.0, 15.0), 0),
+            "reward_daily_forum_post": lambda uid: self.assertTrue(
+                points.reward_daily_forum_post(uid, guild_id, 1, uid, amount=5.0, daily_limit=3)["success"]
+            ),
+            "record_praise_scan_log": lambda uid: points.record_praise_scan_log(
+                guild_id=guild_id, channel_id=1, message_id=uid, author_id=uid, author_name="bench",
+                content="赞美奇米蛋！", status="rewarded", reason="bench", rule_id="bench", amount=1.0,
+            ),
+            "get_successful_praise_scan_record": lambda uid: points.get_successful_praise_scan_record(
+                guild_id, uid, "bench"
+            ),
+            "reward_daily_kimi_praise": lambda uid: self.assertTrue(
+                points.reward_daily_kimi_praise(uid, guild_id, snowflake_now + uid)["success"]
+            ),
+        }
+
+    def _median_latencies(self) -> dict:
+        latencies = {}
+        for name, call in self._hot_path_calls().items():
+            samples = []
+            for _ in range(self.CALLS):
+                user_id = self._fresh_user()
+                started = time.perf_counter()
+                call(user_id)
+                samples.append(time.perf_counter() - started)
+            latencies[name] = statistics.median(samples)
+        return latencies
+
+    def test_reward_paths_stay_flat_as_user_table_grows(self):
+        self._seed_users(1_000)
+        small = self._median_latencies()
+        self.next_user = 1_000
+        self._seed_users(100_000)
+        large = self._median_latencies()
+        for name, baseline in small.items():
+            with self.subTest(hot_path=name):
+                # 允许 3 倍抖动外加 5ms 绝对余量；整表加载在 100k 用户下会慢两个数量级。
+                self.assertLess(large[name], baseline * 3 + 0.005, f"{name}: {baseline:.5f}s -> {large[name]:.5f}s")
+
+
+class PraiseRuleSetTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.original_rules_file = points.PRAISE_RULES_FILE
+        points.PRAISE_RULES_FILE = str(Path(self.temp_dir.name) / "praise_rules.json")
+
+    def tearDown(self):
+        points.PRAISE_RULES_FILE = self.original_rules_file
+        points._PRAISE_RULESET_CACHE = None
+        self.temp_dir.cleanup()
+
+    def test_aho_corasick_finds_overlapping_patterns(self):
+        automaton = text_match.AhoCorasick(["he", "she", "his", "hers", ""])
+        self.assertEqual(automaton.matched_indices("ushers"), {0, 1, 3})
+        self.assertEqual(automaton.first_match("ahishe"), 2)
+        self.assertIsNone(automaton.first_match("xyz"))
+        self.assertFalse(text_match.AhoCorasick([""]))
+
+    def test_ruleset_keeps_rule_order_and_time_windows(self):
+        points.save_praise_rules([
+            {"id": "expired", "field": "奇米蛋", "match_mode": "contains", "end_at": "2020-01-01"},
+            {"id": "exact", "field": "赞美 奇米蛋！", "match_mode": "exact"},
+            {"id": "contains", "field": "奇米", "match_mode": "contains"},
+        ])
+        ruleset = points.load_praise_ruleset()
+        self.assertIs(points.load_praise_ruleset(), ruleset)
+        self.assertEqual(points.match_praise_rule("赞美奇米蛋!")["id"], "exact")
+        self.assertEqual(points.match_praise_rule("今天也夸奇米蛋")["id"], "contains")
+        self.assertEqual(
+            points.match_praise_rule("夸奇米蛋", datetime(2019, 6, 1, tzinfo=points.TZ_CN), ruleset)["id"], "expired"
+        )
+        self.assertIsNone(points.match_praise_rule("无关内容", rules=points.load_praise_rules()))
+
+        points.save_praise_rules([{"id": "only", "field": "蛋蛋", "match_mode": "contains"}])
+        self.assertIsNot(points.load_praise_ruleset(), ruleset)
+        self.assertIsNone(points.match_praise_rule("今天也夸奇米蛋"))
+
+
+class AdRuleEngineTests(unittest.TestCase):
+    @staticmethod
+    def _naive_match(rules, content):
+        for rule_id, pattern in sorted(rules):
+            if re.search(pattern, content, re.IGNORECASE):
+                return rule_id
+        return None
+
+    def test_required_literal_skips_optional_and_branch_parts(self):
+        self.assertEqual(ad_rules.required_literal(re.escape("Discord.GG/abc")), "discord.gg/abc")
+        self.assertEqual(ad_rules.required_literal(r"free\s*nitro(?:gift)?"), "nitro")
+        self.assertEqual(ad_rules.required_literal(r"(?:steam|stearn)community"), "community")
+        self.assertEqual(ad_rules.required_literal(r"cat|dog"), "")
+        self.assertEqual(ad_rules.required_literal(r"(bad"), "")
+
+    def test_matches_like_sequential_scan_including_case_folding(self):
+        rules = [
+            (1, r"nitro\s+gift"),
+            (2, re.escape("steamcommunity.com")),
+            (3, r"cat|dog"),
+            (4, r"免费\d+领取"),
+            (5, r"kiss"),
+            (6, r"(bad"),
+        ]
+        engine = ad_rules.AdRuleEngine(rules)
+        self.assertEqual(len(engine), 5)
+        valid = [rule for rule in rules if rule[0] != 6]
+        for content in [
+            "NITRO   GIFT here",
+            "visit STEAMCOMMUNITY.COM now",
+            "my dog and nitro gift",
+            "免费100领取",
+            "KIſS",
+            "nothing to see",
+            "",
+        ]:
+            with self.subTest(content=content):
+                rule = engine.match(content)
+                self.assertEqual(rule.rule_id if rule else None, self._naive_match(valid, content))
+
+    def test_incremental_add_and_remove_track_rule_set(self):
+        engine = ad_rules.AdRuleEngine([(1, "alpha"), (2, "beta")])
+        live = {1: "alpha", 2: "beta"}
+        for rule_id in range(3, 3 + ad_rules.PENDING_LITERAL_LIMIT * 3):
+            pattern = f"spam{rule_id}x"
+            self.assertTrue(engine.add(rule_id, pattern))
+            live[rule_id] = pattern
+        self.assertFalse(engine.add(999, "(bad"))
+        for rule_id in list(live)[::2]:
+            self.assertTrue(engine.remove(rule_id))
+            del live[rule_id]
+        self.assertFalse(engine.remove(1))
+        engine.add(2, "gamma")
+        live[2] = "gamma"
+        for content in ["alpha", "beta", "gamma", "spam4x", "spam5x and spam8x", "spam50x"]:
+            with self.subTest(content=content):
+                rule = engine.match(content)
+                self.assertEqual(rule.rule_id if rule else None, self._naive_match(live.items(), content))
+
+    def test_engine_scales_past_sequential_scan(self):
+        rng = random.Random(10)
+        links = [f"scam{rule_id}.example/{rng.randrange(10**6)}" for rule_id in range(1, 2001)]
+        rules = [(rule_id, re.escape(link)) for rule_id, link in enumerate(links, start=1)]
+        rules += [(2000 + i, rf"promo{i}\s*code\d+") for i in range(1, 51)]
+        messages = [f"hello everyone, message {i} about nothing" for i in range(450)]
+        messages += [f"check {rng.choice(links).upper()} now" for _ in range(40)]
+        messages += [f"PROMO{rng.randrange(1, 51)} code{i}" for i in range(10)]
+
+        start = time.perf_counter()
+        engine = ad_rules.AdRuleEngine(rules)
+        build_seconds = time.perf_counter() - start
+
+        compiled = [(rule_id, re.compile(pattern, re.IGNORECASE)) for rule_id, pattern in rules]
+        start = time.perf_counter()
+        expected = []
+        for content in messages:
+            expected.append(next((rule_id for rule_id, regex in compiled if regex.search(content)), None))
+        sequential_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = []
+        for content in messages:
+            rule = engine.match(content)
+            actual.append(rule.rule_id if rule else None)
+        engine_seconds = time.perf_counter() - start
+
+        self.assertEqual(actual, expected)
+        self.assertEqual(sum(1 for rule_id in actual if rule_id), 50)
+        self.assertLess(build_seconds, 2.0)
+        self.assertLess(engine_seconds * 5, sequential_seconds, f"{engine_seconds:.4f}s vs {sequential_seconds:.4f}s")
+
+
+class BloomFilterTests(unittest.TestCase):
+    def test_no_false_negatives_and_measured_rate_within_target(self):
+        members = [str(10**18 + i * 7919) for i in range(10000)]
+        question_filter = bloom_filter.BloomFilter(len(members), 0.001, members)
+        self.assertTrue(all(member in question_filter for member in members))
+
+        probes = [str(2 * 10**18 + i) for i in range(100000)]
+        false_positives = sum(probe in question_filter for probe in probes)
+        measured = false_positives / len(probes)
+        self.assertLess(measured, 0.003)
+        self.assertLess(question_filter.estimated_false_positive_rate(), 0.003)
+
+
+class SpamTrackerTests(unittest.TestCase):
+    def test_triggers_on_distinct_channels_inside_window_only(self):
+        tracker = spam_tracker.SpamTracker(window_seconds=10, channel_limit=4, history_size=8)
+        for channel_id in range(3):
+            self.assertIsNone(tracker.record(1, channel_id, "buy nitro", now=float(channel_id)))
+        # 超出窗口的旧频道会被增量扣除，不再计入
+        self.assertIsNone(tracker.record(1, 3, "", now=20.0))
+        for offset, channel_id in enumerate((4, 5)):
+            self.assertIsNone(tracker.record(1, channel_id, "new link", now=21.0 + offset))
+        self.assertEqual(tracker.record(1, 6, "new link", now=23.0), ["new link"])
+        self.assertEqual(len(tracker), 0)
+
+    def test_history_and_user_count_stay_bounded(self):
+        tracker = spam_tracker.SpamTracker(window_seconds=60, channel_limit=3, history_size=4, max_users=100)
+        for index in range(50):
+            self.assertIsNone(tracker.record(7, index % 2, f"msg {index}", now=float(index) / 100))
+        window = tracker._users[7]
+        self.assertEqual(len(window.events), 4)
+        self.assertEqual(sum(window.channel_counts.values()), 4)
+        self.assertEqual(len(window.contents), 4)
+
+        for user_id in range(1000, 1500):
+            tracker.record(user_id, 1, "hi", now=1.0)
+        self.assertEqual(len(tracker), 100)
+        self.assertEqual(tracker.evicted_users, 401)
+        self.assertNotIn(7, tracker._users)
+        self.assertEqual(tracker.prune(now=100.0), 100)
+
+    def test_long_messages_keep_links_past_old_cutoff(self):
+        tracker = spam_tracker.SpamTracker(window_seconds=10, channel_limit=2, history_size=4)
+        content = "x" * 482 + " https://discord.gg/freenitro"
+        self.assertIsNone(tracker.record(1, 1, content, now=0.0))
+        self.assertEqual(tracker.record(1, 2, content, now=1.0), [content])
+
+
+class ScamDBMessageLogTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.module_dir = tempfile.TemporaryDirectory()
+        cls.blocker_db = _load_module_in_directory("blocker_db_test", "cogs/manage/blocker_db.py", cls.module_dir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.blocker_db.scam_db._conn.close()
+        cls.module_dir.cleanup()
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db = self.blocker_db.ScamDB(str(Path(self.temp_dir.name) / "scam.db"), log_backlog_max=1000)
+
+    def tearDown(self):
+        self.db._conn.close()
+        self.temp_dir.cleanup()
+
+    def _row_count(self) -> int:
+        return sum(self.db._query(f"SELECT COUNT(*) FROM {table}")[0][0] for table in self.db._live_log_tables())
+
+    def test_queued_logs_flush_in_one_batch_and_before_lookup(self):
+        for message_id in range(1, 301):
+            self.db.queue_message_log(message_id, message_id % 3, 10 + message_id % 5)
+        self.assertEqual(self._row_count(), 0)
+
+        statements: list[str] = []
+        self.db._conn.set_trace_callback(statements.append)
+        self.assertEqual(asyncio.run(self.db.flush_logs()), 300)
+        self.db._conn.set_trace_callback(None)
+        self.assertEqual(sum(1 for sql in statements if sql.strip().upper() == "COMMIT"), 1)
+        self.assertEqual(self._row_count(), 300)
+
+        self.db.queue_message_log(1001, 7, 99)
+        self.assertEqual(asyncio.run(self.db.get_user_messages(7)), [(1001, 99)])
+        self.assertEqual(self.db.log_stats(), {"pending": 0, "flushed": 301, "dropped": 0})
+
+    def test_backlog_is_bounded_and_counts_drops(self):
+        for message_id in range(1, 1251):
+            self.db.queue_message_log(message_id, 1, 1)
+        self.assertEqual(self.db.log_stats()["dropped"], 250)
+        self.assertEqual(self.db.flush_logs_sync(), 1000)
+        self.assertEqual(min(message_id for message_id, _ in asyncio.run(self.db.get_user_messages(1))), 251)
+
+    def test_hourly_partitions_expire_by_drop_and_keep_retention_window(self):
+        hour = self.blocker_db.LOG_PARTITION_SECONDS
+        now = 1_000 * hour + 1800.0
+        with mock.patch.object(self.blocker_db.time, "time", side_effect=[now - hour * offset for offset in range(8)]):
+            for offset in range(8):
+                self.db.queue_message_log(100 + offset, 5, offset)
+        self.db.flush_logs_sync()
+        self.assertEqual(len(self.db._live_log_tables()), 8)
+        self.assertEqual(len(asyncio.run(self.db.get_user_messages(5))), 8)
+
+        self.assertEqual(self.db._drop_expired_logs(6 * hour, now=now), 1)
+        kept = {message_id for message_id, _ in asyncio.run(self.db.get_user_messages(5))}
+        # 6 小时保留窗口内的记录必须全部可见；只有整段过期的分表被删除
+        self.assertTrue({100 + offset for offset in range(7)} <= kept)
+        self.assertNotIn(107, kept)
+
+        asyncio.run(self.db.delete_user_logs(5))
+        self.assertEqual(self._row_count(), 0)
+
+    def test_legacy_single_table_moves_into_partitions(self):
+        path = Path(self.temp_dir.name) / "legacy.db"
+        connection = sqlite3.connect(path)
+        connection.execute(
+            "CREATE TABLE message_logs (message_id INTEGER PRIMARY KEY, user_id INTEGER, channel_id INTEGER, timestamp REAL)"
+        )
+        connection.executemany(
+            "INSERT INTO message_logs VALUES (?, ?, ?, ?)",
+            [(1, 9, 1, 3600.0 * 10), (2, 9, 2, 3600.0 * 10 + 5), (3, 9, 3, 3600.0 * 11)],
+        )
+        connection.commit()
+        connection.close()
+
+        legacy = self.blocker_db.ScamDB(str(path))
+        try:
+            self.assertEqual(legacy._live_log_tables(), ["message_logs_10", "message_logs_11"])
+            self.assertEqual(sorted(asyncio.run(legacy.get_user_messages(9))), [(1, 1), (2, 2), (3, 3)])
+            self.assertFalse(legacy._query("SELECT 1 FROM sqlite_master WHERE name = 'message_logs'"))
+        finally:
+            legacy._conn.close()
+
+    def test_failed_flush_keeps_rows_for_retry(self):
+        self.db.queue_message_log(1, 1, 1)
+        with mock.patch.object(self.db, "_write_logs", side_effect=sqlite3.OperationalError("locked")):
+            with self.assertRaises(sqlite3.OperationalError):
+                self.db.flush_logs_sync()
+        self.assertEqual(self.db.pending_log_count(), 1)
+        self.assertEqual(self.db.flush_logs_sync(), 1)
+
+
+class PunishmentDBTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.module_dir = tempfile.TemporaryDirectory()
+        cls.punishment_db = _load_module_in_directory(
+            "punishment_db_test", "cogs/manage/punishment_db.py", cls.module_dir.name
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        sqlite_pool.close_all_connections()
+        cls.module_dir.cleanup()
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.temp_dir.name) / "punishments.db")
+        self.db = self.punishment_db.PunishmentDB(self.path)
+
+    def tearDown(self):
+        self.db._executor.shutdown(wait=True)
+        sqlite_pool.close_all_connections()
+        self.temp_dir.cleanup()
+
+    def test_strikes_are_cached_write_through_and_async_safe(self):
+        async def burst():
+            return await asyncio.gather(*(self.db.add_strike_async(user_id % 50) for user_id in range(200)))
+
+        results = asyncio.run(burst())
+        self.assertEqual(sorted(results)[-50:], [4] * 50)
+        self.assertEqual(self.db.get_strikes(7), 4)
+        self.assertEqual(asyncio.run(self.db.remove_strike_async(7)), 3)
+        self.assertEqual(self.db.remove_strike(999), 0)
+        self.db.reset_strikes(8)
+        self.assertEqual(self.db.get_strikes(8), 0)
+
+        reloaded = self.punishment_db.PunishmentDB(self.path)
+        try:
+            self.assertEqual(reloaded.get_strikes(7), 3)
+            self.assertEqual(reloaded.get_strikes(8), 0)
+            self.assertEqual(reloaded.get_strikes(9), 4)
+        finally:
+            reloaded._executor.shutdown(wait=True)
+
+    def test_signature_hits_are_batched(self):
+        self.assertTrue(self.db.add_ad_signature("discord\\.gift"))
+        self.assertFalse(self.db.add_ad_signature("discord\\.gift"))
+        self.assertEqual(self.db.list_ad_signatures(), ["discord\\.gift"])
+        for _ in range(5):
+            self.db.mark_ad_signature_hit("discord\\.gift")
+        self.db.mark_ad_signature_hit("unknown")
+
+        with sqlite3.connect(self.path) as connection:
+            self.assertEqual(connection.execute("SELECT hit_count FROM ad_signatures").fetchone()[0], 0)
+        self.assertEqual(self.db.flush_signature_hits(), 1)
+        with sqlite3.connect(self.path) as connection:
+            self.assertEqual(connection.execute("SELECT hit_count FROM ad_signatures").fetchone()[0], 5)
+        self.assertEqual(self.db.flush_signature_hits(), 0)
+
+
+class BlockerPurgeChannelTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # 导入处罚相关模块会在当前目录建默认库，放到临时目录里
+        cls.module_dir = tempfile.TemporaryDirectory()
+        cwd = os.getcwd()
+        os.chdir(cls.module_dir.name)
+        try:
+            cls.blocker_cog = importlib.import_module("cogs.manage.blocker_cog")
+        finally:
+            os.chdir(cwd)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.blocker_cog.scam_db._conn.close()
+        cls.blocker_cog.punishment_db._executor.shutdown(wait=True)
+        sqlite_pool.close_all_connections()
+        cls.module_dir.cleanup()
+
+    def _fake_channel(self, tracker: dict):
+        channel = mock.MagicMock(spec=self.blocker_cog.discord.TextChannel)
+        channel.bulk_chunks = []
+        channel.single_deletes = []
+
+        async def delete_messages(chunk, reason=None):
+            tracker["active"] += 1
+            tracker["peak"] = max(tracker["peak"], tracker["active"])
+            await asyncio.sleep(0.01)
+            tracker["active"] -= 1
+            channel.bulk_chunks.append([obj.id for obj in chunk])
+
+        def get_partial_message(message_id):
+            partial = mock.MagicMock()
+            partial.delete = mock.AsyncMock(side_effect=lambda reason=None: channel.single_deletes.append(message_id))
+            return partial
+
+        channel.delete_messages = mock.AsyncMock(side_effect=delete_messages)
+        channel.get_partial_message = mock.MagicMock(side_effect=get_partial_message)
+        return channel
+
+    def test_purge_splits_by_age_and_caps_channel_concurrency(self):
+        now = self.blocker_cog.discord.utils.utcnow()
+        recent_at = now - timedelta(days=1)
+        expired_at = now - self.blocker_cog.BULK_DELETE_MAX_AGE - timedelta(minutes=1)
+        tracker = {"active": 0, "peak": 0}
+        channels = {channel_id: self._fake_channel(tracker) for channel_id in range(1, 7)}
+        messages = {
+            channel_id: [mock.Mock(id=channel_id * 1000 + i, created_at=recent_at) for i in range(250)]
+            + [mock.Mock(id=channel_id * 1000 + 900 + i, created_at=expired_at) for i in range(3)]
+            for channel_id in channels
+        }
+
+        async def fetch_channel(guild, channel_id):
+            return channels.get(channel_id)
+
+        with mock.patch.object(self.blocker_cog, "PURGE_CHANNEL_CONCURRENCY", 2):
+            cog = self.blocker_cog.ScamBlockerCog(mock.MagicMock())
+
+        async def purge_all():
+            with mock.patch.object(cog, "_fetch_channel", side_effect=fetch_channel):
+                return await asyncio.gather(
+                    *(cog._purge_channel(None, channel_id, msgs, "test") for channel_id, msgs in messages.items()),
+                    cog._purge_channel(None, 99, [mock.Mock(id=1, created_at=recent_at)], "test"),
+                )
+
+        results = asyncio.run(purge_all())
+        self.assertIsNone(results[-1])
+        for (channel_id, channel), (deleted, seconds) in zip(channels.items(), results):
+            self.assertEqual(deleted, 253)
+            self.assertGreaterEqual(seconds, 0.0)
+            self.assertEqual([len(chunk) for chunk in channel.bulk_chunks], [100, 100, 50])
+            self.assertEqual(channel.single_deletes, [channel_id * 1000 + 900 + i for i in range(3)])
+        self.assertEqual(tracker["peak"], 2)
+
+
+class RoleConfigSnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.original_file = roles.ROLES_DATA_FILE
+        roles.ROLES_DATA_FILE = str(Path(self.temp_dir.name) / "general_roles.json")
+        lottery = list(range(1000, 1300))
+        redeem = list(range(2000, 2100))
+        Path(roles.ROLES_DATA_FILE).write_text(
+            json.dumps(
+                {
+                    "lottery_roles": lottery,
+                    "redeem_roles": redeem,
+                    "lottery_role_meta": {
+                        str(rid): {"rarity": roles.SUPPORTED_RARITIES[rid % 4], "kind": ("color", "icon")[rid % 2]}
+                        for rid in lottery
+                    },
+                    "redeem_role_meta": {str(rid): {"price": rid % 50 + 1} for rid in redeem},
+                    "collection_config": {
+                        "groups": [
+                            {"id": f"g{i}", "role_ids": lottery[i * 10 : i * 10 + 10], "reward_role_id": 3000 + i}
+                            for i in range(20)
+                        ]
+                    },
+                }
+            ),
+            encoding="utf-8",
+        )
+
+    def tearDown(self):
+        roles.ROLES_DATA_FILE = self.original_file
+        roles._role_snapshot = None
+        self.temp_dir.cleanup()
+
+    def test_snapshot_is_shared_read_only_and_replaced_on_save(self):
+        snapshot = roles.load_role_data()
+        self.assertIs(roles.load_role_data(), snapshot)
+        with self.assertRaises(TypeError):
+            snapshot["panel_info"] = {}
+        with self.assertRaises(TypeError):
+            snapshot["lottery_roles"].append(1)
+        with self.assertRaises(TypeError):
+            snapshot.lottery_config["weights"]["1"] = 0
+        self.assertEqual(len(snapshot.kind_rarity_pools["icon"][roles.RARITY_RARE]), 75)
+        self.assertEqual(snapshot.redeem_prices[2001]["price"], 2.0)
+        self.assertEqual(len(roles.get_collection_reward_role_ids(snapshot)), 20)
+
+        editable = roles.load_role_data_for_update()
+        editable["lottery_roles"].append(1)
+        self.assertNotIn(1, snapshot["lottery_roles"])
+        self.assertTrue(roles.set_lottery_role_rarity(1001, roles.RARITY_LEGENDARY))
+        updated = roles.load_role_data()
+        self.assertGreater(updated.version, snapshot.version)
+        self.assertIn(1001, updated.rarity_pools[roles.RARITY_LEGENDARY])
+        self.assertNotIn(1001, snapshot.rarity_pools[roles.RARITY_LEGENDARY])
+        self.assertFalse(roles.set_lottery_role_rarity(9, roles.RARITY_LEGENDARY))
+        self.assertEqual(roles.update_lottery_config(cost_single=2)["cost_single"], 2.0)
+        self.assertEqual(roles.load_role_data().lottery_config["cost_single"], 2.0)
+
+    def test_per_draw_config_overhead_benchmark(self):
+        normalized = roles._normalize_role_data(json.loads(Path(roles.ROLES_DATA_FILE).read_text(encoding="utf-8")))
+        rounds = 300
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            data = copy.deepcopy(normalized)
+            roles.get_lottery_config(data)
+            roles.get_lottery_pools_by_kind_and_rarity(data)
+        baseline = time.perf_counter() - started
+
+        roles.load_role_data()
+        started = time.perf_counter()
+        for _ in range(rounds):
+            data = roles.load_role_data()
+            data.lottery_config
+            roles.get_lottery_pools_by_kind_and_rarity(data)
+        snapshot = time.perf_counter() - started
+
+        self.assertLess(snapshot * 50, baseline)
+
+
+class LotteryEngineTests(unittest.TestCase):
+    def setUp(self):
+        self.pools = {
+            "color": {roles.RARITY_NORMAL: [1, 2], roles.RARITY_RARE: [3], roles.RARITY_LEGENDARY: [4]},
+            "icon": {roles.RARITY_NORMAL: [5], roles.RARITY_JUNK: [6]},
+        }
+
+    def test_alias_table_matches_weights(self):
+        table = lottery_engine.AliasTable([1, 0, 3, 6])
+        picks = table.sample_many(200000, random.Random(7))
+        for index, expected in enumerate((0.1, 0.0, 0.3, 0.6)):
+            self.assertAlmostEqual(picks.count(index) / len(picks), expected, delta=0.01)
+        self.assertEqual(picks.count(1), 0)
+        with self.assertRaises(ValueError):
+            lottery_engine.AliasTable([0, 0])
+
+    def test_pity_rules_are_state_transitions(self):
+        engine = lottery_engine.LotteryEngine(
+            {"outcome_weights": {"role": 0, "shells": 0, "empty": 10**9}}, self.pools
+        )
+        rng = random.Random(3)
+        state = lottery_engine.PityState()
+        for _ in range(lottery_engine.EMPTY_PITY_LIMIT - 1):
+            self.assertEqual(engine.draw(state, rng), ({"type": "empty"}, []))
+        result, notes = engine.draw(state, rng)
+        self.assertEqual(result["type"], "shells")
+        self.assertEqual(notes, [lottery_engine.PITY_EMPTY])
+        self.assertEqual(state.empty_streak, 0)
+
+        state = lottery_engine.PityState(no_role_streak=lottery_engine.ROLE_PITY_LIMIT - 1)
+        result, notes = engine.draw(state, rng)
+        self.assertEqual((result["type"], notes), ("role", [lottery_engine.PITY_ROLE]))
+        self.assertEqual(state.no_role_streak, 0)
+
+        state = lottery_engine.PityState(no_legendary_streak=lottery_engine.LEGENDARY_PITY_LIMIT - 1)
+        result, notes = engine.draw(state, rng)
+        self.assertEqual((result["item"], result["rarity"]), (4, roles.RARITY_LEGENDARY))
+        self.assertEqual(notes, [lottery_engine.PITY_LEGENDARY])
+        self.assertEqual(state.no_legendary_streak, 0)
+
+        no_legendary = lottery_engine.LotteryEngine({}, {"color": {roles.RARITY_NORMAL: [1]}})
+        state = lottery_engine.PityState(no_legendary_streak=lottery_engine.LEGENDARY_PITY_LIMIT - 1)
+        result, notes = no_legendary.draw(state, rng)
+        self.assertEqual(result["item"], 1)
+        self.assertEqual(notes, [lottery_engine.PITY_LEGENDARY, lottery_engine.PITY_LEGENDARY_FALLBACK])
+
+    def test_simulation_reports_rates_and_cost(self):
+        engine = lottery_engine.LotteryEngine(
+            {
+                "cost_single": 2,
+                "outcome_weights": {"role": 1, "shells": 1, "empty": 2},
+                "weights": {"1": 1000, "2": 0, "3": 0, "4": 0},
+                "refund": {"1": 0.5},
+            },
+            self.pools,
+        )
+        result = engine.simulate(20000, seed=11)
+        self.assertEqual(sum(result["outcomes"].values()), 20000)
+        self.assertAlmostEqual(result["role_rate"], 0.25, delta=0.02)
+        # 三星权重被抬到最低 1，远低于普通档，主要靠 80 抽兜底出货
+        self.assertGreater(result["pity"][lottery_engine.PITY_LEGENDARY], 0)
+        self.assertEqual(result["rarity_hits"][roles.RARITY_RARE], 0)
+        self.assertEqual(result["new_roles"], 4)
+        self.assertEqual(result["cost"], 40000)
+        self.assertAlmostEqual(
+            result["net_cost"], result["cost"] - result["shell_rewards"] - result["refunds"], delta=0.2
+        )
+        self.assertEqual(engine.simulate(500, seed=5), engine.simulate(500, seed=5))
+
+        first = lottery_engine.get_engine(("v1", "pools"), {}, self.pools)
+        self.assertIs(lottery_engine.get_engine(("v1", "pools"), {}, self.pools), first)
+        self.assertIsNot(lottery_engine.get_engine(("v2", "pools"), {}, self.pools), first)
+
+    def test_block_simulation_matches_single_draws(self):
+        engine = lottery_engine.LotteryEngine({"outcome_weights": {"role": 1, "shells": 3, "empty": 12}}, self.pools)
+        draws = 30000
+        rng = random.Random(21)
+        state = lottery_engine.PityState()
+        single = {"role": 0, "shells": 0, "empty": 0, "pity": 0}
+        for _ in range(draws):
+            result, notes = engine.draw(state, rng)
+            single[result["type"]] += 1
+            single["pity"] += len(notes)
+
+        with mock.patch.object(
+            lottery_engine.AliasTable, "sample_many", autospec=True,
+            side_effect=lottery_engine.AliasTable.sample_many,
+        ) as sample_many:
+            sim_state = lottery_engine.PityState()
+            result = engine.simulate(draws, state=sim_state, seed=21)
+        self.assertTrue(sample_many.called)
+        for outcome in lottery_engine.OUTCOME_ORDER:
+            self.assertAlmostEqual(result["outcomes"][outcome] / draws, single[outcome] / draws, delta=0.015)
+        self.assertAlmostEqual(sum(result["pity"].values()) / draws, single["pity"] / draws, delta=0.01)
+        self.assertLess(sim_state.empty_streak, lottery_engine.EMPTY_PITY_LIMIT)
+        self.assertLess(sim_state.no_role_streak, lottery_engine.ROLE_PITY_LIMIT)
+
+
+class LotterySettlementTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        root = Path(self.temp_dir.name)
+        self.patches = [
+            mock.patch.object(live_points, "POINTS_DATA_FILE", str(root / "user_points.json")),
+            mock.patch.object(live_points, "POINTS_DB_FILE", str(root / "user_points.sqlite3")),
+            mock.patch.object(live_points, "_POINTS_DB_READY", False),
+            mock.patch.object(live_roles, "COLLECTIONS_DATA_FILE", str(root / "collections.json")),
+            mock.patch.object(live_roles, "REDEEM_OWNERSHIP_DATA_FILE", str(root / "redeem.json")),
+            mock.patch.object(live_roles, "LOTTERY_STATS_DATA_FILE", str(root / "stats.json")),
+            mock.patch.object(live_roles, "COLLECTION_REWARDS_DATA_FILE", str(root / "rewards.json")),
+            mock.patch.object(live_roles, "ROLE_STATE_DB_FILE", str(root / "role_state.sqlite3")),
+            mock.patch.object(live_roles, "_role_state_ready", False),
+            mock.patch.object(app_store, "APP_STATE_DB_FILE", str(root / "app_state.sqlite3")),
+            mock.patch.object(app_store, "_SCHEMA_READY", False),
+            mock.patch.object(settlement, "_collection_claims_ready", False),
+        ]
+        for patcher in self.patches:
+            patcher.start()
+        self.role_data = {
+            "lottery_roles": [1, 2],
+            "collection_config": {
+                "groups": [{"id": "pair", "name": "一对", "role_ids": [1, 2], "reward_shells": 3, "reward_role_id": 0}],
+            },
+        }
+        self.engine = lottery_engine.LotteryEngine(
+            {"outcome_weights": {"role": 1, "shells": 0, "empty": 0}, "refund": {"1": 0.5}},
+            {"color": {live_roles.RARITY_NORMAL: [1, 2]}},
+        )
+        live_points.modify_user_points(7, 20, 99, source="test")
+
+    def tearDown(self):
+        sqlite_pool.close_all_connections()
+        for patcher in reversed(self.patches):
+            patcher.stop()
+        self.temp_dir.cleanup()
+
+    def _settle(self, cost=10.0):
+        return settlement.settle_lottery_draw(
+            7,
+            99,
+            engine=self.engine,
+            draw_count=10,
+            cost=cost,
+            role_data=self.role_data,
+            drawn_at="2026-10-01T00:00:00+08:00",
+            rng=random.Random(2),
+        )
+
+    def test_ten_pull_commits_every_store_in_one_transaction(self):
+        result = self._settle()
+        self.assertTrue(result["success"])
+        self.assertEqual(sorted(result["granted_role_ids"]), [1, 2])
+        self.assertEqual(result["refund_shells"], 4.0)
+        self.assertEqual([reward["key"] for reward in result["collection_rewards"]], ["group:pair"])
+        self.assertEqual(result["balance"], 20 - 10 + 4 + 3)
+        self.assertEqual(live_points.get_user_points(7, 99), result["balance"])
+        self.assertEqual(live_roles.get_user_collection(7), [1, 2])
+        self.assertEqual(live_roles.get_lottery_stats(7, 99)["total_draws"], 10)
+        self.assertEqual(live_roles.get_collection_reward_claim_status(7)["groups"], ["pair"])
+        sources = [tx["source"] for tx in live_points.get_recent_transactions(7, 99, limit=10)]
+        self.assertCountEqual(sources, ["test", "role_lottery", "role_lottery_refund", "role_collection_reward"])
+
+        # 附加库在结算后已卸下，连接可继续用于普通读写
+        with sqlite_pool.pooled_connection(live_points.POINTS_DB_FILE) as connection:
+            self.assertEqual([row[1] for row in connection.execute("PRAGMA database_list")], ["main"])
+
+    def test_insufficient_balance_and_failures_leave_no_partial_writes(self):
+        self.assertFalse(self._settle(cost=50)["success"])
+        self.assertEqual(live_points.get_user_points(7, 99), 20)
+
+        with mock.patch.object(live_roles, "_apply_lottery_results", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                self._settle()
+        self.assertEqual(live_points.get_user_points(7, 99), 20)
+        self.assertEqual(live_roles.get_user_collection(7), [])
+        self.assertEqual(live_roles.get_lottery_stats(7, 99)["total_draws"], 0)
+        self.assertEqual(live_roles.get_collection_reward_claim_status(7)["groups"], [])
+
+        self.assertTrue(self._settle()["success"])
+
+
 class RoleStateSQLiteMigrationTests(unittest.TestCase):
     def setUp(self):
         self.temp_dir = tempfile.TemporaryDirectory()
@@ -113,6 +1106,7 @@ class RoleStateSQLiteMigrationTests(unittest.TestCase):
 
     def tearDown(self):
         roles._role_state_ready = False
+        sqlite_pool.close_all_connections()
         self.temp_dir.cleanup()
 
     def test_collection_batch_and_lottery_stats_are_targeted(self):
@@ -130,6 +1124,94 @@ class RoleStateSQLiteMigrationTests(unittest.TestCase):
         self.assertEqual(result["total_draws"], 2)
         self.assertEqual(roles.get_lottery_stats(7, 99)["shell_hits"], 1)
 
+    def test_namespace_save_writes_only_the_diff(self):
+        self.assertEqual(roles.get_user_collection(7), [101])
+        counts = roles.save_collections_data({"7": [101], "8": [102, 102], "9": [103]})
+        self.assertEqual(counts, {"inserted": 2, "updated": 0, "deleted": 0, "unchanged": 1})
+
+        with sqlite_pool.pooled_connection(roles.ROLE_STATE_DB_FILE) as connection:
+            before = connection.total_changes
+        counts = roles.save_collections_data({"7": [101, 104], "8": [102]})
+        self.assertEqual(counts, {"inserted": 0, "updated": 1, "deleted": 1, "unchanged": 1})
+        with sqlite_pool.pooled_connection(roles.ROLE_STATE_DB_FILE) as connection:
+            self.assertEqual(connection.total_changes - before, 2)
+        self.assertEqual(roles.load_collections_data(), {"7": [101, 104], "8": [102]})
+
+        counts = roles.write_role_states("redeem", {"8": [201]})
+        self.assertEqual(counts["inserted"], 1)
+        self.assertEqual(roles.write_role_states("redeem", {"9": [202]})["deleted"], 0)
+        self.assertEqual(roles.load_redeem_ownership_data(), {"8": [201], "9": [202]})
+
+    def test_member_ownership_reconcile_only_writes_changed_users(self):
+        role_data = {"lottery_roles": [101, 102], "redeem_roles": [201]}
+        roles.add_many_to_collection(8, [102])
+        result = roles.reconcile_cached_member_ownership({7: {101, 102, 999}, 8: {102}, 9: {201}}, role_data)
+        self.assertEqual(
+            result, {"users_changed": 2, "collection_roles_added": 1, "redeem_roles_added": 1}
+        )
+        self.assertEqual(roles.get_user_collection(7), [101, 102])
+        self.assertEqual(roles.get_user_redeem_ownership(9), [201])
+
+        with sqlite_pool.pooled_connection(roles.ROLE_STATE_DB_FILE) as connection:
+            before = connection.total_changes
+        self.assertEqual(roles.reconcile_cached_member_ownership({7: {101}, 8: {102}}, role_data)["users_changed"], 0)
+        with sqlite_pool.pooled_connection(roles.ROLE_STATE_DB_FILE) as connection:
+            self.assertEqual(connection.total_changes, before)
+
+
+class RedPacketExpiryTests(unittest.TestCase):
+    def test_one_failing_refund_does_not_block_later_packets(self):
+        packets = [
+            {"id": pid, "sender_id": sender, "guild_id": 99, "refund_amount": 2.0}
+            for pid, sender in (("a", 1), ("b", 2), ("c", 3))
+        ]
+        refunded, unmarked = [], []
+
+        def fake_modify(user_id, amount, guild_id, **kwargs):
+            if user_id == 2:
+                raise sqlite3.OperationalError("bad sender")
+            refunded.append(user_id)
+            return amount
+
+        cog = red_packet_cog.RedPacketCog(mock.MagicMock())
+        store = red_packet_cog.storage
+        with (
+            mock.patch.object(store, "expire_due_packets", return_value=[]),
+            mock.patch.object(store, "get_unrefunded_expired_packets", return_value=packets),
+            mock.patch.object(store, "mark_refunded", return_value=True),
+            mock.patch.object(store, "unmark_refunded", side_effect=unmarked.append),
+            mock.patch.object(store, "get_packet", return_value=None),
+            mock.patch.object(red_packet_cog, "modify_user_points", side_effect=fake_modify),
+            mock.patch.object(cog, "_refresh_packet_message", new=mock.AsyncMock()) as refresh,
+        ):
+            asyncio.run(cog._process_expired_packets())
+
+        self.assertEqual(refunded, [1, 3])
+        self.assertEqual(unmarked, ["b"])
+        self.assertEqual([call.args[0]["id"] for call in refresh.await_args_list], ["a", "c"])
+
+    def test_scheduler_backs_off_after_processing_failure(self):
+        cog = red_packet_cog.RedPacketCog(mock.MagicMock())
+        cog.bot.wait_until_ready = mock.AsyncMock()
+        store = red_packet_cog.storage
+
+        async def run_briefly():
+            task = asyncio.create_task(cog._run_expiry_scheduler())
+            await asyncio.sleep(0.3)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with (
+            mock.patch.object(red_packet_cog, "EXPIRY_RETRY_SECONDS", 0.1),
+            mock.patch.object(store, "expire_due_packets", side_effect=sqlite3.OperationalError("locked")) as expire,
+            mock.patch.object(store, "next_expiry_ts", return_value=time.time() - 5),
+            mock.patch("builtins.print"),
+        ):
+            asyncio.run(run_briefly())
+        # 逾期的到期时间不会让调度器空转：0.3 秒内只按退避间隔重试
+        self.assertLessEqual(expire.call_count, 4)
+
 
 class AppStateSQLiteMigrationTests(unittest.TestCase):
     def setUp(self):
@@ -139,6 +1221,7 @@ class AppStateSQLiteMigrationTests(unittest.TestCase):
         app_store._SCHEMA_READY = False
         red_packets.DATA_FILE = str(root / "red_packets.json")
         submissions.DATA_FILE = str(root / "submissions.json")
+        egg_qa.DATA_FILE = str(root / "egg_qa.json")
         Path(red_packets.DATA_FILE).write_text(
             json.dumps({"version": 1, "packets": {"legacy": {"id": "legacy"}}}),
             encoding="utf-8",
@@ -146,6 +1229,7 @@ class AppStateSQLiteMigrationTests(unittest.TestCase):
 
     def tearDown(self):
         app_store._SCHEMA_READY = False
+        sqlite_pool.close_all_connections()
         self.temp_dir.cleanup()
 
     def test_namespace_migration_is_one_time_and_backed_up(self):
@@ -157,6 +1241,118 @@ class AppStateSQLiteMigrationTests(unittest.TestCase):
         Path(red_packets.DATA_FILE).write_text("{}", encoding="utf-8")
         self.assertIn("new", red_packets.load_data()["packets"])
 
+    def test_red_packet_claims_never_double_allocate_under_concurrency(self):
+        packet = red_packets.create_packet(
+            guild_id=1,
+            channel_id=2,
+            sender_id=3,
+            sender_name="sender",
+            total_amount=100,
+            count=200,
+            message="",
+            admin_free=False,
+        )
+        other = red_packets.create_packet(
+            guild_id=1, channel_id=2, sender_id=3, sender_name="sender",
+            total_amount=20, count=20, message="", admin_free=False,
+        )
+        users = list(range(1000, 1250))
+        jobs = [(packet["id"], uid) for uid in users] + [(other["id"], uid) for uid in users[:40]]
+        jobs += [(packet["id"], uid) for uid in users[:20]]
+        random.Random(7).shuffle(jobs)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+            results = list(executor.map(lambda job: (job, red_packets.claim_packet(*job)), jobs))
+
+        for target, total, count in ((packet, 100.0, 200), (other, 20.0, 20)):
+            won = [result for (packet_id, _), result in results if packet_id == target["id"] and result["success"]]
+            self.assertEqual(len(won), count)
+            self.assertAlmostEqual(sum(result["amount"] for result in won), total)
+            stored = red_packets.load_data()["packets"][target["id"]]
+            self.assertEqual(stored["status"], "empty")
+            self.assertEqual((stored["remaining_count"], stored["remaining_amount"]), (0, 0.0))
+            self.assertEqual(stored["allocations"], [])
+            self.assertEqual(len(stored["claims"]), count)
+        reasons = {result.get("reason") for _, result in results if not result["success"]}
+        self.assertLessEqual(reasons, {"empty", "already_claimed"})
+        self.assertEqual(red_packets.claim_packet(packet["id"], 3)["reason"], "sender_blocked")
+        self.assertEqual(red_packets.claim_packet("missing", 1)["reason"], "not_found")
+
+    def test_red_packet_expiry_refunds_remaining_once(self):
+        packet = red_packets.create_packet(
+            guild_id=1, channel_id=2, sender_id=3, sender_name="sender",
+            total_amount=1, count=2, message="", admin_free=False,
+        )
+        first = red_packets.claim_packet(packet["id"], 4)
+        self.assertTrue(first["success"])
+        with mock.patch.object(red_packets, "now_cn", return_value=red_packets.now_cn() + timedelta(days=2)):
+            expired = red_packets.expire_due_packets()
+        expired = {item["id"]: item for item in expired}
+        self.assertAlmostEqual(expired[packet["id"]]["refund_amount"], round(1 - first["amount"], 1))
+        self.assertEqual(red_packets.claim_packet(packet["id"], 5)["reason"], "expired")
+        self.assertEqual(red_packets.get_active_packets(), [])
+
+    def test_red_packet_due_index_drives_expiry_and_refund_claims(self):
+        red_packets.initialize_red_packet_storage()
+        self.assertEqual(len(red_packets.expire_due_packets()), 1)  # 旧数据里没有到期时间的 legacy 红包
+        self.assertIsNone(red_packets.next_expiry_ts())
+        kwargs = dict(guild_id=1, channel_id=2, sender_id=3, sender_name="s", total_amount=1, count=1, message="")
+        first = red_packets.create_packet(admin_free=False, **kwargs)
+        with mock.patch.object(red_packets, "now_cn", return_value=red_packets.now_cn() - timedelta(hours=1)):
+            earlier = red_packets.create_packet(admin_free=True, **kwargs)
+        self.assertAlmostEqual(
+            red_packets.next_expiry_ts(), red_packets.parse_time(earlier["expires_at"]).timestamp()
+        )
+        with red_packets._connection() as connection:
+            plan = " ".join(
+                row["detail"]
+                for row in connection.execute(
+                    "EXPLAIN QUERY PLAN SELECT id FROM red_packets WHERE status='active' AND expires_ts <= ?", (0,)
+                )
+            )
+        self.assertIn("idx_red_packets_due", plan)
+
+        later = red_packets.now_cn() + timedelta(hours=23, minutes=30)
+        with mock.patch.object(red_packets, "now_cn", return_value=later):
+            self.assertEqual([item["id"] for item in red_packets.expire_due_packets()], [earlier["id"]])
+        self.assertEqual(
+            {item["id"] for item in red_packets.get_unrefunded_expired_packets()}, {"legacy", earlier["id"]}
+        )
+        self.assertTrue(red_packets.mark_refunded(earlier["id"]))
+        self.assertFalse(red_packets.mark_refunded(earlier["id"]))
+        red_packets.unmark_refunded(earlier["id"])
+        self.assertTrue(red_packets.mark_refunded(earlier["id"]))
+        self.assertAlmostEqual(
+            red_packets.next_expiry_ts(), red_packets.parse_time(first["expires_at"]).timestamp()
+        )
+
+    def test_red_packet_stats_aggregate_without_loading_packets(self):
+        kwargs = dict(guild_id=1, channel_id=2, sender_id=3, sender_name="s", message="")
+        first = red_packets.create_packet(total_amount=3, count=3, admin_free=True, **kwargs)
+        red_packets.create_packet(total_amount=1.5, count=1, admin_free=False, **kwargs)
+        for user_id in (4, 5):
+            self.assertTrue(red_packets.claim_packet(first["id"], user_id)["success"])
+
+        packets = red_packets.load_data()["packets"]
+        with mock.patch.object(red_packets, "_packet_details", side_effect=AssertionError("per-packet read")):
+            stats = red_packets.packet_stats()
+        self.assertEqual(stats["packets"], len(packets))
+        self.assertEqual(stats["claims"], sum(len(packet["claims"]) for packet in packets.values()))
+        self.assertEqual(stats["admin_free"], 1)
+        self.assertEqual(sum(stats["status_counts"].values()), len(packets))
+        self.assertAlmostEqual(stats["total_amount"], sum(p["total_amount"] for p in packets.values()))
+        self.assertAlmostEqual(stats["remaining_amount"], sum(p["remaining_amount"] for p in packets.values()))
+
+    def test_red_packet_tables_gain_due_column_in_place(self):
+        with app_store.app_state_connection() as connection:
+            connection.executescript(red_packets._SCHEMA_SQL.replace("    expires_ts REAL NOT NULL DEFAULT 0,\n", ""))
+            connection.execute(
+                "INSERT INTO red_packets(id, expires_at) VALUES ('old', '2030-01-01T00:00:00+08:00')"
+            )
+        red_packets._ensure_packet_tables()
+        with red_packets._connection() as connection:
+            row = connection.execute("SELECT expires_ts FROM red_packets WHERE id='old'").fetchone()
+        self.assertEqual(row["expires_ts"], red_packets.parse_time("2030-01-01T00:00:00+08:00").timestamp())
+
     def test_submission_notification_subscription_is_owned_and_persistent(self):
         record, created = submissions.create_submission_once(
             guild_id=99,
@@ -178,6 +1374,158 @@ class AppStateSQLiteMigrationTests(unittest.TestCase):
         )
         self.assertTrue(submissions.submission_notifications_enabled({"id": "legacy"}))
 
+    def test_submission_blob_migrates_into_indexed_tables(self):
+        today = datetime.now(submissions.TZ_CN).date().isoformat()
+        legacy = submissions._empty_data()
+        legacy["panel_info"] = {"channel_id": "1", "message_id": "2"}
+        legacy["comment_rewards"] = {f"99:5:{today}": 14.0}
+        legacy["submissions"] = {
+            "s1": {
+                "id": "s1",
+                "guild_id": "99",
+                "author_id": "7",
+                "kind": submissions.KIND_REPO,
+                "fields": {"target": "旧投稿"},
+                "message_id": "555",
+                "status": submissions.STATUS_OPEN,
+                "extra_reward": 0.0,
+                "useful_user_ids": ["1", "2"],
+                "useful_reward_tiers": [],
+                "comments": [{"user_id": "3", "user_name": "c", "content": "旧评论", "created_at": f"{today}T01:00:00+08:00"}],
+                "comment_page": 0,
+                "created_at": f"{today}T00:00:00+08:00",
+            }
+        }
+        app_store.save_json_namespace("submissions", legacy)
+
+        record = submissions.find_by_message_id(555)
+        self.assertEqual(record["useful_user_ids"], ["1", "2"])
+        self.assertEqual(record["comments"][0]["content"], "旧评论")
+        self.assertEqual(record["fields"], {"target": "旧投稿"})
+        self.assertEqual(submissions.get_panel_info(), {"channel_id": "1", "message_id": "2"})
+        self.assertEqual(
+            submissions.count_daily_submissions(guild_id=99, author_id=7, kind=submissions.KIND_REPO), 1
+        )
+        self.assertIsNone(submissions.find_by_message_id(556))
+
+        # 持有旧记录的整条保存不会覆盖期间新增的评论和投票
+        stale = submissions.get_submission("s1")
+        submissions.add_comment("s1", 4, "d", "新评论")
+        result = submissions.toggle_useful("s1", 3)
+        self.assertEqual(result["new_tier_rewards"], [{"count": 3, "reward": 1.0}])
+        stale["comment_page"] = 1
+        submissions.save_submission(stale)
+        latest = submissions.get_submission("s1")
+        self.assertEqual(len(latest["comments"]), 2)
+        self.assertEqual(latest["useful_user_ids"], ["1", "2", "3"])
+        self.assertEqual(latest["comment_page"], 1)
+        self.assertFalse(submissions.toggle_useful("s1", 3)["added"])
+
+        capped = submissions.grant_comment_reward(guild_id=99, user_id=5, requested_reward=5.0)
+        self.assertEqual((capped["awarded"], capped["used"]), (1.0, 15.0))
+        self.assertEqual(submissions.load_data()["comment_rewards"], {f"99:5:{today}": 15.0})
+
+        # 迁移只执行一次：改写旧整块数据不会再影响新表
+        app_store.save_json_namespace("submissions", submissions._empty_data())
+        app_store._blob_tables_ready.clear()
+        self.assertIsNotNone(submissions.get_submission("s1"))
+
+    def test_egg_qa_blob_migrates_and_claims_are_single_rows(self):
+        today = datetime.now(egg_qa.TZ_CN).date().isoformat()
+        legacy = egg_qa._empty_data()
+        legacy["questions"] = {
+            "q1": {
+                "id": "q1",
+                "guild_id": "9",
+                "channel_id": "1",
+                "message_id": "100",
+                "author_id": "7",
+                "content": "问题",
+                "date": today,
+                "created_at": f"{today}T08:00:00+08:00",
+                "rewards": {"5": {"user_id": "5", "reply_message_id": "200", "amount": 13, "date": today}},
+                "subscribers": {"6": {"subscribed_at": "x"}},
+            }
+        }
+        legacy["panels"] = {"1": {"channel_id": "1", "message_id": "2", "updated_at": "y"}}
+        legacy["author_subscriptions"] = {"9:7": {"enabled_at": "z"}}
+        app_store.save_json_namespace("egg_qa", legacy)
+
+        self.assertTrue(egg_qa.may_be_question_message(100))
+        question = egg_qa.find_question_by_message(100)
+        self.assertEqual(question["id"], "q1")
+        self.assertEqual(question["rewards"]["5"]["amount"], 13)
+        self.assertIsNone(egg_qa.find_question_by_message(101))
+        self.assertEqual(egg_qa.get_daily_usage(7, 9), 1)
+        self.assertEqual(egg_qa.list_panels()[0]["message_id"], "2")
+        self.assertEqual(sorted(egg_qa.get_question_notification_subscribers("q1")), [6, 7])
+
+        # 每日上限跨问题按 (服务器, 用户, 日期) 索引累计
+        self.assertIsNone(egg_qa.claim_reply_reward(question_id="q1", user_id=5, reply_message_id=201))
+        created = egg_qa.create_question(author_id=8, guild_id=9, channel_id=1, content="新问题")
+        self.assertFalse(egg_qa.may_be_question_message(300))
+        egg_qa.finalize_question(created["id"], 300)
+        self.assertTrue(egg_qa.may_be_question_message(300))
+        with mock.patch.object(egg_qa.random, "choices", return_value=[5]):
+            reward = egg_qa.claim_reply_reward(question_id=created["id"], user_id=5, reply_message_id=301)
+            self.assertEqual((reward["amount"], reward["daily_total_after"]), (2, 15))
+            self.assertIsNone(egg_qa.claim_reply_reward(question_id=created["id"], user_id=5, reply_message_id=302))
+            egg_qa.revoke_reply_reward(question_id=created["id"], user_id=5, reply_message_id=301)
+            self.assertEqual(
+                egg_qa.claim_reply_reward(question_id=created["id"], user_id=5, reply_message_id=303)["amount"], 2
+            )
+
+        self.assertFalse(egg_qa.toggle_author_subscription(user_id=7, guild_id=9))
+        self.assertEqual(egg_qa.get_question_notification_subscribers("q1"), [6])
+        egg_qa.cancel_question("q1")
+        self.assertIsNone(egg_qa.find_question_by_message(100))
+        self.assertIsNone(egg_qa.toggle_question_subscription(question_id="q1", user_id=6))
+
+        app_store.save_json_namespace("egg_qa", legacy)
+        app_store._blob_tables_ready.clear()
+        self.assertIsNone(egg_qa.find_question_by_message(100))
+
+
+class SharedSQLitePoolTests(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_file = str(Path(self.temp_dir.name) / "pool.sqlite3")
+
+    def tearDown(self):
+        sqlite_pool.close_all_connections()
+        self.temp_dir.cleanup()
+
+    def test_connection_is_reused_per_thread_and_commits(self):
+        with sqlite_pool.pooled_connection(self.db_file) as first:
+            first.execute("CREATE TABLE items (value INTEGER)")
+            first.execute("INSERT INTO items(value) VALUES (1)")
+        with sqlite_pool.pooled_connection(self.db_file) as second:
+            self.assertIs(first, second)
+            self.assertFalse(second.in_transaction)
+            self.assertEqual(second.execute("SELECT COUNT(*) FROM items").fetchone()[0], 1)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            other = executor.submit(self._connection_identity).result()
+        self.assertNotEqual(other, id(first))
+
+    def test_nested_checkout_uses_independent_connection(self):
+        with sqlite_pool.pooled_connection(self.db_file) as outer:
+            outer.execute("CREATE TABLE items (value INTEGER)")
+            with sqlite_pool.pooled_connection(self.db_file) as inner:
+                self.assertIsNot(outer, inner)
+            outer.execute("INSERT INTO items(value) VALUES (1)")
+            self.assertTrue(outer.in_transaction)
+        with self.assertRaises(RuntimeError):
+            with sqlite_pool.pooled_connection(self.db_file) as connection:
+                connection.execute("INSERT INTO items(value) VALUES (2)")
+                raise RuntimeError("rollback")
+        with sqlite_pool.pooled_connection(self.db_file) as connection:
+            self.assertEqual(connection.execute("SELECT COUNT(*) FROM items").fetchone()[0], 1)
+
+    def _connection_identity(self) -> int:
+        with sqlite_pool.pooled_connection(self.db_file) as connection:
+            return id(connection)
+
 
 if __name__ == "__main__":
     unittest.main()